@@ -0,0 +1,258 @@
+"""
+python scripts/batch/benchmark_loan_calculations.py --companies_per_product_type 2 --num_loans 40 --output /tmp/benchmark.json
+
+What:
+This script creates synthetic companies (see bespoke_test.finance.portfolio_test_helper)
+in a throwaway SQLite database and times the loan calculations against them:
+CustomerBalance._get_customer_update, repayment_util.calculate_repayment_effect
+and CustomerBalance.update over the last --days_back days.
+
+Why:
+Run it before and after changing the loan calculations and compare the JSON it
+writes, so that slowdowns are caught before they reach production. Nothing
+touches the network or DATABASE_URL, and the same --seed always creates the
+same companies, so runs on the same machine are comparable.
+
+Each timing is reported as the best of --repeat runs, in seconds, and per loan
+day: the number of days, summed over the loans and report dates, from a loan's
+origination date to the report date.
+"""
+
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from os import path
+from typing import Any, Callable, Dict, List
+
+# Path hack before we try to import bespoke
+sys.path.append(path.realpath(path.join(path.dirname(__file__), "../../src")))
+sys.path.append(path.realpath(path.join(path.dirname(__file__), "../")))
+
+import sqlalchemy
+from sqlalchemy.orm import sessionmaker
+
+from bespoke.date import date_util
+from bespoke.db import models
+from bespoke.finance.fetchers import per_customer_fetcher
+from bespoke.finance.payments import repayment_util
+from bespoke.finance.payments.payment_util import RepaymentOption
+from bespoke.finance.reports import loan_balances
+from bespoke.finance.types import per_customer_types
+from bespoke_test.finance import portfolio_test_helper
+
+def _time(fn: Callable[[], Any], repeat: int) -> float:
+	best = None
+	for _ in range(repeat):
+		start = time.perf_counter()
+		fn()
+		seconds = time.perf_counter() - start
+		best = seconds if best is None else min(best, seconds)
+	return best
+
+def _get_loan_days(loans: List[models.LoanDict], report_dates: List[datetime.date]) -> int:
+	return sum([
+		max(0, (report_date - loan['origination_date']).days + 1)
+		for loan in loans
+		for report_date in report_dates
+	])
+
+def _get_timing(seconds: float, loan_days: int) -> Dict[str, Any]:
+	return {
+		'seconds': round(seconds, 6),
+		'loan_days': loan_days,
+		'microseconds_per_loan_day': round(seconds * 1e6 / loan_days, 3) if loan_days else None,
+	}
+
+def _get_git_commit() -> str:
+	try:
+		return subprocess.check_output(
+			['git', 'rev-parse', 'HEAD'], cwd=path.dirname(__file__), stderr=subprocess.DEVNULL
+		).decode().strip()
+	except Exception:
+		return None
+
+def _benchmark_company(
+	session_maker: Callable,
+	company_id: str,
+	today: datetime.date,
+	days_back: int,
+	repeat: int,
+) -> Dict[str, Any]:
+	session = session_maker()
+	try:
+		company = session.query(models.Company).get(company_id)
+		company_dict = company.as_dict()
+
+		fetcher = per_customer_fetcher.Fetcher(
+			per_customer_types.CompanyInfoDict(id=company_id, name=company.name),
+			session,
+			ignore_deleted=True,
+		)
+		_, err = fetcher.fetch(today)
+		if err:
+			raise err
+		customer_info = fetcher.get_financials()
+		loans = customer_info['financials']['loans']
+		customer_balance = loan_balances.CustomerBalance(company_dict, session)
+
+		def get_customer_update() -> None:
+			_, err = customer_balance._get_customer_update(
+				today,
+				customer_info,
+				include_debug_info=False,
+				include_frozen=False,
+				is_past_date=False,
+			)
+			if err:
+				raise err
+
+		open_loan_ids = [
+			loan['id'] for loan in loans if loan['adjusted_maturity_date'] >= today
+		] or [loan['id'] for loan in loans[-1:]]
+
+		def calculate_repayment_effect() -> None:
+			_, err = repayment_util.calculate_repayment_effect(
+				session=session,
+				company_id=company_id,
+				payment_option=RepaymentOption.CUSTOM_AMOUNT,
+				amount=1000.0,
+				deposit_date=date_util.date_to_str(today),
+				settlement_date=date_util.date_to_str(today),
+				items_covered={
+					'loan_ids': open_loan_ids,
+					'to_account_fees': 0.0,
+				},
+				should_pay_principal_first=False,
+			)
+			if err:
+				raise err
+
+		def update() -> None:
+			_, err = customer_balance.update(
+				start_date_for_storing_updates=today - timedelta(days=days_back),
+				today=today,
+				include_debug_info=False,
+				is_past_date_default_val=False,
+			)
+			if err:
+				raise err
+
+		report_dates = [today - timedelta(days=i) for i in range(days_back + 1)]
+		return {
+			'company_id': company_id,
+			'product_type': customer_info['financials']['contracts'][0]['product_type'],
+			'num_loans': len(loans),
+			'num_transactions': len(customer_info['financials']['augmented_transactions']),
+			'timings': {
+				'get_customer_update': _get_timing(
+					_time(get_customer_update, repeat), _get_loan_days(loans, [today])),
+				'calculate_repayment_effect': _get_timing(
+					_time(calculate_repayment_effect, repeat),
+					_get_loan_days([loan for loan in loans if loan['id'] in open_loan_ids], [today])),
+				'update': _get_timing(
+					_time(update, repeat), _get_loan_days(loans, report_dates)),
+			},
+		}
+	finally:
+		# Calculating may extend contracts, which should not carry over to the
+		# next company or run
+		session.rollback()
+		session.close()
+
+def _summarize(results: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+	product_type_to_summary: Dict[str, Dict[str, Any]] = {}
+	for result in results:
+		summary = product_type_to_summary.setdefault(result['product_type'], {})
+		for name, timing in result['timings'].items():
+			cur = summary.setdefault(name, {'seconds': 0.0, 'loan_days': 0})
+			cur['seconds'] += timing['seconds']
+			cur['loan_days'] += timing['loan_days']
+
+	for summary in product_type_to_summary.values():
+		for name, cur in summary.items():
+			summary[name] = _get_timing(cur['seconds'], cur['loan_days'])
+	return product_type_to_summary
+
+def main(
+	companies_per_product_type: int,
+	config: portfolio_test_helper.PortfolioConfigDict,
+	days_back: int,
+	repeat: int,
+	seed: int,
+	today: datetime.date,
+	output: str,
+) -> None:
+	db_dir = tempfile.mkdtemp()
+	engine = sqlalchemy.create_engine(f"sqlite:///{path.join(db_dir, 'benchmark.db')}")
+	models.Base.metadata.create_all(engine)
+	session_maker = sessionmaker(engine)
+
+	with models.session_scope(session_maker) as session:
+		product_type_to_company_ids = portfolio_test_helper.create_portfolio(
+			session, today, companies_per_product_type, config, seed=seed)
+
+	results = []
+	for product_type, company_ids in product_type_to_company_ids.items():
+		for company_id in company_ids:
+			print(f'Benchmarking a {product_type} company with id {company_id}', file=sys.stderr)
+			results.append(_benchmark_company(session_maker, company_id, today, days_back, repeat))
+
+	report = {
+		'git_commit': _get_git_commit(),
+		'python_version': platform.python_version(),
+		'today': date_util.date_to_str(today),
+		'config': dict(
+			config,
+			companies_per_product_type=companies_per_product_type,
+			days_back=days_back,
+			repeat=repeat,
+			seed=seed,
+		),
+		'summary': _summarize(results),
+		'results': results,
+	}
+
+	report_json = json.dumps(report, indent=2)
+	if output:
+		with open(output, 'w') as f:
+			f.write(report_json)
+	else:
+		print(report_json)
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--companies_per_product_type', default='1', help='How many companies to create for each product type')
+parser.add_argument('--num_loans', default='20', help='How many loans each company has')
+parser.add_argument('--repayments_per_loan', default='2', help='How many repayments each loan has')
+parser.add_argument('--num_contracts', default='2', help='How many contracts each company has had')
+parser.add_argument('--history_days', default='365', help='Over how many days before today the loans are originated')
+parser.add_argument('--dynamic_interest_rate', action='store_true', help='Whether the contracts use dynamic interest rates')
+parser.add_argument('--days_back', default='14', help='How many days back CustomerBalance.update calculates balances for')
+parser.add_argument('--repeat', default='3', help='How many times to time each calculation, the best time is kept')
+parser.add_argument('--seed', default='0', help='Seed of the random loans and repayments')
+parser.add_argument('--today', default='06/30/2022', help='Report date (MM/DD/YYYY format) the companies are created and benchmarked for')
+parser.add_argument('--output', default=None, help='File to write the JSON results to, instead of stdout')
+
+if __name__ == '__main__':
+	args = parser.parse_args()
+
+	main(
+		companies_per_product_type=int(args.companies_per_product_type),
+		config=portfolio_test_helper.PortfolioConfigDict(
+			num_loans=int(args.num_loans),
+			repayments_per_loan=int(args.repayments_per_loan),
+			num_contracts=int(args.num_contracts),
+			use_dynamic_interest_rate=args.dynamic_interest_rate,
+			history_days=int(args.history_days),
+		),
+		days_back=int(args.days_back),
+		repeat=int(args.repeat),
+		seed=int(args.seed),
+		today=date_util.load_date_str(args.today),
+		output=args.output,
+	)
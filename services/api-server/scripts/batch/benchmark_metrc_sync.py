@@ -0,0 +1,242 @@
+"""
+python scripts/batch/benchmark_metrc_sync.py --num_licenses 2 --num_days 3 --latency_ms 20 --output /tmp/benchmark.json
+
+What:
+This script syncs --num_days days of --num_licenses licenses from a simulated
+Metrc API (see bespoke_test.metrc.metrc_simulator) into a throwaway SQLite
+database, or --database_url, with download_data_for_metrc_api_key_license_in_date_range,
+and times it.
+
+Why:
+Run it before and after changing the Metrc sync (concurrency, batch sizes,
+rate limits, etc.) and compare the JSON it writes. The simulated API answers
+after --latency_ms, with 429s and 500s at the rates given, and the same
+--seed always serves the same data, so runs on the same machine are comparable
+without a Metrc API key or touching Metrc.
+
+The report has the wall time per license-day, requests per second, the
+rows in each Metrc table after the sync, per second, and the sync metrics
+of each license by endpoint and phase (see metrc_metrics_util). The METRC_*
+environment variables (e.g., METRC_NUM_PARALLEL_SALES_TRANSACTIONS)
+configure the sync like they do in production.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from os import path
+from typing import Any, Dict, List
+
+# Path hack before we try to import bespoke
+sys.path.append(path.realpath(path.join(path.dirname(__file__), "../../src")))
+sys.path.append(path.realpath(path.join(path.dirname(__file__), "../")))
+
+# The simulated API key is encrypted like a real one, and the simulator
+# accepts any vendor key
+os.environ.setdefault('URL_SECRET_KEY', 'benchmark-url-secret-key')
+os.environ.setdefault('URL_SALT', 'benchmark-url-salt')
+os.environ.setdefault('METRC_VENDOR_KEY_CA', 'benchmark-vendor-key')
+
+import sqlalchemy
+from sqlalchemy.orm import sessionmaker
+from server.config import get_config
+
+from bespoke.date import date_util
+from bespoke.db import models
+from bespoke.db.models import session_scope
+from bespoke.metrc import metrc_download_util
+from bespoke.metrc.common import metrc_common_util, metrc_download_summary_util
+from bespoke_test.metrc import metrc_simulator
+
+METRC_MODELS = [
+	models.MetrcPackage,
+	models.MetrcHarvest,
+	models.MetrcPlantBatch,
+	models.MetrcPlant,
+	models.MetrcSalesReceipt,
+	models.MetrcSalesTransaction,
+	models.MetrcTransfer,
+	models.MetrcDelivery,
+	models.MetrcTransferPackage,
+	models.CompanyDelivery,
+	models.MetrcDownloadSummary,
+]
+
+def _get_git_commit() -> str:
+	try:
+		return subprocess.check_output(
+			['git', 'rev-parse', 'HEAD'], cwd=path.dirname(__file__), stderr=subprocess.DEVNULL
+		).decode().strip()
+	except Exception:
+		return None
+
+def _get_table_to_count(session_maker: Any) -> Dict[str, int]:
+	with session_scope(session_maker) as session:
+		return {model.__tablename__: session.query(model).count() for model in METRC_MODELS}
+
+def _per_second(count: float, seconds: float) -> float:
+	return round(count / seconds, 3) if seconds else None
+
+def main(
+	simulator_config: metrc_simulator.SimulatorConfigDict,
+	num_licenses: int,
+	num_days: int,
+	end_date: datetime.date,
+	requests_per_second_per_api_key: float,
+	database_url: str,
+	output: str,
+) -> None:
+	if not database_url:
+		db_dir = tempfile.mkdtemp()
+		database_url = f"sqlite:///{path.join(db_dir, 'benchmark.db')}"
+	engine = sqlalchemy.create_engine(database_url)
+	models.Base.metadata.create_all(engine)
+	session_maker = sessionmaker(engine)
+
+	config = get_config()
+	license_numbers = [f'SIM-LICENSE-{i}' for i in range(num_licenses)]
+	with session_scope(session_maker) as session:
+		metrc_api_key_id = metrc_simulator.create_company_with_metrc_api_key(
+			session, config.get_security_config(), license_numbers, api_key=f'benchmark-api-key-{time.time()}')
+
+	simulator = metrc_simulator.MetrcSimulator(simulator_config, license_numbers)
+	uninstall_simulator = metrc_simulator.install_simulator(simulator, requests_per_second_per_api_key)
+
+	start_date = end_date - timedelta(days=num_days - 1)
+	table_to_count_before = _get_table_to_count(session_maker)
+	license_results: List[Dict[str, Any]] = []
+	try:
+		before = time.perf_counter()
+		for license_number in license_numbers:
+			print(f'Syncing license {license_number} from {start_date} to {end_date}', file=sys.stderr)
+			license_before = time.perf_counter()
+			num_requests_before = simulator.num_requests
+			with session_scope(session_maker) as session:
+				resp, err = metrc_download_util.download_data_for_metrc_api_key_license_in_date_range(
+					session=session,
+					config=config,
+					apis_to_use=metrc_common_util.get_default_apis_to_use(),
+					metrc_api_key_id=metrc_api_key_id,
+					license_number=license_number,
+					start_date=start_date,
+					end_date=end_date,
+				)
+			license_seconds = time.perf_counter() - license_before
+			license_results.append({
+				'license_number': license_number,
+				'success': resp['success'] if resp else False,
+				'error': str(err) if err else None,
+				'num_nonblocking_errors': len(resp['nonblocking_download_errors']) if resp else None,
+				'seconds': round(license_seconds, 6),
+				'num_requests': simulator.num_requests - num_requests_before,
+			})
+		seconds = time.perf_counter() - before
+	finally:
+		uninstall_simulator()
+
+	table_to_count_after = _get_table_to_count(session_maker)
+	table_to_num_rows = {
+		table: table_to_count_after[table] - table_to_count_before[table]
+		for table in table_to_count_after
+	}
+	num_rows = sum(table_to_num_rows.values())
+
+	with session_scope(session_maker) as session:
+		sync_metrics_report, err = metrc_download_summary_util.get_sync_metrics_report(
+			session, start_date, end_date, license_numbers)
+		if err:
+			raise err
+
+	num_license_days = num_licenses * num_days
+
+	report = {
+		'git_commit': _get_git_commit(),
+		'python_version': platform.python_version(),
+		'database': engine.dialect.name,
+		'config': dict(
+			simulator_config,
+			num_licenses=num_licenses,
+			num_days=num_days,
+			end_date=date_util.date_to_str(end_date),
+			requests_per_second_per_api_key=requests_per_second_per_api_key,
+			metrc_worker_config=vars(config.get_metrc_worker_config()),
+		),
+		'summary': {
+			'seconds': round(seconds, 6),
+			'seconds_per_license_day': round(seconds / num_license_days, 6),
+			'num_requests': simulator.num_requests,
+			'requests_per_second': _per_second(simulator.num_requests, seconds),
+			'status_code_to_count': {str(k): v for k, v in sorted(simulator.status_code_to_count.items())},
+			'num_rows': num_rows,
+			'rows_per_second': _per_second(num_rows, seconds),
+		},
+		'table_to_num_rows': table_to_num_rows,
+		'licenses': license_results,
+		'sync_metrics': sync_metrics_report,
+	}
+
+	report_json = json.dumps(report, indent=2)
+	if output:
+		with open(output, 'w') as f:
+			f.write(report_json)
+	else:
+		print(report_json)
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--num_licenses', default='1', help='How many licenses to sync')
+parser.add_argument('--num_days', default='2', help='How many days, up to --end_date, to sync for each license')
+parser.add_argument('--end_date', default=None, help='Last date (MM/DD/YYYY format) to sync, defaults to yesterday')
+parser.add_argument('--packages_per_day', default='30', help='How many packages each license modifies a day')
+parser.add_argument('--harvests_per_day', default='5', help='How many harvests each license modifies a day')
+parser.add_argument('--plant_batches_per_day', default='5', help='How many plant batches each license modifies a day')
+parser.add_argument('--plants_per_day', default='20', help='How many plants each license modifies a day')
+parser.add_argument('--sales_receipts_per_day', default='50', help='How many sales receipts each license modifies a day')
+parser.add_argument('--transactions_per_receipt', default='3', help='How many transactions each sales receipt has')
+parser.add_argument('--transfers_per_day', default='6', help='How many transfers each license modifies a day')
+parser.add_argument('--deliveries_per_transfer', default='2', help='How many deliveries each outgoing transfer has (at most 9)')
+parser.add_argument('--packages_per_delivery', default='3', help='How many packages each delivery has')
+parser.add_argument('--latency_ms', default='0', help='How long the simulated API takes to respond to each request')
+parser.add_argument('--too_many_requests_rate', default='0', help='Fraction of requests the simulated API responds to with a 429')
+parser.add_argument('--server_error_rate', default='0', help='Fraction of requests the simulated API responds to with a 500')
+parser.add_argument('--retry_after_seconds', default='0.1', help='Retry-After of the 429 responses')
+parser.add_argument('--requests_per_second_per_api_key', default='0', help='Rate limit of the requests to the simulated API, unlimited when 0')
+parser.add_argument('--seed', default='0', help='Seed of the simulated data and errors')
+parser.add_argument('--database_url', default=None, help='Database to sync into, instead of a throwaway SQLite database')
+parser.add_argument('--output', default=None, help='File to write the JSON results to, instead of stdout')
+
+if __name__ == '__main__':
+	args = parser.parse_args()
+	logging.basicConfig(level=logging.WARNING)
+
+	main(
+		simulator_config=metrc_simulator.SimulatorConfigDict(
+			packages_per_day=int(args.packages_per_day),
+			harvests_per_day=int(args.harvests_per_day),
+			plant_batches_per_day=int(args.plant_batches_per_day),
+			plants_per_day=int(args.plants_per_day),
+			sales_receipts_per_day=int(args.sales_receipts_per_day),
+			transactions_per_receipt=int(args.transactions_per_receipt),
+			transfers_per_day=int(args.transfers_per_day),
+			deliveries_per_transfer=int(args.deliveries_per_transfer),
+			packages_per_delivery=int(args.packages_per_delivery),
+			latency_seconds=float(args.latency_ms) / 1000,
+			too_many_requests_rate=float(args.too_many_requests_rate),
+			server_error_rate=float(args.server_error_rate),
+			retry_after_seconds=float(args.retry_after_seconds),
+			seed=int(args.seed),
+		),
+		num_licenses=int(args.num_licenses),
+		num_days=int(args.num_days),
+		end_date=date_util.load_date_str(args.end_date) if args.end_date else date_util.now_as_date() - timedelta(days=1),
+		requests_per_second_per_api_key=float(args.requests_per_second_per_api_key) or None,
+		database_url=args.database_url,
+		output=args.output,
+	)
@@ -164,7 +164,6 @@ def main(
 				license_number=license_number,
 				start_date=parsed_start_date,
 				end_date=parsed_end_date,
-				is_async_job=False,
 				is_retry_failures=force_retry_failures,
 			)
 
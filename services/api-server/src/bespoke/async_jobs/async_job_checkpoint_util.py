@@ -0,0 +1,55 @@
+"""
+	Lets a long-running async job save its progress, so that when it runs
+	again, after it timed out or was orphaned by a restart (see
+	async_jobs_util.remove_orphaned_initialized_jobs), it resumes where it
+	left off rather than from the start.
+
+	A job saves a cursor, e.g., the last date or company it is done with,
+	into its retry_payload, which is the payload it runs with next. Saving a
+	checkpoint also beats the job's heartbeat, which is how the orchestration
+	handler tells a job that is still making progress from one that is stuck.
+"""
+from typing import Any, Callable, Dict, Optional, cast
+
+from bespoke.date import date_util
+from bespoke.db import models
+from bespoke.db.models import session_scope
+
+# Key of the cursor in the retry_payload
+CURSOR_KEY = 'cursor'
+
+def get_cursor(job_payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+	"""
+		The cursor of the job's last checkpoint, None if it starts from the start.
+	"""
+	return job_payload.get(CURSOR_KEY)
+
+class JobCheckpointer(object):
+	"""
+		Saves the checkpoints of a running job. Each checkpoint is committed in
+		a session of its own, so only save the cursor of work that is already
+		committed. The job, which execute_job merges back when the job ends, is
+		kept up to date too.
+	"""
+
+	def __init__(self, session_maker: Callable, job: models.AsyncJob) -> None:
+		self._session_maker = session_maker
+		self._job = job
+
+	def heartbeat(self) -> None:
+		self._update(heartbeat_at=date_util.now())
+
+	def save(self, cursor: Dict[str, Any]) -> None:
+		self._update(
+			heartbeat_at=date_util.now(),
+			retry_payload=dict(cast(Dict[str, Any], self._job.job_payload), **{CURSOR_KEY: cursor}),
+		)
+
+	def _update(self, **values: Any) -> None:
+		with session_scope(self._session_maker) as session:
+			job = cast(models.AsyncJob, session.query(models.AsyncJob).get(self._job.id))
+			for key, value in values.items():
+				setattr(job, key, value)
+
+		for key, value in values.items():
+			setattr(self._job, key, value)
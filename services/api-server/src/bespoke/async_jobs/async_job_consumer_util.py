@@ -0,0 +1,124 @@
+"""
+	Runs async jobs as soon as they are queued, rather than when the
+	orchestration handler is next called. Consumer threads claim queued jobs
+	one at a time (see async_jobs_util.claim_queued_job) and run them, and when
+	there is none left they sleep until add_job_to_queue sends a NOTIFY on
+	async_jobs_util.JOB_QUEUED_CHANNEL.
+"""
+import logging
+import select
+import threading
+from typing import Any, Callable, List
+
+from sqlalchemy.engine import Engine
+
+from bespoke.async_jobs import async_job_scheduler_util, async_jobs_util
+from bespoke.email import sendgrid_util
+from server.config import Config
+
+class AsyncJobConsumer(object):
+
+	def __init__(
+		self,
+		engine: Engine,
+		session_maker: Callable,
+		cfg: Config,
+		sendgrid_client: sendgrid_util.Client,
+		num_threads: int,
+		poll_seconds: float,
+	) -> None:
+		self._engine = engine
+		self._session_maker = session_maker
+		self._cfg = cfg
+		self._sendgrid_client = sendgrid_client
+		self._num_threads = num_threads
+		self._poll_seconds = poll_seconds
+
+		# Counts the NOTIFYs received, so that a consumer that found no job
+		# does not go to sleep if a job was queued since it looked
+		self._num_wake_ups = 0
+		self._condition = threading.Condition()
+		self._stopped = threading.Event()
+		self._threads: List[threading.Thread] = []
+
+	def start(self) -> None:
+		for i in range(self._num_threads):
+			self._start_thread(f'async-job-consumer-{i}', self._consume)
+
+		# Without LISTEN/NOTIFY (e.g., SQLite) the consumers only poll
+		if self._engine.dialect.name == 'postgresql':
+			self._start_thread('async-job-listener', self._listen)
+
+	def stop(self) -> None:
+		self._stopped.set()
+		self.wake_up()
+		for thread in self._threads:
+			thread.join()
+
+	def wake_up(self) -> None:
+		with self._condition:
+			self._num_wake_ups += 1
+			self._condition.notify_all()
+
+	def run_next_job(self) -> bool:
+		job, err = async_jobs_util.claim_queued_job(
+			self._session_maker, async_job_scheduler_util.get_job_name_to_lane(self._cfg))
+		if err:
+			logging.error(f'Failed to claim a queued async job: {err}')
+			return False
+		if not job:
+			return False
+
+		try:
+			async_jobs_util.execute_job(self._session_maker, self._cfg, self._sendgrid_client, job)
+		except Exception:
+			# Like a job that never started, it is timed out by the orchestration handler
+			logging.exception(f'Failed to run async job {job.id}')
+		return True
+
+	def _start_thread(self, name: str, target: Callable[[], None]) -> None:
+		thread = threading.Thread(target=target, name=name, daemon=True)
+		thread.start()
+		self._threads.append(thread)
+
+	def _consume(self) -> None:
+		while not self._stopped.is_set():
+			num_wake_ups = self._num_wake_ups
+			if self.run_next_job():
+				continue
+
+			with self._condition:
+				if self._num_wake_ups == num_wake_ups and not self._stopped.is_set():
+					self._condition.wait(self._poll_seconds)
+
+	def _listen(self) -> None:
+		while not self._stopped.is_set():
+			try:
+				self._listen_on_connection()
+			except Exception:
+				logging.exception('Lost the connection listening for queued async jobs')
+				self._stopped.wait(self._poll_seconds)
+
+	def _listen_on_connection(self) -> None:
+		# A connection of its own, since it LISTENs for as long as we run and
+		# must not be handed out by the pool
+		connection = self._engine.raw_connection()
+		connection.detach()
+		try:
+			dbapi_connection: Any = connection.connection
+			dbapi_connection.autocommit = True
+			with dbapi_connection.cursor() as cursor:
+				cursor.execute(f'LISTEN {async_jobs_util.JOB_QUEUED_CHANNEL}')
+			# Jobs may have been queued while we were not listening
+			self.wake_up()
+
+			while not self._stopped.is_set():
+				readable, _, _ = select.select([dbapi_connection], [], [], self._poll_seconds)
+				if not readable:
+					continue
+				dbapi_connection.poll()
+				if dbapi_connection.notifies:
+					del dbapi_connection.notifies[:]
+					self.wake_up()
+		finally:
+			connection.close()
@@ -0,0 +1,132 @@
+"""
+	Decides which queued async jobs to start when there are free slots. Each
+	job name is a lane, with at most max_concurrency jobs running at once, and
+	the free slots are shared between the lanes that have queued jobs in
+	proportion to their weights, so that a flood of one job (e.g., company
+	balance updates) cannot starve the others.
+
+	Within and across lanes, high priority jobs go first, then the jobs that
+	have been queued for longer than their lane's SLO, then the others.
+"""
+import datetime
+from typing import Dict, List, Optional, Tuple
+
+from mypy_extensions import TypedDict
+
+from bespoke.db import models
+from bespoke.db.db_constants import AsyncJobNameEnum
+from server.config import Config
+
+AsyncJobLaneDict = TypedDict('AsyncJobLaneDict', {
+	# None for no limit
+	'max_concurrency': Optional[int],
+	# Share of the slots, relative to the other lanes with queued jobs
+	'weight': int,
+	# Jobs queued for longer than this are started before the others
+	'slo_minutes': int,
+})
+
+DEFAULT_LANE = AsyncJobLaneDict(max_concurrency=None, weight=1, slo_minutes=120)
+
+ASYNC_JOB_NAME_TO_LANE: Dict[str, AsyncJobLaneDict] = {
+	# Emails and repayments our customers expect on the day
+	AsyncJobNameEnum.AUTOGENERATE_REPAYMENTS: AsyncJobLaneDict(max_concurrency=None, weight=4, slo_minutes=15),
+	AsyncJobNameEnum.AUTOGENERATE_REPAYMENT_ALERTS: AsyncJobLaneDict(max_concurrency=None, weight=4, slo_minutes=15),
+	AsyncJobNameEnum.AUTOMATIC_DEBIT_COURTESY_ALERTS: AsyncJobLaneDict(max_concurrency=None, weight=4, slo_minutes=15),
+	AsyncJobNameEnum.LOANS_COMING_DUE: AsyncJobLaneDict(max_concurrency=None, weight=4, slo_minutes=15),
+	AsyncJobNameEnum.LOANS_PAST_DUE: AsyncJobLaneDict(max_concurrency=None, weight=4, slo_minutes=15),
+	AsyncJobNameEnum.ASYNC_MONITORING: AsyncJobLaneDict(max_concurrency=None, weight=4, slo_minutes=15),
+	AsyncJobNameEnum.FINANCIAL_REPORTS_COMING_DUE_ALERTS: AsyncJobLaneDict(max_concurrency=None, weight=2, slo_minutes=30),
+	AsyncJobNameEnum.PURCHASE_ORDERS_PAST_DUE: AsyncJobLaneDict(max_concurrency=None, weight=2, slo_minutes=60),
+	AsyncJobNameEnum.DAILY_COMPANY_BALANCES_RUN: AsyncJobLaneDict(max_concurrency=None, weight=2, slo_minutes=60),
+	AsyncJobNameEnum.UPDATE_COMPANY_BALANCES: AsyncJobLaneDict(max_concurrency=None, weight=1, slo_minutes=60),
+	AsyncJobNameEnum.LOC_MONTHLY_REPORT_SUMMARY: AsyncJobLaneDict(max_concurrency=None, weight=1, slo_minutes=120),
+	AsyncJobNameEnum.NON_LOC_MONTHLY_REPORT_SUMMARY: AsyncJobLaneDict(max_concurrency=None, weight=1, slo_minutes=120),
+	AsyncJobNameEnum.REFRESH_METRC_API_KEY_PERMISSIONS: AsyncJobLaneDict(max_concurrency=None, weight=1, slo_minutes=120),
+	# max_concurrency is ASYNC_MAX_NUM_CAPPED_JOB, see get_job_name_to_lane
+	AsyncJobNameEnum.DOWNLOAD_DATA_FOR_METRC_API_KEY_LICENSE: AsyncJobLaneDict(max_concurrency=None, weight=1, slo_minutes=240),
+}
+
+def get_job_name_to_lane(cfg: Config) -> Dict[str, AsyncJobLaneDict]:
+	job_name_to_lane = dict(ASYNC_JOB_NAME_TO_LANE)
+	metrc_lane = job_name_to_lane[AsyncJobNameEnum.DOWNLOAD_DATA_FOR_METRC_API_KEY_LICENSE]
+	job_name_to_lane[AsyncJobNameEnum.DOWNLOAD_DATA_FOR_METRC_API_KEY_LICENSE] = AsyncJobLaneDict(
+		max_concurrency=cfg.ASYNC_MAX_NUM_CAPPED_JOB,
+		weight=metrc_lane['weight'],
+		slo_minutes=metrc_lane['slo_minutes'],
+	)
+	return job_name_to_lane
+
+def get_lane(job_name_to_lane: Dict[str, AsyncJobLaneDict], job_name: str) -> AsyncJobLaneDict:
+	return job_name_to_lane.get(job_name, DEFAULT_LANE)
+
+def get_num_jobs_to_fetch(lane: AsyncJobLaneDict, num_running: int, num_jobs: int) -> int:
+	"""
+		How many of the lane's queued jobs schedule_jobs may need, at most, to
+		start num_jobs jobs.
+	"""
+	if lane['max_concurrency'] is None:
+		return num_jobs
+	return max(min(num_jobs, lane['max_concurrency'] - num_running), 0)
+
+def _get_queued_at(job: models.AsyncJob) -> datetime.datetime:
+	# queued_at is a timestamptz, but SQLite (e.g., in tests) drops the timezone
+	if job.queued_at.tzinfo is None:
+		return job.queued_at.replace(tzinfo=datetime.timezone.utc)
+	return job.queued_at
+
+def _get_tier(job: models.AsyncJob, lane: AsyncJobLaneDict, now: datetime.datetime) -> int:
+	if job.is_high_priority:
+		return 2
+	if _get_queued_at(job) < now - datetime.timedelta(minutes=lane['slo_minutes']):
+		return 1
+	return 0
+
+def schedule_jobs(
+	job_name_to_lane: Dict[str, AsyncJobLaneDict],
+	job_name_to_num_running: Dict[str, int],
+	job_name_to_queued_jobs: Dict[str, List[models.AsyncJob]],
+	num_jobs: int,
+	now: datetime.datetime,
+) -> List[models.AsyncJob]:
+	"""
+		Picks up to num_jobs of the queued jobs to start, in the order they
+		should start. The queued jobs of each job name must be ordered by
+		is_high_priority descending, then queued_at ascending.
+
+		Each pick goes to the highest tier of job at the head of a lane with a
+		free slot. Between lanes of the same tier, it goes to the lane whose
+		running jobs per weight would be the fewest, then to the job queued
+		first.
+	"""
+	job_name_to_num_running = dict(job_name_to_num_running)
+	job_name_to_num_picked: Dict[str, int] = {}
+	jobs_to_start: List[models.AsyncJob] = []
+
+	while len(jobs_to_start) < num_jobs:
+		best_job = None
+		best_key: Tuple[int, float, datetime.datetime] = None
+		for job_name, queued_jobs in job_name_to_queued_jobs.items():
+			num_picked = job_name_to_num_picked.get(job_name, 0)
+			if num_picked >= len(queued_jobs):
+				continue
+
+			lane = get_lane(job_name_to_lane, job_name)
+			num_running = job_name_to_num_running.get(job_name, 0)
+			if lane['max_concurrency'] is not None and num_running >= lane['max_concurrency']:
+				continue
+
+			job = queued_jobs[num_picked]
+			key = (-_get_tier(job, lane, now), (num_running + 1) / lane['weight'], _get_queued_at(job))
+			if best_key is None or key < best_key:
+				best_job = job
+				best_key = key
+
+		if best_job is None:
+			break
+
+		jobs_to_start.append(best_job)
+		job_name_to_num_picked[best_job.name] = job_name_to_num_picked.get(best_job.name, 0) + 1
+		job_name_to_num_running[best_job.name] = job_name_to_num_running.get(best_job.name, 0) + 1
+
+	return jobs_to_start
@@ -2,12 +2,15 @@ from collections import defaultdict
 import datetime
 import logging
 from datetime import timedelta
-from typing import Any, Callable, Dict, cast, Iterable, List, Tuple
+from typing import Any, Callable, Dict, cast, Iterable, List, Optional, Tuple
 from flask import current_app
 from bespoke import errors
 from decimal import *
 import json
 
+from bespoke.async_jobs import async_job_checkpoint_util, async_job_scheduler_util
+from bespoke.async_jobs.async_job_checkpoint_util import JobCheckpointer
+from bespoke.async_jobs.async_job_scheduler_util import AsyncJobLaneDict
 from bespoke.date import date_util
 from bespoke.db import db_constants, models, models_util, queries
 from bespoke.db.db_constants import AsyncJobNameEnum, AsyncJobStatusEnum, ClientSurveillanceCategoryEnum, CustomerRoles, LoanTypeEnum, ProductType, CustomerEmailsEnum
@@ -25,13 +28,177 @@ from bespoke.metrc.common.metrc_common_util import chunker, chunker_dict
 from bespoke.reports import report_generation_util
 from bespoke.slack import slack_util
 from server.config import Config
-from sqlalchemy import or_
+import sqlalchemy
+from sqlalchemy import String, func, or_, text
+from sqlalchemy.orm import Query
 from sqlalchemy.orm.session import Session
 
 ASYNC_JOB_NAME_TO_CUSTOM_DELAY_TOLERANCE_HOURS = {
 	AsyncJobNameEnum.DOWNLOAD_DATA_FOR_METRC_API_KEY_LICENSE: 4,
 }
 
+# A running job whose heartbeat (see async_job_checkpoint_util) is older than
+# this is timed out
+ASYNC_JOB_HEARTBEAT_TIMEOUT_HOURS = 1
+
+# Jobs whose orchestration takes a checkpointer, to save their progress and
+# resume from it when they run again
+CHECKPOINTED_JOB_NAMES = set([
+	AsyncJobNameEnum.DAILY_COMPANY_BALANCES_RUN,
+	AsyncJobNameEnum.DOWNLOAD_DATA_FOR_METRC_API_KEY_LICENSE,
+])
+
+# How many companies of a balances job are computed and committed before
+# the job saves a checkpoint
+COMPANIES_PER_BALANCE_CHECKPOINT = 5
+
+# The daily company balances run queues the customers in batches of up to
+# this much estimated work (see get_company_id_to_balance_work) and this many
+# companies, so that small customers share a job, and its fetches and writes
+MAX_BALANCE_WORK_PER_BATCH = 500.0
+MAX_COMPANIES_PER_BALANCE_BATCH = 25
+
+# The balances of a loan are replayed from its origination, so a loan counts
+# as one more unit of work for every this many days since its origination
+BALANCE_WORK_DAYS_PER_LOAN_UNIT = 30
+
+# PostgreSQL channel notified when a job is queued, which the job consumers
+# (see async_job_consumer_util) LISTEN on
+JOB_QUEUED_CHANNEL = 'async_job_queued'
+
+def _notify_job_queued(session: Session) -> None:
+	if session.get_bind().dialect.name == 'postgresql':
+		# Sent when the transaction commits, and only once per transaction
+		session.execute(text(f'NOTIFY {JOB_QUEUED_CHANNEL}'))
+
+def _query_queued_jobs(session: Session, job_name: str) -> Query:
+	# Rows locked by another transaction are being claimed by it, so they are
+	# skipped rather than waited on
+	return session.query(models.AsyncJob).filter(
+		models.AsyncJob.status == AsyncJobStatusEnum.QUEUED
+	).filter(
+		models.AsyncJob.name == job_name
+	).filter(
+		cast(Callable, models.AsyncJob.is_deleted.isnot)(True)
+	).order_by(
+		models.AsyncJob.is_high_priority.desc()
+	).order_by(
+		models.AsyncJob.queued_at.asc()
+	).with_for_update(
+		skip_locked=True
+	)
+
+def _get_job_name_to_num_running(
+	session: Session,
+	job_names: Optional[Iterable[str]] = None,
+) -> Dict[str, int]:
+	query = session.query(
+		models.AsyncJob.name, func.count(models.AsyncJob.id)
+	).filter(
+		models.AsyncJob.status.in_([
+			AsyncJobStatusEnum.INITIALIZED,
+			AsyncJobStatusEnum.IN_PROGRESS,
+		])
+	).filter(
+		cast(Callable, models.AsyncJob.is_deleted.isnot)(True)
+	)
+	if job_names is not None:
+		query = query.filter(models.AsyncJob.name.in_(list(job_names)))
+	return dict(query.group_by(models.AsyncJob.name).all())
+
+def _claim_jobs(
+	session: Session,
+	job_name_to_lane: Dict[str, AsyncJobLaneDict],
+	num_jobs: int,
+) -> List[models.AsyncJob]:
+	# Marks up to num_jobs queued jobs, picked by
+	# async_job_scheduler_util.schedule_jobs, as initialized. Claims running
+	# at the same time may count the same running jobs, so once the claim is
+	# committed, _release_jobs_over_max_concurrency must be called.
+	if num_jobs <= 0:
+		return []
+
+	job_name_to_num_running = _get_job_name_to_num_running(session)
+
+	queued_job_names = [name for (name,) in session.query(
+		models.AsyncJob.name
+	).filter(
+		models.AsyncJob.status == AsyncJobStatusEnum.QUEUED
+	).filter(
+		cast(Callable, models.AsyncJob.is_deleted.isnot)(True)
+	).distinct().all()]
+
+	job_name_to_queued_jobs: Dict[str, List[models.AsyncJob]] = {}
+	for job_name in queued_job_names:
+		num_jobs_to_fetch = async_job_scheduler_util.get_num_jobs_to_fetch(
+			async_job_scheduler_util.get_lane(job_name_to_lane, job_name),
+			job_name_to_num_running.get(job_name, 0),
+			num_jobs,
+		)
+		if num_jobs_to_fetch > 0:
+			job_name_to_queued_jobs[job_name] = cast(
+				List[models.AsyncJob],
+				_query_queued_jobs(session, job_name).limit(num_jobs_to_fetch).all())
+
+	jobs = async_job_scheduler_util.schedule_jobs(
+		job_name_to_lane=job_name_to_lane,
+		job_name_to_num_running=job_name_to_num_running,
+		job_name_to_queued_jobs=job_name_to_queued_jobs,
+		num_jobs=num_jobs,
+		now=date_util.now(),
+	)
+	for job in jobs:
+		job.status = AsyncJobStatusEnum.INITIALIZED
+		job.initialized_at = date_util.now()
+	return jobs
+
+def _release_jobs_over_max_concurrency(
+	session: Session,
+	job_name_to_lane: Dict[str, AsyncJobLaneDict],
+	jobs: List[models.AsyncJob],
+) -> List[models.AsyncJob]:
+	"""
+		Puts the claimed jobs that took a lane over its max_concurrency back
+		into the queue, and returns the ones left to run. Called in a new
+		transaction once the claim is committed, so it counts the jobs that
+		other claims committed since.
+
+		Of two claims that took the last slot of a lane, the one that commits
+		last sees both jobs and releases its own, so a lane never runs more
+		than its max_concurrency jobs. If both commit before either counts,
+		both release theirs and the slot is taken by the next claim.
+	"""
+	job_name_to_max_concurrency = {}
+	for job in jobs:
+		max_concurrency = async_job_scheduler_util.get_lane(job_name_to_lane, job.name)['max_concurrency']
+		if max_concurrency is not None:
+			job_name_to_max_concurrency[job.name] = max_concurrency
+	if not job_name_to_max_concurrency:
+		return jobs
+
+	job_name_to_num_running = _get_job_name_to_num_running(
+		session, job_name_to_max_concurrency.keys())
+
+	jobs_to_run = []
+	released_jobs = []
+	# The jobs claimed last are the first released
+	for job in reversed(jobs):
+		max_concurrency = job_name_to_max_concurrency.get(job.name)
+		if max_concurrency is not None and job_name_to_num_running.get(job.name, 0) > max_concurrency:
+			job_name_to_num_running[job.name] -= 1
+			released_jobs.append(job)
+		else:
+			jobs_to_run.insert(0, job)
+
+	for job in released_jobs:
+		job.status = AsyncJobStatusEnum.QUEUED
+		job.initialized_at = None
+		session.merge(job)
+	if released_jobs:
+		_notify_job_queued(session)
+
+	return jobs_to_run
+
 @errors.return_error_tuple
 def generate_jobs(
 	session: Session,
@@ -77,9 +244,30 @@ def add_job_to_queue(
 	)
 
 	session.add(new_job)
+	_notify_job_queued(session)
 
 	return True, None
 
+def add_jobs_to_queue(
+	session: Session,
+	job_name: str,
+	submitted_by_user_id: str,
+	is_high_priority: bool,
+	job_payloads: List[Dict[str, Any]],
+) -> None:
+	# Like add_job_to_queue, with one INSERT for all the jobs
+	if not job_payloads:
+		return
+
+	session.bulk_insert_mappings(models.AsyncJob, [{
+		'name': job_name,
+		'submitted_by_user_id': submitted_by_user_id,
+		'status': AsyncJobStatusEnum.QUEUED,
+		'is_high_priority': is_high_priority,
+		'job_payload': job_payload,
+	} for job_payload in job_payloads])
+	_notify_job_queued(session)
+
 @errors.return_error_tuple
 def delete_job(
 	session: Session,
@@ -138,11 +326,23 @@ def retry_job(
 		if job.status == AsyncJobStatusEnum.FAILED:
 			job.queued_at = date_util.now()
 			job.status = AsyncJobStatusEnum.QUEUED
+			# Retried by hand, so it starts over rather than from its last checkpoint
+			job.retry_payload = None
 		else:
 			return None, errors.Error(f"{job.id} is not failed and can not be changed.")
 
+	_notify_job_queued(session)
+
 	return True, None
 
+def _is_older_than_hours(at: datetime.datetime, hours: int) -> bool:
+	if at is None:
+		return False
+	# The columns are timestamptz, but SQLite (e.g., in tests) drops the timezone
+	if at.tzinfo is None:
+		at = at.replace(tzinfo=datetime.timezone.utc)
+	return at < date_util.hours_from_today(-hours)
+
 @errors.return_error_tuple
 def orchestration_handler(
 	session_maker: Callable,
@@ -171,70 +371,43 @@ def orchestration_handler(
 			return [], None
 
 		starting_job_limit = available_job_number - number_of_running_jobs
-		queued_jobs_to_be_run = []
-		
-		capped_jobs = [AsyncJobNameEnum.DOWNLOAD_DATA_FOR_METRC_API_KEY_LICENSE]
-		capped_jobs_currently_running = list(filter(lambda job: job.name in capped_jobs, currently_running_jobs))
-		maximum_number_of_capped_jobs = cfg.ASYNC_MAX_NUM_CAPPED_JOB
-		num_capped_jobs_available_to_run = maximum_number_of_capped_jobs - len(capped_jobs_currently_running)
-		capped_job_limit = num_capped_jobs_available_to_run if starting_job_limit > num_capped_jobs_available_to_run else starting_job_limit
-		# checks and runs the capped jobs and adds them first to upcoming running jobs
-		if capped_job_limit >= 1:
-			starting_capped_jobs = cast(
-				List[models.AsyncJob],
-				session.query(models.AsyncJob).filter(
-					models.AsyncJob.status == AsyncJobStatusEnum.QUEUED
-				).filter(
-					models.AsyncJob.name.in_(capped_jobs)
-				).filter(
-					cast(Callable, models.AsyncJob.is_deleted.isnot)(True)
-				).order_by(
-					models.AsyncJob.is_high_priority.desc()
-				).order_by(
-					models.AsyncJob.queued_at.asc()
-				).limit(
-					capped_job_limit
-				).all())
-			if len(starting_capped_jobs) > 0:
-				queued_jobs_to_be_run = starting_capped_jobs
-				starting_job_limit -= len(starting_capped_jobs)
-
-		# any left over jobs space is alotted to regular jobs
-		if starting_job_limit >= 1:
-			queued_jobs = cast(
-				List[models.AsyncJob],
-				session.query(models.AsyncJob).filter(
-					models.AsyncJob.status == AsyncJobStatusEnum.QUEUED
-				).filter(
-					cast(Callable, models.AsyncJob.is_deleted.isnot)(True)
-				).filter(
-					models.AsyncJob.name.notin_(capped_jobs)
-				).order_by(
-					models.AsyncJob.is_high_priority.desc()
-				).order_by(
-					models.AsyncJob.queued_at.asc()
-				).limit(
-					starting_job_limit
-				).all())
-			for job in queued_jobs:
-				queued_jobs_to_be_run.append(job)
+		if cfg.ASYNC_JOB_CONSUMER_NUM_THREADS > 0:
+			# The job consumers start the queued jobs, we only time out jobs
+			starting_job_limit = 0
+
+		# The free slots are shared between the lanes of the queued jobs,
+		# see async_job_scheduler_util. All the jobs are marked as initialized
+		# in one commit, which also releases their row locks, so another
+		# orchestrator cannot claim the ones that are not marked yet.
+		job_name_to_lane = async_job_scheduler_util.get_job_name_to_lane(cfg)
+		queued_jobs_to_be_run = _claim_jobs(session, job_name_to_lane, starting_job_limit)
+		session.commit()
+
+		queued_jobs_to_be_run = _release_jobs_over_max_concurrency(
+			session, job_name_to_lane, queued_jobs_to_be_run)
+		session.commit()
 
 		# Cfg and sendgrid_client need to be passed in too the thread function 
 		# or else the app instance is not recognized once a thread is spawned
 		for job in queued_jobs_to_be_run:
-			job.status = AsyncJobStatusEnum.INITIALIZED
-			job.initialized_at = date_util.now()
-			session.commit()
 			cfg.THREAD_POOL.submit(execute_job, session_maker, cfg, sendgrid_client, job)
 
-		# jobs that have run for over an hour are put into failure state
+		# jobs that have not shown progress for over an hour are requeued, and
+		# resume from their last checkpoint, or put into failure state
 		for job in currently_running_jobs:
-			if job.initialized_at is not None and job.initialized_at < date_util.hours_from_today(-1):
+			# Jobs that started keep their initialized_at, but only their
+			# heartbeat tells whether they are stuck
+			if job.status == AsyncJobStatusEnum.INITIALIZED and _is_older_than_hours(job.initialized_at, 1):
 				job.status = AsyncJobStatusEnum.QUEUED
 				job.initialized_at = None
 				job.err_details = json.dumps({"Error" : f"Async job was initialized but did not run and was requeued."}) # type: ignore
 
-			if job.started_at is not None and job.started_at < date_util.hours_from_today(-1):
+			if job.status != AsyncJobStatusEnum.IN_PROGRESS:
+				continue
+
+			# Jobs that ran before heartbeats only have a started_at
+			heartbeat_at = job.heartbeat_at if job.heartbeat_at is not None else job.started_at
+			if _is_older_than_hours(heartbeat_at, ASYNC_JOB_HEARTBEAT_TIMEOUT_HOURS):
 				if job.num_retries >= cfg.ASYNC_MAX_FAILED_ATTMEPTS:
 					job.status = AsyncJobStatusEnum.FAILED
 					slack_util.send_job_slack_message(cfg, job)
@@ -250,6 +423,29 @@ def orchestration_handler(
 
 	return [], None
 
+@errors.return_error_tuple
+def claim_queued_job(
+	session_maker: Callable,
+	job_name_to_lane: Dict[str, AsyncJobLaneDict],
+) -> Tuple[Optional[models.AsyncJob], errors.Error]:
+	"""
+		Marks the next queued job to run, as orchestration_handler would pick
+		it, as initialized and returns it, None if there is no job to run.
+
+		Jobs are selected with FOR UPDATE SKIP LOCKED, so any number of
+		consumers can claim jobs at once without ever claiming the same job, and
+		a job that took its lane over max_concurrency is put back into the
+		queue (see _release_jobs_over_max_concurrency).
+	"""
+	with session_scope(session_maker) as session:
+		session.expire_on_commit = False
+
+		jobs = _claim_jobs(session, job_name_to_lane, num_jobs=1)
+		session.commit()
+
+		jobs = _release_jobs_over_max_concurrency(session, job_name_to_lane, jobs)
+		return (jobs[0] if jobs else None), None
+
 @errors.return_error_tuple
 def remove_orphaned_initialized_jobs(
 	session_maker: Callable,
@@ -273,7 +469,8 @@ def remove_orphaned_initialized_jobs(
 			return True, None
 
 
-		# only requeue jobs if they're not company balances
+		# only requeue jobs if they're not company balances. The jobs that saved
+		# a checkpoint resume from it, see execute_job.
 		for job in initialized_jobs:
 			if job.name == AsyncJobNameEnum.UPDATE_COMPANY_BALANCES:
 				job.status = AsyncJobStatusEnum.COMPLETED
@@ -292,22 +489,36 @@ def execute_job(
 	with session_scope(session_maker) as session:
 		job.status = AsyncJobStatusEnum.IN_PROGRESS
 		job.started_at = date_util.now()
+		job.heartbeat_at = job.started_at
 		# explicitly adding a session.merge() needed here in order for 
 		# it to recognize that this is the same job created earlier. 
 		session.merge(job)
 		session.commit()
 
 	with session_scope(session_maker) as session:
-		payload = job.retry_payload if job.num_retries != 0 and job.retry_payload is not None else job.job_payload
+		# The retry_payload has the job's last checkpoint, if it saved one
+		payload = job.retry_payload if job.retry_payload is not None else job.job_payload
 		payload = cast(Dict[str, Any], payload)
 
 		try_catch_exception = None
+		job_success, err_msg = False, None
 		try:
-			job_success, err_msg = ASYNC_JOB_ORCHESTRATION_LOOKUP[job.name](session, cfg, sendgrid_client, payload)
+			orchestrate = ASYNC_JOB_ORCHESTRATION_LOOKUP[job.name]
+			if job.name in CHECKPOINTED_JOB_NAMES:
+				checkpointer = JobCheckpointer(session_maker, job)
+				job_success, err_msg = orchestrate(session, cfg, sendgrid_client, payload, checkpointer=checkpointer)
+			else:
+				job_success, err_msg = orchestrate(session, cfg, sendgrid_client, payload)
 		except Exception as e:
 			try_catch_exception = e
 		if job_success:
 			job.status = AsyncJobStatusEnum.COMPLETED
+			job.retry_payload = None
+			if err_msg:
+				# Errors of a job that still completed, e.g., of some of the
+				# companies of a batch, with their details (e.g., the error of
+				# each company)
+				job.err_details = [err_msg.msg, err_msg.details] if err_msg.details else [str(err_msg)]
 		else:
 			if job.num_retries >= cfg.ASYNC_MAX_FAILED_ATTMEPTS:
 				job.status = AsyncJobStatusEnum.FAILED
@@ -863,6 +1074,53 @@ def orchestrate_autogenerate_repayment_alerts(
 
 	return True, None
 
+def get_company_id_to_balance_work(
+	session: Session,
+	company_ids: List[str],
+	today: datetime.date,
+) -> Dict[str, float]:
+	# A rough estimate of the work to recompute each company's balances: one
+	# unit per company, plus one per open loan and per
+	# BALANCE_WORK_DAYS_PER_LOAN_UNIT days since the loan's origination
+	company_id_to_work = {company_id: 1.0 for company_id in company_ids}
+	if not company_ids:
+		return company_id_to_work
+
+	loans = session.query(
+		models.Loan.company_id, models.Loan.origination_date
+	).filter(
+		models.Loan.company_id.in_(company_ids)
+	).filter(
+		cast(Callable, models.Loan.is_deleted.isnot)(True)
+	).filter(
+		models.Loan.closed_at == None
+	).filter(
+		models.Loan.origination_date != None
+	).all()
+
+	for company_id, origination_date in loans:
+		loan_age_days = max((today - origination_date).days, 0)
+		company_id_to_work[str(company_id)] += 1 + loan_age_days / BALANCE_WORK_DAYS_PER_LOAN_UNIT
+
+	return company_id_to_work
+
+def get_company_balance_batches(
+	company_id_to_work: Dict[str, float],
+	max_work: float,
+	max_companies: int,
+) -> List[List[str]]:
+	# The heaviest companies go first, each in a batch of its own if it is
+	# heavier than max_work, then the lighter ones fill up the batches
+	batches: List[List[str]] = []
+	batch_work = 0.0
+	for company_id, work in sorted(company_id_to_work.items(), key=lambda item: (-item[1], item[0])):
+		if not batches or len(batches[-1]) >= max_companies or batch_work + work > max_work:
+			batches.append([])
+			batch_work = 0.0
+		batches[-1].append(company_id)
+		batch_work += work
+	return batches
+
 def generate_daily_company_balances_run(
 	session: Session,
 ) -> Tuple[bool, errors.Error]:
@@ -888,21 +1146,63 @@ def generate_daily_company_balances_run(
 		days_to_compute_back=reports_util.DAYS_TO_COMPUTE_BACK, 
 	)
 
-	for company in companies:
-		payload = {"company_id" :company["id"]}
-
-		add_job_to_queue(
-			session = session,
-			job_name = AsyncJobNameEnum.DAILY_COMPANY_BALANCES_RUN,
-			submitted_by_user_id = cfg.BOT_USER_ID,
-			is_high_priority = False,
-			job_payload = payload
-		)
+	company_id_to_work = get_company_id_to_balance_work(session, company_ids, cur_date)
+	company_id_batches = get_company_balance_batches(
+		company_id_to_work,
+		max_work=MAX_BALANCE_WORK_PER_BATCH,
+		max_companies=MAX_COMPANIES_PER_BALANCE_BATCH,
+	)
+	add_jobs_to_queue(
+		session = session,
+		job_name = AsyncJobNameEnum.DAILY_COMPANY_BALANCES_RUN,
+		submitted_by_user_id = cfg.BOT_USER_ID,
+		is_high_priority = False,
+		job_payloads = [{"company_ids": batch_company_ids} for batch_company_ids in company_id_batches],
+	)
 
 	add_job_summary(session, AsyncJobNameEnum.DAILY_COMPANY_BALANCES_RUN)
 
 	return True, None
 
+def list_dirty_company_ids_without_queued_job(
+	session: Session,
+) -> List[str]:
+	"""
+		The customers with a financial summary that needs its balances
+		recomputed, and no queued UPDATE_COMPANY_BALANCES job, in one query.
+	"""
+	payload_company_id = models.AsyncJob.job_payload['company_id'].as_string()
+	company_id = sqlalchemy.cast(models.FinancialSummary.company_id, String)
+	if session.get_bind().dialect.name == 'sqlite':
+		# GUIDs are stored without dashes on SQLite (e.g., in tests), unlike
+		# the company ids in the payloads, so the dashes are left out of both
+		payload_company_id = func.replace(payload_company_id, '-', '')
+		company_id = func.replace(company_id, '-', '')
+
+	queued_job_exists = session.query(models.AsyncJob.id).filter(
+		models.AsyncJob.name == AsyncJobNameEnum.UPDATE_COMPANY_BALANCES
+	).filter(
+		models.AsyncJob.status == AsyncJobStatusEnum.QUEUED
+	).filter(
+		cast(Callable, models.AsyncJob.is_deleted.isnot)(True)
+	).filter(
+		payload_company_id == company_id
+	).exists()
+
+	rows = session.query(models.FinancialSummary.company_id).join(
+		models.Company, models.Company.id == models.FinancialSummary.company_id
+	).filter(
+		models.FinancialSummary.needs_recompute == True
+	).filter(
+		cast(Callable, models.Company.is_customer.is_)(True)
+	).filter(
+		~queued_job_exists
+	).group_by(
+		models.FinancialSummary.company_id
+	).all()
+
+	return [str(row.company_id) for row in rows]
+
 @errors.return_error_tuple
 def generate_update_company_balances(
 	session: Session
@@ -910,43 +1210,15 @@ def generate_update_company_balances(
 	logging.info("Received request to update all company balances")
 	cfg = cast(Config, current_app.app_config)
 
-	# queries for all the company_balances job that are queued to not replicate work to be done
-	currently_queued_jobs = cast(
-		List[models.AsyncJob],
-		session.query(models.AsyncJob).filter(
-			models.AsyncJob.name.in_([
-				AsyncJobNameEnum.UPDATE_COMPANY_BALANCES,
-			])
-		).filter(
-			models.AsyncJob.status == AsyncJobStatusEnum.QUEUED
-		).all())
-	currently_queued_payloads = [dict(job.job_payload if job.job_payload else {}) for job in currently_queued_jobs]
-	currently_queued_company_ids = [ payload.get("company_id") for  payload in currently_queued_payloads]
-
-	# Grab all companies and check if each one is dirty, if so generate job to update
-	companies = reports_util.list_all_companies(session)
-	cur_date = date_util.now_as_date(date_util.DEFAULT_TIMEZONE)
-
-	# add each companies recomputing job to the queue
-	for company in companies:
-		if company["id"] not in currently_queued_company_ids:
-			summary_requests = reports_util.list_financial_summaries_that_need_balances_recomputed_by_company(
-				session,
-				company["id"],
-				date_util.now_as_date(),
-				amount_to_fetch = 1
-			)
-
-			if len(summary_requests) > 0:
-				payload = {"company_id" :company["id"]}
-
-				add_job_to_queue(
-					session=session,
-					job_name=AsyncJobNameEnum.UPDATE_COMPANY_BALANCES,
-					submitted_by_user_id=cfg.BOT_USER_ID,
-					is_high_priority=False,
-					job_payload=payload
-				)
+	# add a recomputing job to the queue for each dirty company that does not have one queued yet
+	company_ids = list_dirty_company_ids_without_queued_job(session)
+	add_jobs_to_queue(
+		session=session,
+		job_name=AsyncJobNameEnum.UPDATE_COMPANY_BALANCES,
+		submitted_by_user_id=cfg.BOT_USER_ID,
+		is_high_priority=False,
+		job_payloads=[{"company_id": company_id} for company_id in company_ids],
+	)
 
 	# this checks if a job summary already exists for the day, all the others
 	# should be duplicates, but we want to make sure that it runs once a day
@@ -961,52 +1233,103 @@ def generate_update_company_balances(
 
 	return True, None
 
-@errors.return_error_tuple
-def orchestrate_update_dirty_company_balances(
+def _update_dirty_company_balances(
 	session: Session,
 	cfg: Config,
-	sendgrid_client: sendgrid_util.Client,
-	job_payload: Dict[str, Any],
-) -> Tuple[bool, errors.Error]:
-	# before this was done for all companies at once now the update is going to be done for one company at a time
-
-	logging.debug("Received request to update dirty company balances")
-	company_id = job_payload["company_id"]
-	today = date_util.now_as_date(date_util.DEFAULT_TIMEZONE)
-
-	compute_requests = reports_util.list_financial_summaries_that_need_balances_recomputed_by_company(
+	company_ids: List[str],
+	today: datetime.date,
+	company_id_to_error: Dict[str, str],
+) -> Tuple[int, errors.Error]:
+	# Returns how many financial summaries were updated
+	compute_requests = reports_util.list_financial_summaries_that_need_balances_recomputed_by_companies(
 		session, 
-		company_id,
+		company_ids,
 		today, 
 		amount_to_fetch=5,
 	)
 	if not compute_requests:
-		return True, None
-	
-	active_compute_requests = reports_util.remove_financial_summaries_that_no_longer_need_to_be_recomputed(
-		session,
-		company_id,
-		compute_requests,
-	)
+		return 0, None
+
+	company_id_to_compute_requests: Dict[str, List[reports_util.ComputeSummaryRequest]] = defaultdict(list)
+	for compute_request in compute_requests:
+		company_id_to_compute_requests[compute_request['company_id']].append(compute_request)
+
+	active_compute_requests = []
+	for company_id, company_compute_requests in company_id_to_compute_requests.items():
+		active_compute_requests += reports_util.remove_financial_summaries_that_no_longer_need_to_be_recomputed(
+			session,
+			company_id,
+			company_compute_requests,
+		)
 
 	dates_updated, descriptive_errors, fatal_error = reports_util.run_customer_balances_for_financial_summaries_that_need_recompute(
 		session,
 		active_compute_requests,
+		process_pool=cfg.BALANCE_PROCESS_POOL,
+		company_id_to_error=company_id_to_error,
 	)
 
 	if fatal_error:
 		logging.error(f"Got FATAL error while recomputing balances for companies that need it: '{fatal_error}'")
-		return False, errors.Error(str(fatal_error))
+		return None, errors.Error(str(fatal_error))
 
-	for cur_date in dates_updated:
-		fatal_error = reports_util.compute_and_update_bank_financial_summaries(
-			session, 
-			cur_date,
-		)
-		if fatal_error:
-			return False, errors.Error('FAILED to update bank financial summary on {}'.format(fatal_error))
+	return len(compute_requests), None
 
-	logging.info("Finished request to update {} dirty financial summaries".format(len(compute_requests)))
+@errors.return_error_tuple
+def orchestrate_update_dirty_company_balances(
+	session: Session,
+	cfg: Config,
+	sendgrid_client: sendgrid_util.Client,
+	job_payload: Dict[str, Any],
+	checkpointer: JobCheckpointer = None,
+) -> Tuple[bool, errors.Error]:
+	# The payload is either one company (UPDATE_COMPANY_BALANCES) or a batch
+	# of companies (DAILY_COMPANY_BALANCES_RUN), whose balances are fetched,
+	# computed and written together, COMPANIES_PER_BALANCE_CHECKPOINT
+	# companies at a time
+
+	logging.debug("Received request to update dirty company balances")
+	company_ids = job_payload["company_ids"] if "company_ids" in job_payload else [job_payload["company_id"]]
+	today = date_util.now_as_date(date_util.DEFAULT_TIMEZONE)
+
+	num_companies_done = 0
+	company_id_to_error: Dict[str, str] = {}
+	cursor = async_job_checkpoint_util.get_cursor(job_payload)
+	if cursor:
+		# The balances of these companies were committed before the job was
+		# interrupted, along with the errors of the ones that failed
+		num_companies_done = cursor['num_companies_done']
+		company_id_to_error = dict(cursor.get('company_id_to_error', {}))
+
+	num_updated = 0
+	while num_companies_done < len(company_ids):
+		chunk_company_ids = company_ids[num_companies_done:num_companies_done + COMPANIES_PER_BALANCE_CHECKPOINT]
+		# Companies that fail are recorded in company_id_to_error, even if
+		# all of the chunk's do, only errors fetching or writing the balances
+		# fail the job
+		num_chunk_updated, err = _update_dirty_company_balances(
+			session, cfg, chunk_company_ids, today, company_id_to_error)
+		if err:
+			return False, err
+		session.commit()
+
+		num_updated += num_chunk_updated
+		num_companies_done += len(chunk_company_ids)
+		if checkpointer:
+			checkpointer.save({
+				'num_companies_done': num_companies_done,
+				'company_id_to_error': company_id_to_error,
+			})
+
+	logging.info("Finished request to update {} dirty financial summaries of {} companies".format(
+		num_updated, len(company_ids)))
+
+	if company_id_to_error:
+		# The job still completes, with the companies that failed in its err_details
+		return True, errors.Error(
+			f'Failed to update the balances of {len(company_id_to_error)} of {len(company_ids)} companies',
+			details={'company_id_to_error': company_id_to_error},
+		)
 
 	return True, None
 
@@ -1454,39 +1777,25 @@ def generate_download_data_for_metrc_api_key_license_jobs_by_metrc_api_key_permi
 	return True, None
 
 # This method is NOT invoked by a daily cron job.
-@errors.return_error_tuple
-def generate_download_data_for_metrc_api_key_license_job_by_license_number(
-	session: Session,
-	cfg: Config,
-	metrc_api_key_id: str,
-	license_number: str,
-) -> Tuple[bool, errors.Error]:
-	job_payload = {
-		"metrc_api_key_id": metrc_api_key_id,
-		"license_number": license_number,
-	}
-	add_job_to_queue(
-		session=session,
-		job_name=AsyncJobNameEnum.DOWNLOAD_DATA_FOR_METRC_API_KEY_LICENSE,
-		submitted_by_user_id=cfg.BOT_USER_ID,
-		is_high_priority=False,
-		job_payload=job_payload,
-	)
-
-	return True, None
-
 @errors.return_error_tuple
 def orchestrate_download_data_for_metrc_api_key_license(
 	session: Session,
 	cfg: Config,
 	sendgrid_client: sendgrid_util.Client,
 	job_payload: Dict[str, Any],
+	checkpointer: JobCheckpointer = None,
 ) -> Tuple[bool, errors.Error]:
 	metrc_api_key_id = job_payload["metrc_api_key_id"]
 	license_number = job_payload["license_number"]
 
-	end_date = date_util.now_as_date() - datetime.timedelta(days=1) # End date is yesterday.
-	start_date = end_date - datetime.timedelta(days=cfg.DOWNLOAD_METRC_DATA_DAYS)
+	cursor = async_job_checkpoint_util.get_cursor(job_payload)
+	if cursor:
+		# Resume from the day after the last day downloaded
+		start_date = date_util.load_date_str(cursor['start_date'])
+		end_date = date_util.load_date_str(cursor['end_date'])
+	else:
+		end_date = date_util.now_as_date() - datetime.timedelta(days=1) # End date is yesterday.
+		start_date = end_date - datetime.timedelta(days=cfg.DOWNLOAD_METRC_DATA_DAYS)
 
 	response, err = metrc_download_util.download_data_for_metrc_api_key_license_in_date_range(
 		session=session,
@@ -1496,7 +1805,7 @@ def orchestrate_download_data_for_metrc_api_key_license(
 		license_number=license_number,
 		start_date=start_date,
 		end_date=end_date,
-		is_async_job=True,
+		checkpointer=checkpointer,
 		is_retry_failures=False,
 	)
 
@@ -0,0 +1,41 @@
+import concurrent.futures
+import logging
+import multiprocessing
+import threading
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable
+
+class RestartingProcessPool(concurrent.futures.Executor):
+	"""
+		A pool of worker processes that starts over with new workers once it
+		is broken, e.g., after one of its workers was killed for running out of
+		memory. The futures of the broken pool raise BrokenProcessPool, but
+		what is submitted next goes to the new workers.
+	"""
+
+	def __init__(self, max_workers: int) -> None:
+		self._max_workers = max_workers
+		self._lock = threading.Lock()
+		self._executor = self._new_executor()
+
+	def _new_executor(self) -> concurrent.futures.ProcessPoolExecutor:
+		return concurrent.futures.ProcessPoolExecutor(
+			max_workers=self._max_workers,
+			# Spawn rather than fork the workers, since this process has threads
+			# and database connections that must not be copied into them
+			mp_context=multiprocessing.get_context('spawn'),
+		)
+
+	def submit(self, fn: Callable, *args: Any, **kwargs: Any) -> concurrent.futures.Future:
+		with self._lock:
+			try:
+				return self._executor.submit(fn, *args, **kwargs)
+			except BrokenProcessPool:
+				logging.error('A worker process of the process pool died, starting new workers')
+				self._executor.shutdown(wait=False)
+				self._executor = self._new_executor()
+				return self._executor.submit(fn, *args, **kwargs)
+
+	def shutdown(self, wait: bool = True) -> None:
+		with self._lock:
+			self._executor.shutdown(wait=wait)
@@ -1,6 +1,6 @@
 import os
 from mypy_extensions import TypedDict
-from typing import Tuple, Dict
+from typing import Tuple, Dict, Optional
 
 from bespoke import errors
 
@@ -26,10 +26,28 @@ class MetrcWorkerConfig(object):
 		num_parallel_licenses: int,
 		num_parallel_sales_transactions: int,
 		force_fetch_missing_sales_transactions: bool,
+		num_parallel_time_ranges: int = 1,
+		max_concurrent_requests_per_api_key: int = None,
+		num_days_to_prefetch: int = 0,
+		archive_dir: str = None,
+		archive_mode: str = None,
 	) -> None:
 		self.num_parallel_licenses = num_parallel_licenses
 		self.num_parallel_sales_transactions = num_parallel_sales_transactions
 		self.force_fetch_missing_sales_transactions = force_fetch_missing_sales_transactions
+		# How many of the intraday time ranges of a split request are fetched at once
+		self.num_parallel_time_ranges = num_parallel_time_ranges
+		# How many requests can be in flight at once for the same API key, across
+		# all the licenses and dates being downloaded in this process
+		self.max_concurrent_requests_per_api_key = max_concurrent_requests_per_api_key
+		# How many days of a date range can be downloaded, and waiting to be
+		# written, while the current day is written. 0 downloads and writes
+		# one day at a time.
+		self.num_days_to_prefetch = num_days_to_prefetch
+		# Where raw Metrc responses are archived, and whether they are recorded
+		# there or replayed from there (see metrc_archive_util.ArchiveMode)
+		self.archive_dir = archive_dir
+		self.archive_mode = archive_mode
 
 
 class MetrcAuthProvider(object):
@@ -62,6 +80,12 @@ def get_metrc_auth_provider() -> MetrcAuthProvider:
 		}
 	)
 
+def get_metrc_requests_per_second_per_api_key() -> Optional[float]:
+	# How many requests per second this process may make with a single Metrc API key,
+	# unlimited when set to 0
+	requests_per_second = os.environ.get('METRC_REQUESTS_PER_SECOND_PER_API_KEY')
+	return float(requests_per_second) if requests_per_second else 10.0
+
 FCSConfigDict = TypedDict('FCSConfigDict', {
 	'use_prod': bool,
 	'client_id': str,
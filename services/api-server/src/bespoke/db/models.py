@@ -624,6 +624,7 @@ class MetrcDownloadSummary(Base):
 	retry_payload = Column(JSON) # stores all paths to retry
 	err_details = Column(JSON)
 	num_retries = Column(Integer)
+	metrics_payload = Column(JSON) # metrc_metrics_util.SyncMetricsDict of the latest download
 
 	created_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
 	updated_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
@@ -1274,6 +1275,24 @@ class FinancialSummary(Base):
 	accounting_interest_accrued_today = Column(Numeric, nullable=True)
 	accounting_late_fees_accrued_today = Column(Numeric, nullable=True)
 
+class LoanBalanceCheckpoint(Base):
+	"""
+	The end-of-day state of a loan, so the loan calculator can resume
+	from this date rather than replaying the loan from its origination date.
+	"""
+	__tablename__ = 'loan_balance_checkpoints'
+
+	id = Column(GUID, primary_key=True, default=GUID_DEFAULT, unique=True)
+	company_id = Column(GUID, nullable=False)
+	loan_id = cast(GUID, Column(GUID, ForeignKey('loans.id'), nullable=False))
+	date = Column(Date, nullable=False)
+
+	inputs_hash = Column(Text, nullable=False) # Hash of the loan inputs on or before date which the state depends on
+	state_payload = Column(JSON, nullable=False) # See loan_calculator.LoanCheckpointDict
+
+	created_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+	updated_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+
 ### End of financial tables
 
 class RevokedTokenModel(Base):
@@ -1727,9 +1746,11 @@ class AsyncJob(Base):
 
 	queued_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
 	initialized_at = Column(DateTime, nullable=True)
-	started_at = Column(DateTime, nullable=False)
-	ended_at = Column(DateTime, nullable=False)
-	is_deleted = Column(Boolean, nullable=False)
+	started_at = Column(DateTime, nullable=True)
+	ended_at = Column(DateTime, nullable=True)
+	# Last time the job showed progress, see async_job_checkpoint_util
+	heartbeat_at = Column(DateTime, nullable=True)
+	is_deleted = Column(Boolean, nullable=True)
 	submitted_by_user_id = cast(GUID, Column(GUID, ForeignKey('users.id'), nullable=True))
 	status = Column(String) # enum: AsyncJobStatusEnum
 	is_high_priority = Column(Boolean, default=False)
@@ -1,3 +1,4 @@
+import bisect
 import datetime
 import json
 import logging
@@ -167,11 +168,19 @@ class DynamicInterestRateHelper(object):
 
 	def __init__(self, dynamic_interest_rates: List[DynamicInterestRate], private: bool) -> None:
 		self._dynamic_interest_rates = dynamic_interest_rates
+		self._start_dates = [dynamic_rate['start_date'] for dynamic_rate in dynamic_interest_rates]
 
 	def get_interest_rate(self, cur_date: datetime.date) -> Tuple[float, errors.Error]:
-		# Find the contract that fits in between the time range
+		# Find the interest rate that fits in between the time range. The rates are
+		# sorted by start date and do not overlap, but the previous range may still
+		# end on the day the next one starts, in which case the earlier one wins.
+		index = bisect.bisect_right(self._start_dates, cur_date) - 1
 
-		for dynamic_rate in self._dynamic_interest_rates:
+		for i in (index - 1, index):
+			if i < 0:
+				continue
+
+			dynamic_rate = self._dynamic_interest_rates[i]
 			if cur_date >= dynamic_rate['start_date'] and cur_date <= dynamic_rate['end_date']:
 				return dynamic_rate['interest_rate'], None
 
@@ -283,6 +292,21 @@ class Contract(object):
 		"""
 		self._late_fee_ranges: List[Tuple[int, int, float]] = []
 
+		# Values parsed out of the product config, cached because the loan
+		# calculator asks for them on every day of every loan.
+		self._days_past_due_to_fee_multiplier: Dict[int, Tuple[float, errors.Error]] = {}
+		self._contract_financing_terms: Tuple[int, errors.Error] = None
+		self._dynamic_interest_rate_helper: Tuple['DynamicInterestRateHelper', errors.Error] = None
+		self._date_to_interest_rate: Dict[datetime.date, Tuple[float, errors.Error]] = {}
+
+	def _clear_cached_values(self) -> None:
+		self._is_populated = False
+		self._late_fee_ranges = []
+		self._days_past_due_to_fee_multiplier = {}
+		self._contract_financing_terms = None
+		self._dynamic_interest_rate_helper = None
+		self._date_to_interest_rate = {}
+
 	def get_product_config(self) -> Dict:
 		# NOTE: This may be modified in the "build" function to add additional fields
 		# if this was an older config
@@ -316,6 +340,7 @@ class Contract(object):
 			))
 			self._internal_name_to_field[field['internal_name']] = field
 
+		self._is_populated = True
 		return True, None
 
 	def _set_field(self, internal_name: str, value: Any) -> Tuple[bool, errors.Error]:
@@ -326,6 +351,7 @@ class Contract(object):
 		for field in orig_fields:
 			if field['internal_name'] == internal_name:
 				field['value'] = value
+				self._clear_cached_values()
 				return True, None
 
 		return False, errors.Error('{} was not found as a field to set'.format(internal_name))
@@ -398,7 +424,10 @@ class Contract(object):
 		return field['value'], None
 
 	def get_contract_financing_terms(self) -> Tuple[int, errors.Error]:
-		return self._get_int_value('contract_financing_terms')
+		if self._contract_financing_terms is None:
+			self._contract_financing_terms = self._get_int_value('contract_financing_terms')
+
+		return self._contract_financing_terms
 
 	def get_product_type(self) -> Tuple[str, errors.Error]:
 		if 'product_type' not in self._config:
@@ -510,21 +539,37 @@ class Contract(object):
 
 		return dynamic_interest_rate_dict if is_dynamic_interest_rate_set else None
 
+	def _get_dynamic_interest_rate_helper(self) -> Tuple['DynamicInterestRateHelper', errors.Error]:
+		# Returns None for the helper if no dynamic interest rate is set.
+		if self._dynamic_interest_rate_helper is None:
+			dynamic_interest_rate_dict = self._get_dynamic_interest_rate_dict()
+
+			if dynamic_interest_rate_dict:
+				self._dynamic_interest_rate_helper = DynamicInterestRateHelper.build(
+					dynamic_interest_rate_dict,
+					contract_start_date=None,
+					contract_end_date=None)
+			else:
+				self._dynamic_interest_rate_helper = (None, None)
+
+		return self._dynamic_interest_rate_helper
+
 	def get_interest_rate(self, cur_date: datetime.date) -> Tuple[float, errors.Error]:
 		# Returns interest rate in decimal format (0.0 = 0%, 1.0 = 100%).
-		dynamic_interest_rate_dict = self._get_dynamic_interest_rate_dict()
+		if cur_date in self._date_to_interest_rate:
+			return self._date_to_interest_rate[cur_date]
 
-		if dynamic_interest_rate_dict:
-			dynamic_helper, err = DynamicInterestRateHelper.build(
-				dynamic_interest_rate_dict,
-				contract_start_date=None,
-				contract_end_date=None)
-			if err:
-				return None, err
+		dynamic_helper, err = self._get_dynamic_interest_rate_helper()
+		if err:
+			return None, err
 
-			return dynamic_helper.get_interest_rate(cur_date)
+		if dynamic_helper:
+			interest_rate_tuple = dynamic_helper.get_interest_rate(cur_date)
+		else:
+			interest_rate_tuple = self._get_fixed_interest_rate()
 
-		return self._get_fixed_interest_rate()
+		self._date_to_interest_rate[cur_date] = interest_rate_tuple
+		return interest_rate_tuple
 
 	def get_wire_fee(self) -> Tuple[float, errors.Error]:
 		return self._get_float_value('wire_fee')
@@ -591,6 +636,14 @@ class Contract(object):
 			For example, if the late fee structure is 25% more when things are 1-7 late,
 			then this returns 0.25 as the multiplier.
 		"""
+		if days_past_due in self._days_past_due_to_fee_multiplier:
+			return self._days_past_due_to_fee_multiplier[days_past_due]
+
+		fee_multiplier_tuple = self._get_fee_multiplier(days_past_due)
+		self._days_past_due_to_fee_multiplier[days_past_due] = fee_multiplier_tuple
+		return fee_multiplier_tuple
+
+	def _get_fee_multiplier(self, days_past_due: int) -> Tuple[float, errors.Error]:
 		product_type, err = self.get_product_type()
 		if err:
 			return None, err
@@ -943,16 +996,39 @@ class ContractHelper(object):
 
 	def __init__(self, contract_dicts: List[models.ContractDict], private: bool) -> None:
 		self._contract_dicts = contract_dicts
+		self._start_dates = [contract_dict['start_date'] for contract_dict in contract_dicts]
+		# Each contract is only built once, so the values it parses out of its
+		# product config are shared by every lookup.
+		self._contracts: List[Contract] = [None] * len(contract_dicts)
 
 	def get_latest_contract_dict(self) -> models.ContractDict:
 		return self._contract_dicts[-1]
 
+	def get_contract_dicts(self) -> List[models.ContractDict]:
+		return self._contract_dicts
+
+	def _get_contract_at_index(self, index: int) -> Tuple[Contract, errors.Error]:
+		if self._contracts[index] is None:
+			contract, err = Contract.build(self._contract_dicts[index], validate=False)
+			if err:
+				return None, err
+			self._contracts[index] = contract
+
+		return self._contracts[index], None
+
 	def get_contract(self, cur_date: datetime.date) -> Tuple[Contract, errors.Error]:
-		# Find the contract that fits in between the time range
+		# Find the contract that fits in between the time range. Contracts are
+		# sorted by start date and do not overlap, but the previous contract may
+		# still end on the day the next one starts, in which case the earlier one wins.
+		index = bisect.bisect_right(self._start_dates, cur_date) - 1
+
+		for i in (index - 1, index):
+			if i < 0:
+				continue
 
-		for cur_contract in self._contract_dicts:
+			cur_contract = self._contract_dicts[i]
 			if cur_date >= cur_contract['start_date'] and cur_date <= cur_contract['adjusted_end_date']:
-				return Contract.build(cur_contract, validate=False)
+				return self._get_contract_at_index(i)
 
 		return None, errors.Error(f'There is no contract configured for the date {cur_date}')
 
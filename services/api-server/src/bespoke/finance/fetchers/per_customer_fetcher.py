@@ -3,7 +3,7 @@
 """
 import datetime
 from datetime import timedelta
-from typing import Callable, List, Tuple, cast
+from typing import Any, Callable, Dict, List, Tuple, cast
 from sqlalchemy.orm.session import Session
 
 from bespoke import errors
@@ -310,6 +310,13 @@ class Fetcher(object):
 		if err:
 			raise err
 
+		_, err = self._set_active_ebba_applications()
+		if err:
+			raise err
+
+		return True, None
+
+	def _set_active_ebba_applications(self) -> Tuple[bool, errors.Error]:
 		# Use the 'active_ebba_application' in CompanySettings to find the
 		# EbbaApplicationDict associated with that application. If this becomes
 		# problematically slow, we can author a new function that takes and
@@ -358,3 +365,284 @@ class Fetcher(object):
 				active_financial_report=self._active_financial_report
 			)
 		)
+
+def _group_by_company_id(rows: List[Any]) -> Dict[str, List[Any]]:
+	company_id_to_rows: Dict[str, List[Any]] = {}
+	for row in rows:
+		company_id = str(row.company_id)
+		if company_id not in company_id_to_rows:
+			company_id_to_rows[company_id] = []
+		company_id_to_rows[company_id].append(row)
+	return company_id_to_rows
+
+class BulkFetcher(object):
+	"""
+		Fetches the same financial information as the Fetcher, but for many
+		customers at once: every table is queried once for all the customers,
+		and the rows are then split up by customer.
+	"""
+
+	def __init__(self,
+		company_info_dicts: List[per_customer_types.CompanyInfoDict], session: Session, ignore_deleted: bool):
+		self._company_ids = [company_info_dict['id'] for company_info_dict in company_info_dicts]
+		self._session = session
+		self._ignore_deleted = ignore_deleted
+
+		self._company_id_to_fetcher = {
+			company_info_dict['id']: Fetcher(company_info_dict, session, ignore_deleted)
+			for company_info_dict in company_info_dicts
+		}
+		self._company_id_to_error: Dict[str, errors.Error] = {}
+
+	def _set_error(self, company_id: str, err: errors.Error) -> None:
+		if company_id not in self._company_id_to_error:
+			self._company_id_to_error[company_id] = err
+
+	def _query_contracts(self, company_ids: List[str]) -> Dict[str, List[models.Contract]]:
+		contracts = cast(
+			List[models.Contract],
+			contract_util.get_active_contracts_base_query(self._session).filter(
+				models.Contract.company_id.in_(company_ids)
+			).all())
+		return _group_by_company_id(contracts)
+
+	def _fetch_contracts(self, today: datetime.date) -> Tuple[bool, errors.Error]:
+		company_id_to_contracts = self._query_contracts(self._company_ids)
+
+		extended_company_ids = []
+		for company_id, contracts in company_id_to_contracts.items():
+			fetcher = self._company_id_to_fetcher[company_id]
+			fetcher._contracts = [c.as_dict() for c in contracts]
+
+			# Extend contracts before doing any financial computations
+			was_extended, err = errors.return_error_tuple(_extend_the_last_contract_if_needed)(
+				fetcher._contracts, today, self._session)
+			if err:
+				self._set_error(company_id, err)
+				continue
+
+			if was_extended:
+				extended_company_ids.append(company_id)
+
+		if extended_company_ids:
+			# Fetch the contracts again for the customers whose contract we extended
+			company_id_to_contracts = self._query_contracts(extended_company_ids)
+			for company_id in extended_company_ids:
+				contracts = company_id_to_contracts.get(company_id, [])
+				self._company_id_to_fetcher[company_id]._contracts = [c.as_dict() for c in contracts]
+
+		return True, None
+
+	def _fetch_company_details(self) -> Tuple[bool, errors.Error]:
+		settings_list = cast(
+			List[models.CompanySettings],
+			self._session.query(models.CompanySettings).filter(
+				models.CompanySettings.company_id.in_(self._company_ids)
+			).all())
+		company_id_to_settings = _group_by_company_id(settings_list)
+
+		for company_id, fetcher in self._company_id_to_fetcher.items():
+			if company_id not in company_id_to_settings:
+				self._set_error(company_id, errors.Error('No settings found'))
+				continue
+
+			fetcher._settings_dict = company_id_to_settings[company_id][0].as_dict()
+
+		return True, None
+
+	def _fetch_loans(self) -> Tuple[bool, errors.Error]:
+		query = self._session.query(models.Loan).filter(
+			models.Loan.company_id.in_(self._company_ids)
+		).order_by(
+			models.Loan.origination_date.asc()
+		)
+
+		if self._ignore_deleted:
+			query = query.filter(cast(Callable, models.Loan.is_deleted.isnot)(True))
+
+		loans = cast(List[models.Loan], query.all())
+		for company_id, company_loans in _group_by_company_id(loans).items():
+			self._company_id_to_fetcher[company_id]._loans = [l.as_dict() for l in company_loans]
+
+		return True, None
+
+	def _fetch_payments(self) -> Tuple[bool, errors.Error]:
+		query = self._session.query(models.Payment).filter(
+			models.Payment.company_id.in_(self._company_ids)
+		)
+
+		if self._ignore_deleted:
+			query = query.filter(cast(Callable, models.Payment.is_deleted.isnot)(True))
+
+		payments = cast(List[models.Payment], query.all())
+		for company_id, company_payments in _group_by_company_id(payments).items():
+			self._company_id_to_fetcher[company_id]._payments = [
+				p.as_dict() for p in company_payments if p.amount is not None
+			]
+
+		return True, None
+
+	def _fetch_transactions(self) -> Tuple[bool, errors.Error]:
+		payment_id_to_company_id = {}
+		for company_id, fetcher in self._company_id_to_fetcher.items():
+			for payment in fetcher._payments:
+				payment_id_to_company_id[payment['id']] = company_id
+
+		if not payment_id_to_company_id:
+			return True, None
+
+		query = self._session.query(models.Transaction).filter(
+			models.Transaction.payment_id.in_(list(payment_id_to_company_id.keys()))
+		)
+		if self._ignore_deleted:
+			query = query.filter(cast(Callable, models.Transaction.is_deleted.isnot)(True))
+
+		transactions = cast(List[models.Transaction], query.all())
+
+		company_id_to_transaction_dicts: Dict[str, List[models.TransactionDict]] = {}
+		for transaction in transactions:
+			company_id = payment_id_to_company_id[str(transaction.payment_id)]
+			if company_id not in company_id_to_transaction_dicts:
+				company_id_to_transaction_dicts[company_id] = []
+			company_id_to_transaction_dicts[company_id].append(transaction.as_dict())
+
+		for company_id, transaction_dicts in company_id_to_transaction_dicts.items():
+			fetcher = self._company_id_to_fetcher[company_id]
+			augmented_transactions, err = models_util.get_augmented_transactions(
+				transaction_dicts, fetcher._payments
+			)
+			if err:
+				self._set_error(company_id, err)
+				continue
+
+			fetcher._augmented_transactions = augmented_transactions
+
+		return True, None
+
+	def _get_artifact_id_to_company_id(self) -> Dict[str, str]:
+		artifact_id_to_company_id = {}
+		for company_id, fetcher in self._company_id_to_fetcher.items():
+			for loan in fetcher._loans:
+				if loan['artifact_id']:
+					artifact_id_to_company_id[loan['artifact_id']] = company_id
+		return artifact_id_to_company_id
+
+	def _fetch_invoices(self) -> Tuple[bool, errors.Error]:
+		artifact_id_to_company_id = self._get_artifact_id_to_company_id()
+		if not artifact_id_to_company_id:
+			return True, None
+
+		query = self._session.query(models.Invoice).filter(
+				models.Invoice.company_id.in_(self._company_ids)
+			).filter(
+				models.Invoice.id.in_(list(artifact_id_to_company_id.keys()))
+			)
+
+		if self._ignore_deleted:
+			query = query.filter(cast(Callable, models.Invoice.is_deleted.isnot)(True))
+
+		invoices = cast(List[models.Invoice], query.all())
+		for company_id, company_invoices in _group_by_company_id(invoices).items():
+			self._company_id_to_fetcher[company_id]._invoices = [
+				inv.as_dict() for inv in company_invoices
+				if artifact_id_to_company_id[str(inv.id)] == company_id
+			]
+
+		return True, None
+
+	def _fetch_purchase_orders(self) -> Tuple[bool, errors.Error]:
+		artifact_id_to_company_id = self._get_artifact_id_to_company_id()
+		if not artifact_id_to_company_id:
+			return True, None
+
+		query = self._session.query(models.PurchaseOrder).filter(
+				models.PurchaseOrder.company_id.in_(self._company_ids)
+			).filter(
+				models.PurchaseOrder.id.in_(list(artifact_id_to_company_id.keys()))
+			)
+
+		if self._ignore_deleted:
+			query = query.filter(cast(Callable, models.PurchaseOrder.is_deleted.isnot)(True))
+
+		purchase_orders = cast(List[models.PurchaseOrder], query.all())
+		for company_id, company_purchase_orders in _group_by_company_id(purchase_orders).items():
+			self._company_id_to_fetcher[company_id]._purchase_orders = [
+				po.as_dict() for po in company_purchase_orders
+				if artifact_id_to_company_id[str(po.id)] == company_id
+			]
+
+		return True, None
+
+	def _fetch_ebba_applications(self) -> Tuple[bool, errors.Error]:
+		ebba_applications = cast(
+			List[models.EbbaApplication],
+			self._session.query(models.EbbaApplication).filter(
+				models.EbbaApplication.company_id.in_(self._company_ids)
+			).all()
+		)
+		for company_id, company_ebba_applications in _group_by_company_id(ebba_applications).items():
+			self._company_id_to_fetcher[company_id]._ebba_applications = [
+				e.as_dict() for e in company_ebba_applications
+			]
+
+		return True, None
+
+	@errors.return_error_tuple
+	def fetch(self, today: datetime.date) -> Tuple[bool, errors.Error]:
+		"""
+			An error that only affects one customer does not fail the fetch,
+			instead it is returned when getting that customer's financials.
+		"""
+		if not self._company_ids:
+			return True, None
+
+		_, err = self._fetch_contracts(today)
+		if err:
+			raise err
+
+		_, err = self._fetch_company_details()
+		if err:
+			raise err
+
+		_, err = self._fetch_loans()
+		if err:
+			raise err
+
+		_, err = self._fetch_payments()
+		if err:
+			raise err
+
+		_, err = self._fetch_transactions()
+		if err:
+			raise err
+
+		_, err = self._fetch_invoices()
+		if err:
+			raise err
+
+		_, err = self._fetch_purchase_orders()
+		if err:
+			raise err
+
+		_, err = self._fetch_ebba_applications()
+		if err:
+			raise err
+
+		for company_id, fetcher in self._company_id_to_fetcher.items():
+			if company_id in self._company_id_to_error:
+				continue
+
+			_, err = errors.return_error_tuple(fetcher._set_active_ebba_applications)()
+			if err:
+				self._set_error(company_id, err)
+
+		return True, None
+
+	def get_financials(self, company_id: str) -> Tuple[per_customer_types.CustomerFinancials, errors.Error]:
+		if company_id in self._company_id_to_error:
+			return None, self._company_id_to_error[company_id]
+
+		if company_id not in self._company_id_to_fetcher:
+			return None, errors.Error(f"Financials for company '{company_id}' were not fetched")
+
+		return self._company_id_to_fetcher[company_id].get_financials(), None
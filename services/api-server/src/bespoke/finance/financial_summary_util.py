@@ -6,6 +6,21 @@ from bespoke.date import date_util
 from bespoke.db import models
 from sqlalchemy.orm.session import Session
 
+# The financial summary columns that are summed up into the bank financial summaries
+BANK_FINANCIAL_SUMMARY_FIELDS = [
+	'total_limit',
+	'adjusted_total_limit',
+	'total_outstanding_principal',
+	'total_outstanding_principal_for_interest',
+	'total_outstanding_principal_past_due',
+	'total_outstanding_interest',
+	'total_outstanding_fees',
+	'total_principal_in_requested_state',
+	'interest_accrued_today',
+	'late_fees_accrued_today',
+	'available_limit',
+]
+
 def _get_today(now_for_test: datetime.datetime) -> datetime.date:
 	return now_for_test.date() if now_for_test else date_util.now_as_date(date_util.DEFAULT_TIMEZONE)
 
@@ -2,7 +2,7 @@ import datetime
 import logging
 from calendar import monthrange
 from datetime import timedelta
-from typing import Dict, Tuple
+from typing import Any, Dict, List, Tuple
 
 from bespoke import errors
 from bespoke.date import date_util
@@ -16,6 +16,13 @@ AccumulatedAmountDict = TypedDict('AccumulatedAmountDict', {
 	'fees_amount': float
 })
 
+# The amounts in a FeeAccumulator, in a form that can be stored as JSON
+FeeAccumulatorStateDict = TypedDict('FeeAccumulatorStateDict', {
+	'months': List[Dict], # month, year, interest_amount, fees_amount
+	'quarters': List[Dict], # quarter, year, interest_amount, fees_amount
+	'contract_years': List[Dict], # contract_start_date, contract_end_date, interest_amount, fees_amount
+})
+
 _MONTH_TO_QUARTER = {
 	1: 1,
 	2: 1,
@@ -266,6 +273,50 @@ class FeeAccumulator(object):
 		self._contract_year_to_amounts[contract_year_key]['interest_amount'] += interest_for_day
 		self._contract_year_to_amounts[contract_year_key]['fees_amount'] += fees_for_day
 
+	def get_state(self) -> FeeAccumulatorStateDict:
+		return FeeAccumulatorStateDict(
+			months=[{
+				'month': month.month,
+				'year': month.year,
+				'interest_amount': amounts['interest_amount'],
+				'fees_amount': amounts['fees_amount'],
+			} for month, amounts in self._month_to_amounts.items()],
+			quarters=[{
+				'quarter': quarter.quarter,
+				'year': quarter.year,
+				'interest_amount': amounts['interest_amount'],
+				'fees_amount': amounts['fees_amount'],
+			} for quarter, amounts in self._quarter_to_amounts.items()],
+			contract_years=[{
+				'contract_start_date': date_util.date_to_db_str(contract_start_date),
+				'contract_end_date': date_util.date_to_db_str(contract_end_date),
+				'interest_amount': amounts['interest_amount'],
+				'fees_amount': amounts['fees_amount'],
+			} for (contract_start_date, contract_end_date), amounts in self._contract_year_to_amounts.items()],
+		)
+
+	def add_state(self, state: FeeAccumulatorStateDict) -> None:
+		# Adds the amounts from another accumulator's state to this one
+		def _add(key_to_amounts: Dict, key: Any, entry: Dict) -> None:
+			if key not in key_to_amounts:
+				key_to_amounts[key] = AccumulatedAmountDict(interest_amount=0, fees_amount=0)
+
+			key_to_amounts[key]['interest_amount'] += entry['interest_amount']
+			key_to_amounts[key]['fees_amount'] += entry['fees_amount']
+
+		for entry in state['months']:
+			_add(self._month_to_amounts, finance_types.Month(month=entry['month'], year=entry['year']), entry)
+
+		for entry in state['quarters']:
+			_add(self._quarter_to_amounts, finance_types.Quarter(quarter=entry['quarter'], year=entry['year']), entry)
+
+		for entry in state['contract_years']:
+			contract_year_key = (
+				date_util.load_date_str(entry['contract_start_date']),
+				date_util.load_date_str(entry['contract_end_date']),
+			)
+			_add(self._contract_year_to_amounts, contract_year_key, entry)
+
 
 def get_cur_minimum_fees(contract_helper: contract_util.ContractHelper, today: datetime.date, fee_accumulator: FeeAccumulator) -> Tuple[MinimumInterestInfoDict, errors.Error]:
 	cur_contract, err = contract_helper.get_contract(today)
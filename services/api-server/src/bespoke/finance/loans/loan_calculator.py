@@ -3,12 +3,16 @@
 	and then calculates the outstanding principal, interest and fees that will
 	be associated with this loan at a particular date.
 """
+import bisect
 import copy
 import datetime
+import hashlib
+import json
 import logging
+import numpy as np
 from collections import OrderedDict
 from datetime import timedelta
-from typing import Dict, List, Tuple, Union, Set, cast
+from typing import Callable, Dict, List, Tuple, Union, Set, cast
 
 from bespoke import errors
 from bespoke.date import date_util
@@ -141,21 +145,67 @@ CalculateResultDict = TypedDict('CalculateResultDict', {
 	'debug_info': LoanUpdateDebugInfoDict
 })
 
+# The state of a loan at the end of a day while replaying its history
+LoanDayStateDict = TypedDict('LoanDayStateDict', {
+	'balances': CalculatorBalances,
+	'amount_to_pay_interest_on': float,
+	'interest_accrued_today': float,
+	'fees_accrued_today': float,
+	'financing_day_limit': int,
+	'payment_effect': PaymentEffectDict,
+})
+
+FeeAccrualDict = TypedDict('FeeAccrualDict', {
+	'contract_start_date': datetime.date,
+	'contract_end_date': datetime.date,
+	'interest_for_day': float,
+	'fees_for_day': float,
+	'day': datetime.date,
+})
+
+# The end-of-day state of a loan on a date, which a replay can resume from
+LoanCheckpointDict = TypedDict('LoanCheckpointDict', {
+	'date': datetime.date,
+	'inputs_hash': str, # See _get_checkpoint_inputs_hash
+	'state': LoanDayStateDict,
+	'fee_accumulator_state': fee_util.FeeAccumulatorStateDict, # Interest and fees accrued up to and including date
+})
+
+class LoanCheckpoints(object):
+	"""
+		The stored checkpoints of a loan a calculation may resume from, and the
+		checkpoint the calculation produced which should be stored for next time.
+	"""
+
+	def __init__(self, checkpoints: List[LoanCheckpointDict]) -> None:
+		self.checkpoints = sorted(checkpoints, key=lambda checkpoint: checkpoint['date'], reverse=True)
+		self.new_checkpoint: LoanCheckpointDict = None
+
 class ThresholdAccumulator(object):
 	"""
 		An object to accumulate the principal amounts for the factoring fee threshold
 	"""
 
 	def __init__(self, contract_helper: contract_util.ContractHelper) -> None:
-		self._date_to_txs: Dict[datetime.date, List[models.AugmentedTransactionDict]] = OrderedDict()
+		# Only the principal of repayments counts towards the threshold, but every
+		# transaction's date is kept, since that is the order dates are checked in.
+		self._date_to_repayment_principals: Dict[datetime.date, List[float]] = OrderedDict()
 		self._contract_helper = contract_helper
 
 	def add_transaction(self, tx: models.AugmentedTransactionDict) -> None:
 		cur_date = tx['transaction']['effective_date']
-		if cur_date not in self._date_to_txs:
-			self._date_to_txs[cur_date] = []
+		if cur_date not in self._date_to_repayment_principals:
+			self._date_to_repayment_principals[cur_date] = []
+
+		if payment_util.is_repayment(tx['transaction']):
+			self._date_to_repayment_principals[cur_date].append(tx['transaction']['to_principal'])
+
+	def add_transaction_index(self, transaction_index: 'TransactionIndex') -> None:
+		for cur_date, repayment_principals in transaction_index.date_to_repayment_principals.items():
+			if cur_date not in self._date_to_repayment_principals:
+				self._date_to_repayment_principals[cur_date] = []
 
-		self._date_to_txs[cur_date].append(tx)
+			self._date_to_repayment_principals[cur_date].extend(repayment_principals)
 
 	def compute_threshold_info(self, report_date: datetime.date) -> Tuple[ThresholdInfoDict, errors.Error]:
 		contract, err = self._contract_helper.get_contract(report_date)
@@ -183,19 +233,16 @@ class ThresholdAccumulator(object):
 				day_threshold_met=start_date
 			), None
 
-		for cur_date, aug_txs in self._date_to_txs.items():
+		for cur_date, repayment_principals in self._date_to_repayment_principals.items():
 
-			for aug_tx in aug_txs:
-				tx = aug_tx['transaction']
-
-				if tx['effective_date'] < start_date or tx['effective_date'] > end_date or tx['effective_date'] > report_date:
-					# Dont include transactions happening outside of the range
-					# of the current contract in effect, or that come after
-					# the current report date.
-					continue
+			if cur_date < start_date or cur_date > end_date or cur_date > report_date:
+				# Dont include transactions happening outside of the range
+				# of the current contract in effect, or that come after
+				# the current report date.
+				continue
 
-				if payment_util.is_repayment(tx):
-					total_repayments_amount += tx['to_principal']
+			for repayment_principal in repayment_principals:
+				total_repayments_amount += repayment_principal
 
 			if has_threshold_set and total_repayments_amount >= factoring_fee_threshold:
 				return ThresholdInfoDict(
@@ -237,6 +284,86 @@ def get_transactions_for_loan(
 
 	return loan_txs
 
+class LoanTransactionIndex(object):
+	"""
+		A loan's transactions grouped by their deposit and settlement dates.
+		None of this depends on the report date, so the TransactionsHelper of
+		every report date can share it.
+	"""
+
+	def __init__(self, augmented_transactions: List[models.AugmentedTransactionDict]) -> None:
+		self.deposit_date_to_txs: Dict[datetime.date, List[models.AugmentedTransactionDict]] = {}
+		self.settlement_date_to_txs: Dict[datetime.date, List[models.AugmentedTransactionDict]] = {}
+		# The (deposit date, settlement date) of every repayment, in transaction order
+		self.repayment_dates: List[Tuple[datetime.date, datetime.date]] = []
+
+		for tx in augmented_transactions:
+			cur_deposit_date = tx['payment']['deposit_date']
+			if cur_deposit_date not in self.deposit_date_to_txs:
+				self.deposit_date_to_txs[cur_deposit_date] = []
+			self.deposit_date_to_txs[cur_deposit_date].append(tx)
+
+			cur_settlement_date = tx['transaction']['effective_date']
+			if cur_settlement_date not in self.settlement_date_to_txs:
+				self.settlement_date_to_txs[cur_settlement_date] = []
+			self.settlement_date_to_txs[cur_settlement_date].append(tx)
+
+			if payment_util.is_repayment(tx['transaction']):
+				self.repayment_dates.append((cur_deposit_date, cur_settlement_date))
+
+		# Sorted deposit and settlement dates
+		self.transaction_dates = sorted(
+			tx_date for tx_date in set(self.deposit_date_to_txs.keys()) | set(self.settlement_date_to_txs.keys())
+			if tx_date is not None
+		)
+
+class TransactionIndex(object):
+	"""
+		A customer's transactions grouped by loan. It is built once per customer,
+		so calculating each loan (for each report date) does not have to scan
+		through all of the customer's transactions.
+	"""
+
+	def __init__(self) -> None:
+		self._loan_id_to_txs: Dict[str, List[models.AugmentedTransactionDict]] = {}
+		self._loan_id_to_loan_index: Dict[str, LoanTransactionIndex] = {}
+		# The inputs of the ThresholdAccumulator, see add_transaction_index
+		self.date_to_repayment_principals: Dict[datetime.date, List[float]] = OrderedDict()
+
+	def get_transactions_for_loan(self, loan_id: str) -> List[models.AugmentedTransactionDict]:
+		return self._loan_id_to_txs.get(loan_id, [])
+
+	def get_loan_transaction_index(self, loan_id: str) -> LoanTransactionIndex:
+		if loan_id not in self._loan_id_to_loan_index:
+			self._loan_id_to_loan_index[loan_id] = LoanTransactionIndex(
+				self.get_transactions_for_loan(loan_id))
+		return self._loan_id_to_loan_index[loan_id]
+
+	@staticmethod
+	def build(
+		loans: List[models.LoanDict],
+		augmented_transactions: List[models.AugmentedTransactionDict]) -> 'TransactionIndex':
+		index = TransactionIndex()
+
+		for tx in augmented_transactions:
+			loan_id = tx['transaction']['loan_id']
+			if loan_id not in index._loan_id_to_txs:
+				index._loan_id_to_txs[loan_id] = []
+			index._loan_id_to_txs[loan_id].append(tx)
+
+		# Only the transactions of these loans count towards the factoring fee
+		# threshold, in the same order as adding them one loan at a time.
+		for loan in loans:
+			for tx in index.get_transactions_for_loan(loan['id']):
+				cur_date = tx['transaction']['effective_date']
+				if cur_date not in index.date_to_repayment_principals:
+					index.date_to_repayment_principals[cur_date] = []
+
+				if payment_util.is_repayment(tx['transaction']):
+					index.date_to_repayment_principals[cur_date].append(tx['transaction']['to_principal'])
+
+		return index
+
 def _apply_to(cur_loan_state: LoanFinancialStateDict, category: str, amount_left: float) -> Tuple[float, float]:
 	if category == 'principal':
 		outstanding_amount = cur_loan_state['outstanding_principal']
@@ -412,6 +539,7 @@ class TransactionsHelper(object):
 		self._deposit_date_to_txs: Dict[datetime.date, List[models.AugmentedTransactionDict]] = {}
 		self.last_tx_settlement_date: datetime.date = None
 		self.loan_repayment_dates: List[Tuple[datetime.date, datetime.date]] = []
+		self._transaction_dates: List[datetime.date] = [] # Sorted deposit and settlement dates
 
 	def get_transactions_on_deposit_date(self, cur_date: datetime.date) -> List[models.AugmentedTransactionDict]:
 		return self._deposit_date_to_txs.get(cur_date, [])
@@ -419,29 +547,28 @@ class TransactionsHelper(object):
 	def get_transactions_on_settlement_date(self, cur_date: datetime.date) -> List[models.AugmentedTransactionDict]:
 		return self._settlement_date_to_txs.get(cur_date, [])
 
+	def get_next_transaction_date(self, cur_date: datetime.date) -> datetime.date:
+		# The first day on or after cur_date that a transaction deposits or settles
+		index = bisect.bisect_left(self._transaction_dates, cur_date)
+		if index == len(self._transaction_dates):
+			return None
+		return self._transaction_dates[index]
+
 	@staticmethod
 	def build(
 		augmented_transactions: List[models.AugmentedTransactionDict],
 		payment_to_include: IncludedPaymentDict,
-		today: datetime.date) -> Tuple['TransactionsHelper', errors.Error]:
+		today: datetime.date,
+		loan_transaction_index: LoanTransactionIndex = None) -> Tuple['TransactionsHelper', errors.Error]:
+
+		if not loan_transaction_index:
+			loan_transaction_index = LoanTransactionIndex(augmented_transactions)
 
 		loan_repayment_dates_set: Set[Tuple[datetime.date, datetime.date]] = set([])
 		last_tx_settlement_date = None
-		settlement_date_to_txs: Dict[datetime.date, List[models.AugmentedTransactionDict]] = {}
-		deposit_date_to_txs: Dict[datetime.date, List[models.AugmentedTransactionDict]] = {}
-
-		for tx in augmented_transactions:
-			cur_deposit_date = tx['payment']['deposit_date']
-			if cur_deposit_date not in deposit_date_to_txs:
-				deposit_date_to_txs[cur_deposit_date] = []
-			deposit_date_to_txs[cur_deposit_date].append(tx)
-
-			cur_settlement_date = tx['transaction']['effective_date']
-			if cur_settlement_date not in settlement_date_to_txs:
-				settlement_date_to_txs[cur_settlement_date] = []
-			settlement_date_to_txs[cur_settlement_date].append(tx)
 
-			if payment_util.is_repayment(tx['transaction']) and cur_deposit_date <= today:
+		for cur_deposit_date, cur_settlement_date in loan_transaction_index.repayment_dates:
+			if cur_deposit_date <= today:
 				# If this transaction was deposited within this report date,
 				# we actually need to calculate all the loan details up until its
 				# settlement date.
@@ -461,8 +588,9 @@ class TransactionsHelper(object):
 				last_tx_settlement_date = payment_to_include['settlement_date']
 
 		helper = TransactionsHelper()
-		helper._deposit_date_to_txs = deposit_date_to_txs
-		helper._settlement_date_to_txs = settlement_date_to_txs
+		helper._deposit_date_to_txs = loan_transaction_index.deposit_date_to_txs
+		helper._settlement_date_to_txs = loan_transaction_index.settlement_date_to_txs
+		helper._transaction_dates = loan_transaction_index.transaction_dates
 		helper.last_tx_settlement_date = last_tx_settlement_date
 
 		loan_repayment_dates = list(loan_repayment_dates_set)
@@ -582,6 +710,193 @@ def _get_interest_and_fees_due_on_day(
 		fee_multiplier=fee_multiplier,
 	), None
 
+# Results of accruing interest and fees over consecutive days, one entry per day
+AccrualDaysDict = TypedDict('AccrualDaysDict', {
+	'num_days': int,
+	'financing_day_limits': List[int],
+	'contract_start_dates': List[datetime.date],
+	'contract_end_dates': List[datetime.date],
+	'amount_to_pay_interest_on': float,
+	'interest_rates_used': List[float],
+	'fee_multipliers': List[float],
+	'interest_due': List[float],
+	'fees_due': List[float],
+	'outstanding_interest': List[float],
+	'outstanding_fees': List[float],
+	'accounting_outstanding_interest': List[float],
+	'accounting_outstanding_late_fees': List[float],
+})
+
+def _accrue_interest_and_fees_over_days(
+	contract_helper: contract_util.ContractHelper,
+	start_date: datetime.date,
+	end_date: datetime.date,
+	input_dict: CalculateInterestInputDict,
+	company_settings: models.CompanySettingsDict,
+	balances: CalculatorBalances,
+	financing_day_limit: int,
+) -> AccrualDaysDict:
+	"""
+		Accrues the interest and fees for every day from start_date to end_date,
+		when no transaction deposits or settles on any of those days. The principal
+		is the same on each of these days, so the amounts accrued only depend on the
+		contract terms of each day and are computed as arrays.
+
+		The results are the same as calling _get_interest_and_fees_due_on_day for
+		each day. Accrual stops before the first day that one of the contract terms
+		cannot be determined, so num_days may be less than the days requested and
+		the daily calculation reports the error for that day.
+	"""
+	threshold_info = input_dict['threshold_info']
+	loan = input_dict['loan']
+	invoice = input_dict['invoice']
+	day_threshold_met = threshold_info['day_threshold_met']
+
+	days: List[datetime.date] = []
+	financing_day_limits: List[int] = []
+	contract_start_dates: List[datetime.date] = []
+	contract_end_dates: List[datetime.date] = []
+	interest_rates: List[float] = []
+	fee_multipliers: List[float] = []
+	is_invoice_financing = None
+
+	cur_date = start_date
+	has_err = False
+	while cur_date <= end_date and not has_err:
+		# The contract and the terms which only depend on it are looked up once
+		# for all the days it is in effect.
+		cur_contract, err = contract_helper.get_contract(cur_date)
+		if err:
+			break
+
+		product_type, err = cur_contract.get_product_type()
+		if err:
+			break
+
+		if product_type != db_constants.ProductType.LINE_OF_CREDIT:
+			financing_day_limit, err = cur_contract.get_contract_financing_terms()
+			if err:
+				break
+
+		cur_contract_start_date, err = cur_contract.get_start_date()
+		if err:
+			break
+
+		cur_contract_end_date, err = cur_contract.get_adjusted_end_date()
+		if err:
+			break
+
+		contract_is_invoice_financing = product_type == db_constants.ProductType.INVOICE_FINANCING
+		if is_invoice_financing is not None and contract_is_invoice_financing != is_invoice_financing:
+			# The amount to pay interest on is calculated differently from here on
+			break
+		is_invoice_financing = contract_is_invoice_financing
+
+		if is_invoice_financing and not invoice:
+			break
+
+		factoring_fee_threshold, err = cur_contract.get_factoring_fee_threshold()
+		has_threshold_set = factoring_fee_threshold > 0.0
+
+		while cur_date <= end_date and cur_date <= cur_contract_end_date:
+			interest_rate, err = cur_contract.get_interest_rate(cur_date)
+			if err:
+				has_err = True
+				break
+
+			fee_multiplier = 0.0
+			if cur_date > loan['adjusted_maturity_date']:
+				days_past_due = (cur_date - loan['adjusted_maturity_date']).days
+				fee_multiplier, err = cur_contract.get_fee_multiplier(days_past_due=days_past_due)
+				if err:
+					has_err = True
+					break
+
+			if has_threshold_set and day_threshold_met and cur_date > day_threshold_met:
+				interest_rate, err = cur_contract.get_discounted_interest_rate_due_to_factoring_fee(cur_date)
+				if err:
+					has_err = True
+					break
+
+			days.append(cur_date)
+			financing_day_limits.append(financing_day_limit)
+			contract_start_dates.append(cur_contract_start_date)
+			contract_end_dates.append(cur_contract_end_date)
+			interest_rates.append(interest_rate)
+			fee_multipliers.append(fee_multiplier)
+			cur_date = cur_date + timedelta(days=1)
+
+	num_days = len(days)
+	if num_days == 0:
+		return AccrualDaysDict(
+			num_days=0,
+			financing_day_limits=[],
+			contract_start_dates=[],
+			contract_end_dates=[],
+			amount_to_pay_interest_on=None,
+			interest_rates_used=[],
+			fee_multipliers=[],
+			interest_due=[],
+			fees_due=[],
+			outstanding_interest=[],
+			outstanding_fees=[],
+			accounting_outstanding_interest=[],
+			accounting_outstanding_late_fees=[],
+		)
+
+	if is_invoice_financing:
+		if number_util.is_currency_zero(balances['outstanding_principal_for_interest']):
+			amount_to_pay_interest_on = 0.0
+		else:
+			amount_to_pay_interest_on = max(0.0, invoice['subtotal_amount'] - balances['amount_paid_back_on_loan'])
+	else:
+		amount_to_pay_interest_on = balances['outstanding_principal_for_interest']
+
+	interest_rates_used = np.array(interest_rates, dtype=np.float64)
+	if number_util.is_currency_zero(amount_to_pay_interest_on):
+		interest_rates_used = np.zeros(num_days)
+	elif number_util.round_currency(amount_to_pay_interest_on) < 0:
+		for day in days:
+			logging.warn(f'Amount to pay interest on ({amount_to_pay_interest_on}) is negative on {day} for loan {loan["id"]}')
+
+	interest_due = interest_rates_used * amount_to_pay_interest_on
+	if balances['loan_paid_by_maturity_date']:
+		fees_due = np.zeros(num_days)
+	else:
+		fees_due = np.array(fee_multipliers, dtype=np.float64) * interest_due
+
+	# Accounting balances only increase up to the interest and late fees end dates
+	day_ordinals = np.array([day.toordinal() for day in days])
+	accounting_interest_due = interest_due
+	if company_settings['interest_end_date'] is not None:
+		accounting_interest_due = np.where(
+			day_ordinals <= company_settings['interest_end_date'].toordinal(), interest_due, 0.0)
+
+	accounting_fees_due = fees_due
+	if company_settings['late_fees_end_date'] is not None:
+		accounting_fees_due = np.where(
+			day_ordinals <= company_settings['late_fees_end_date'].toordinal(), fees_due, 0.0)
+
+	def _running_total(start_value: float, amounts: np.ndarray) -> List[float]:
+		# Cumulative sums add one day at a time, the same as the daily loop
+		return np.cumsum(np.concatenate(([start_value], amounts)))[1:].tolist()
+
+	return AccrualDaysDict(
+		num_days=num_days,
+		financing_day_limits=financing_day_limits,
+		contract_start_dates=contract_start_dates,
+		contract_end_dates=contract_end_dates,
+		amount_to_pay_interest_on=amount_to_pay_interest_on,
+		interest_rates_used=interest_rates_used.tolist(),
+		fee_multipliers=fee_multipliers,
+		interest_due=interest_due.tolist(),
+		fees_due=fees_due.tolist(),
+		outstanding_interest=_running_total(balances['outstanding_interest'], interest_due),
+		outstanding_fees=_running_total(balances['outstanding_fees'], fees_due),
+		accounting_outstanding_interest=_running_total(balances['accounting_outstanding_interest'], accounting_interest_due),
+		accounting_outstanding_late_fees=_running_total(balances['accounting_outstanding_late_fees'], accounting_fees_due),
+	)
+
 def _update_at_beginning_of_day(
 	transactions_by_settlement_date: List[models.AugmentedTransactionDict],
 	balances: CalculatorBalances
@@ -695,17 +1010,27 @@ def _get_additional_interest_and_fees_for_repayment_effect(
 
 	return additional_interest, additional_fees, None
 
-def _perform_daily_interest_and_fees_adjustment(fee_accumulator: fee_util.FeeAccumulator, txs_helper: TransactionsHelper, date_to_result: Dict[datetime.date, CalculateResultDict]) -> Tuple[bool, errors.Error]:
+def _perform_daily_interest_and_fees_adjustment(
+	fee_accumulator: fee_util.FeeAccumulator,
+	txs_helper: TransactionsHelper,
+	date_to_result: Dict[datetime.date, CalculateResultDict],
+	start_date: datetime.date = None,
+) -> Tuple[bool, errors.Error]:
 	# Iterate through days that had a repayment deposited
 	# Within each deposit - settlement window, re-distribute the interest
 	# adjustments so:
 	#  1) the Finance team can book revenue within the same month the payment deposits
 	#  2) We can close out the loan on the deposit date, because we know they
 	#     paid enough of the interest / fees that will collect by the settlement date
+	#
+	# start_date is set when there are no results before it (the loan was resumed
+	# from a checkpoint), in which case windows that settled before it are skipped.
 	performed_adjustment_by_month: Dict[finance_types.Month, bool] = {}
 
 	for deposit_date, settlement_date in txs_helper.loan_repayment_dates:
-		
+		if start_date and settlement_date < start_date:
+			continue
+
 		settlement_update = date_to_result[settlement_date]['loan_update']
 		if settlement_update['should_close_loan']:
 			# If the loan was closed on the settlement date, then we can
@@ -799,36 +1124,368 @@ def _perform_daily_interest_and_fees_adjustment(fee_accumulator: fee_util.FeeAcc
 
 	return True, None
 
+def _get_calculate_up_to_date(txs_helper: TransactionsHelper, today: datetime.date) -> datetime.date:
+	# If a repayment deposited by today settles after today, we need to calculate
+	# all the loan details up until its settlement date.
+	last_tx_settlement_date = txs_helper.last_tx_settlement_date
+	if last_tx_settlement_date and last_tx_settlement_date > today:
+		return last_tx_settlement_date
+	return today
+
+def _get_calculate_result_dict(
+	loan: models.LoanDict,
+	company_settings: models.CompanySettingsDict,
+	state: LoanDayStateDict,
+	today: datetime.date,
+	result_today: datetime.date, # "Today" date to use in the result dict.
+	day_last_repayment_settles: datetime.date,
+	payment_to_include: IncludedPaymentDict,
+	should_round_output: bool,
+	debug_info: LoanUpdateDebugInfoDict,
+) -> CalculateResultDict:
+	# If you haven't gone through the transaction's settlement days, but you did include
+	# them because they were deposited, interest and fees may go negative for those
+	# clearance days, but then when those settlement days happen, the fees and interest
+	# balance out.
+	balances = state['balances']
+	interest_accrued_today = state['interest_accrued_today']
+	fees_accrued_today = state['fees_accrued_today']
+
+	should_close_loan = False
+	outstanding_principal = _format_output_value(balances['outstanding_principal'], should_round_output)
+	outstanding_principal_for_interest = _format_output_value(balances['outstanding_principal_for_interest'], should_round_output)
+	outstanding_interest = _format_output_value(balances['outstanding_interest'], should_round_output)
+	outstanding_fees = _format_output_value(balances['outstanding_fees'], should_round_output)
+
+	accounting_outstanding_principal = _format_output_value(balances['accounting_outstanding_principal'], should_round_output)
+	accounting_outstanding_interest = _format_output_value(balances['accounting_outstanding_interest'], should_round_output)
+	accounting_outstanding_late_fees = _format_output_value(balances['accounting_outstanding_late_fees'], should_round_output)
+	accounting_interest_accrued_today = 0.0 if company_settings['interest_end_date'] is not None and \
+		result_today > company_settings['interest_end_date'] else interest_accrued_today
+	accounting_late_fees_accrued_today = 0.0 if company_settings['late_fees_end_date'] is not None and \
+		result_today > company_settings['late_fees_end_date'] else fees_accrued_today
+
+	if not loan['closed_at'] and balances['has_been_funded']:
+		# If the loan hasn't been closed yet and is funded, then
+		# check whether it should be closed.
+		# If it already has been closed, then no need to close it again.
+		# If it's not funded yet, then we shouldnt close it out yet.
+		should_close_loan = payment_util.should_close_loan(
+			new_outstanding_principal=outstanding_principal,
+			new_outstanding_interest=outstanding_interest,
+			new_outstanding_fees=outstanding_fees,
+			day_last_repayment_settles=day_last_repayment_settles,
+			cur_date=result_today
+		)
+
+	report_repayment_date = balances['repayment_date']
+	financing_period = None
+
+	# Financing period is complete on date loan is closed.
+	is_financing_period_complete = loan['closed_at'] or should_close_loan
+
+	if is_financing_period_complete:
+		if not report_repayment_date and payment_to_include:
+			report_repayment_date = payment_to_include['settlement_date']
+
+		# If there is a repayment date, calculate the financing period for this closed loan.
+		# Note: there may not be a repayment date if the loan was closed via adjustments.
+		if report_repayment_date:
+			financing_period = date_util.number_days_between_dates(
+				report_repayment_date,
+				loan['origination_date'],
+				inclusive_later_date=True,
+			)
+
+		days_overdue = 0
+	else:
+		# Since loan is not closed, financing period is not complete.
+		financing_period = date_util.number_days_between_dates(
+			max(result_today, report_repayment_date) if report_repayment_date else result_today,
+			loan['origination_date'],
+			inclusive_later_date=True,
+		)
+
+		days_overdue = date_util.number_days_between_dates(
+			result_today,
+			loan['adjusted_maturity_date'],
+		)
+		days_overdue = days_overdue if days_overdue else 0
+
+	adjusted_maturity_date = loan['adjusted_maturity_date']
+	l = LoanUpdateDict(
+		loan_id=loan['id'],
+		adjusted_maturity_date=loan['adjusted_maturity_date'],
+		outstanding_principal=outstanding_principal,
+		outstanding_principal_for_interest=outstanding_principal_for_interest,
+		outstanding_principal_past_due=outstanding_principal if today > adjusted_maturity_date else 0.0,
+		outstanding_interest=outstanding_interest,
+		outstanding_fees=outstanding_fees,
+		interest_paid_daily_adjustment=0.0, # Will be filled in later if necessary
+		fees_paid_daily_adjustment=0.0, # Will be filled in later if necessary
+		amount_to_pay_interest_on=_format_output_value(state['amount_to_pay_interest_on'], should_round_output),
+		interest_accrued_today=_format_output_value(interest_accrued_today, should_round_output),
+		fees_accrued_today=_format_output_value(fees_accrued_today, should_round_output),
+		should_close_loan=should_close_loan,
+		repayment_date=report_repayment_date,
+		day_last_repayment_settles=day_last_repayment_settles,
+		financing_period=financing_period,
+		financing_day_limit=state['financing_day_limit'],
+		total_principal_paid=_format_output_value(balances['total_principal_paid'], should_round_output),
+		total_interest_paid=_format_output_value(balances['total_interest_paid'], should_round_output),
+		total_fees_paid=_format_output_value(balances['total_fees_paid'], should_round_output),
+		days_overdue=days_overdue,
+		accounting_outstanding_principal=accounting_outstanding_principal,
+		accounting_outstanding_interest=accounting_outstanding_interest,
+		accounting_outstanding_late_fees=accounting_outstanding_late_fees,
+		accounting_interest_accrued_today=accounting_interest_accrued_today,
+		accounting_late_fees_accrued_today=accounting_late_fees_accrued_today,
+	)
+
+	return CalculateResultDict(
+		payment_effect=state['payment_effect'],
+		loan_update=l,
+		debug_info=debug_info
+	)
+
+_DEBUG_COLUMN_NAMES = [
+	'date',
+	'outstanding_principal',
+	'outstanding_principal_for_interest',
+	'outstanding_interest',
+	'outstanding_fees',
+
+	'amount_to_pay_interest_on',
+	'interest_due_for_day',
+	'fee_for_day',
+	'interest_rate',
+	'fee_multiplier',
+]
+
+def _get_debug_row(
+	cur_date: datetime.date,
+	balances: CalculatorBalances,
+	interest_fee_info: InterestFeeInfoDict,
+) -> UpdateDebugStateDict:
+	debug_row_info: List[Union[str, int, float]] = [
+		date_util.date_to_db_str(cur_date),
+		balances['outstanding_principal'],
+		balances['outstanding_principal_for_interest'],
+		balances['outstanding_interest'],
+		balances['outstanding_fees'],
+
+		interest_fee_info['amount_to_pay_interest_on'],
+		interest_fee_info['interest_due_for_day'],
+		interest_fee_info['fee_due_for_day'],
+		interest_fee_info['interest_rate_used'],
+		interest_fee_info['fee_multiplier'],
+	]
+	return UpdateDebugStateDict(
+		row_info=debug_row_info
+	)
+
+def _get_accrual_only_end_date(
+	loan: models.LoanDict,
+	txs_helper: TransactionsHelper,
+	payment_to_include: IncludedPaymentDict,
+	cur_date: datetime.date,
+	last_date: datetime.date,
+) -> datetime.date:
+	# The last day of the run of days starting at cur_date (and ending no later
+	# than last_date) on which nothing but interest and fees accrue, or None if
+	# something else happens on cur_date itself.
+	end_date = last_date
+
+	event_dates = [txs_helper.get_next_transaction_date(cur_date)]
+	if payment_to_include:
+		event_dates.extend([payment_to_include['deposit_date'], payment_to_include['settlement_date']])
+
+	for event_date in event_dates:
+		if event_date is None or event_date < cur_date:
+			continue
+
+		if event_date == cur_date:
+			return None
+
+		end_date = min(end_date, event_date - timedelta(days=1))
+
+	if loan['is_frozen'] and loan['closed_at']:
+		# Days after a frozen loan closes are skipped by the daily loop
+		closed_date = loan['closed_at'].date()
+		if cur_date > closed_date:
+			return None
+		end_date = min(end_date, closed_date)
+
+	return end_date
+
+def _get_checkpoint_inputs_hash(
+	contract_helper: contract_util.ContractHelper,
+	threshold_info: ThresholdInfoDict,
+	loan: models.LoanDict,
+	invoice: models.InvoiceDict,
+	company_settings: models.CompanySettingsDict,
+	augmented_transactions: List[models.AugmentedTransactionDict],
+	checkpoint_date: datetime.date,
+) -> str:
+	# Everything the state of the loan at the end of checkpoint_date depends on.
+	# A checkpoint is only used while its inputs are the same as the current ones.
+	transactions = [
+		{
+			'transaction': tx['transaction'],
+			'deposit_date': tx['payment']['deposit_date'],
+		}
+		for tx in augmented_transactions
+		if tx['payment']['deposit_date'] <= checkpoint_date or tx['transaction']['effective_date'] <= checkpoint_date
+	]
+	transactions.sort(key=lambda tx: str(tx['transaction']['id']))
+
+	inputs = {
+		'loan': {
+			'id': loan['id'],
+			'origination_date': loan['origination_date'],
+			'adjusted_maturity_date': loan['adjusted_maturity_date'],
+			'is_frozen': loan['is_frozen'],
+			'closed_at': loan['closed_at'],
+		},
+		'invoice_subtotal_amount': invoice['subtotal_amount'] if invoice else None,
+		'interest_end_date': company_settings['interest_end_date'],
+		'late_fees_end_date': company_settings['late_fees_end_date'],
+		'day_threshold_met': threshold_info['day_threshold_met'],
+		'contracts': [
+			contract_dict for contract_dict in contract_helper.get_contract_dicts()
+			if contract_dict['start_date'] <= checkpoint_date
+		],
+		'transactions': transactions,
+	}
+	inputs_str = json.dumps(inputs, sort_keys=True, default=str)
+	return hashlib.sha256(inputs_str.encode('utf-8')).hexdigest()
+
+def _is_checkpoint_date_allowed(
+	augmented_transactions: List[models.AugmentedTransactionDict],
+	checkpoint_date: datetime.date,
+) -> bool:
+	# The daily interest and fees adjustment needs the results of every day from
+	# a repayment's deposit date to its settlement date, so a checkpoint cannot
+	# fall in between the two.
+	for tx in augmented_transactions:
+		if not payment_util.is_repayment(tx['transaction']):
+			continue
+
+		if tx['payment']['deposit_date'] <= checkpoint_date and checkpoint_date < tx['transaction']['effective_date']:
+			return False
+
+	return True
+
+class LoanReplay(object):
+	"""
+		The end-of-day states of a loan from one replay of its history.
+
+		A replay walks from the origination date up to the last date any of its
+		report dates needs, so the results for several report dates can be read
+		off of the same pass.
+	"""
+
+	def __init__(
+		self,
+		initial_state: LoanDayStateDict,
+		checkpoint: LoanCheckpointDict = None,
+	) -> None:
+		self.initial_state = initial_state
+		# When the replay resumed from a checkpoint, days up to and including
+		# the checkpoint date are not part of this replay.
+		self.checkpoint = checkpoint
+		self.date_to_state: Dict[datetime.date, LoanDayStateDict] = OrderedDict()
+		# The dates of date_to_state in order, to look up states by bisection
+		self._state_dates: List[datetime.date] = []
+		self.fee_accruals: List[FeeAccrualDict] = []
+		self.dated_errors: List[Tuple[datetime.date, errors.Error]] = []
+		# An error which stopped the replay on the given date
+		self.fatal_error: Tuple[datetime.date, errors.Error] = None
+		self.debug_column_names: List[str] = []
+		self.debug_rows: List[Tuple[datetime.date, UpdateDebugStateDict]] = []
+
+	def get_errors(self, calculate_up_to_date: datetime.date) -> List[errors.Error]:
+		if self.fatal_error and self.fatal_error[0] <= calculate_up_to_date:
+			return [self.fatal_error[1]]
+
+		return [err for cur_date, err in self.dated_errors if cur_date <= calculate_up_to_date]
+
+	def set_state(self, cur_date: datetime.date, state: LoanDayStateDict) -> None:
+		if cur_date not in self.date_to_state:
+			if not self._state_dates or self._state_dates[-1] < cur_date:
+				self._state_dates.append(cur_date)
+			else:
+				bisect.insort(self._state_dates, cur_date)
+		self.date_to_state[cur_date] = state
+
+	def get_state_as_of(self, cur_date: datetime.date) -> LoanDayStateDict:
+		# The most recent end-of-day state on or before cur_date. Days skipped
+		# during the replay (e.g., closed frozen loans) do not change the state.
+		index = bisect.bisect_right(self._state_dates, cur_date)
+		if index == 0:
+			return self.initial_state
+
+		return self.date_to_state[self._state_dates[index - 1]]
+
+	def get_debug_info(self, calculate_up_to_date: datetime.date) -> LoanUpdateDebugInfoDict:
+		update_states = [row for cur_date, row in self.debug_rows if cur_date <= calculate_up_to_date]
+		return LoanUpdateDebugInfoDict(
+			column_names=self.debug_column_names if update_states else [],
+			update_states=update_states
+		)
+
+class _ReplayResultsDict(dict):
+	"""
+		Date to CalculateResultDict for one report date, where results are only
+		formatted from the replay states when they are looked up.
+	"""
+
+	def __init__(self, format_fn: Callable[[datetime.date], CalculateResultDict], last_date: datetime.date) -> None:
+		super(_ReplayResultsDict, self).__init__()
+		self._format_fn = format_fn
+		self._last_date = last_date
+
+	def __missing__(self, cur_date: datetime.date) -> CalculateResultDict:
+		if self._last_date is None or cur_date > self._last_date:
+			raise KeyError(cur_date)
+
+		result = self._format_fn(cur_date)
+		self[cur_date] = result
+		return result
+
 class LoanCalculator(object):
 	"""
 		Helps calculate and summarize the history of the loan with respect to
 		how the interest and fees are accumulated.
 	"""
-	def __init__(self, contract_helper: contract_util.ContractHelper, fee_accumulator: fee_util.FeeAccumulator) -> None:
+	def __init__(
+		self,
+		contract_helper: contract_util.ContractHelper,
+		fee_accumulator: fee_util.FeeAccumulator,
+		use_accrual_kernel: bool = True,
+	) -> None:
 		self._contract_helper = contract_helper
 		self._fee_accumulator = fee_accumulator
+		# Whether days where only interest and fees accrue are calculated
+		# together by _accrue_interest_and_fees_over_days
+		self._use_accrual_kernel = use_accrual_kernel
 
-	def _calculate_loan_balance_internal(
+	def _replay_loan_history(
 		self,
 		threshold_info: ThresholdInfoDict,
 		loan: models.LoanDict,
 		invoice: models.InvoiceDict, # Filled in if this loan is related to invoice financing
 		company_settings: models.CompanySettingsDict,
-		augmented_transactions: List[models.AugmentedTransactionDict],
-		today: datetime.date,
-		should_round_output: bool = True,
-		payment_to_include: IncludedPaymentDict = None,
-		include_debug_info: bool = False,
-		now_for_test: datetime.datetime = None,
-	) -> Tuple[CalculateResultDict, List[errors.Error]]:
+		txs_helper: TransactionsHelper,
+		replay_up_to_date: datetime.date, # None if no days need to be replayed
+		payment_to_include: IncludedPaymentDict,
+		include_debug_info: bool,
+		checkpoint: LoanCheckpointDict = None,
+	) -> LoanReplay:
 		# Replay the history of the loan and all the expenses that are due as a result.
 		# Heres what you owe based on the transaction history applied to your loan.
 
-		if not loan['origination_date']:
-			return None, [errors.Error('Could not determine loan balance for loan_id={} because it has no origination_date set'.format(
-				loan['id']))]
-
-		# For each day between today and the origination date, you need to calculate interest and fees
+		# For each day between the replay date and the origination date, you need to calculate interest and fees
 		# and consider transactions along the way.
 		balances = CalculatorBalances(
 			outstanding_principal = 0.0, # The customer sees this as their outstanding principal
@@ -841,6 +1498,7 @@ class LoanCalculator(object):
 			has_been_funded = False,
 			amount_paid_back_on_loan = 0.0,
 			loan_paid_by_maturity_date = False,
+			# Depends on the report date, so it is filled in when formatting results
 			day_last_repayment_settles=None,
 
 			# Report values: values used for reporting purposes ONLY.
@@ -857,8 +1515,6 @@ class LoanCalculator(object):
 		# Variables used to calculate the repayment effect
 		payment_effect_dict = None # Only filled in when payment_to_include is incorporated
 		inserted_repayment_transaction = None # A transaction which would occur, if the user did indeed include this payment
-		debug_update_states: List[UpdateDebugStateDict] = []
-		debug_column_names: List[str] = []
 		interest_input_dict = CalculateInterestInputDict(
 			loan=loan,
 			invoice=invoice,
@@ -866,153 +1522,45 @@ class LoanCalculator(object):
 		)
 
 		financing_day_limit = None
-		date_to_result = {}
-
-		errors_list = []
-
-		if payment_to_include and not payment_to_include.get('deposit_date'):
-			return None, [errors.Error('Deposit date missing from payment to include')]
-
-		if payment_to_include and not payment_to_include.get('settlement_date'):
-			return None, [errors.Error('Settlement date missing from payment to include')]
-
-		def _get_calculate_result_dict(
-			result_today: datetime.date, # "Today" date to use in the result dict.
-		) -> CalculateResultDict:
-			# If you haven't gone through the transaction's settlement days, but you did include
-			# them because they were deposited, interest and fees may go negative for those
-			# clearance days, but then when those settlement days happen, the fees and interest
-			# balance out.
-
-			should_close_loan = False
-			outstanding_principal = _format_output_value(balances['outstanding_principal'], should_round_output)
-			outstanding_principal_for_interest = _format_output_value(balances['outstanding_principal_for_interest'], should_round_output)
-			outstanding_interest = _format_output_value(balances['outstanding_interest'], should_round_output)
-			outstanding_fees = _format_output_value(balances['outstanding_fees'], should_round_output)
-
-			accounting_outstanding_principal = _format_output_value(balances['accounting_outstanding_principal'], should_round_output)
-			accounting_outstanding_interest = _format_output_value(balances['accounting_outstanding_interest'], should_round_output)
-			accounting_outstanding_late_fees = _format_output_value(balances['accounting_outstanding_late_fees'], should_round_output)
-			accounting_interest_accrued_today = 0.0 if company_settings['interest_end_date'] is not None and \
-				result_today > company_settings['interest_end_date'] else interest_accrued_today
-			accounting_late_fees_accrued_today = 0.0 if company_settings['late_fees_end_date'] is not None and \
-				result_today > company_settings['late_fees_end_date'] else fees_accrued_today
-
-			if not loan['closed_at'] and balances['has_been_funded']:
-				# If the loan hasn't been closed yet and is funded, then
-				# check whether it should be closed.
-				# If it already has been closed, then no need to close it again.
-				# If it's not funded yet, then we shouldnt close it out yet.
-				should_close_loan = payment_util.should_close_loan(
-					new_outstanding_principal=outstanding_principal,
-					new_outstanding_interest=outstanding_interest,
-					new_outstanding_fees=outstanding_fees,
-					day_last_repayment_settles=balances['day_last_repayment_settles'],
-					cur_date=result_today
-				)
-
-			report_repayment_date = balances['repayment_date']
-			financing_period = None
-
-			# Financing period is complete on date loan is closed.
-			is_financing_period_complete = loan['closed_at'] or should_close_loan
-
-			if is_financing_period_complete:
-				if not report_repayment_date and payment_to_include:
-					report_repayment_date = payment_to_include['settlement_date']
-
-				# If there is a repayment date, calculate the financing period for this closed loan.
-				# Note: there may not be a repayment date if the loan was closed via adjustments.
-				if report_repayment_date:
-					financing_period = date_util.number_days_between_dates(
-						report_repayment_date,
-						loan['origination_date'],
-						inclusive_later_date=True,
-					)
-
-				days_overdue = 0
-			else:
-				# Since loan is not closed, financing period is not complete.
-				financing_period = date_util.number_days_between_dates(
-					max(result_today, report_repayment_date) if report_repayment_date else result_today,
-					loan['origination_date'],
-					inclusive_later_date=True,
-				)
-
-				days_overdue = date_util.number_days_between_dates(
-					result_today, 
-					loan['adjusted_maturity_date'],
-				)
-				days_overdue = days_overdue if days_overdue else 0
-
-			adjusted_maturity_date = loan['adjusted_maturity_date']
-			l = LoanUpdateDict(
-				loan_id=loan['id'],
-				adjusted_maturity_date=loan['adjusted_maturity_date'],
-				outstanding_principal=outstanding_principal,
-				outstanding_principal_for_interest=outstanding_principal_for_interest,
-				outstanding_principal_past_due=outstanding_principal if today > adjusted_maturity_date else 0.0,
-				outstanding_interest=outstanding_interest,
-				outstanding_fees=outstanding_fees,
-				interest_paid_daily_adjustment=0.0, # Will be filled in later if necessary
-				fees_paid_daily_adjustment=0.0, # Will be filled in later if necessary
-				amount_to_pay_interest_on=_format_output_value(amount_to_pay_interest_on, should_round_output),
-				interest_accrued_today=_format_output_value(interest_accrued_today, should_round_output),
-				fees_accrued_today=_format_output_value(fees_accrued_today, should_round_output),
-				should_close_loan=should_close_loan,
-				repayment_date=report_repayment_date,
-				day_last_repayment_settles=balances['day_last_repayment_settles'],
-				financing_period=financing_period,
+		start_date = loan['origination_date']
+
+		if checkpoint:
+			# Pick up where the checkpoint left off instead of at the origination date
+			checkpoint_state = checkpoint['state']
+			balances = cast(CalculatorBalances, dict(checkpoint_state['balances']))
+			amount_to_pay_interest_on = checkpoint_state['amount_to_pay_interest_on']
+			interest_accrued_today = checkpoint_state['interest_accrued_today']
+			fees_accrued_today = checkpoint_state['fees_accrued_today']
+			financing_day_limit = checkpoint_state['financing_day_limit']
+			start_date = checkpoint['date'] + timedelta(days=1)
+
+		def _get_day_state() -> LoanDayStateDict:
+			return LoanDayStateDict(
+				balances=cast(CalculatorBalances, dict(balances)),
+				amount_to_pay_interest_on=amount_to_pay_interest_on,
+				interest_accrued_today=interest_accrued_today,
+				fees_accrued_today=fees_accrued_today,
 				financing_day_limit=financing_day_limit,
-				total_principal_paid=_format_output_value(balances['total_principal_paid'], should_round_output),
-				total_interest_paid=_format_output_value(balances['total_interest_paid'], should_round_output),
-				total_fees_paid=_format_output_value(balances['total_fees_paid'], should_round_output),
-				days_overdue=days_overdue,
-				accounting_outstanding_principal=accounting_outstanding_principal,
-				accounting_outstanding_interest=accounting_outstanding_interest,
-				accounting_outstanding_late_fees=accounting_outstanding_late_fees,
-				accounting_interest_accrued_today=accounting_interest_accrued_today,
-				accounting_late_fees_accrued_today=accounting_late_fees_accrued_today,
-			)
-
-			return CalculateResultDict(
 				payment_effect=payment_effect_dict,
-				loan_update=l,
-				debug_info=LoanUpdateDebugInfoDict(
-					column_names=debug_column_names,
-					update_states=debug_update_states
-				)
 			)
 
-		# Run through all the days and compute the balances
-		if loan['is_frozen'] and not loan['closed_at']:
-			logging.warn(f'Loan {loan["identifier"]} ({loan["id"]}) is frozen but closed_at is None')
+		replay = LoanReplay(initial_state=_get_day_state(), checkpoint=checkpoint)
 
-		txs_helper, err = TransactionsHelper.build(augmented_transactions, payment_to_include, today)
-		if err:
-			return None, [err]
-		
-		last_tx_settlement_date = txs_helper.last_tx_settlement_date
-		if last_tx_settlement_date and last_tx_settlement_date > today:
-			calculate_up_to_date = last_tx_settlement_date
-		else:
-			calculate_up_to_date = today
-
-		balances['day_last_repayment_settles'] = last_tx_settlement_date
-
-		if today < loan['origination_date']:
-			# No loan has been originated yet, so skip any calculations for it.
+		if replay_up_to_date is None or replay_up_to_date < start_date:
 			days_out = 0
 		else:
-			# Once we've considered how these transactions were applied, here is the remaining amount
-			# which hasn't been factored in yet based on how much you owe up to this particular day.
 			days_out = date_util.num_calendar_days_passed(
-				calculate_up_to_date,
-				loan['origination_date'],
+				replay_up_to_date,
+				start_date,
 			)
 
+		# The last day already calculated by the accrual kernel
+		accrued_through_date = start_date - timedelta(days=1)
+
 		for i in range(days_out):
-			cur_date = loan['origination_date'] + timedelta(days=i)
+			cur_date = start_date + timedelta(days=i)
+			if cur_date <= accrued_through_date:
+				continue
 
 			# For frozen loans: if loan is closed, do not perform any calculations for this date.
 			# TODO(warrenshen): apply the same logic for non-frozen loans.
@@ -1020,18 +1568,73 @@ class LoanCalculator(object):
 				logging.error('WE SHOULD NEVER SEE CLOSED, FROZEN LOANS in loan_calculator in prod')
 				continue
 
+			accrual_end_date = None
+			if self._use_accrual_kernel:
+				accrual_end_date = _get_accrual_only_end_date(
+					loan, txs_helper, payment_to_include, cur_date, replay_up_to_date)
+
+			if accrual_end_date and accrual_end_date > cur_date:
+				accrual_days = _accrue_interest_and_fees_over_days(
+					self._contract_helper,
+					cur_date,
+					accrual_end_date,
+					interest_input_dict,
+					company_settings,
+					balances,
+					financing_day_limit,
+				)
+
+				for j in range(accrual_days['num_days']):
+					accrual_date = cur_date + timedelta(days=j)
+					balances['outstanding_interest'] = accrual_days['outstanding_interest'][j]
+					balances['outstanding_fees'] = accrual_days['outstanding_fees'][j]
+					balances['accounting_outstanding_interest'] = accrual_days['accounting_outstanding_interest'][j]
+					balances['accounting_outstanding_late_fees'] = accrual_days['accounting_outstanding_late_fees'][j]
+
+					interest_accrued_today = accrual_days['interest_due'][j]
+					fees_accrued_today = accrual_days['fees_due'][j]
+					amount_to_pay_interest_on = accrual_days['amount_to_pay_interest_on']
+					financing_day_limit = accrual_days['financing_day_limits'][j]
+
+					replay.fee_accruals.append(FeeAccrualDict(
+						contract_start_date=accrual_days['contract_start_dates'][j],
+						contract_end_date=accrual_days['contract_end_dates'][j],
+						interest_for_day=interest_accrued_today,
+						fees_for_day=fees_accrued_today,
+						day=accrual_date
+					))
+
+					if include_debug_info:
+						replay.debug_column_names = _DEBUG_COLUMN_NAMES
+						replay.debug_rows.append((accrual_date, _get_debug_row(accrual_date, balances, InterestFeeInfoDict(
+							amount_to_pay_interest_on=amount_to_pay_interest_on,
+							interest_due_for_day=interest_accrued_today,
+							interest_rate_used=accrual_days['interest_rates_used'][j],
+							fee_due_for_day=fees_accrued_today,
+							fee_multiplier=accrual_days['fee_multipliers'][j],
+						))))
+
+					replay.set_state(accrual_date, _get_day_state())
+
+				if accrual_days['num_days'] > 0:
+					accrued_through_date = cur_date + timedelta(days=accrual_days['num_days'] - 1)
+					continue
+
 			cur_date_contract, err = self._contract_helper.get_contract(cur_date)
 			if err:
-				return None, [err]
+				replay.fatal_error = (cur_date, err)
+				return replay
 
 			product_type, err = cur_date_contract.get_product_type()
 			if err:
-				return None, [err]
+				replay.fatal_error = (cur_date, err)
+				return replay
 
 			if product_type != db_constants.ProductType.LINE_OF_CREDIT:
 				financing_day_limit, err = cur_date_contract.get_contract_financing_terms()
 				if err:
-					return None, [err]
+					replay.fatal_error = (cur_date, err)
+					return replay
 
 			# Check each transaction and the effect it had on this loan
 			transactions_by_settlement_date = txs_helper.get_transactions_on_settlement_date(cur_date)
@@ -1040,7 +1643,7 @@ class LoanCalculator(object):
 			# be the same as deposit date)
 
 			_update_at_beginning_of_day(transactions_by_settlement_date, balances)
-			
+
 
 			interest_fee_info, err = _get_interest_and_fees_due_on_day(
 				self._contract_helper,
@@ -1049,7 +1652,7 @@ class LoanCalculator(object):
 				balances=balances
 			)
 			if err:
-				errors_list.append(err)
+				replay.dated_errors.append((cur_date, err))
 				continue
 
 			interest_due_for_day = interest_fee_info['interest_due_for_day']
@@ -1059,8 +1662,8 @@ class LoanCalculator(object):
 			balances['outstanding_interest'] += interest_due_for_day
 			balances['outstanding_fees'] += fee_due_for_day
 
-			# Update accounting balances, in which balances are increased 
-			# if customer is on happy path but are not increased if after 
+			# Update accounting balances, in which balances are increased
+			# if customer is on happy path but are not increased if after
 			# the interest or late fees end dates.
 			balances['accounting_outstanding_interest'] += interest_due_for_day if company_settings['interest_end_date'] is None or cur_date <= company_settings['interest_end_date'] else 0
 			balances['accounting_outstanding_late_fees'] += fee_due_for_day if company_settings['late_fees_end_date'] is None or cur_date <= company_settings['late_fees_end_date'] else 0
@@ -1071,58 +1674,33 @@ class LoanCalculator(object):
 
 			cur_contract_start_date, err = cur_date_contract.get_start_date()
 			if err:
-				errors_list.append(err)
+				replay.dated_errors.append((cur_date, err))
 				continue
 
 			cur_contract_end_date, err = cur_date_contract.get_adjusted_end_date()
 			if err:
-				errors_list.append(err)
+				replay.dated_errors.append((cur_date, err))
 				continue
 
-			self._fee_accumulator.accumulate(
+			# The fee accumulator depends on which report dates include this day,
+			# so the accruals are applied when the results are built.
+			replay.fee_accruals.append(FeeAccrualDict(
 				contract_start_date=cur_contract_start_date,
 				contract_end_date=cur_contract_end_date,
 				interest_for_day=interest_due_for_day,
 				fees_for_day=fee_due_for_day,
 				day=cur_date
-			)
+			))
 
 			if include_debug_info:
-				debug_column_names = [
-					'date',
-					'outstanding_principal',
-					'outstanding_principal_for_interest',
-					'outstanding_interest', 
-					'outstanding_fees',
-
-					'amount_to_pay_interest_on',
-					'interest_due_for_day',
-					'fee_for_day',
-					'interest_rate',
-					'fee_multiplier',
-				]
-				debug_row_info: List[Union[str, int, float]] = [
-					date_util.date_to_db_str(cur_date),
-					balances['outstanding_principal'],
-					balances['outstanding_principal_for_interest'],
-					balances['outstanding_interest'],
-					balances['outstanding_fees'],
-
-					interest_fee_info['amount_to_pay_interest_on'],
-					interest_fee_info['interest_due_for_day'],
-					interest_fee_info['fee_due_for_day'],
-					interest_fee_info['interest_rate_used'],
-					interest_fee_info['fee_multiplier'],
-				]
-				debug_update_states.append(UpdateDebugStateDict(
-					row_info=debug_row_info
-				))
+				replay.debug_column_names = _DEBUG_COLUMN_NAMES
+				replay.debug_rows.append((cur_date, _get_debug_row(cur_date, balances, interest_fee_info)))
 
 			# Apply repayment transactions at the "end of the day"
 
 			transactions_by_deposit_date = txs_helper.get_transactions_on_deposit_date(cur_date)
 			_update_end_of_day_repayment_deposits(transactions_by_deposit_date, balances, cur_date, loan)
-			
+
 			if payment_to_include and payment_to_include['deposit_date'] == cur_date:
 				# Incorporate this payment and snapshot what the state of the balance was
 				# before this payment was incorporated
@@ -1134,19 +1712,19 @@ class LoanCalculator(object):
 					amount_to_pay_interest_on=amount_to_pay_interest_on
 				)
 				inner_balances = cast(CalculatorBalances, copy.deepcopy(cast(Dict, balances)))
-				
+
 				# Calculate the fees and interest that will accrue in between the deposit
 				# and settlement date.
-				
+
 				additional_interest, additional_fees, inner_has_err = _get_additional_interest_and_fees_for_repayment_effect(
-					self._contract_helper, cur_date, payment_to_include, 
+					self._contract_helper, cur_date, payment_to_include,
 					inner_balances,
-					txs_helper=txs_helper, 
+					txs_helper=txs_helper,
 					interest_input_dict=interest_input_dict
-				) 
+				)
 
 				if inner_has_err:
-					errors_list.append(inner_has_err)
+					replay.dated_errors.append((cur_date, inner_has_err))
 					continue
 
 				# The purpose of loan_update_before_payment is to show the user what the state of the loan
@@ -1220,27 +1798,240 @@ class LoanCalculator(object):
 				# Since it is the settlement date, whatever got applied to principal on this date
 				# reduces their outstanding_principal_for_interest
 				if not inserted_repayment_transaction:
-					errors_list.append(errors.Error(
-						f'There is no inserted repayment transaction for loan {loan["identifier"]} ({loan["id"]}) on {date_util.date_to_db_str(cur_date)}. An error must have occurred while determining details about the repayment on the deposit date. Likely you chose a deposit date outside the range of loan origination date and maturity date.'))
+					replay.dated_errors.append((cur_date, errors.Error(
+						f'There is no inserted repayment transaction for loan {loan["identifier"]} ({loan["id"]}) on {date_util.date_to_db_str(cur_date)}. An error must have occurred while determining details about the repayment on the deposit date. Likely you chose a deposit date outside the range of loan origination date and maturity date.')))
 					continue
 
 				balances['outstanding_principal_for_interest'] -= inserted_repayment_transaction['to_principal']
 				balances['amount_paid_back_on_loan'] += inserted_repayment_transaction['amount']
 
-			date_to_result[cur_date] = _get_calculate_result_dict(cur_date)
+			replay.set_state(cur_date, _get_day_state())
+
+		return replay
+
+	def _get_checkpoint_to_resume_from(
+		self,
+		checkpoints: LoanCheckpoints,
+		threshold_info: ThresholdInfoDict,
+		loan: models.LoanDict,
+		invoice: models.InvoiceDict,
+		company_settings: models.CompanySettingsDict,
+		augmented_transactions: List[models.AugmentedTransactionDict],
+		before_date: datetime.date,
+	) -> LoanCheckpointDict:
+		# The latest checkpoint before before_date which is still up to date
+		for checkpoint in checkpoints.checkpoints:
+			if checkpoint['date'] >= before_date or checkpoint['date'] < loan['origination_date']:
+				continue
+
+			inputs_hash = _get_checkpoint_inputs_hash(
+				self._contract_helper,
+				threshold_info,
+				loan,
+				invoice,
+				company_settings,
+				augmented_transactions,
+				checkpoint['date'],
+			)
+			if inputs_hash == checkpoint['inputs_hash']:
+				return checkpoint
+
+		return None
+
+	def _get_new_checkpoint(
+		self,
+		replay: LoanReplay,
+		threshold_info: ThresholdInfoDict,
+		loan: models.LoanDict,
+		invoice: models.InvoiceDict,
+		company_settings: models.CompanySettingsDict,
+		augmented_transactions: List[models.AugmentedTransactionDict],
+		before_date: datetime.date,
+	) -> LoanCheckpointDict:
+		# Checkpoints are only taken at the end of a month, which keeps the daily
+		# interest and fees adjustment (done at most once per month) the same
+		# whether or not a replay resumed from one.
+		checkpoint_date = datetime.date(year=before_date.year, month=before_date.month, day=1) - timedelta(days=1)
+		if checkpoint_date < loan['origination_date']:
+			return None
+
+		if replay.checkpoint and replay.checkpoint['date'] >= checkpoint_date:
+			# Nothing newer than what the replay resumed from
+			return None
+
+		if replay.get_errors(checkpoint_date):
+			return None
+
+		if not _is_checkpoint_date_allowed(augmented_transactions, checkpoint_date):
+			return None
+
+		fee_accumulator = fee_util.FeeAccumulator()
+		if replay.checkpoint:
+			fee_accumulator.add_state(replay.checkpoint['fee_accumulator_state'])
+
+		for accrual in replay.fee_accruals:
+			if accrual['day'] > checkpoint_date:
+				break
+
+			fee_accumulator.accumulate(
+				contract_start_date=accrual['contract_start_date'],
+				contract_end_date=accrual['contract_end_date'],
+				interest_for_day=accrual['interest_for_day'],
+				fees_for_day=accrual['fees_for_day'],
+				day=accrual['day']
+			)
+
+		return LoanCheckpointDict(
+			date=checkpoint_date,
+			inputs_hash=_get_checkpoint_inputs_hash(
+				self._contract_helper,
+				threshold_info,
+				loan,
+				invoice,
+				company_settings,
+				augmented_transactions,
+				checkpoint_date,
+			),
+			state=replay.get_state_as_of(checkpoint_date),
+			fee_accumulator_state=fee_accumulator.get_state(),
+		)
+
+	def _get_result_for_report_date(
+		self,
+		replay: LoanReplay,
+		loan: models.LoanDict,
+		company_settings: models.CompanySettingsDict,
+		txs_helper: TransactionsHelper,
+		today: datetime.date,
+		fee_accumulator: fee_util.FeeAccumulator,
+		should_round_output: bool,
+		payment_to_include: IncludedPaymentDict,
+	) -> Tuple[CalculateResultDict, List[errors.Error]]:
+		# Read the result for one report date off of a replay which went
+		# at least as far as this report date needs.
+		calculate_up_to_date = _get_calculate_up_to_date(txs_helper, today)
+		day_last_repayment_settles = txs_helper.last_tx_settlement_date
+
+		if today < loan['origination_date']:
+			# No loan has been originated yet, so skip any calculations for it.
+			last_date = None
+			last_state = replay.initial_state
+		else:
+			errors_list = replay.get_errors(calculate_up_to_date)
+			if errors_list:
+				return None, errors_list
+
+			if replay.checkpoint:
+				fee_accumulator.add_state(replay.checkpoint['fee_accumulator_state'])
+
+			for accrual in replay.fee_accruals:
+				if accrual['day'] > calculate_up_to_date:
+					break
+
+				fee_accumulator.accumulate(
+					contract_start_date=accrual['contract_start_date'],
+					contract_end_date=accrual['contract_end_date'],
+					interest_for_day=accrual['interest_for_day'],
+					fees_for_day=accrual['fees_for_day'],
+					day=accrual['day']
+				)
 
-		if errors_list:
-			return None, errors_list
+			last_date = calculate_up_to_date
+			last_state = replay.get_state_as_of(calculate_up_to_date)
 
-		if today not in date_to_result:
+		debug_info = replay.get_debug_info(calculate_up_to_date) if last_date else LoanUpdateDebugInfoDict(
+			column_names=[],
+			update_states=[]
+		)
+
+		def _format_result(result_today: datetime.date, state: LoanDayStateDict) -> CalculateResultDict:
+			return _get_calculate_result_dict(
+				loan=loan,
+				company_settings=company_settings,
+				state=state,
+				today=today,
+				result_today=result_today,
+				day_last_repayment_settles=day_last_repayment_settles,
+				payment_to_include=payment_to_include,
+				should_round_output=should_round_output,
+				debug_info=debug_info,
+			)
+
+		def _format_result_from_replay(result_today: datetime.date) -> CalculateResultDict:
+			if result_today not in replay.date_to_state:
+				raise KeyError(result_today)
+			return _format_result(result_today, replay.date_to_state[result_today])
+
+		date_to_result = _ReplayResultsDict(_format_result_from_replay, last_date)
+
+		if last_date is None or today not in replay.date_to_state:
 			# If we haven't added any results yet, just add a dummy one here.
-			date_to_result[today] = _get_calculate_result_dict(today)
+			date_to_result[today] = _format_result(today, last_state)
 
-		success, err = _perform_daily_interest_and_fees_adjustment(self._fee_accumulator, txs_helper, date_to_result)
+		success, err = _perform_daily_interest_and_fees_adjustment(
+			fee_accumulator,
+			txs_helper,
+			date_to_result,
+			start_date=replay.checkpoint['date'] + timedelta(days=1) if replay.checkpoint else None,
+		)
 		if err:
 			return None, [err]
 		return date_to_result[today], None
 
+	def _calculate_loan_balance_internal(
+		self,
+		threshold_info: ThresholdInfoDict,
+		loan: models.LoanDict,
+		invoice: models.InvoiceDict, # Filled in if this loan is related to invoice financing
+		company_settings: models.CompanySettingsDict,
+		augmented_transactions: List[models.AugmentedTransactionDict],
+		today: datetime.date,
+		should_round_output: bool = True,
+		payment_to_include: IncludedPaymentDict = None,
+		include_debug_info: bool = False,
+		now_for_test: datetime.datetime = None,
+	) -> Tuple[CalculateResultDict, List[errors.Error]]:
+
+		if not loan['origination_date']:
+			return None, [errors.Error('Could not determine loan balance for loan_id={} because it has no origination_date set'.format(
+				loan['id']))]
+
+		if payment_to_include and not payment_to_include.get('deposit_date'):
+			return None, [errors.Error('Deposit date missing from payment to include')]
+
+		if payment_to_include and not payment_to_include.get('settlement_date'):
+			return None, [errors.Error('Settlement date missing from payment to include')]
+
+		# Run through all the days and compute the balances
+		if loan['is_frozen'] and not loan['closed_at']:
+			logging.warn(f'Loan {loan["identifier"]} ({loan["id"]}) is frozen but closed_at is None')
+
+		txs_helper, err = TransactionsHelper.build(augmented_transactions, payment_to_include, today)
+		if err:
+			return None, [err]
+
+		replay = self._replay_loan_history(
+			threshold_info=threshold_info,
+			loan=loan,
+			invoice=invoice,
+			company_settings=company_settings,
+			txs_helper=txs_helper,
+			replay_up_to_date=_get_calculate_up_to_date(txs_helper, today) if today >= loan['origination_date'] else None,
+			payment_to_include=payment_to_include,
+			include_debug_info=include_debug_info,
+		)
+
+		return self._get_result_for_report_date(
+			replay=replay,
+			loan=loan,
+			company_settings=company_settings,
+			txs_helper=txs_helper,
+			today=today,
+			fee_accumulator=self._fee_accumulator,
+			should_round_output=should_round_output,
+			payment_to_include=payment_to_include,
+		)
+
 	def calculate_loan_balance(
 		self,
 		threshold_info: ThresholdInfoDict,
@@ -1271,3 +2062,131 @@ class LoanCalculator(object):
 			return None, err
 
 		return calculate_result, None
+
+	def calculate_loan_balances_for_report_dates(
+		self,
+		report_date_to_threshold_info: Dict[datetime.date, ThresholdInfoDict],
+		report_date_to_fee_accumulator: Dict[datetime.date, fee_util.FeeAccumulator],
+		loan: models.LoanDict,
+		invoice: models.InvoiceDict, # Filled in if this loan is related to invoice financing
+		company_settings: models.CompanySettingsDict,
+		augmented_transactions: List[models.AugmentedTransactionDict],
+		should_round_output: bool = True,
+		include_debug_info: bool = False,
+		checkpoints: LoanCheckpoints = None,
+		loan_transaction_index: LoanTransactionIndex = None,
+	) -> Tuple[Dict[datetime.date, CalculateResultDict], Dict[datetime.date, List[errors.Error]]]:
+		"""
+			Calculates the loan balance for every report date with one replay of the
+			loan's history (one replay per distinct threshold info), instead of one
+			replay per report date. Each report date gets the same result that
+			calculate_loan_balance would give it. Report dates with errors are
+			returned in the second dict instead of the first.
+
+			When checkpoints are given, the replay resumes from the latest usable
+			checkpoint before the report dates, and checkpoints.new_checkpoint is
+			set to the checkpoint that should be stored for the next calculation.
+		"""
+		date_to_result: Dict[datetime.date, CalculateResultDict] = {}
+		date_to_errors: Dict[datetime.date, List[errors.Error]] = {}
+
+		if not loan['origination_date']:
+			for report_date in report_date_to_threshold_info.keys():
+				date_to_errors[report_date] = [errors.Error('Could not determine loan balance for loan_id={} because it has no origination_date set'.format(
+					loan['id']))]
+			return date_to_result, date_to_errors
+
+		if loan['is_frozen'] and not loan['closed_at']:
+			logging.warn(f'Loan {loan["identifier"]} ({loan["id"]}) is frozen but closed_at is None')
+
+		# The threshold info changes the interest charged on each day, so report
+		# dates only share a replay when they share the same threshold info.
+		day_threshold_met_to_report_dates: Dict[datetime.date, List[datetime.date]] = OrderedDict()
+		report_date_to_txs_helper: Dict[datetime.date, TransactionsHelper] = {}
+
+		if not loan_transaction_index:
+			loan_transaction_index = LoanTransactionIndex(augmented_transactions)
+
+		for report_date, threshold_info in report_date_to_threshold_info.items():
+			txs_helper, err = TransactionsHelper.build(
+				augmented_transactions, None, report_date, loan_transaction_index=loan_transaction_index)
+			if err:
+				date_to_errors[report_date] = [err]
+				continue
+
+			report_date_to_txs_helper[report_date] = txs_helper
+			day_threshold_met = threshold_info['day_threshold_met']
+			if day_threshold_met not in day_threshold_met_to_report_dates:
+				day_threshold_met_to_report_dates[day_threshold_met] = []
+			day_threshold_met_to_report_dates[day_threshold_met].append(report_date)
+
+		for report_dates in day_threshold_met_to_report_dates.values():
+			replay_up_to_date = None
+			for report_date in report_dates:
+				if report_date < loan['origination_date']:
+					continue
+
+				calculate_up_to_date = _get_calculate_up_to_date(report_date_to_txs_helper[report_date], report_date)
+				if replay_up_to_date is None or calculate_up_to_date > replay_up_to_date:
+					replay_up_to_date = calculate_up_to_date
+
+			threshold_info = report_date_to_threshold_info[report_dates[0]]
+			earliest_report_date = min(report_dates)
+
+			# Debug info includes every day of the loan, so it needs a full replay
+			checkpoint = None
+			if checkpoints and not include_debug_info:
+				checkpoint = self._get_checkpoint_to_resume_from(
+					checkpoints,
+					threshold_info,
+					loan,
+					invoice,
+					company_settings,
+					augmented_transactions,
+					before_date=earliest_report_date,
+				)
+
+			# Which transactions fall on which day does not depend on the report date,
+			# so any of the report dates' helpers can drive the replay.
+			replay = self._replay_loan_history(
+				threshold_info=threshold_info,
+				loan=loan,
+				invoice=invoice,
+				company_settings=company_settings,
+				txs_helper=report_date_to_txs_helper[report_dates[0]],
+				replay_up_to_date=replay_up_to_date,
+				payment_to_include=None,
+				include_debug_info=include_debug_info,
+				checkpoint=checkpoint,
+			)
+
+			# Only one checkpoint is kept per date, so none is taken when the
+			# report dates do not all share the same threshold info.
+			if checkpoints and len(day_threshold_met_to_report_dates) == 1:
+				checkpoints.new_checkpoint = self._get_new_checkpoint(
+					replay,
+					threshold_info,
+					loan,
+					invoice,
+					company_settings,
+					augmented_transactions,
+					before_date=earliest_report_date,
+				)
+
+			for report_date in report_dates:
+				calculate_result, errors_list = self._get_result_for_report_date(
+					replay=replay,
+					loan=loan,
+					company_settings=company_settings,
+					txs_helper=report_date_to_txs_helper[report_date],
+					today=report_date,
+					fee_accumulator=report_date_to_fee_accumulator[report_date],
+					should_round_output=should_round_output,
+					payment_to_include=None,
+				)
+				if errors_list:
+					date_to_errors[report_date] = errors_list
+				else:
+					date_to_result[report_date] = calculate_result
+
+		return date_to_result, date_to_errors
@@ -0,0 +1,147 @@
+"""
+	Stores the end-of-day states of loans (checkpoints), so recomputing a
+	loan's balances can resume from its latest checkpoint rather than
+	replaying the loan from its origination date.
+"""
+import datetime
+from datetime import timedelta
+from typing import Dict, List, cast
+
+from bespoke.date import date_util
+from bespoke.db import models
+from bespoke.finance.loans.loan_calculator import (
+	CalculatorBalances, LoanCheckpointDict, LoanCheckpoints, LoanDayStateDict
+)
+from sqlalchemy.orm.session import Session
+
+# Older checkpoints of a loan are only needed if the newer ones get invalidated
+# by a change in the past, so we only keep about a quarter's worth of them.
+CHECKPOINT_DAYS_TO_KEEP = 92
+
+_BALANCES_DATE_FIELDS = ['day_last_repayment_settles', 'repayment_date']
+
+def _checkpoint_to_payload(checkpoint: LoanCheckpointDict) -> Dict:
+	state = checkpoint['state']
+	balances = dict(state['balances'])
+	for field in _BALANCES_DATE_FIELDS:
+		if balances[field]:
+			balances[field] = date_util.date_to_db_str(balances[field])
+
+	return {
+		'balances': balances,
+		'amount_to_pay_interest_on': state['amount_to_pay_interest_on'],
+		'interest_accrued_today': state['interest_accrued_today'],
+		'fees_accrued_today': state['fees_accrued_today'],
+		'financing_day_limit': state['financing_day_limit'],
+		'fee_accumulator_state': checkpoint['fee_accumulator_state'],
+	}
+
+def _payload_to_checkpoint(
+	checkpoint_date: datetime.date,
+	inputs_hash: str,
+	payload: Dict,
+) -> LoanCheckpointDict:
+	balances = dict(payload['balances'])
+	for field in _BALANCES_DATE_FIELDS:
+		if balances[field]:
+			balances[field] = date_util.load_date_str(balances[field])
+
+	return LoanCheckpointDict(
+		date=checkpoint_date,
+		inputs_hash=inputs_hash,
+		state=LoanDayStateDict(
+			balances=cast(CalculatorBalances, balances),
+			amount_to_pay_interest_on=payload['amount_to_pay_interest_on'],
+			interest_accrued_today=payload['interest_accrued_today'],
+			fees_accrued_today=payload['fees_accrued_today'],
+			financing_day_limit=payload['financing_day_limit'],
+			payment_effect=None,
+		),
+		fee_accumulator_state=payload['fee_accumulator_state'],
+	)
+
+def get_loan_id_to_checkpoints(
+	session: Session,
+	company_id: str,
+	before_date: datetime.date,
+) -> Dict[str, LoanCheckpoints]:
+	loan_checkpoints = cast(
+		List[models.LoanBalanceCheckpoint],
+		session.query(models.LoanBalanceCheckpoint).filter(
+			models.LoanBalanceCheckpoint.company_id == company_id
+		).filter(
+			models.LoanBalanceCheckpoint.date < before_date
+		).all())
+
+	loan_id_to_checkpoint_dicts: Dict[str, List[LoanCheckpointDict]] = {}
+	for loan_checkpoint in loan_checkpoints:
+		loan_id = str(loan_checkpoint.loan_id)
+		if loan_id not in loan_id_to_checkpoint_dicts:
+			loan_id_to_checkpoint_dicts[loan_id] = []
+
+		loan_id_to_checkpoint_dicts[loan_id].append(_payload_to_checkpoint(
+			loan_checkpoint.date,
+			loan_checkpoint.inputs_hash,
+			cast(Dict, loan_checkpoint.state_payload),
+		))
+
+	return {
+		loan_id: LoanCheckpoints(checkpoint_dicts)
+		for loan_id, checkpoint_dicts in loan_id_to_checkpoint_dicts.items()
+	}
+
+def save_new_checkpoints(
+	session: Session,
+	company_id: str,
+	loan_id_to_checkpoints: Dict[str, LoanCheckpoints],
+) -> None:
+	loan_id_to_new_checkpoint = {
+		loan_id: checkpoints.new_checkpoint
+		for loan_id, checkpoints in loan_id_to_checkpoints.items()
+		if checkpoints.new_checkpoint
+	}
+	if not loan_id_to_new_checkpoint:
+		return
+
+	existing_loan_checkpoints = cast(
+		List[models.LoanBalanceCheckpoint],
+		session.query(models.LoanBalanceCheckpoint).filter(
+			models.LoanBalanceCheckpoint.loan_id.in_(list(loan_id_to_new_checkpoint.keys()))
+		).all())
+
+	loan_id_and_date_to_loan_checkpoint = {
+		(str(loan_checkpoint.loan_id), loan_checkpoint.date): loan_checkpoint
+		for loan_checkpoint in existing_loan_checkpoints
+	}
+
+	for loan_id, new_checkpoint in loan_id_to_new_checkpoint.items():
+		loan_checkpoint = loan_id_and_date_to_loan_checkpoint.get((loan_id, new_checkpoint['date']))
+		if not loan_checkpoint:
+			loan_checkpoint = models.LoanBalanceCheckpoint(
+				company_id=company_id,
+				loan_id=loan_id,
+				date=new_checkpoint['date'],
+			)
+			session.add(loan_checkpoint)
+
+		loan_checkpoint.inputs_hash = new_checkpoint['inputs_hash']
+		loan_checkpoint.state_payload = _checkpoint_to_payload(new_checkpoint)
+		loan_checkpoint.updated_at = date_util.now()
+
+	for existing_loan_checkpoint in existing_loan_checkpoints:
+		new_checkpoint = loan_id_to_new_checkpoint[str(existing_loan_checkpoint.loan_id)]
+		if existing_loan_checkpoint.date < new_checkpoint['date'] - timedelta(days=CHECKPOINT_DAYS_TO_KEEP):
+			session.delete(existing_loan_checkpoint)
+
+def delete_checkpoints_on_or_after(
+	session: Session,
+	company_ids: List[str],
+	start_date: datetime.date,
+) -> None:
+	# A checkpoint depends on everything up to and including its date, so
+	# once anything from start_date onwards changes it can no longer be used.
+	session.query(models.LoanBalanceCheckpoint).filter(
+		models.LoanBalanceCheckpoint.company_id.in_(company_ids)
+	).filter(
+		models.LoanBalanceCheckpoint.date >= start_date
+	).delete(synchronize_session=False)
@@ -1,3 +1,4 @@
+import concurrent.futures
 import datetime
 import decimal
 import logging
@@ -11,8 +12,11 @@ from bespoke.date import date_util
 from bespoke.db import db_constants, models
 from bespoke.db.models import session_scope
 from bespoke.finance import financial_summary_util, number_util, contract_util
+from bespoke.finance.fetchers import per_customer_fetcher
+from bespoke.finance.loans import loan_checkpoint_util
 from bespoke.finance.reports import loan_balances
 from bespoke.finance.reports.loan_balances import CustomerUpdateDict
+from bespoke.finance.types import per_customer_types
 
 from sqlalchemy import or_, and_
 from sqlalchemy.orm.session import Session
@@ -132,6 +136,13 @@ def set_needs_balance_recomputed(
 			financial_summary.needs_recompute = True
 			financial_summary.days_to_compute_back = days_to_compute_back
 
+	# Loan checkpoints from the first day being recomputed onwards are out of date
+	loan_checkpoint_util.delete_checkpoints_on_or_after(
+		session,
+		company_ids,
+		start_date=cur_date - timedelta(days=days_to_compute_back),
+	)
+
 	return True, None
 
 def set_companies_needs_recompute_by_date_range(
@@ -179,24 +190,40 @@ def update_company_balance(
 	update_days_back: int,
 	is_past_date_default_val: bool,
 	include_debug_info: bool,
-	today_for_test: datetime.date = None
+	today_for_test: datetime.date = None,
+	customer_info: per_customer_types.CustomerFinancials = None,
+	process_pool: concurrent.futures.Executor = None,
+	writer: loan_balances.CustomerUpdatesWriter = None,
+	pending_update: loan_balances.PendingCustomerUpdate = None,
 ) -> Tuple[Dict[datetime.date, CustomerUpdateDict], str]:
 	"""
 		is_past_date_default_val is set to True if in fact this update_company_balance
 		is a date in the past. See /run_customer_balances to see how this value should be
 		set to True on dates where the update is a previous date.
+
+		If writer is given, the updates are added to it and the caller writes
+		them; otherwise they are all written before this returns.
+
+		If pending_update is given, the updates it started (see
+		CustomerBalance.start_update) are used rather than calculated here.
 	"""
 	logging.info(f"Calculating balance for '{company['name']}' with id: '{company['id']}' for report date '{report_date}, update_days_back={update_days_back}'")
 
 	customer_balance = loan_balances.CustomerBalance(company, session)
 	if update_days_back == None:
 		update_days_back = 0
-	day_to_customer_update_dict, err = customer_balance.update(
-		start_date_for_storing_updates=report_date - timedelta(days=update_days_back),
-		today=report_date,
-		include_debug_info=include_debug_info,
-		is_past_date_default_val=is_past_date_default_val
-	)
+	if pending_update:
+		day_to_customer_update_dict, err = customer_balance.finish_update(pending_update)
+	else:
+		day_to_customer_update_dict, err = customer_balance.update(
+			start_date_for_storing_updates=report_date - timedelta(days=update_days_back),
+			today=report_date,
+			include_debug_info=include_debug_info,
+			is_past_date_default_val=is_past_date_default_val,
+			use_checkpoints=True,
+			customer_info=customer_info,
+			process_pool=process_pool,
+		)
 
 	if err:
 		msg = 'Error updating customer balance for company "{}". Error: {}'.format(
@@ -214,6 +241,10 @@ def update_company_balance(
 	if not today:
 		today = date_util.now_as_date(date_util.DEFAULT_TIMEZONE)
 
+	should_write = writer is None
+	if should_write:
+		writer = loan_balances.CustomerUpdatesWriter(session)
+
 	for i in range(len(days_to_update)):
 		cur_date = days_to_update[i]
 		customer_update_dict = day_to_customer_update_dict[cur_date]
@@ -230,13 +261,7 @@ def update_company_balance(
 			)
 
 			is_todays_update = today == cur_date
-			success, err = customer_balance.write(customer_update_dict, is_todays_update)
-			if err:
-				msg = 'Error writing results to update customer balance. Error: {}'.format(err)
-				logging.error(msg)
-				event.set_failed().write_with_session(session)
-				session.rollback()
-				return None, msg
+			writer.add(company['id'], customer_update_dict, is_todays_update)
 			event.set_succeeded().write_with_session(session)
 
 			logging.debug(f"Successfully updated balance for '{company['name']}' with id '{company['id']}' for date '{cur_date}'")
@@ -244,6 +269,14 @@ def update_company_balance(
 			logging.debug(f"Skipping balance for '{company['name']}' with id '{company['id']}' for date '{cur_date}' because it could not be calculated")
 	
 	_set_financial_summary_no_longer_needs_recompute(session, company['id'], report_date)
+
+	if should_write:
+		_, err = writer.write()
+		if err:
+			msg = 'Error writing results to update customer balance. Error: {}'.format(err)
+			logging.error(msg)
+			session.rollback()
+			return None, msg
 	
 	# Internally we re-compute the most recent X days of previous loan balances
 	# when an update happens to a customer, but in terms of this fucntion,
@@ -421,23 +454,136 @@ def compute_and_update_bank_financial_summaries(
 			product_type = str(existing_bank_summary.product_type)
 			new_bank_summary = new_bank_summary_map[product_type]
 
-			existing_bank_summary.total_limit = new_bank_summary.total_limit
-			existing_bank_summary.total_outstanding_principal = new_bank_summary.total_outstanding_principal
-			existing_bank_summary.total_outstanding_principal_for_interest = new_bank_summary.total_outstanding_principal_for_interest
-			existing_bank_summary.total_outstanding_principal_past_due = new_bank_summary.total_outstanding_principal_past_due
-			existing_bank_summary.total_outstanding_interest = new_bank_summary.total_outstanding_interest
-			existing_bank_summary.total_outstanding_fees = new_bank_summary.total_outstanding_fees
-			existing_bank_summary.total_principal_in_requested_state = new_bank_summary.total_principal_in_requested_state
-			existing_bank_summary.available_limit = new_bank_summary.available_limit
-			existing_bank_summary.adjusted_total_limit = new_bank_summary.adjusted_total_limit
-			existing_bank_summary.interest_accrued_today = new_bank_summary.interest_accrued_today
-			existing_bank_summary.late_fees_accrued_today = new_bank_summary.late_fees_accrued_today
+			for field in financial_summary_util.BANK_FINANCIAL_SUMMARY_FIELDS:
+				existing_value = getattr(existing_bank_summary, field)
+				new_value = getattr(new_bank_summary, field)
+				# The bank financial summaries are otherwise kept up to date by
+				# update_bank_financial_summaries_incrementally, so this is also the
+				# check that those updates add up
+				if existing_value is None or \
+					number_util.round_currency_decimal(decimal.Decimal(existing_value)) != new_value:
+					logging.warning(f"Bank financial summary for '{product_type}' on '{report_date}' had {field}={existing_value}, recomputed as {new_value}")
+				setattr(existing_bank_summary, field, new_value)
 	else:
 		for new_bank_summary in new_bank_financial_summaries:
 			session.add(new_bank_summary)
 
 	return None
 
+@errors.return_error_tuple
+def update_bank_financial_summaries_incrementally(
+	session: Session,
+	financial_summary_changes: List[loan_balances.FinancialSummaryChangeDict],
+) -> Tuple[Set[datetime.date], errors.Error]:
+	"""
+		Adds how each financial summary changed to the bank financial summary
+		of its company's product type, rather than summing up every financial
+		summary of the date again.
+
+		Returns the dates this cannot be done for, because their bank financial
+		summaries do not exist yet, or do not come from the financial summaries
+		of that date, or one of the companies has no active contract. These
+		need compute_and_update_bank_financial_summaries instead.
+	"""
+	if not financial_summary_changes:
+		return set([]), None
+
+	company_ids = list(set([change['company_id'] for change in financial_summary_changes]))
+	dates = list(set([change['date'] for change in financial_summary_changes]))
+
+	companies = session.query(models.Company.id, models.Company.contract_id).filter(
+		models.Company.id.in_(company_ids)
+	).all()
+	company_id_to_contract_id = {
+		str(company_id): str(contract_id) if contract_id else None
+		for company_id, contract_id in companies
+	}
+
+	contract_ids = [contract_id for contract_id in company_id_to_contract_id.values() if contract_id]
+	contracts = contract_util.get_active_contracts_base_query(session).filter(
+		models.Contract.id.in_(contract_ids)
+	).all() if contract_ids else []
+	contract_id_to_product_type = {str(contract.id): contract.product_type for contract in contracts}
+
+	dummy_company_ids = set([
+		str(company_id) for (company_id,) in session.query(models.CompanySettings.company_id).filter(
+			models.CompanySettings.company_id.in_(company_ids)
+		).filter(
+			cast(Callable, models.CompanySettings.is_dummy_account.is_)(True)
+		).all()
+	])
+
+	bank_summaries = session.query(
+		models.BankFinancialSummary.date,
+		models.BankFinancialSummary.product_type,
+	).filter(
+		models.BankFinancialSummary.date.in_(dates)
+	).all()
+	dates_with_bank_summaries = set([date for date, _ in bank_summaries])
+
+	dates_to_recompute = set([date for date in dates if date not in dates_with_bank_summaries])
+	date_to_has_existing_summary: Dict[datetime.date, bool] = {}
+	date_to_product_type_to_delta: Dict[datetime.date, Dict[str, Dict[str, decimal.Decimal]]] = {}
+
+	for change in financial_summary_changes:
+		cur_date = change['date']
+		company_id = change['company_id']
+		date_to_has_existing_summary[cur_date] = \
+			date_to_has_existing_summary.get(cur_date, False) or change['old_values'] is not None
+
+		if company_id not in company_id_to_contract_id:
+			dates_to_recompute.add(cur_date)
+			continue
+		contract_id = company_id_to_contract_id[company_id]
+		if not contract_id or company_id in dummy_company_ids:
+			# These are left out of the bank financial summaries
+			continue
+		if contract_id not in contract_id_to_product_type:
+			dates_to_recompute.add(cur_date)
+			continue
+
+		product_type_to_delta = date_to_product_type_to_delta.setdefault(cur_date, {})
+		delta = product_type_to_delta.setdefault(contract_id_to_product_type[contract_id], {
+			field: decimal.Decimal(0) for field in financial_summary_util.BANK_FINANCIAL_SUMMARY_FIELDS
+		})
+		for field in financial_summary_util.BANK_FINANCIAL_SUMMARY_FIELDS:
+			old_value = change['old_values'][field] if change['old_values'] else None
+			delta[field] += decimal.Decimal(change['new_values'][field] or 0) - decimal.Decimal(old_value or 0)
+
+	# Without any financial summaries on a date, its bank financial summaries
+	# were computed from the most recent date that has them
+	# (see financial_summary_util.get_financial_summary_for_all_customers),
+	# so there is nothing to add to.
+	for cur_date, has_existing_summary in date_to_has_existing_summary.items():
+		if has_existing_summary or cur_date in dates_to_recompute:
+			continue
+		changed_company_ids = [
+			change['company_id'] for change in financial_summary_changes if change['date'] == cur_date
+		]
+		other_summary = session.query(models.FinancialSummary.id).filter(
+			models.FinancialSummary.date == cur_date
+		).filter(
+			cast(Callable, models.FinancialSummary.company_id.notin_)(changed_company_ids)
+		).first()
+		if not other_summary:
+			dates_to_recompute.add(cur_date)
+
+	for cur_date, product_type_to_delta in date_to_product_type_to_delta.items():
+		if cur_date in dates_to_recompute:
+			continue
+		for product_type, delta in product_type_to_delta.items():
+			session.query(models.BankFinancialSummary).filter(
+				models.BankFinancialSummary.date == cur_date
+			).filter(
+				models.BankFinancialSummary.product_type == product_type
+			).update({
+				getattr(models.BankFinancialSummary, field): \
+					getattr(models.BankFinancialSummary, field) + delta[field]
+				for field in financial_summary_util.BANK_FINANCIAL_SUMMARY_FIELDS
+			}, synchronize_session=False)
+
+	return dates_to_recompute, None
+
 def list_financial_summaries_that_need_balances_recomputed(
 	session: Session,
 	today: datetime.date, 
@@ -562,6 +708,53 @@ def list_financial_summaries_that_need_balances_recomputed_by_company(
 
 	return summary_requests
 	
+def list_financial_summaries_that_need_balances_recomputed_by_companies(
+	session: Session,
+	company_ids: List[str],
+	today: datetime.date,
+	amount_to_fetch: int,
+) -> List[ComputeSummaryRequest]:
+	"""
+		list_financial_summaries_that_need_balances_recomputed_by_company for
+		many companies at once: up to amount_to_fetch summaries of each company,
+		today's first. Companies that do not exist are skipped.
+	"""
+	financial_summaries = cast(
+		List[models.FinancialSummary],
+		session.query(models.FinancialSummary).filter(
+			models.FinancialSummary.needs_recompute == True
+		).filter(
+			models.FinancialSummary.company_id.in_(company_ids)
+		).all())
+
+	companies = cast(
+		List[models.Company],
+		session.query(models.Company).filter(
+			models.Company.id.in_(company_ids)
+		).all())
+	company_id_to_company = {str(company.id): company.as_dict() for company in companies}
+
+	company_id_to_summary_requests: Dict[str, List[ComputeSummaryRequest]] = {}
+	for fin_summary in sorted(financial_summaries, key=lambda fin_summary: fin_summary.date != today):
+		company_id = str(fin_summary.company_id)
+		if company_id not in company_id_to_company:
+			continue
+
+		summary_requests = company_id_to_summary_requests.setdefault(company_id, [])
+		if len(summary_requests) < amount_to_fetch:
+			summary_requests.append(ComputeSummaryRequest(
+				report_date=fin_summary.date,
+				company_id=company_id,
+				company=company_id_to_company[company_id],
+				update_days_back=fin_summary.days_to_compute_back
+			))
+
+	return [
+		summary_request
+		for company_id in company_ids
+		for summary_request in company_id_to_summary_requests.get(company_id, [])
+	]
+
 def remove_financial_summaries_that_no_longer_need_to_be_recomputed(
 	session: Session, 
 	company_id: str,
@@ -609,31 +802,148 @@ def remove_financial_summaries_that_no_longer_need_to_be_recomputed(
 
 def run_customer_balances_for_financial_summaries_that_need_recompute(
 	session: Session,
-	compute_requests: List[ComputeSummaryRequest]
+	compute_requests: List[ComputeSummaryRequest],
+	process_pool: concurrent.futures.Executor = None,
+	company_id_to_error: Dict[str, str] = None,
 ) -> Tuple[Set[datetime.date], List[str], errors.Error]:
+	"""
+		If process_pool is given, the balances are calculated in its worker
+		processes, see CustomerBalance.update.
+
+		The bank financial summaries of the dates updated are kept up to date
+		too, see update_bank_financial_summaries_incrementally.
+
+		If company_id_to_error is given, the error of each company whose
+		balances could not be computed is added to it, and it is not a fatal
+		error even if no company could be computed: the caller records them.
+	"""
 	dates_updated = set([])
 
-	descriptive_errors = []
+	# Fetch the financials of all the companies at once. The contracts are
+	# extended as of the latest report date of each company, which is the
+	# same as computing that report date first.
+	company_id_to_company_info: Dict[str, per_customer_types.CompanyInfoDict] = {}
+	company_id_to_report_date: Dict[str, datetime.date] = {}
 	for compute_request in compute_requests:
-		day_to_customer_update_dict, descriptive_error = update_company_balance(
-			session, 
-			compute_request['company'],
-			compute_request['report_date'],
-			update_days_back=compute_request['update_days_back'],
-			include_debug_info=False,
-			is_past_date_default_val=False
+		company_id = compute_request['company']['id']
+		company_id_to_company_info[company_id] = per_customer_types.CompanyInfoDict(
+			id=company_id,
+			name=compute_request['company']['name'],
+		)
+		if company_id not in company_id_to_report_date or \
+			compute_request['report_date'] > company_id_to_report_date[company_id]:
+			company_id_to_report_date[company_id] = compute_request['report_date']
+
+	report_date_to_bulk_fetcher: Dict[datetime.date, per_customer_fetcher.BulkFetcher] = {}
+	company_id_to_bulk_fetcher: Dict[str, per_customer_fetcher.BulkFetcher] = {}
+	for report_date in set(company_id_to_report_date.values()):
+		bulk_fetcher = per_customer_fetcher.BulkFetcher(
+			[
+				company_id_to_company_info[company_id]
+				for company_id, company_report_date in company_id_to_report_date.items()
+				if company_report_date == report_date
+			],
+			session,
+			ignore_deleted=True,
 		)
+		_, err = bulk_fetcher.fetch(report_date)
+		if err:
+			return None, [], err
+		report_date_to_bulk_fetcher[report_date] = bulk_fetcher
+
+	for company_id, report_date in company_id_to_report_date.items():
+		company_id_to_bulk_fetcher[company_id] = report_date_to_bulk_fetcher[report_date]
+
+	# The updates of all the companies are written together at the end
+	writer = loan_balances.CustomerUpdatesWriter(session)
+	descriptive_errors = []
+
+	# Start the updates of all the companies first, so that with a process
+	# pool they are calculated at once, then finish them one by one. Each
+	# company runs in a savepoint, so that a database error of one company
+	# only rolls back its own changes, and the session can still be used for
+	# the others.
+	pending_updates: List[loan_balances.PendingCustomerUpdate] = []
+	for compute_request in compute_requests:
+		customer_info, err = company_id_to_bulk_fetcher[compute_request['company']['id']].get_financials(
+			compute_request['company']['id'])
+		if err:
+			# Fall back to fetching the company's financials on its own, so
+			# the error is surfaced the same way as before.
+			customer_info = None
+
+		update_days_back = compute_request['update_days_back'] or 0
+		savepoint = session.begin_nested()
+		try:
+			pending_update = loan_balances.CustomerBalance(compute_request['company'], session).start_update(
+				start_date_for_storing_updates=compute_request['report_date'] - timedelta(days=update_days_back),
+				today=compute_request['report_date'],
+				include_debug_info=False,
+				is_past_date_default_val=False,
+				use_checkpoints=True,
+				customer_info=customer_info,
+				process_pool=process_pool,
+			)
+			savepoint.commit()
+		except Exception as e:
+			# Reported when the update is finished, like an error of the update itself
+			logging.exception(f"Error starting the balance update of company {compute_request['company']['id']}")
+			savepoint.rollback()
+			pending_update = loan_balances.PendingCustomerUpdate(err=errors.Error('{}'.format(e)))
+		pending_updates.append(pending_update)
+
+	for compute_request, pending_update in zip(compute_requests, pending_updates):
+		num_updates = len(writer)
+		savepoint = session.begin_nested()
+		try:
+			day_to_customer_update_dict, descriptive_error = update_company_balance(
+				session, 
+				compute_request['company'],
+				compute_request['report_date'],
+				update_days_back=compute_request['update_days_back'],
+				include_debug_info=False,
+				is_past_date_default_val=False,
+				process_pool=process_pool,
+				writer=writer,
+				pending_update=pending_update,
+			)
+			savepoint.commit()
+		except Exception as e:
+			# One company's bug does not stop the balances of the others
+			logging.exception(f"Unexpected error updating customer balance for company {compute_request['company']['id']}")
+			savepoint.rollback()
+			writer.discard_since(num_updates)
+			descriptive_error = 'Error updating customer balance for company "{}". Error: {}'.format(
+				compute_request['company']['name'], e)
 		if descriptive_error:
 			descriptive_errors.append(descriptive_error)
+			if company_id_to_error is not None:
+				company_id_to_error[compute_request['company']['id']] = descriptive_error
 
 		if compute_request['update_days_back'] == None:
 			compute_request['update_days_back'] = 0
 		dates_updated.update(get_dates_updated(compute_request['report_date'], compute_request['update_days_back']))
 
-	if len(descriptive_errors) == len(compute_requests) and len(compute_requests) != 0:
+	if company_id_to_error is None and len(descriptive_errors) == len(compute_requests) and len(compute_requests) != 0:
 		return None, descriptive_errors, errors.Error('No companies balances could be computed successfully. Errors: {}'.format(
 			descriptive_errors))
 
+	_, err = writer.write()
+	if err:
+		logging.error(f'Error writing the balances of {len(compute_requests)} companies. Error: {err}')
+		session.rollback()
+		return None, descriptive_errors, errors.Error('Failed to write the computed balances. Error: {}'.format(err))
+
+	dates_to_recompute, err = update_bank_financial_summaries_incrementally(
+		session, writer.get_financial_summary_changes())
+	if err:
+		return None, descriptive_errors, errors.Error('FAILED to update bank financial summaries. Error: {}'.format(err))
+
+	for cur_date in sorted(dates_to_recompute):
+		err = compute_and_update_bank_financial_summaries(session, cur_date)
+		if err:
+			return None, descriptive_errors, errors.Error('FAILED to update bank financial summary on {}'.format(err))
+
 	return dates_updated, descriptive_errors, None 
 
 def list_all_companies(
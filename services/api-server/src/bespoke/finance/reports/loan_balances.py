@@ -14,9 +14,12 @@
 	Balances:
 	Billing reports:
 """
+import concurrent.futures
 import datetime
 import decimal
 import logging
+from collections import OrderedDict
+from concurrent.futures.process import BrokenProcessPool
 from datetime import timedelta
 from flask import current_app
 from typing import Any, Callable, Dict, List, Tuple, cast
@@ -26,14 +29,14 @@ from bespoke.date import date_util
 from bespoke.db import db_constants, models
 from bespoke.db.db_constants import LoanStatusEnum, PaymentType, ProductType
 from bespoke.db.models import session_scope
-from bespoke.finance import contract_util, number_util
+from bespoke.finance import contract_util, financial_summary_util, number_util
 from bespoke.finance.fetchers import per_customer_fetcher
-from bespoke.finance.loans import fee_util, loan_calculator
+from bespoke.finance.loans import fee_util, loan_calculator, loan_checkpoint_util
 from bespoke.finance.loans.fee_util import MinimumInterestInfoDict
 from bespoke.finance.loans.loan_calculator import LoanUpdateDebugInfoDict, LoanUpdateDict
-from bespoke.finance.payments import payment_util
 from bespoke.finance.types import finance_types, per_customer_types
 from mypy_extensions import TypedDict
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.sql import and_, or_
 from sqlalchemy.orm.session import Session
 
@@ -308,6 +311,30 @@ def _get_summary_update(
 		accounting_late_fees_accrued_today=accounting_total_late_fees_accrued_today,
 	), None
 
+class PendingCustomerUpdate(object):
+	"""
+		The updates of a customer between CustomerBalance.start_update and
+		finish_update. future is None when they are calculated in finish_update,
+		and err is set when they could not be started.
+	"""
+
+	def __init__(
+		self,
+		report_date_to_is_past_date: Dict[datetime.date, bool] = None,
+		customer_info: per_customer_types.CustomerFinancials = None,
+		include_debug_info: bool = False,
+		include_frozen: bool = False,
+		loan_id_to_checkpoints: Dict[str, loan_calculator.LoanCheckpoints] = None,
+		err: errors.Error = None,
+	) -> None:
+		self.report_date_to_is_past_date = report_date_to_is_past_date
+		self.customer_info = customer_info
+		self.include_debug_info = include_debug_info
+		self.include_frozen = include_frozen
+		self.loan_id_to_checkpoints = loan_id_to_checkpoints
+		self.err = err
+		self.future: concurrent.futures.Future = None
+
 class CustomerBalance(object):
 	"""
 		Object to help us calculate what the customer's balance should be.
@@ -319,82 +346,120 @@ class CustomerBalance(object):
 		self._company_id = company_dict['id']
 
 	def _get_customer_update(
-		self, 
-		today: datetime.date, 
+		self,
+		today: datetime.date,
 		customer_info: per_customer_types.CustomerFinancials,
 		include_debug_info: bool,
 		include_frozen: bool,
 		is_past_date: bool) -> Tuple[CustomerUpdateDict, errors.Error]:
 
+		date_to_customer_update, err = self._get_customer_updates(
+			OrderedDict([(today, is_past_date)]),
+			customer_info,
+			include_debug_info,
+			include_frozen,
+		)
+		if err:
+			return None, err
+
+		return date_to_customer_update[today], None
+
+	def _get_customer_updates(
+		self,
+		report_date_to_is_past_date: Dict[datetime.date, bool],
+		customer_info: per_customer_types.CustomerFinancials,
+		include_debug_info: bool,
+		include_frozen: bool,
+		loan_id_to_checkpoints: Dict[str, loan_calculator.LoanCheckpoints] = None,
+	) -> Tuple[Dict[datetime.date, CustomerUpdateDict], errors.Error]:
+		"""
+		Computes the customer update for every report date while replaying each
+		loan's history only once. A report date maps to None if there is nothing
+		to calculate for it, and the first report date (in the order given) that
+		fails determines the error returned.
+
+		If loan_id_to_checkpoints is given, loans resume from their checkpoints
+		and the new checkpoint of each loan is filled in on it.
+		"""
 		financials = customer_info['financials']
 		company_settings = customer_info['company_settings']
 
+		report_dates = list(report_date_to_is_past_date.keys())
 		if not financials['contracts']:
-			return None, None
+			return {report_date: None for report_date in report_dates}, None
 
 		contract_helper, err = contract_util.ContractHelper.build(
 			self._company_id, financials['contracts'])
 		if err:
 			raise err
 
-		contract, err = contract_helper.get_contract(today)
-		if err and is_past_date:
-			# If we dont have a contract for a date in the past, that is OK,
-			# because we technically only need today's report_date to succeed
-			return None, None
+		date_to_customer_update: Dict[datetime.date, CustomerUpdateDict] = {}
+		date_to_err: Dict[datetime.date, errors.Error] = {}
+		computed_report_dates = []
 
-		if err:
-			# However if its a current day, then we really cant calculate the customer update for today
-			return None, err
+		for report_date, is_past_date in report_date_to_is_past_date.items():
+			contract, err = contract_helper.get_contract(report_date)
+			if err and is_past_date:
+				# If we dont have a contract for a date in the past, that is OK,
+				# because we technically only need today's report_date to succeed
+				date_to_customer_update[report_date] = None
+				continue
 
-		# For now, we just assume the start date is today.
-		start_date = today
-		fee_accumulator = fee_util.FeeAccumulator()
-		fee_accumulator.init_with_date_range(start_date, today)
+			if err:
+				# However if its a current day, then we really cant calculate the customer update for today
+				date_to_err[report_date] = err
+				continue
+
+			computed_report_dates.append(report_date)
 
-		all_errors = []
-		loan_update_dicts = []
+		# For now, we just assume the start date is each report date.
+		report_date_to_fee_accumulator: Dict[datetime.date, fee_util.FeeAccumulator] = {}
+		for report_date in computed_report_dates:
+			fee_accumulator = fee_util.FeeAccumulator()
+			fee_accumulator.init_with_date_range(report_date, report_date)
+			report_date_to_fee_accumulator[report_date] = fee_accumulator
+
+		report_date_to_errors: Dict[datetime.date, List[errors.Error]] = {
+			report_date: [] for report_date in computed_report_dates
+		}
+		report_date_to_loan_update_dicts: Dict[datetime.date, List[LoanUpdateDict]] = {
+			report_date: [] for report_date in computed_report_dates
+		}
+		report_date_to_loan_id_to_debug_info: Dict[datetime.date, Dict[str, LoanUpdateDebugInfoDict]] = {
+			report_date: {} for report_date in computed_report_dates
+		}
 		total_principal_in_requested_state = 0.0
 
 		# What day do you cross the threshold, and on that day you cross the threshold,
 		# how much money stays below the threshold
-		loan_id_to_transactions = {}
+		transaction_index = loan_calculator.TransactionIndex.build(
+			financials['loans'], financials['augmented_transactions'])
 		threshold_accumulator = loan_calculator.ThresholdAccumulator(contract_helper)
+		threshold_accumulator.add_transaction_index(transaction_index)
 
 		for loan in financials['loans']:
-			transactions_for_loan = loan_calculator.get_transactions_for_loan(
-				loan['id'], financials['augmented_transactions'], accumulator=threshold_accumulator)
-
 			if loan['status'] == LoanStatusEnum.APPROVAL_REQUESTED:
 				total_principal_in_requested_state += loan['amount']
 
-			if not loan['origination_date']:
-				# If the loan hasn't been originated yet, nothing to calculate
-				continue
-
-			if not loan['adjusted_maturity_date']:
-				logging.error('Data issue, adjusted_maturity_date missing for loan {}'.format(loan['id']))
-				continue
-
-			loan_id_to_transactions[loan['id']] = transactions_for_loan
-
 		artifact_id_to_invoice = {}
 		for invoice in financials['invoices']:
 			artifact_id_to_invoice[invoice['id']] = invoice
 
 		# Calculate a summary for the factoring fee threshold
-		threshold_info, err = threshold_accumulator.compute_threshold_info(
-			report_date=today)
-		if err:
-			return None, err
+		report_date_to_threshold_info: Dict[datetime.date, loan_calculator.ThresholdInfoDict] = OrderedDict()
+		for report_date in computed_report_dates:
+			threshold_info, err = threshold_accumulator.compute_threshold_info(
+				report_date=report_date)
+			if err:
+				date_to_err[report_date] = err
+				continue
+			report_date_to_threshold_info[report_date] = threshold_info
 
-		purchase_order_id_to_update: Dict[str, POUpdateDict] = {}
+		# The purchase orders amount funded does not depend on the report date
+		purchase_order_id_to_amount_funded: Dict[str, float] = {}
 		for purchase_order in financials['purchase_orders']:
-			purchase_order_id_to_update[purchase_order['id']] = POUpdateDict(
-				amount_funded=0.0
-			)
+			purchase_order_id_to_amount_funded[purchase_order['id']] = 0.0
 
-		loan_id_to_debug_info = {}
 		for loan in financials['loans']:
 			if not loan['origination_date']:
 				# If the loan hasn't been originated yet, nothing to calculate
@@ -404,83 +469,112 @@ class CustomerBalance(object):
 				logging.error('Data issue, adjusted_maturity_date missing for loan {}'.format(loan['id']))
 				continue
 
-			transactions_for_loan = loan_id_to_transactions[loan['id']]
+			transactions_for_loan = transaction_index.get_transactions_for_loan(loan['id'])
 			invoice = artifact_id_to_invoice.get(loan['artifact_id'])
-			po_update = purchase_order_id_to_update.get(loan['artifact_id'])
-			if po_update and loan['funded_at']:
+			if loan['artifact_id'] in purchase_order_id_to_amount_funded and loan['funded_at']:
 				# If the loan is funded and we found its corresponding purchase order
 				# then update details about the Purchase Order
-				po_update['amount_funded'] += loan['amount']
+				purchase_order_id_to_amount_funded[loan['artifact_id']] += loan['amount']
 
 			if not include_frozen and loan['is_frozen']:
-				# We want to calculate details like how much a loan contributes to whether a 
+				# We want to calculate details like how much a loan contributes to whether a
 				# Purchase Order is fully funded, but we don't want to run any balances for it
 				# so we skip it after accounting for its contribution to Purchase Orders but
 				# before calculating any balances
 				continue
 
-			calculator = loan_calculator.LoanCalculator(contract_helper, fee_accumulator)
-			calculate_result, errors_list = calculator.calculate_loan_balance(
-				threshold_info,
+			if not report_date_to_threshold_info:
+				continue
+
+			checkpoints = None
+			if loan_id_to_checkpoints is not None:
+				if loan['id'] not in loan_id_to_checkpoints:
+					loan_id_to_checkpoints[loan['id']] = loan_calculator.LoanCheckpoints([])
+				checkpoints = loan_id_to_checkpoints[loan['id']]
+
+			calculator = loan_calculator.LoanCalculator(contract_helper, fee_accumulator=None)
+			date_to_calculate_result, date_to_errors_list = calculator.calculate_loan_balances_for_report_dates(
+				report_date_to_threshold_info,
+				report_date_to_fee_accumulator,
 				loan,
 				invoice,
 				company_settings,
 				transactions_for_loan,
-				today,
 				should_round_output=False,
-				include_debug_info=include_debug_info
+				include_debug_info=include_debug_info,
+				checkpoints=checkpoints,
+				loan_transaction_index=transaction_index.get_loan_transaction_index(loan['id']),
 			)
-			if errors_list:
-				logging.error('Got these errors associated with loan {}'.format(loan['id']))
+
+			for report_date, errors_list in date_to_errors_list.items():
+				logging.error('Got these errors associated with loan {} on report date {}'.format(loan['id'], report_date))
 				for err in errors_list:
 					logging.error(err.msg)
 
-				all_errors.extend(errors_list)
-			else:
-				loan_update_dict = calculate_result['loan_update']
-				loan_update_dicts.append(loan_update_dict)
-				loan_id_to_debug_info[loan['id']] = calculate_result['debug_info'] 
-
-		if all_errors:
-			raise errors.Error(
-				'Will not proceed with updates because there was more than 1 error during loan balance updating',
-				details={'errors': all_errors}
+				report_date_to_errors[report_date].extend(errors_list)
+
+			for report_date, calculate_result in date_to_calculate_result.items():
+				report_date_to_loan_update_dicts[report_date].append(calculate_result['loan_update'])
+				report_date_to_loan_id_to_debug_info[report_date][loan['id']] = calculate_result['debug_info']
+
+		for report_date, threshold_info in report_date_to_threshold_info.items():
+			all_errors = report_date_to_errors[report_date]
+			if all_errors:
+				date_to_err[report_date] = errors.Error(
+					'Will not proceed with updates because there was more than 1 error during loan balance updating',
+					details={'errors': all_errors}
+				)
+				continue
+
+			borrowing_base_update, err = _get_active_borrowing_base_update(
+				contract_helper,
+				financials.get('active_borrowing_base'),
+				report_date,
+			)
+			if err:
+				date_to_err[report_date] = err
+				continue
+
+			loan_update_dicts = report_date_to_loan_update_dicts[report_date]
+			summary_update, err = _get_summary_update(
+				customer_info,
+				contract_helper,
+				loan_update_dicts,
+				borrowing_base_update,
+				report_date_to_fee_accumulator[report_date],
+				report_date,
 			)
+			if err:
+				date_to_err[report_date] = err
+				continue
 
-		borrowing_base_update, err = _get_active_borrowing_base_update(
-			contract_helper,
-			financials.get('active_borrowing_base'),
-			today,
-		)
-		if err:
-			raise err
+			summary_update['total_principal_in_requested_state'] = total_principal_in_requested_state
+			summary_update['day_volume_threshold_met'] = threshold_info['day_threshold_met']
 
-		summary_update, err = _get_summary_update(
-			customer_info,
-			contract_helper,
-			loan_update_dicts,
-			borrowing_base_update,
-			fee_accumulator,
-			today,
-		)
+			purchase_order_id_to_update: Dict[str, POUpdateDict] = {}
+			for purchase_order_id, amount_funded in purchase_order_id_to_amount_funded.items():
+				purchase_order_id_to_update[purchase_order_id] = POUpdateDict(
+					amount_funded=amount_funded
+				)
 
-		if err:
-			raise err
+			date_to_customer_update[report_date] = CustomerUpdateDict(
+				today=report_date,
+				loan_updates=loan_update_dicts,
+				active_ebba_application_update=borrowing_base_update,
+				purchase_orders_update=PurchaseOrdersUpdateDict(
+					purchase_order_id_to_update=purchase_order_id_to_update
+				),
+				summary_update=summary_update,
+				loan_id_to_debug_info=report_date_to_loan_id_to_debug_info[report_date]
+			)
 
-		summary_update['total_principal_in_requested_state'] = total_principal_in_requested_state
-		summary_update['day_volume_threshold_met'] = threshold_info['day_threshold_met']
+		ordered_date_to_customer_update: Dict[datetime.date, CustomerUpdateDict] = OrderedDict()
+		for report_date in report_dates:
+			if report_date in date_to_err:
+				return None, date_to_err[report_date]
+			ordered_date_to_customer_update[report_date] = date_to_customer_update[report_date]
 
-		customer_update = CustomerUpdateDict(
-			today=today,
-			loan_updates=loan_update_dicts,
-			active_ebba_application_update=borrowing_base_update,
-			purchase_orders_update=PurchaseOrdersUpdateDict(
-				purchase_order_id_to_update=purchase_order_id_to_update
-			),
-			summary_update=summary_update,
-			loan_id_to_debug_info=loan_id_to_debug_info
-		)
-		return customer_update, None
+		return ordered_date_to_customer_update, None
 
 	@errors.return_error_tuple
 	def update(
@@ -490,238 +584,521 @@ class CustomerBalance(object):
 		include_debug_info: bool,
 		is_past_date_default_val: bool,
 		include_frozen: bool = False,
+		use_checkpoints: bool = False,
+		customer_info: per_customer_types.CustomerFinancials = None,
+		process_pool: concurrent.futures.Executor = None,
 	) -> Tuple[Dict[datetime.date, CustomerUpdateDict], errors.Error]:
 		"""
 		Returns None if company does not have any contracts.
+
+		If use_checkpoints is True, loans are calculated starting from their
+		latest stored checkpoint, and newer checkpoints are stored in the session.
+
+		If customer_info is given (e.g. from a BulkFetcher), it is used instead
+		of fetching the customer's financials again.
+
+		If process_pool is given, the updates are calculated in one of its worker
+		processes, while fetching and writing stays in this process. To calculate
+		the updates of several customers at once, call start_update for each of
+		them, then finish_update.
 		"""
-		# Get your contracts and loans
-		fetcher = per_customer_fetcher.Fetcher(
-			per_customer_types.CompanyInfoDict(
-				id=self._company_id,
-				name=self._company_name
-			),
-			self._session,
-			ignore_deleted=True,
+		pending_update = self.start_update(
+			start_date_for_storing_updates=start_date_for_storing_updates,
+			today=today,
+			include_debug_info=include_debug_info,
+			is_past_date_default_val=is_past_date_default_val,
+			include_frozen=include_frozen,
+			use_checkpoints=use_checkpoints,
+			customer_info=customer_info,
+			process_pool=process_pool,
 		)
-		_, err = fetcher.fetch(today)
-		if err:
-			raise err
+		return self.finish_update(pending_update)
 
-		customer_info = fetcher.get_financials()
+	def start_update(
+		self,
+		start_date_for_storing_updates: datetime.date,
+		today: datetime.date,
+		include_debug_info: bool,
+		is_past_date_default_val: bool,
+		include_frozen: bool = False,
+		use_checkpoints: bool = False,
+		customer_info: per_customer_types.CustomerFinancials = None,
+		process_pool: concurrent.futures.Executor = None,
+	) -> 'PendingCustomerUpdate':
+		"""
+		Fetches what the updates are calculated from and, if process_pool is
+		given, submits their calculation to it. See update.
+		"""
+		if not customer_info:
+			# Get your contracts and loans
+			fetcher = per_customer_fetcher.Fetcher(
+				per_customer_types.CompanyInfoDict(
+					id=self._company_id,
+					name=self._company_name
+				),
+				self._session,
+				ignore_deleted=True,
+			)
+			_, err = fetcher.fetch(today)
+			if err:
+				raise err
 
-		customer_update, err = self._get_customer_update(
-			today, customer_info, include_debug_info, include_frozen, is_past_date=is_past_date_default_val)
-		if err:
-			return None, err
+			customer_info = fetcher.get_financials()
 
-		date_to_customer_update = {}
-		date_to_customer_update[today] = customer_update
+		# Today's update comes first, followed by the remaining days in the past,
+		# all of which are computed from one replay of each loan.
+		report_date_to_is_past_date: Dict[datetime.date, bool] = OrderedDict()
+		report_date_to_is_past_date[today] = is_past_date_default_val
 
-		# Calculate the customer update for the remaining days in the past
 		cur_date = start_date_for_storing_updates
 		while cur_date < today:
-			customer_update, err = self._get_customer_update(
-				cur_date, customer_info, include_debug_info, include_frozen, is_past_date=True)
-			if err:
-				return None, err
-			date_to_customer_update[cur_date] = customer_update
-
+			report_date_to_is_past_date[cur_date] = True
 			cur_date = cur_date + timedelta(days=1)
 
-		return date_to_customer_update, None
+		loan_id_to_checkpoints = None
+		if use_checkpoints:
+			loan_id_to_checkpoints = loan_checkpoint_util.get_loan_id_to_checkpoints(
+				self._session,
+				self._company_id,
+				before_date=min(report_date_to_is_past_date.keys()),
+			)
 
-	def _update_todays_info(self, customer_update: CustomerUpdateDict, session: Session) -> None:
-		loan_ids = []
-		loan_id_to_update = {}
-		for loan_update in customer_update['loan_updates']:
-			loan_id = loan_update['loan_id']
-			loan_id_to_update[loan_id] = loan_update
-			loan_ids.append(loan_id)
-
-		loans = cast(
-				List[models.Loan],
-				session.query(models.Loan).filter(
-					models.Loan.id.in_(loan_ids)
-				).all())
-
-		if not loans:
-			loans = []
-
-		loan_report_ids = [loan.loan_report_id for loan in loans]
-		loan_reports = cast(
-			List[models.LoanReport],
-			session.query(models.LoanReport).filter(
-				models.LoanReport.id.in_(loan_report_ids)
-			).all())
-
-		loan_report_id_to_loan_report = dict({})
-		for loan_report in loan_reports:
-			loan_report_id_to_loan_report[str(loan_report.id)] = loan_report
-
-		for loan in loans:
-			cur_loan_update = loan_id_to_update[str(loan.id)]
-			loan.outstanding_principal_balance = decimal.Decimal(number_util.round_currency(cur_loan_update['outstanding_principal']))
-			loan.outstanding_interest = decimal.Decimal(number_util.round_currency(cur_loan_update['outstanding_interest']))
-			loan.outstanding_fees = decimal.Decimal(number_util.round_currency(cur_loan_update['outstanding_fees']))
+		pending_update = PendingCustomerUpdate(
+			report_date_to_is_past_date=report_date_to_is_past_date,
+			customer_info=customer_info,
+			include_debug_info=include_debug_info,
+			include_frozen=include_frozen,
+			loan_id_to_checkpoints=loan_id_to_checkpoints,
+		)
+		if process_pool:
+			pending_update.future = process_pool.submit(
+				_get_customer_updates_in_worker,
+				cast(models.CompanyDict, {'id': self._company_id, 'name': self._company_name}),
+				report_date_to_is_past_date,
+				customer_info,
+				include_debug_info,
+				include_frozen,
+				loan_id_to_checkpoints,
+			)
+		return pending_update
 
-			if cur_loan_update['should_close_loan']:
-				payment_util.close_loan(loan)
-
-			loan_report_id = str(loan.loan_report_id) if loan.loan_report_id else None
-			loan_report = loan_report_id_to_loan_report.get(loan_report_id, None)
-			if not loan_report:
-				loan_report = models.LoanReport()
-				session.add(loan_report)
-				session.flush()
-				loan.loan_report_id = loan_report.id
-
-			loan_report.repayment_date = cur_loan_update['repayment_date']
-			loan_report.financing_period = cur_loan_update['financing_period']
-			loan_report.financing_day_limit = cur_loan_update['financing_day_limit']
-			loan_report.total_principal_paid = decimal.Decimal(number_util.round_currency(cur_loan_update['total_principal_paid']))
-			loan_report.total_interest_paid = decimal.Decimal(number_util.round_currency(cur_loan_update['total_interest_paid']))
-			loan_report.total_fees_paid = decimal.Decimal(number_util.round_currency(cur_loan_update['total_fees_paid']))
-
-		purchase_order_id_to_update = customer_update['purchase_orders_update']['purchase_order_id_to_update']
-		purchase_order_ids = list(purchase_order_id_to_update.keys())
-		purchase_orders = cast(
-			List[models.PurchaseOrder],
-			session.query(models.PurchaseOrder).filter(
-				models.PurchaseOrder.id.in_(purchase_order_ids)
-			).all())
-
-		if not purchase_orders:
-			purchase_orders = []
-
-		for purchase_order in purchase_orders:
-			po_update = purchase_order_id_to_update[str(purchase_order.id)]
-			purchase_order.amount_funded = decimal.Decimal(po_update['amount_funded'])
-
-		# If there is an active ebba application, update its calculated borrowing
-		# base to reflect the value as a product of the current contract. These are
-		# first computed in the UI and stored on the server. However, if the
-		# contract changes, then the calculated value we've stored may no
-		# longer reflect the terms of the company's contract.
-		active_ebba_application_update = customer_update.get('active_ebba_application_update')
-		if active_ebba_application_update and active_ebba_application_update['id'] is not None:
-			app = session.query(models.EbbaApplication).get(active_ebba_application_update['id'])
-			app.calculated_borrowing_base = decimal.Decimal(active_ebba_application_update['calculated_borrowing_base'])
+	@errors.return_error_tuple
+	def finish_update(
+		self,
+		pending_update: 'PendingCustomerUpdate',
+	) -> Tuple[Dict[datetime.date, CustomerUpdateDict], errors.Error]:
+		"""
+		Waits for the updates started by start_update, and stores the newer
+		checkpoints in the session. See update.
+		"""
+		if pending_update.err:
+			return None, pending_update.err
+
+		loan_id_to_checkpoints = pending_update.loan_id_to_checkpoints
+		future = pending_update.future
+		if future:
+			try:
+				date_to_customer_update, loan_id_to_checkpoints, err = future.result()
+			except BrokenProcessPool:
+				# The worker died, e.g., it ran out of memory. The updates that
+				# were in flight are calculated here instead, and the pool starts
+				# new workers for the next ones (see RestartingProcessPool).
+				logging.exception(f'Worker process died calculating the balances of company {self._company_id}')
+				future = None
+
+		if not future:
+			date_to_customer_update, err = self._get_customer_updates(
+				pending_update.report_date_to_is_past_date,
+				pending_update.customer_info,
+				pending_update.include_debug_info,
+				pending_update.include_frozen,
+				loan_id_to_checkpoints=loan_id_to_checkpoints,
+			)
+		if err:
+			return None, err
+
+		if loan_id_to_checkpoints is not None:
+			loan_checkpoint_util.save_new_checkpoints(
+				self._session, self._company_id, loan_id_to_checkpoints)
+
+		return date_to_customer_update, None
 
 	@errors.return_error_tuple
 	def write(self, customer_update: CustomerUpdateDict, is_todays_update: bool) -> Tuple[bool, errors.Error]:
+		writer = CustomerUpdatesWriter(self._session)
+		writer.add(self._company_id, customer_update, is_todays_update)
+		return writer.write()
+
+FinancialSummaryChangeDict = TypedDict('FinancialSummaryChangeDict', {
+	'company_id': str,
+	'date': datetime.date,
+	'old_values': Dict[str, decimal.Decimal], # None if the financial summary is new
+	'new_values': Dict[str, decimal.Decimal],
+})
 
-		err_details = {
-			'customer_name': self._company_name,
-			'method': 'CustomerBalance.write'
-		}
+# How many financial summaries go into each INSERT ... ON CONFLICT statement
+FINANCIAL_SUMMARIES_PER_UPSERT = 500
+
+def _get_loans_info_entry(update: LoanUpdateDict) -> LoansInfoEntryDict:
+	# NOTE(JR): update's fees should eventually become late_fees, where applicable
+	# We're setting it up in loans_info to get us incrementally to the correct place
+	return {
+		'outstanding_principal': update['outstanding_principal'], 
+		'outstanding_principal_for_interest': update['outstanding_principal_for_interest'], 
+		'outstanding_principal_past_due': update['outstanding_principal_past_due'], 
+		'outstanding_interest': update['outstanding_interest'], 
+		'outstanding_late_fees': update['outstanding_fees'],
+		'amount_to_pay_interest_on': update['amount_to_pay_interest_on'], 
+		'interest_accrued_today': update['interest_accrued_today'], 
+		'fees_accrued_today': update['fees_accrued_today'], 
+		'total_principal_paid': update['total_principal_paid'], 
+		'total_interest_paid': update['total_interest_paid'], 
+		'total_late_fees_paid': update['total_fees_paid'], 
+		'days_overdue': update['days_overdue'],
+		'accounting_outstanding_interest': update['accounting_outstanding_interest'],
+		'accounting_outstanding_late_fees': update['accounting_outstanding_late_fees'],
+	}
+
+def _round_or_none(value: float) -> decimal.Decimal:
+	return decimal.Decimal(number_util.round_currency(value)) if value is not None else None
+
+def _get_financial_summary_values(
+	company_id: str,
+	customer_update: CustomerUpdateDict,
+	loans_info: Dict[str, LoansInfoEntryDict],
+) -> Dict[str, Any]:
+	summary_update = customer_update['summary_update']
+	minimum_interest_info = cast(Dict, summary_update['minimum_interest_info'])
+
+	return {
+		'company_id': company_id,
+		'date': customer_update['today'],
+		'total_limit': decimal.Decimal(number_util.round_currency(summary_update['total_limit'])),
+		'adjusted_total_limit': decimal.Decimal(number_util.round_currency(summary_update['adjusted_total_limit'])),
+		'total_outstanding_principal': decimal.Decimal(number_util.round_currency(summary_update['total_outstanding_principal'])),
+		'total_outstanding_principal_for_interest': decimal.Decimal(number_util.round_currency(summary_update['total_outstanding_principal_for_interest'])),
+		'total_outstanding_principal_past_due': decimal.Decimal(number_util.round_currency(summary_update['total_outstanding_principal_past_due'])),
+		'total_outstanding_interest': decimal.Decimal(number_util.round_currency(summary_update['total_outstanding_interest'])),
+		'total_outstanding_fees': decimal.Decimal(number_util.round_currency(summary_update['total_outstanding_fees'])),
+		'total_principal_in_requested_state': decimal.Decimal(number_util.round_currency(summary_update['total_principal_in_requested_state'])),
+		'total_amount_to_pay_interest_on': decimal.Decimal(number_util.round_currency(summary_update['total_amount_to_pay_interest_on'])),
+		'interest_accrued_today': decimal.Decimal(number_util.round_currency_to_five_digits(summary_update['total_interest_accrued_today'])),
+		'total_interest_paid_adjustment_today': decimal.Decimal(number_util.round_currency(summary_update['total_interest_paid_adjustment_today'])),
+		'late_fees_accrued_today': decimal.Decimal(number_util.round_currency_to_five_digits(summary_update['total_late_fees_accrued_today'])),
+		'total_fees_paid_adjustment_today': decimal.Decimal(number_util.round_currency(summary_update['total_fees_paid_adjustment_today'])),
+		'available_limit': decimal.Decimal(number_util.round_currency(summary_update['available_limit'])),
+		'minimum_monthly_payload': minimum_interest_info,
+		'minimum_interest_duration': minimum_interest_info['duration'],
+		'minimum_interest_amount': _round_or_none(minimum_interest_info['minimum_amount']),
+		'minimum_interest_remaining': _round_or_none(minimum_interest_info['amount_short']) if minimum_interest_info['minimum_amount'] is not None else None,
+		'account_level_balance_payload': cast(Dict, summary_update['account_level_balance_payload']),
+		'day_volume_threshold_met': summary_update['day_volume_threshold_met'],
+		'product_type': summary_update['product_type'],
+		'daily_interest_rate': decimal.Decimal(summary_update['daily_interest_rate']),
+		'most_overdue_loan_days': summary_update['most_overdue_loan_days'],
+		'loans_info': loans_info,
+		'accounting_total_outstanding_principal': _round_or_none(summary_update['accounting_total_outstanding_principal']),
+		'accounting_total_outstanding_interest': _round_or_none(summary_update['accounting_total_outstanding_interest']),
+		'accounting_total_outstanding_late_fees': _round_or_none(summary_update['accounting_total_outstanding_late_fees']),
+		'accounting_interest_accrued_today': _round_or_none(summary_update['accounting_interest_accrued_today']),
+		'accounting_late_fees_accrued_today': _round_or_none(summary_update['accounting_late_fees_accrued_today']),
+		# The balance was updated so we no longer need to "recompute" it
+		'needs_recompute': False,
+	}
+
+class CustomerUpdatesWriter(object):
+	"""
+		Writes the customer updates of any number of companies and report dates
+		with a fixed number of statements: bulk updates for the loans, loan
+		reports, purchase orders and ebba applications changed by today's
+		updates, and one INSERT ... ON CONFLICT (company_id, date) DO UPDATE
+		for every FINANCIAL_SUMMARIES_PER_UPSERT financial summaries.
+
+		When the same company and date is added more than once, the update
+		added last is the one that gets written.
+	"""
+
+	def __init__(self, session: Session) -> None:
+		self._session = session
+		self._updates: List[Tuple[str, CustomerUpdateDict, bool]] = []
+		self._financial_summary_changes: List[FinancialSummaryChangeDict] = []
+
+	def add(self, company_id: str, customer_update: CustomerUpdateDict, is_todays_update: bool) -> None:
+		self._updates.append((company_id, customer_update, is_todays_update))
+
+	def __len__(self) -> int:
+		return len(self._updates)
+
+	def discard_since(self, num_updates: int) -> None:
+		# Drops the updates added since the writer had num_updates, e.g., those
+		# of a company whose balances failed half way
+		del self._updates[num_updates:]
+
+	def _write_todays_info(self) -> None:
 		session = self._session
 
-		if is_todays_update:
-			self._update_todays_info(customer_update, session)
+		loan_id_to_update: Dict[str, LoanUpdateDict] = {}
+		purchase_order_id_to_update: Dict[str, Any] = {}
+		ebba_application_id_to_update: Dict[str, Any] = {}
+		for _, customer_update, is_todays_update in self._updates:
+			if not is_todays_update:
+				continue
 
-		financial_summary = cast(
-			models.FinancialSummary,
-			session.query(models.FinancialSummary).filter(
-				models.FinancialSummary.company_id == self._company_id)
-			.filter(models.FinancialSummary.date == customer_update['today'].isoformat()).first())
+			for loan_update in customer_update['loan_updates']:
+				loan_id_to_update[loan_update['loan_id']] = loan_update
 
-		should_add_summary = not financial_summary
-		if should_add_summary:
-			financial_summary = models.FinancialSummary(
-				company_id=self._company_id
-			)
+			purchase_order_id_to_update.update(
+				customer_update['purchase_orders_update']['purchase_order_id_to_update'])
 
-		loans_info: Dict[str, LoansInfoEntryDict] = {}
-		all_loan_ids: List[str] = []
-		loan_id_to_update_lookup: Dict[str, LoanUpdateDict] = {}
-		for loan_update in customer_update['loan_updates']:
-			update_loan_id = loan_update['loan_id']
-			all_loan_ids.append(update_loan_id)
-			loan_id_to_update_lookup[update_loan_id] = loan_update
+			# If there is an active ebba application, update its calculated borrowing
+			# base to reflect the value as a product of the current contract. These are
+			# first computed in the UI and stored on the server. However, if the
+			# contract changes, then the calculated value we've stored may no
+			# longer reflect the terms of the company's contract.
+			active_ebba_application_update = customer_update.get('active_ebba_application_update')
+			if active_ebba_application_update and active_ebba_application_update['id'] is not None:
+				ebba_application_id_to_update[active_ebba_application_update['id']] = active_ebba_application_update
 
-		transaction_subquery = session.query(models.Transaction).join( #type: ignore
+		loan_rows = session.query(
+			models.Loan.id, models.Loan.loan_report_id
+		).filter(
+			models.Loan.id.in_(list(loan_id_to_update.keys()))
+		).all() if loan_id_to_update else []
+
+		existing_loan_report_ids = set([
+			str(loan_report_id) for (loan_report_id,) in session.query(models.LoanReport.id).filter(
+				models.LoanReport.id.in_([loan_report_id for _, loan_report_id in loan_rows if loan_report_id])
+			).all()
+		]) if loan_rows else set([])
+
+		loan_mappings = []
+		loan_report_mappings = []
+		new_loan_report_mappings = []
+		for loan_id, loan_report_id in loan_rows:
+			cur_loan_update = loan_id_to_update[str(loan_id)]
+			loan_mapping: Dict[str, Any] = {
+				'id': loan_id,
+				'outstanding_principal_balance': decimal.Decimal(number_util.round_currency(cur_loan_update['outstanding_principal'])),
+				'outstanding_interest': decimal.Decimal(number_util.round_currency(cur_loan_update['outstanding_interest'])),
+				'outstanding_fees': decimal.Decimal(number_util.round_currency(cur_loan_update['outstanding_fees'])),
+			}
+
+			if cur_loan_update['should_close_loan']:
+				# Same as payment_util.close_loan
+				loan_mapping['closed_at'] = date_util.now()
+				loan_mapping['payment_status'] = db_constants.PaymentStatusEnum.CLOSED
+
+			loan_report_mapping = {
+				'repayment_date': cur_loan_update['repayment_date'],
+				'financing_period': cur_loan_update['financing_period'],
+				'financing_day_limit': cur_loan_update['financing_day_limit'],
+				'total_principal_paid': decimal.Decimal(number_util.round_currency(cur_loan_update['total_principal_paid'])),
+				'total_interest_paid': decimal.Decimal(number_util.round_currency(cur_loan_update['total_interest_paid'])),
+				'total_fees_paid': decimal.Decimal(number_util.round_currency(cur_loan_update['total_fees_paid'])),
+			}
+			if loan_report_id and str(loan_report_id) in existing_loan_report_ids:
+				loan_report_mapping['id'] = loan_report_id
+				loan_report_mappings.append(loan_report_mapping)
+			else:
+				loan_report_mapping['id'] = models.GUID_DEFAULT()
+				loan_mapping['loan_report_id'] = loan_report_mapping['id']
+				new_loan_report_mappings.append(loan_report_mapping)
+
+			loan_mappings.append(loan_mapping)
+
+		session.bulk_insert_mappings(models.LoanReport, new_loan_report_mappings)
+		session.bulk_update_mappings(models.LoanReport, loan_report_mappings)
+		session.bulk_update_mappings(models.Loan, loan_mappings)
+
+		# Only existing rows can be bulk updated, so look up which ids exist first
+		if purchase_order_id_to_update:
+			purchase_order_ids = session.query(models.PurchaseOrder.id).filter(
+				models.PurchaseOrder.id.in_(list(purchase_order_id_to_update.keys()))
+			).all()
+			session.bulk_update_mappings(models.PurchaseOrder, [
+				{
+					'id': purchase_order_id,
+					'amount_funded': decimal.Decimal(purchase_order_id_to_update[str(purchase_order_id)]['amount_funded']),
+				}
+				for (purchase_order_id,) in purchase_order_ids
+			])
+
+		if ebba_application_id_to_update:
+			ebba_application_ids = session.query(models.EbbaApplication.id).filter(
+				models.EbbaApplication.id.in_(list(ebba_application_id_to_update.keys()))
+			).all()
+			session.bulk_update_mappings(models.EbbaApplication, [
+				{
+					'id': ebba_application_id,
+					'calculated_borrowing_base': decimal.Decimal(
+						ebba_application_id_to_update[str(ebba_application_id)]['calculated_borrowing_base']),
+				}
+				for (ebba_application_id,) in ebba_application_ids
+			])
+
+	def _get_financial_summary_rows(self) -> List[Dict[str, Any]]:
+		session = self._session
+
+		all_loan_ids = set([])
+		for _, customer_update, _ in self._updates:
+			for loan_update in customer_update['loan_updates']:
+				all_loan_ids.add(loan_update['loan_id'])
+
+		# A loan is in the loans_info of a date when it is not closed, or when the
+		# most recent repayment (of any loan) is on or after that date; there are
+		# no open loans at all before the first repayment. This is what the
+		# per-date query this replaced selected.
+		latest_repayment = session.query(models.Transaction.effective_date).join(
 			models.Loan,
 			models.Transaction.loan_id == models.Loan.id
 		).filter(
 			models.Transaction.type == PaymentType.REPAYMENT
 		).order_by(
 			models.Transaction.effective_date.desc()
-		).limit(1).subquery()
+		).first()
+		latest_repayment_date = latest_repayment[0] if latest_repayment else None
 
-		open_loans = cast(
-			List[models.Loan],
-			session.query(models.Loan).filter(
-				models.Loan.id.in_(all_loan_ids)
-			).filter(
-				or_(
-					models.Loan.closed_at == None,
-					transaction_subquery.c.effective_date >= customer_update['today'],
-				)
+		loan_id_to_closed_at: Dict[str, datetime.datetime] = {}
+		if all_loan_ids and latest_repayment is not None:
+			loan_rows = session.query(models.Loan.id, models.Loan.closed_at).filter(
+				models.Loan.id.in_(list(all_loan_ids))
 			).filter(
 				cast(Callable, models.Loan.is_deleted.isnot)(True)
-			).all())
-
-		for loan in open_loans:
-			loan_id = str(loan.id)
-			update = loan_id_to_update_lookup[loan_id]
-
-			# NOTE(JR): update's fees should eventually become late_fees, where applicable
-			# We're setting it up in loans_info to get us incrementally to the correct place
-			loans_info[loan_id] = {
-				'outstanding_principal': update['outstanding_principal'], 
-				'outstanding_principal_for_interest': update['outstanding_principal_for_interest'], 
-				'outstanding_principal_past_due': update['outstanding_principal_past_due'], 
-				'outstanding_interest': update['outstanding_interest'], 
-				'outstanding_late_fees': update['outstanding_fees'],
-				'amount_to_pay_interest_on': update['amount_to_pay_interest_on'], 
-				'interest_accrued_today': update['interest_accrued_today'], 
-				'fees_accrued_today': update['fees_accrued_today'], 
-				'total_principal_paid': update['total_principal_paid'], 
-				'total_interest_paid': update['total_interest_paid'], 
-				'total_late_fees_paid': update['total_fees_paid'], 
-				'days_overdue': update['days_overdue'],
-				'accounting_outstanding_interest': update['accounting_outstanding_interest'],
-				'accounting_outstanding_late_fees': update['accounting_outstanding_late_fees'],
-			}
+			).all()
+			loan_id_to_closed_at = {str(loan_id): closed_at for loan_id, closed_at in loan_rows}
+
+		key_to_row: Dict[Tuple[str, datetime.date], Dict[str, Any]] = {}
+		for company_id, customer_update, _ in self._updates:
+			today = customer_update['today']
+			loans_info: Dict[str, LoansInfoEntryDict] = {}
+			for loan_update in customer_update['loan_updates']:
+				loan_id = loan_update['loan_id']
+				if loan_id not in loan_id_to_closed_at:
+					continue
+				if loan_id_to_closed_at[loan_id] is not None and latest_repayment_date < today:
+					continue
+				loans_info[loan_id] = _get_loans_info_entry(loan_update)
+
+			key_to_row[(str(company_id), today)] = _get_financial_summary_values(
+				company_id, customer_update, loans_info)
+
+		return list(key_to_row.values())
+
+	def _upsert_financial_summaries(self, rows: List[Dict[str, Any]]) -> None:
+		session = self._session
+
+		# Remember what each summary was before, so the bank financial summaries
+		# can be updated by the difference
+		existing_summaries = session.query(
+			models.FinancialSummary.id,
+			models.FinancialSummary.company_id,
+			models.FinancialSummary.date,
+			*[getattr(models.FinancialSummary, field) for field in financial_summary_util.BANK_FINANCIAL_SUMMARY_FIELDS],
+		).filter(
+			models.FinancialSummary.company_id.in_(list(set([row['company_id'] for row in rows])))
+		).filter(
+			models.FinancialSummary.date.in_(list(set([row['date'] for row in rows])))
+		).with_for_update().all()
+		key_to_existing_summary = {
+			(str(summary.company_id), summary.date): summary for summary in existing_summaries
+		}
 
-		summary_update = customer_update['summary_update']
-		minimum_interest_info = cast(Dict, summary_update['minimum_interest_info'])
-
-		financial_summary.date = customer_update['today']
-		financial_summary.total_limit = decimal.Decimal(number_util.round_currency(summary_update['total_limit']))
-		financial_summary.adjusted_total_limit = decimal.Decimal(number_util.round_currency(summary_update['adjusted_total_limit']))
-		financial_summary.total_outstanding_principal = decimal.Decimal(number_util.round_currency(summary_update['total_outstanding_principal']))
-		financial_summary.total_outstanding_principal_for_interest = decimal.Decimal(number_util.round_currency(summary_update['total_outstanding_principal_for_interest']))
-		financial_summary.total_outstanding_principal_past_due = decimal.Decimal(number_util.round_currency(summary_update['total_outstanding_principal_past_due']))
-		financial_summary.total_outstanding_interest = decimal.Decimal(number_util.round_currency(summary_update['total_outstanding_interest']))
-		financial_summary.total_outstanding_fees = decimal.Decimal(number_util.round_currency(summary_update['total_outstanding_fees']))
-		financial_summary.total_principal_in_requested_state = decimal.Decimal(number_util.round_currency(summary_update['total_principal_in_requested_state']))
-		financial_summary.total_amount_to_pay_interest_on = decimal.Decimal(number_util.round_currency(summary_update['total_amount_to_pay_interest_on']))
-		financial_summary.interest_accrued_today = decimal.Decimal(number_util.round_currency_to_five_digits(summary_update['total_interest_accrued_today']))
-		financial_summary.total_interest_paid_adjustment_today = decimal.Decimal(number_util.round_currency(summary_update['total_interest_paid_adjustment_today']))
-		financial_summary.late_fees_accrued_today = decimal.Decimal(number_util.round_currency_to_five_digits(summary_update['total_late_fees_accrued_today']))
-		financial_summary.total_fees_paid_adjustment_today = decimal.Decimal(number_util.round_currency(summary_update['total_fees_paid_adjustment_today']))
-		financial_summary.available_limit = decimal.Decimal(number_util.round_currency(summary_update['available_limit']))
-		financial_summary.minimum_monthly_payload = minimum_interest_info
-		financial_summary.minimum_interest_duration = minimum_interest_info['duration']
-		financial_summary.minimum_interest_amount = decimal.Decimal(number_util.round_currency(minimum_interest_info['minimum_amount'])) if minimum_interest_info['minimum_amount'] is not None else None
-		financial_summary.minimum_interest_remaining = decimal.Decimal(number_util.round_currency(minimum_interest_info['amount_short'])) if minimum_interest_info['minimum_amount'] is not None else None
-		financial_summary.account_level_balance_payload = cast(Dict, summary_update['account_level_balance_payload'])
-		financial_summary.day_volume_threshold_met = summary_update['day_volume_threshold_met']
-		financial_summary.product_type = summary_update['product_type']
-		financial_summary.daily_interest_rate = decimal.Decimal(summary_update['daily_interest_rate'])
-		financial_summary.most_overdue_loan_days = summary_update['most_overdue_loan_days']
-		financial_summary.loans_info = loans_info
-		financial_summary.accounting_total_outstanding_principal = decimal.Decimal(number_util.round_currency(summary_update['accounting_total_outstanding_principal'])) if summary_update['accounting_total_outstanding_principal'] is not None else None
-		financial_summary.accounting_total_outstanding_interest = decimal.Decimal(number_util.round_currency(summary_update['accounting_total_outstanding_interest'])) if summary_update['accounting_total_outstanding_interest'] is not None else None
-		financial_summary.accounting_total_outstanding_late_fees = decimal.Decimal(number_util.round_currency(summary_update['accounting_total_outstanding_late_fees'])) if summary_update['accounting_total_outstanding_late_fees'] is not None else None
-		financial_summary.accounting_interest_accrued_today = decimal.Decimal(number_util.round_currency(summary_update['accounting_interest_accrued_today'])) if summary_update['accounting_interest_accrued_today'] is not None else None
-		financial_summary.accounting_late_fees_accrued_today = decimal.Decimal(number_util.round_currency(summary_update['accounting_late_fees_accrued_today'])) if summary_update['accounting_late_fees_accrued_today'] is not None else None
-
-		if should_add_summary:
-			session.add(financial_summary)
+		for row in rows:
+			existing_summary = key_to_existing_summary.get((str(row['company_id']), row['date']))
+			self._financial_summary_changes.append(FinancialSummaryChangeDict(
+				company_id=str(row['company_id']),
+				date=row['date'],
+				old_values={
+					field: getattr(existing_summary, field)
+					for field in financial_summary_util.BANK_FINANCIAL_SUMMARY_FIELDS
+				} if existing_summary else None,
+				new_values={
+					field: row[field] for field in financial_summary_util.BANK_FINANCIAL_SUMMARY_FIELDS
+				},
+			))
+
+		if session.get_bind().dialect.name == 'postgresql':
+			update_columns = [column for column in rows[0].keys() if column not in ('company_id', 'date')]
+			now = date_util.now()
+			for i in range(0, len(rows), FINANCIAL_SUMMARIES_PER_UPSERT):
+				statement = postgresql.insert(models.FinancialSummary.__table__).values([
+					dict(row, id=models.GUID_DEFAULT(), created_at=now, updated_at=now)
+					for row in rows[i:i + FINANCIAL_SUMMARIES_PER_UPSERT]
+				])
+				statement = statement.on_conflict_do_update(
+					index_elements=['company_id', 'date'],
+					set_={column: statement.excluded[column] for column in update_columns},
+				)
+				session.execute(statement)
+			return
+
+		# Other databases (sqlite in the tests) have no ON CONFLICT here, so
+		# bulk update the existing summaries instead
+		new_rows = []
+		existing_rows = []
+		for row in rows:
+			existing_summary = key_to_existing_summary.get((str(row['company_id']), row['date']))
+			if existing_summary:
+				existing_rows.append(dict(row, id=existing_summary.id))
+			else:
+				new_rows.append(row)
 
-		# The balance was updated so we no longer need to "recompute" it
-		financial_summary.needs_recompute = False
+		session.bulk_insert_mappings(models.FinancialSummary, new_rows)
+		session.bulk_update_mappings(models.FinancialSummary, existing_rows)
 
+	def get_financial_summary_changes(self) -> List[FinancialSummaryChangeDict]:
+		"""
+			Returns how every financial summary written so far changed, in the
+			order they were written.
+		"""
+		return self._financial_summary_changes
+
+	@errors.return_error_tuple
+	def write(self) -> Tuple[bool, errors.Error]:
+		if not self._updates:
+			return True, None
+
+		session = self._session
+		# The bulk statements below skip the session, so anything pending in
+		# it has to reach the database first.
+		session.flush()
+
+		self._write_todays_info()
+		self._upsert_financial_summaries(self._get_financial_summary_rows())
+
+		# Objects loaded before the write still hold their old values
+		for obj in list(session.identity_map.values()):
+			if isinstance(obj, (
+				models.FinancialSummary,
+				models.Loan,
+				models.LoanReport,
+				models.PurchaseOrder,
+				models.EbbaApplication,
+			)):
+				session.expire(obj)
+
+		self._updates = []
 		return True, None
+
+def _get_customer_updates_in_worker(
+	company_dict: models.CompanyDict,
+	report_date_to_is_past_date: Dict[datetime.date, bool],
+	customer_info: per_customer_types.CustomerFinancials,
+	include_debug_info: bool,
+	include_frozen: bool,
+	loan_id_to_checkpoints: Dict[str, loan_calculator.LoanCheckpoints],
+) -> Tuple[Dict[datetime.date, CustomerUpdateDict], Dict[str, loan_calculator.LoanCheckpoints], errors.Error]:
+	"""
+		Runs CustomerBalance._get_customer_updates in a worker process of a
+		process pool. Everything passed in and out gets pickled, so the
+		checkpoints are returned for their new_checkpoint to reach the caller.
+	"""
+	customer_balance = CustomerBalance(company_dict, session=None)
+	date_to_customer_update, err = customer_balance._get_customer_updates(
+		report_date_to_is_past_date,
+		customer_info,
+		include_debug_info,
+		include_frozen,
+		loan_id_to_checkpoints=loan_id_to_checkpoints,
+	)
+	return date_to_customer_update, loan_id_to_checkpoints, err
@@ -0,0 +1,160 @@
+"""
+	An archive of the raw responses we download from Metrc, so that retries,
+	backfills and parser fixes can be run again from the archive, without
+	making requests to Metrc.
+
+	Layout of the archive directory:
+		objects/<sha[:2]>/<sha>.gz: a gzipped response body, named by the
+			sha256 of the body, so identical responses (e.g., the many empty
+			lists) are only stored once
+		requests/<license number>/<sha>.json: which body was returned for a
+			(license number, path, time range), named by the sha256 of those
+		time_ranges/<license number>/<sha>.json: the time ranges an adaptive
+			split (see metrc_common_util.SplitTimeBy.ADAPTIVE) queried for a
+			(license number, path, day), named by the sha256 of those, since
+			they depend on how Metrc answered and cannot be worked out again
+			on replay
+"""
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+from typing import List, Optional
+
+from bespoke import errors
+from mypy_extensions import TypedDict
+
+# Status code of the error raised when replaying a request that was never archived
+NOT_IN_ARCHIVE_STATUS_CODE = 404
+
+class ArchiveMode(object):
+	# Requests go to Metrc, and are not archived
+	OFF = 'off'
+	# Requests go to Metrc, and their successful responses are archived
+	RECORD = 'record'
+	# Requests are served from the archive, and never go to Metrc
+	REPLAY = 'replay'
+
+ArchivedRequestDict = TypedDict('ArchivedRequestDict', {
+	'license_number': str,
+	'path': str,
+	'time_range': Optional[List[str]],
+	'content_sha256': str,
+	'archived_at': str,
+})
+
+class ArchivedResponse(object):
+	"""
+		Stands in for the requests.models.Response of an archived request.
+	"""
+
+	def __init__(self, content: bytes) -> None:
+		self.content = content
+		self.ok = True
+		self.status_code = 200
+
+def _sha256(content: bytes) -> str:
+	return hashlib.sha256(content).hexdigest()
+
+def _write_atomically(path: str, content: bytes) -> None:
+	# Concurrent downloads may write the same file, so write to a temporary
+	# file first and move it into place, readers never see a partial file.
+	dir_path = os.path.dirname(path)
+	os.makedirs(dir_path, exist_ok=True)
+	fd, tmp_path = tempfile.mkstemp(dir=dir_path)
+	try:
+		with os.fdopen(fd, 'wb') as f:
+			f.write(content)
+		os.replace(tmp_path, path)
+	except:
+		os.remove(tmp_path)
+		raise
+
+class ResponseArchive(object):
+
+	def __init__(self, root_dir: str, mode: str) -> None:
+		if mode not in (ArchiveMode.RECORD, ArchiveMode.REPLAY):
+			raise errors.Error(f'Invalid Metrc archive mode {mode}')
+
+		self.root_dir = root_dir
+		self.mode = mode
+
+	def is_replay(self) -> bool:
+		return self.mode == ArchiveMode.REPLAY
+
+	def _get_object_path(self, content_sha256: str) -> str:
+		return os.path.join(self.root_dir, 'objects', content_sha256[:2], content_sha256 + '.gz')
+
+	def _get_request_path(self, license_number: str, path: str, time_range: Optional[List[str]]) -> str:
+		request_key = json.dumps([license_number, path, list(time_range) if time_range else None])
+		return os.path.join(
+			self.root_dir, 'requests', license_number, _sha256(request_key.encode('utf-8')) + '.json')
+
+	def put(self, license_number: str, path: str, time_range: Optional[List[str]], content: bytes) -> None:
+		content_sha256 = _sha256(content)
+		object_path = self._get_object_path(content_sha256)
+		if not os.path.exists(object_path):
+			_write_atomically(object_path, gzip.compress(content))
+
+		archived_request = ArchivedRequestDict(
+			license_number=license_number,
+			path=path,
+			time_range=list(time_range) if time_range else None,
+			content_sha256=content_sha256,
+			archived_at=datetime.datetime.utcnow().isoformat(),
+		)
+		_write_atomically(
+			self._get_request_path(license_number, path, time_range),
+			json.dumps(archived_request).encode('utf-8'),
+		)
+
+	def get(self, license_number: str, path: str, time_range: Optional[List[str]]) -> Optional[bytes]:
+		request_path = self._get_request_path(license_number, path, time_range)
+		if not os.path.exists(request_path):
+			return None
+
+		with open(request_path, 'rb') as f:
+			archived_request = json.loads(f.read())
+
+		with open(self._get_object_path(archived_request['content_sha256']), 'rb') as f:
+			return gzip.decompress(f.read())
+
+	def _get_time_ranges_path(self, license_number: str, path: str, day_str: str) -> str:
+		time_ranges_key = json.dumps([license_number, path, day_str])
+		return os.path.join(
+			self.root_dir, 'time_ranges', license_number, _sha256(time_ranges_key.encode('utf-8')) + '.json')
+
+	def put_time_ranges(self, license_number: str, path: str, day_str: str, time_ranges: List[List[str]]) -> None:
+		_write_atomically(
+			self._get_time_ranges_path(license_number, path, day_str),
+			json.dumps(time_ranges).encode('utf-8'),
+		)
+
+	def get_time_ranges(self, license_number: str, path: str, day_str: str) -> List[List[str]]:
+		time_ranges_path = self._get_time_ranges_path(license_number, path, day_str)
+		if not os.path.exists(time_ranges_path):
+			raise errors.Error(
+				'Metrc archive has no time ranges for path {} for license number {} and day {}'.format(
+					path, license_number, day_str),
+				details={'status_code': NOT_IN_ARCHIVE_STATUS_CODE},
+			)
+
+		with open(time_ranges_path, 'rb') as f:
+			return json.loads(f.read())
+
+	def get_response(self, license_number: str, path: str, time_range: Optional[List[str]]) -> ArchivedResponse:
+		content = self.get(license_number, path, time_range)
+		if content is None:
+			raise errors.Error(
+				'Metrc archive has no response for path {} for license number {} and time range {}'.format(
+					path, license_number, time_range),
+				details={'status_code': NOT_IN_ARCHIVE_STATUS_CODE},
+			)
+		return ArchivedResponse(content)
+
+def get_archive(root_dir: Optional[str], mode: Optional[str]) -> Optional[ResponseArchive]:
+	if not root_dir or not mode or mode == ArchiveMode.OFF:
+		return None
+	return ResponseArchive(root_dir, mode)
@@ -1,14 +1,18 @@
+import concurrent.futures
 import datetime
 import json
 import logging
 import os
 import requests
+import threading
 import time
 from datetime import timedelta
 from dateutil import parser
 from itertools import islice
 from mypy_extensions import TypedDict
 from requests.auth import HTTPBasicAuth
+from sqlalchemy import func
+from sqlalchemy.orm.session import Session
 from typing import Any, Dict, Iterable, Optional, List, Tuple, cast
 
 from bespoke.config import config_util
@@ -17,6 +21,9 @@ from bespoke import errors
 from bespoke.date import date_util
 from bespoke.db import models
 from bespoke.email import sendgrid_util
+from bespoke.metrc.common import (
+	metrc_archive_util, metrc_metrics_util, metrc_transport_util
+)
 from bespoke.metrc.common.metrc_error_util import (
 	AUTHORIZATION_ERROR_CODES, ErrorCatcher, MetrcRetryError, MetrcErrorDetailsDict
 )
@@ -105,6 +112,40 @@ CompanyStateInfoDict = TypedDict('CompanyStateInfoDict', {
 class SplitTimeBy(object):
 	HOUR = 'hour'
 	QUARTER_HOUR = 'quarter_hour'
+	# Windows sized to how busy the license is, see REST._get_adaptive_results
+	ADAPTIVE = 'adaptive'
+
+# Adaptive splits never query a window shorter than this
+MIN_ADAPTIVE_WINDOW = timedelta(minutes=15)
+
+# A window with more results than this makes the windows after it shorter,
+# and one with less than a quarter of this makes them longer
+MAX_RESULTS_PER_ADAPTIVE_WINDOW = 500
+
+# Statuses Metrc responds with when a query takes too long, which adaptive
+# splits answer by querying a shorter window rather than retrying
+TIMEOUT_STATUS_CODES = [408, 504]
+
+class AdaptiveWindowHints(object):
+	"""
+		The window each license needed for each path at its busiest, the last
+		time it was queried in this process, so the next day starts from there
+		rather than from a whole day. Thread safe.
+	"""
+
+	def __init__(self) -> None:
+		self._key_to_window: Dict[Tuple[str, str], timedelta] = {}
+		self._lock = threading.Lock()
+
+	def get(self, license_number: str, path: str) -> timedelta:
+		with self._lock:
+			return self._key_to_window.get((license_number, path), timedelta(days=1))
+
+	def set(self, license_number: str, path: str, window: timedelta) -> None:
+		with self._lock:
+			self._key_to_window[(license_number, path)] = window
+
+_adaptive_window_hints = AdaptiveWindowHints()
 
 def _get_date_str(cur_date: datetime.date) -> str:
 	return cur_date.strftime('%m/%d/%Y')
@@ -180,6 +221,8 @@ class HTTPResponse(object):
 		# An alternative if you already know its an array of results. 
 		# Specifically used for SplitTimeBy
 		self.results = results
+		# Metrics of the request made for this response, if any
+		self.request_metric: Optional[metrc_metrics_util.RequestMetricDict] = None
 
 	@property
 	def content(self) -> bytes:
@@ -236,6 +279,7 @@ class DownloadContext(object):
 		self.company_details = company_details
 		self.apis_to_use = apis_to_use
 		self.error_catcher = ErrorCatcher()
+		self.metrics = metrc_metrics_util.SyncMetrics()
 		self.rest = REST(
 			sendgrid_client,
 			AuthDict(
@@ -246,6 +290,10 @@ class DownloadContext(object):
 			license_number=license_auth['license_number'],
 			us_state=license_auth['us_state'],
 			error_catcher=self.error_catcher,
+			num_parallel_time_ranges=worker_cfg.num_parallel_time_ranges,
+			max_concurrent_requests=worker_cfg.max_concurrent_requests_per_api_key,
+			archive=metrc_archive_util.get_archive(worker_cfg.archive_dir, worker_cfg.archive_mode),
+			metrics=self.metrics,
 		)
 		self.license = license_auth
 		self.debug = debug
@@ -313,7 +361,7 @@ class FacilitiesFetcher(FacilitiesFetcherInterface):
 		auth = HTTPBasicAuth(auth_dict['vendor_key'], auth_dict['user_key'])
 		base_url = _get_base_url(us_state)
 		url = base_url + '/facilities/v1/'
-		resp = requests.get(url, auth=auth)
+		resp = metrc_transport_util.get_transport().get(base_url, url, auth)
 
 		if not resp.ok:
 			return None, errors.Error('URL: {}. Code: {}. Reason: {}. Response: {}'.format(
@@ -323,6 +371,17 @@ class FacilitiesFetcher(FacilitiesFetcherInterface):
 		facilities_arr = json.loads(resp.content)
 		return facilities_arr, None
 
+# Semaphores limiting the number of requests in flight for each API key,
+# shared by every REST object in this process that uses the same key
+_api_key_to_semaphore: Dict[str, threading.BoundedSemaphore] = {}
+_api_key_to_semaphore_lock = threading.Lock()
+
+def _get_api_key_semaphore(user_key: str, max_concurrent_requests: int) -> threading.BoundedSemaphore:
+	with _api_key_to_semaphore_lock:
+		if user_key not in _api_key_to_semaphore:
+			_api_key_to_semaphore[user_key] = threading.BoundedSemaphore(max_concurrent_requests)
+		return _api_key_to_semaphore[user_key]
+
 class REST(object):
 
 	def __init__(
@@ -334,6 +393,10 @@ class REST(object):
 		us_state: str,
 		error_catcher: ErrorCatcher,
 		debug: bool = False,
+		num_parallel_time_ranges: int = 1,
+		max_concurrent_requests: int = None,
+		archive: metrc_archive_util.ResponseArchive = None,
+		metrics: metrc_metrics_util.SyncMetrics = None,
 	) -> None:
 		self.auth = HTTPBasicAuth(auth_dict['vendor_key'], auth_dict['user_key'])
 		self.license_number = license_number
@@ -342,8 +405,28 @@ class REST(object):
 		self.debug = debug
 		self._error_catcher = error_catcher
 		self.sendgrid_client = sendgrid_client
-
-	def _query_url(self, path: str, time_range: List[str]) -> HTTPResponse:
+		self._num_parallel_time_ranges = max(num_parallel_time_ranges, 1)
+		self._semaphore = _get_api_key_semaphore(
+			auth_dict['user_key'], max_concurrent_requests) if max_concurrent_requests else None
+		self._archive = archive
+		self._metrics = metrics
+
+	def _request(self, url: str) -> requests.models.Response:
+		transport = metrc_transport_util.get_transport()
+		if not self._semaphore:
+			return transport.get(self.base_url, url, self.auth)
+
+		# Only hold onto the API key while the request is in flight, not while
+		# we sleep in between retries
+		with self._semaphore:
+			return transport.get(self.base_url, url, self.auth)
+
+	def _query_url(self, path: str, time_range: List[str], split_statuses: List[int] = None) -> HTTPResponse:
+		"""
+			Responses with a status in split_statuses raise right away, without
+			retries or reporting the error, for the caller to query a shorter
+			time range instead.
+		"""
 		url = self.base_url + path
 
 		needs_q_mark = '?' not in path
@@ -364,6 +447,30 @@ class REST(object):
 		if self.debug:
 			print(url)
 
+		if self._archive and self._archive.is_replay():
+			return HTTPResponse(cast(requests.models.Response, self._archive.get_response(
+				self.license_number, path, time_range)))
+
+		request_metric = metrc_metrics_util.new_request_metric(path, time_range)
+		before = time.time()
+		try:
+			http_resp = self._query_url_with_retries(url, path, time_range, split_statuses, request_metric)
+		finally:
+			request_metric['seconds'] = time.time() - before
+			if self._metrics:
+				self._metrics.add_request(request_metric)
+
+		http_resp.request_metric = request_metric
+		return http_resp
+
+	def _query_url_with_retries(
+		self,
+		url: str,
+		path: str,
+		time_range: List[str],
+		split_statuses: Optional[List[int]],
+		request_metric: metrc_metrics_util.RequestMetricDict,
+	) -> HTTPResponse:
 		NUM_RETRIES = 5
 		NON_RETRY_STATUSES = AUTHORIZATION_ERROR_CODES
 
@@ -372,10 +479,17 @@ class REST(object):
 				logging.info(f'Retry #00{i} {path} download for license number {self.license_number} and time range: {time_range}')
 				logging.info(f'Retrying request with url {url} for license number {self.license_number}')
 
-			resp = requests.get(url, auth=self.auth)
+			resp = self._request(url)
+			request_metric['status_code'] = resp.status_code
+			request_metric['num_bytes'] += len(resp.content) if resp.content else 0
+			request_metric['num_retries'] = i
+			if resp.status_code == metrc_transport_util.TOO_MANY_REQUESTS_STATUS_CODE:
+				request_metric['num_too_many_requests'] += 1
 
 			# Return successful response.
 			if resp.ok:
+				if self._archive:
+					self._archive.put(self.license_number, path, time_range, resp.content)
 				if time_range:
 					logging.info(f'Completed {path} download for license number {self.license_number} and time range: {time_range}')
 				return HTTPResponse(resp)
@@ -385,6 +499,9 @@ class REST(object):
 					self.license_number, self._company_details['name'], time_range),
 					details={'status_code': resp.status_code})
 
+			if split_statuses and resp.status_code in split_statuses:
+				raise e
+
 			if resp.status_code in NON_RETRY_STATUSES:
 				self._error_catcher.add_retry_error(
 					path=path,
@@ -399,6 +516,11 @@ class REST(object):
 			else:
 				logging.error(e)
 
+			if resp.status_code == metrc_transport_util.TOO_MANY_REQUESTS_STATUS_CODE:
+				# The transport already holds back the next request for as long
+				# as Metrc asked us to wait
+				continue
+
 			time.sleep(1 + (i * 3))
 
 		self._error_catcher.add_retry_error(
@@ -429,6 +551,9 @@ class REST(object):
 			split_time_by can only be used when the resultant resp.content is an array
 			that can be joined to one another through list.extend()
 			AND when len(time_range) == 1, which means we are querying for a day
+
+			SplitTimeBy.ADAPTIVE queries its windows one after the other, the
+			fixed splits query num_parallel_time_ranges of them at once.
 		"""
 		if split_time_by and len(time_range) != 1:
 			raise errors.Error('Cannot split time when time_range is already a range, not a single day')
@@ -437,20 +562,118 @@ class REST(object):
 			# Run the query as normal
 			return self._query_url(path, time_range)
 
+		if split_time_by == SplitTimeBy.ADAPTIVE:
+			return HTTPResponse(response=None, results=self._get_adaptive_results(path, time_range[0]))
+
 		time_range_tuples = _get_time_ranges(time_range[0], split_time_by)
-		
+
+		if self._num_parallel_time_ranges > 1:
+			return HTTPResponse(response=None, results=self._get_time_ranges_in_parallel(path, time_range_tuples))
+
 		all_results = []
-		i = 0
 		for time_range_tuple in time_range_tuples:
-			cur_resp = self._query_url(path, time_range_tuple)
-			cur_results = json.loads(cur_resp.content)
-			if type(cur_results) != list:
-				raise errors.Error('When splitting the results using time range, each result must be a list that can be joined together')
-			all_results.extend(cur_results)
-			i += 1
+			all_results.extend(self._get_time_range_results(path, time_range_tuple))
 
 		return HTTPResponse(response=None, results=all_results)
 
+	def _get_time_range_results(self, path: str, time_range: List[str], split_statuses: List[int] = None) -> List[Dict]:
+		cur_resp = self._query_url(path, time_range, split_statuses=split_statuses)
+		cur_results = json.loads(cur_resp.content)
+		if type(cur_results) != list:
+			raise errors.Error('When splitting the results using time range, each result must be a list that can be joined together')
+		if cur_resp.request_metric:
+			cur_resp.request_metric['num_results'] = len(cur_results)
+		return cur_results
+
+	def _get_adaptive_results(self, path: str, orig_time_str: str) -> List[Dict]:
+		"""
+			Walks the day in windows, starting from the window this license needed
+			at its busiest last time (the whole day at first). A window that
+			times out is queried again in halves, a window with too many results
+			halves the windows after it, and one with few results doubles them,
+			so quiet stretches of the day take few requests.
+
+			The windows queried are archived along with their responses, and
+			replays query the same windows.
+		"""
+		if self._archive and self._archive.is_replay():
+			return self._get_archived_adaptive_results(path, orig_time_str)
+
+		orig_date = date_util.load_date_str(orig_time_str)
+		cur_start_time = datetime.datetime(year=orig_date.year, month=orig_date.month, day=orig_date.day)
+		day_end_time = cur_start_time + timedelta(days=1)
+
+		window = _adaptive_window_hints.get(self.license_number, path)
+		# The shortest window this day needed, the hint for the next day
+		busiest_window = timedelta(days=1)
+		all_results: List[Dict] = []
+		# The windows that were answered, which make up the whole day
+		time_ranges: List[List[str]] = []
+		while cur_start_time < day_end_time:
+			cur_end_time = min(cur_start_time + window, day_end_time)
+			cur_window = cur_end_time - cur_start_time
+			can_split = cur_window > MIN_ADAPTIVE_WINDOW
+			time_range = [date_util.datetime_to_str(cur_start_time), date_util.datetime_to_str(cur_end_time)]
+
+			try:
+				cur_results = self._get_time_range_results(
+					path, time_range, split_statuses=TIMEOUT_STATUS_CODES if can_split else None)
+			except errors.Error as e:
+				if not can_split or not e.details or e.details.get('status_code') not in TIMEOUT_STATUS_CODES:
+					raise
+				logging.info(f'Metrc timed out on {path} for license number {self.license_number} and time range {time_range}, splitting it')
+				window = max(cur_window / 2, MIN_ADAPTIVE_WINDOW)
+				busiest_window = min(busiest_window, window)
+				continue
+
+			all_results.extend(cur_results)
+			time_ranges.append(time_range)
+			cur_start_time = cur_end_time
+			if len(cur_results) > MAX_RESULTS_PER_ADAPTIVE_WINDOW:
+				window = max(cur_window / 2, MIN_ADAPTIVE_WINDOW)
+				busiest_window = min(busiest_window, window)
+			elif len(cur_results) < MAX_RESULTS_PER_ADAPTIVE_WINDOW // 4:
+				window = min(window * 2, timedelta(days=1))
+			else:
+				busiest_window = min(busiest_window, cur_window)
+
+		_adaptive_window_hints.set(self.license_number, path, busiest_window)
+		if self._archive:
+			self._archive.put_time_ranges(self.license_number, path, orig_time_str, time_ranges)
+		return all_results
+
+	def _get_archived_adaptive_results(self, path: str, orig_time_str: str) -> List[Dict]:
+		all_results: List[Dict] = []
+		for time_range in self._archive.get_time_ranges(self.license_number, path, orig_time_str):
+			all_results.extend(self._get_time_range_results(path, time_range))
+		return all_results
+
+	def _get_time_ranges_in_parallel(self, path: str, time_range_tuples: List[List[str]]) -> List[Dict]:
+		"""
+			Queries each time range in its own thread, with the same retries as
+			querying them one by one. The results are joined in the order of
+			the time ranges, and the first time range to fail raises its error
+			once the time ranges already being queried finish.
+		"""
+		num_workers = min(self._num_parallel_time_ranges, len(time_range_tuples))
+		with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+			futures = [
+				executor.submit(self._get_time_range_results, path, time_range_tuple)
+				for time_range_tuple in time_range_tuples
+			]
+
+			all_results = []
+			try:
+				for future in futures:
+					all_results.extend(future.result())
+			except Exception:
+				# Don't start querying the time ranges still waiting for a thread
+				for future in futures:
+					future.cancel()
+				raise
+
+		return all_results
+
 def get_rest_helper_for_debug(
 	us_state: str, 
 	license_number: str,
@@ -490,6 +713,54 @@ def chunker_dict(data: Dict, size: int) -> Iterable[Dict]:
 	for i in range(0, len(data), size):
 		yield {k:data[k] for k in islice(data_itr, size)}
 
+# How many ids to look up with each IN query
+LOOKUP_BATCH_SIZE = 500
+
+def get_rows_by_ids(
+	session: Session,
+	model: Any,
+	id_column: Any,
+	ids: Iterable[str],
+	filters: List = None,
+) -> List:
+	"""
+		Returns the rows of model whose id_column is one of ids and which match
+		all the filters, e.g., [models.MetrcPackage.us_state == us_state], with
+		one IN query per LOOKUP_BATCH_SIZE ids. The rows are in no particular
+		order, and ids without a row are left out.
+	"""
+	unique_ids = list(dict.fromkeys(ids))
+	rows = []
+	for ids_chunk in chunker(unique_ids, LOOKUP_BATCH_SIZE):
+		query = session.query(model).filter(id_column.in_(ids_chunk))
+		for f in filters or []:
+			query = query.filter(f)
+		rows.extend(query.all())
+
+	return rows
+
+def get_id_to_row_count(
+	session: Session,
+	id_column: Any,
+	ids: Iterable[str],
+	filters: List = None,
+) -> Dict[str, int]:
+	"""
+		Returns how many rows there are for each of the ids, e.g., the number
+		of sales transactions of each receipt id, with one grouped IN query per
+		LOOKUP_BATCH_SIZE ids. ids without any rows are left out.
+	"""
+	unique_ids = list(dict.fromkeys(ids))
+	id_to_count: Dict[str, int] = {}
+	for ids_chunk in chunker(unique_ids, LOOKUP_BATCH_SIZE):
+		query = session.query(id_column, func.count(id_column)).filter(id_column.in_(ids_chunk))
+		for f in filters or []:
+			query = query.filter(f)
+		for (row_id, count) in query.group_by(id_column).all():
+			id_to_count[row_id] = count
+
+	return id_to_count
+
 def update_if_all_are_unsuccessful(request_status: RequestStatusesDict, key: str, e: errors.Error) -> None:
 	d = cast(Dict, request_status)
 	if d[key] != 200:
@@ -577,7 +848,7 @@ class MetrcApiKeyDataFetcher(MetrcApiKeyDataFetcherInterface):
 			return self.facilities_json
 
 		url = self.base_url + '/facilities/v1'
-		resp = requests.get(url, auth=self.auth)
+		resp = metrc_transport_util.get_transport().get(self.base_url, url, self.auth)
 		if resp.status_code == 401:
 			# Unauthorized.
 			return None
@@ -591,7 +862,7 @@ class MetrcApiKeyDataFetcher(MetrcApiKeyDataFetcherInterface):
 	def _get_harvests(self, license_number: str) -> Any:
 		url = self.base_url + '/harvests/v1/active'
 		url += self.get_request_params(license_number)
-		resp = requests.get(url, auth=self.auth)
+		resp = metrc_transport_util.get_transport().get(self.base_url, url, self.auth)
 		if not resp.ok:
 			raise Exception(f'License: {license_number}; Code: {resp.status_code}; Reason: {resp.reason}; Response: {str(resp.content)}')
 		return json.loads(resp.content)
@@ -600,7 +871,7 @@ class MetrcApiKeyDataFetcher(MetrcApiKeyDataFetcherInterface):
 	def _get_packages(self, license_number: str) -> Any:
 		url = self.base_url + '/packages/v1/active'
 		url += self.get_request_params(license_number)
-		resp = requests.get(url, auth=self.auth)
+		resp = metrc_transport_util.get_transport().get(self.base_url, url, self.auth)
 		if not resp.ok:
 			raise Exception(f'License: {license_number}; Code: {resp.status_code}; Reason: {resp.reason}; Response: {str(resp.content)}')
 		return json.loads(resp.content)
@@ -609,7 +880,7 @@ class MetrcApiKeyDataFetcher(MetrcApiKeyDataFetcherInterface):
 	def _get_plant_batches(self, license_number: str) -> Any:
 		url = self.base_url + '/plantbatches/v1/active'
 		url += self.get_request_params(license_number)
-		resp = requests.get(url, auth=self.auth)
+		resp = metrc_transport_util.get_transport().get(self.base_url, url, self.auth)
 		if not resp.ok:
 			raise Exception(f'License: {license_number}; Code: {resp.status_code}; Reason: {resp.reason}; Response: {str(resp.content)}')
 		return json.loads(resp.content)
@@ -617,7 +888,7 @@ class MetrcApiKeyDataFetcher(MetrcApiKeyDataFetcherInterface):
 	def _get_plants(self, license_number: str) -> Any:
 		url = self.base_url + '/plants/v1/vegetative'
 		url += self.get_request_params(license_number)
-		resp = requests.get(url, auth=self.auth)
+		resp = metrc_transport_util.get_transport().get(self.base_url, url, self.auth)
 		if not resp.ok:
 			raise Exception(f'License: {license_number}; Code: {resp.status_code}; Reason: {resp.reason}; Response: {str(resp.content)}')
 		return json.loads(resp.content)
@@ -625,7 +896,7 @@ class MetrcApiKeyDataFetcher(MetrcApiKeyDataFetcherInterface):
 	def _get_sales_receipts(self, license_number: str) -> Any:
 		url = self.base_url + '/sales/v1/receipts/active'
 		url += self.get_request_params(license_number)
-		resp = requests.get(url, auth=self.auth)
+		resp = metrc_transport_util.get_transport().get(self.base_url, url, self.auth)
 		if not resp.ok:
 			raise Exception(f'License: {license_number}; Code: {resp.status_code}; Reason: {resp.reason}; Response: {str(resp.content)}')
 		return json.loads(resp.content)
@@ -633,7 +904,7 @@ class MetrcApiKeyDataFetcher(MetrcApiKeyDataFetcherInterface):
 	def _get_transfers(self, license_number: str) -> Any:
 		url = self.base_url + '/transfers/v1/incoming'
 		url += self.get_request_params(license_number)
-		resp = requests.get(url, auth=self.auth)
+		resp = metrc_transport_util.get_transport().get(self.base_url, url, self.auth)
 		if not resp.ok:
 			raise Exception(f'License: {license_number}; Code: {resp.status_code}; Reason: {resp.reason}; Response: {str(resp.content)}')
 		return json.loads(resp.content)
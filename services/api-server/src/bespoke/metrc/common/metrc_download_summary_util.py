@@ -1,13 +1,13 @@
 import datetime
 import logging
 from mypy_extensions import TypedDict
-from typing import Any, Dict, List, Tuple, cast
+from typing import Any, Dict, List, Optional, Tuple, cast
 from sqlalchemy.orm.session import Session
 
 from bespoke import errors
 from bespoke.db import models
 from bespoke.db.db_constants import MetrcLicenseCategoryDownloadStatus, MetrcDownloadSummaryStatus
-from bespoke.metrc.common import metrc_common_util
+from bespoke.metrc.common import metrc_common_util, metrc_metrics_util
 from bespoke.metrc.common.metrc_error_util import MetrcRetryError
 
 RerunDailyJobInfoDict = TypedDict('RerunDailyJobInfoDict', {
@@ -15,6 +15,27 @@ RerunDailyJobInfoDict = TypedDict('RerunDailyJobInfoDict', {
 	'company_id': str
 })
 
+EndpointReportRowDict = TypedDict('EndpointReportRowDict', {
+	'license_number': str,
+	'endpoint': str,
+	'num_days': int,
+	'metrics': metrc_metrics_util.EndpointMetricsDict,
+})
+
+PhaseReportRowDict = TypedDict('PhaseReportRowDict', {
+	'license_number': str,
+	'api': str,
+	'phase': str,
+	'num_days': int,
+	'seconds': float,
+	'num_rows': int,
+})
+
+SyncMetricsReportDict = TypedDict('SyncMetricsReportDict', {
+	'endpoints': List[EndpointReportRowDict],
+	'phases': List[PhaseReportRowDict],
+})
+
 def _create_metrc_download_summary_instance(
 	license_permissions_dict: metrc_common_util.LicensePermissionsDict,
 	retry_errors: List[MetrcRetryError],
@@ -107,6 +128,7 @@ def _copy_over_summary(prev: models.MetrcDownloadSummary, cur: models.MetrcDownl
 	prev.retry_payload = cur.retry_payload
 	prev.status = cur.status
 	prev.err_details = cur.err_details
+	prev.metrics_payload = cur.metrics_payload
 
 	prev.harvests_status = cur.harvests_status
 	prev.packages_status = cur.packages_status
@@ -186,11 +208,13 @@ def write_metrc_download_summary(
 	retry_errors: List[MetrcRetryError],
 	company_id: str,
 	metrc_api_key_id: str,
+	metrics: Optional[metrc_metrics_util.SyncMetricsDict] = None,
 ) -> None:
 	new_metrc_download_summary = _create_metrc_download_summary_instance(
 		license_permissions_dict=license_permissions_dict,
 		retry_errors=retry_errors,
 	)
+	new_metrc_download_summary.metrics_payload = cast(Dict, metrics)
 	new_metrc_download_summary.license_number = license_number
 	new_metrc_download_summary.date = cur_date
 	new_metrc_download_summary.company_id = cast(Any, company_id)
@@ -243,3 +267,67 @@ def fetch_metrc_daily_summaries_to_rerun(session: Session, num_to_fetch: int) ->
 		))
 
 	return rerun_daily_infos, None
+
+def get_sync_metrics_report(
+	session: Session,
+	start_date: datetime.date,
+	end_date: datetime.date,
+	license_numbers: List[str] = None,
+) -> Tuple[SyncMetricsReportDict, errors.Error]:
+	"""
+		Sums up the metrics of the downloads of the days from start_date to
+		end_date by license and endpoint, and by license, API and phase, with
+		the ones that took the longest first. Days downloaded before metrics
+		were recorded are left out.
+	"""
+	query = session.query(
+		models.MetrcDownloadSummary.license_number,
+		models.MetrcDownloadSummary.metrics_payload,
+	).filter(
+		models.MetrcDownloadSummary.date >= start_date
+	).filter(
+		models.MetrcDownloadSummary.date <= end_date
+	)
+	if license_numbers is not None:
+		query = query.filter(models.MetrcDownloadSummary.license_number.in_(license_numbers))
+
+	endpoint_key_to_row: Dict[Tuple[str, str], EndpointReportRowDict] = {}
+	phase_key_to_row: Dict[Tuple[str, str, str], PhaseReportRowDict] = {}
+	for license_number, metrics_payload in query.all():
+		if not metrics_payload:
+			continue
+
+		for endpoint, endpoint_metrics in metrics_payload['endpoints'].items():
+			key = (license_number, endpoint)
+			if key not in endpoint_key_to_row:
+				endpoint_key_to_row[key] = EndpointReportRowDict(
+					license_number=license_number,
+					endpoint=endpoint,
+					num_days=0,
+					metrics=metrc_metrics_util.new_endpoint_metrics(),
+				)
+			endpoint_row = endpoint_key_to_row[key]
+			endpoint_row['num_days'] += 1
+			metrc_metrics_util.add_endpoint_metrics(endpoint_row['metrics'], endpoint_metrics)
+
+		for api, phase_to_metrics in metrics_payload['phases'].items():
+			for phase, phase_metrics in phase_to_metrics.items():
+				phase_key = (license_number, api, phase)
+				if phase_key not in phase_key_to_row:
+					phase_key_to_row[phase_key] = PhaseReportRowDict(
+						license_number=license_number,
+						api=api,
+						phase=phase,
+						num_days=0,
+						seconds=0.0,
+						num_rows=0,
+					)
+				phase_row = phase_key_to_row[phase_key]
+				phase_row['num_days'] += 1
+				phase_row['seconds'] += phase_metrics['seconds']
+				phase_row['num_rows'] += phase_metrics['num_rows']
+
+	return SyncMetricsReportDict(
+		endpoints=sorted(endpoint_key_to_row.values(), key=lambda row: row['metrics']['seconds'], reverse=True),
+		phases=sorted(phase_key_to_row.values(), key=lambda row: row['seconds'], reverse=True),
+	), None
@@ -0,0 +1,175 @@
+"""
+	Metrics of the download of a license-day from Metrc: the requests made to
+	each endpoint (how long they took, how large they were, how often they
+	were retried), and how long each phase of each API took, so that we can
+	find which licenses and endpoints take up the time of the sync jobs.
+"""
+import contextlib
+import functools
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, TypeVar, cast
+
+from mypy_extensions import TypedDict
+
+# How many of the slowest requests of a download are kept, with their time range
+NUM_SLOWEST_REQUESTS = 5
+
+class Phase(object):
+	# Requesting and parsing the data, which includes FILTER_NEW_ONLY
+	DOWNLOAD = 'download'
+	# Skipping what is already written
+	FILTER_NEW_ONLY = 'filter_new_only'
+	WRITE = 'write'
+
+RequestMetricDict = TypedDict('RequestMetricDict', {
+	'endpoint': str,
+	'time_range': Optional[List[str]],
+	'status_code': int,
+	'seconds': float, # Including the time spent waiting in between retries
+	'num_bytes': int,
+	'num_results': Optional[int], # Only counted for time ranges that are split
+	'num_retries': int,
+	'num_too_many_requests': int,
+})
+
+EndpointMetricsDict = TypedDict('EndpointMetricsDict', {
+	'num_requests': int,
+	'num_failed_requests': int,
+	'seconds': float,
+	'num_bytes': int,
+	'num_results': int,
+	'num_retries': int,
+	'num_too_many_requests': int,
+})
+
+PhaseMetricsDict = TypedDict('PhaseMetricsDict', {
+	'seconds': float,
+	'num_rows': int,
+})
+
+SyncMetricsDict = TypedDict('SyncMetricsDict', {
+	'endpoints': Dict[str, EndpointMetricsDict],
+	# API (e.g., packages) => phase => metrics
+	'phases': Dict[str, Dict[str, PhaseMetricsDict]],
+	'slowest_requests': List[RequestMetricDict],
+})
+
+_ID_PATH_PART_RE = re.compile(r'/\d+(?=/|$)')
+
+def get_endpoint(path: str) -> str:
+	"""
+		The path without its query and ids, e.g., /sales/v1/receipts/{id}
+		for /sales/v1/receipts/1234?licenseNumber=abcd
+	"""
+	return _ID_PATH_PART_RE.sub('/{id}', path.split('?')[0])
+
+def new_request_metric(path: str, time_range: Optional[List[str]]) -> RequestMetricDict:
+	return RequestMetricDict(
+		endpoint=get_endpoint(path),
+		time_range=list(time_range) if time_range else None,
+		status_code=None,
+		seconds=0.0,
+		num_bytes=0,
+		num_results=None,
+		num_retries=0,
+		num_too_many_requests=0,
+	)
+
+def new_endpoint_metrics() -> EndpointMetricsDict:
+	return EndpointMetricsDict(
+		num_requests=0,
+		num_failed_requests=0,
+		seconds=0.0,
+		num_bytes=0,
+		num_results=0,
+		num_retries=0,
+		num_too_many_requests=0,
+	)
+
+def add_endpoint_metrics(total: EndpointMetricsDict, cur: EndpointMetricsDict) -> None:
+	for key in total.keys():
+		total[key] += cur[key] # type: ignore
+
+class SyncMetrics(object):
+	"""
+		Collects the metrics of the download of a license-day. Thread safe,
+		since requests and phases of the same day may run in several threads.
+	"""
+
+	def __init__(self) -> None:
+		self._request_metrics: List[RequestMetricDict] = []
+		self._api_to_phase_metrics: Dict[str, Dict[str, PhaseMetricsDict]] = {}
+		self._lock = threading.Lock()
+
+	def add_request(self, request_metric: RequestMetricDict) -> None:
+		# num_results may still be filled in after the request is added, the
+		# metrics are only summed up in get_summary
+		with self._lock:
+			self._request_metrics.append(request_metric)
+
+	def _get_phase_metrics(self, api: str, phase: str) -> PhaseMetricsDict:
+		phase_to_metrics = self._api_to_phase_metrics.setdefault(api, {})
+		if phase not in phase_to_metrics:
+			phase_to_metrics[phase] = PhaseMetricsDict(seconds=0.0, num_rows=0)
+		return phase_to_metrics[phase]
+
+	def add_phase(self, api: str, phase: str, seconds: float = 0.0, num_rows: int = 0) -> None:
+		with self._lock:
+			phase_metrics = self._get_phase_metrics(api, phase)
+			phase_metrics['seconds'] += seconds
+			phase_metrics['num_rows'] += num_rows
+
+	@contextlib.contextmanager
+	def time_phase(self, api: str, phase: str) -> Iterator[None]:
+		before = time.time()
+		try:
+			yield
+		finally:
+			self.add_phase(api, phase, seconds=time.time() - before)
+
+	def get_summary(self) -> SyncMetricsDict:
+		with self._lock:
+			request_metrics = list(self._request_metrics)
+			api_to_phase_metrics = {
+				api: {phase: PhaseMetricsDict(**metrics) for phase, metrics in phase_to_metrics.items()}
+				for api, phase_to_metrics in self._api_to_phase_metrics.items()
+			}
+
+		endpoint_to_metrics: Dict[str, EndpointMetricsDict] = {}
+		for request_metric in request_metrics:
+			endpoint_metrics = endpoint_to_metrics.setdefault(request_metric['endpoint'], new_endpoint_metrics())
+			endpoint_metrics['num_requests'] += 1
+			if request_metric['status_code'] != 200:
+				endpoint_metrics['num_failed_requests'] += 1
+			endpoint_metrics['seconds'] += request_metric['seconds']
+			endpoint_metrics['num_bytes'] += request_metric['num_bytes']
+			endpoint_metrics['num_results'] += request_metric['num_results'] or 0
+			endpoint_metrics['num_retries'] += request_metric['num_retries']
+			endpoint_metrics['num_too_many_requests'] += request_metric['num_too_many_requests']
+
+		slowest_requests = sorted(request_metrics, key=lambda m: m['seconds'], reverse=True)
+		return SyncMetricsDict(
+			endpoints=endpoint_to_metrics,
+			phases=api_to_phase_metrics,
+			slowest_requests=slowest_requests[:NUM_SLOWEST_REQUESTS],
+		)
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+def time_filter_new_only(api: str) -> Callable[[F], F]:
+	"""
+		Times a filter_new_only(self, ctx, session) method as the
+		FILTER_NEW_ONLY phase of the api.
+	"""
+	def decorator(f: F) -> F:
+
+		@functools.wraps(f)
+		def inner(self: Any, ctx: Any, session: Any) -> Any:
+			with ctx.metrics.time_phase(api, Phase.FILTER_NEW_ONLY):
+				return f(self, ctx, session)
+
+		return cast(F, inner)
+
+	return decorator
@@ -0,0 +1,155 @@
+"""
+	Shared transport for all requests to Metrc: one pooled requests.Session
+	per state base URL, so connections (and their TLS handshakes) are reused
+	across licenses and downloads, and one token bucket per API key, so the
+	jobs running in this process together stay under Metrc's rate limits.
+"""
+import datetime
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+
+from bespoke.config import config_util
+
+TOO_MANY_REQUESTS_STATUS_CODE = 429
+
+# How long to back off after a 429 response that does not say how long to wait
+DEFAULT_RETRY_AFTER_SECONDS = 5.0
+
+# How many connections each pooled session keeps open to a base URL
+POOL_MAXSIZE = 20
+
+class TokenBucket(object):
+	"""
+		Allows requests_per_second requests on average, and bursts of up to
+		capacity requests after being idle. Without a requests_per_second,
+		it only holds requests back while paused. Thread safe.
+	"""
+
+	def __init__(self, requests_per_second: Optional[float], capacity: float = None) -> None:
+		self._rate = requests_per_second
+		self._capacity = capacity if capacity else max(requests_per_second or 0.0, 1.0)
+		self._tokens = self._capacity
+		self._updated_at = time.monotonic()
+		self._paused_until = 0.0
+		self._lock = threading.Lock()
+
+	def _refill(self, now: float) -> None:
+		if not self._rate:
+			self._tokens = self._capacity
+			return
+		self._tokens = min(self._capacity, self._tokens + (now - self._updated_at) * self._rate)
+		self._updated_at = now
+
+	def acquire(self) -> float:
+		"""
+			Blocks until a request may be made. Returns how many seconds it waited.
+		"""
+		waited = 0.0
+		while True:
+			with self._lock:
+				now = time.monotonic()
+				self._refill(now)
+				if now < self._paused_until:
+					wait_seconds = self._paused_until - now
+				elif self._tokens >= 1.0:
+					self._tokens -= 1.0
+					return waited
+				else:
+					wait_seconds = (1.0 - self._tokens) / self._rate
+
+			time.sleep(wait_seconds)
+			waited += wait_seconds
+
+	def pause(self, seconds: float) -> None:
+		"""
+			Makes every caller wait at least seconds from now, e.g., when Metrc
+			responds with a Retry-After.
+		"""
+		with self._lock:
+			self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+			# Don't let the requests that were held back all go out at once
+			self._tokens = min(self._tokens, 1.0)
+
+def get_retry_after_seconds(resp: requests.models.Response) -> float:
+	"""
+		Retry-After is either a number of seconds or an HTTP date.
+	"""
+	retry_after = resp.headers.get('Retry-After') if resp.headers else None
+	if not retry_after:
+		return DEFAULT_RETRY_AFTER_SECONDS
+
+	try:
+		return max(float(retry_after), 0.0)
+	except ValueError:
+		pass
+
+	try:
+		retry_at = parsedate_to_datetime(retry_after)
+	except (TypeError, ValueError):
+		return DEFAULT_RETRY_AFTER_SECONDS
+
+	if retry_at.tzinfo is None:
+		retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+	now = datetime.datetime.now(datetime.timezone.utc)
+	return max((retry_at - now).total_seconds(), 0.0)
+
+class Transport(object):
+
+	def __init__(self, requests_per_second_per_api_key: Optional[float]) -> None:
+		self._requests_per_second_per_api_key = requests_per_second_per_api_key
+		self._base_url_to_session: Dict[str, requests.Session] = {}
+		self._api_key_to_bucket: Dict[Tuple[str, str], TokenBucket] = {}
+		self._lock = threading.Lock()
+
+	def _get_session(self, base_url: str) -> requests.Session:
+		with self._lock:
+			if base_url not in self._base_url_to_session:
+				session = requests.Session()
+				session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE))
+				self._base_url_to_session[base_url] = session
+			return self._base_url_to_session[base_url]
+
+	def _get_bucket(self, auth: HTTPBasicAuth) -> TokenBucket:
+		api_key = (auth.username, auth.password)
+		with self._lock:
+			if api_key not in self._api_key_to_bucket:
+				self._api_key_to_bucket[api_key] = TokenBucket(self._requests_per_second_per_api_key)
+			return self._api_key_to_bucket[api_key]
+
+	def get(self, base_url: str, url: str, auth: HTTPBasicAuth) -> requests.models.Response:
+		"""
+			GETs the url, which must start with base_url, once the rate limit of
+			the API key allows it. A 429 response holds back all the requests of
+			that API key for as long as its Retry-After asks, and is returned to
+			the caller to retry as they see fit.
+		"""
+		bucket = self._get_bucket(auth)
+		waited = bucket.acquire()
+		if waited > 1.0:
+			logging.info(f'Waited {waited:.1f}s for the Metrc rate limit before requesting {url}')
+
+		resp = self._get_session(base_url).get(url, auth=auth)
+
+		if resp.status_code == TOO_MANY_REQUESTS_STATUS_CODE:
+			retry_after_seconds = get_retry_after_seconds(resp)
+			logging.warning(f'Metrc responded with 429 Too Many Requests, pausing requests for this API key for {retry_after_seconds:.1f}s')
+			bucket.pause(retry_after_seconds)
+
+		return resp
+
+_transport: Transport = None
+_transport_lock = threading.Lock()
+
+def get_transport() -> Transport:
+	global _transport
+	with _transport_lock:
+		if not _transport:
+			_transport = Transport(config_util.get_metrc_requests_per_second_per_api_key())
+		return _transport
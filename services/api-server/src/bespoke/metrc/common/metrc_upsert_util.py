@@ -0,0 +1,239 @@
+"""
+	Bulk upserts of Metrc rows, so that writing a batch of packages, receipts,
+	transfers, etc. takes a few statements rather than one per row.
+"""
+import datetime
+from typing import Any, Dict, Iterable, List, Tuple
+
+from sqlalchemy import func, or_
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm.session import Session
+
+from bespoke.db import models
+from bespoke.metrc.common.metrc_common_util import LOOKUP_BATCH_SIZE, chunker
+
+# How many rows to write with each INSERT ... ON CONFLICT statement
+UPSERT_BATCH_SIZE = 500
+
+def is_not_older(cur: datetime.datetime, prev: datetime.datetime) -> bool:
+	# Rows without a last modified date are always written, like the ORM
+	# writers they replace
+	return cur is None or prev is None or cur >= prev
+
+def get_row(obj: Any, columns: Iterable[str]) -> Dict:
+	return {column: getattr(obj, column) for column in columns}
+
+def get_model_row(obj: Any) -> Dict:
+	"""
+		All the columns of a model object, except the ones upsert_rows fills in.
+	"""
+	return get_row(obj, [
+		column.name for column in obj.__table__.columns
+		if column.name not in ('id', 'created_at', 'updated_at')
+	])
+
+def get_row_key(row: Any, key_columns: List[str]) -> Tuple:
+	if isinstance(row, dict):
+		return tuple([str(row[column]) if row[column] is not None else None for column in key_columns])
+	return tuple([str(getattr(row, column)) if getattr(row, column) is not None else None for column in key_columns])
+
+def _dedupe_rows(
+	rows: List[Dict],
+	key_columns: List[str],
+	keep_if_unset_columns: List[str],
+	guard_column: str,
+) -> List[Dict]:
+	"""
+		ON CONFLICT cannot update the same row twice in one statement, so rows
+		with the same key are merged first, the same way they are merged into
+		the row already written.
+	"""
+	key_to_row: Dict[Tuple, Dict] = {}
+	for row in rows:
+		key = get_row_key(row, key_columns)
+		prev_row = key_to_row.get(key)
+		if prev_row is None:
+			key_to_row[key] = row
+			continue
+
+		if guard_column and not is_not_older(row[guard_column], prev_row[guard_column]):
+			continue
+
+		merged_row = dict(row)
+		for column in keep_if_unset_columns:
+			if merged_row[column] is None:
+				merged_row[column] = prev_row[column]
+		key_to_row[key] = merged_row
+
+	return list(key_to_row.values())
+
+def get_key_to_row(
+	session: Session,
+	model: Any,
+	key_columns: List[str],
+	keys: Iterable[Tuple],
+	columns: List[str],
+) -> Dict[Tuple, Any]:
+	"""
+		Looks up the columns of the rows with the given keys, with one IN query
+		on the last key column per LOOKUP_BATCH_SIZE keys that share the other
+		key columns (e.g., the us_state).
+	"""
+	prefix_to_last_values: Dict[Tuple, List[str]] = {}
+	for key in keys:
+		prefix_to_last_values.setdefault(key[:-1], []).append(key[-1])
+
+	table = model.__table__
+	query_columns = [table.c[column] for column in list(dict.fromkeys(['id'] + key_columns + columns))]
+	key_to_row = {}
+	for prefix, last_values in prefix_to_last_values.items():
+		for last_values_chunk in chunker(list(set(last_values)), LOOKUP_BATCH_SIZE):
+			query = session.query(*query_columns).filter(table.c[key_columns[-1]].in_(last_values_chunk))
+			for column, value in zip(key_columns[:-1], prefix):
+				query = query.filter(table.c[column] == value)
+
+			for row in query.all():
+				key_to_row[get_row_key(row, key_columns)] = row
+
+	return key_to_row
+
+def _upsert_rows_postgresql(
+	session: Session,
+	model: Any,
+	rows: List[Dict],
+	key_columns: List[str],
+	update_columns: List[str],
+	keep_if_unset_columns: List[str],
+	guard_column: str,
+) -> Dict[Tuple, str]:
+	table = model.__table__
+	key_to_id = {}
+
+	for rows_chunk in chunker(rows, UPSERT_BATCH_SIZE):
+		statement = postgresql.insert(table).values(rows_chunk)
+		excluded = statement.excluded
+		set_ = {}
+		for column in update_columns:
+			if column in keep_if_unset_columns:
+				set_[column] = func.coalesce(excluded[column], table.c[column])
+			else:
+				set_[column] = excluded[column]
+
+		where = None
+		if guard_column:
+			where = or_(
+				table.c[guard_column].is_(None),
+				excluded[guard_column].is_(None),
+				excluded[guard_column] >= table.c[guard_column],
+			)
+
+		statement = statement.on_conflict_do_update(
+			index_elements=key_columns,
+			set_=set_,
+			where=where,
+		).returning(table.c.id, *[table.c[column] for column in key_columns])
+
+		for row in session.execute(statement):
+			key_to_id[get_row_key(row, key_columns)] = str(row.id)
+
+	# Rows that were not updated because they are older than what is
+	# written are not returned
+	missing_keys = [
+		get_row_key(row, key_columns) for row in rows
+		if get_row_key(row, key_columns) not in key_to_id
+	]
+	if missing_keys:
+		for key, row in get_key_to_row(session, model, key_columns, missing_keys, []).items():
+			key_to_id[key] = str(row.id)
+
+	return key_to_id
+
+def _upsert_rows_by_lookup(
+	session: Session,
+	model: Any,
+	rows: List[Dict],
+	key_columns: List[str],
+	update_columns: List[str],
+	keep_if_unset_columns: List[str],
+	guard_column: str,
+) -> Dict[Tuple, str]:
+	lookup_columns = keep_if_unset_columns + ([guard_column] if guard_column else [])
+	key_to_prev_row = get_key_to_row(
+		session, model, key_columns, [get_row_key(row, key_columns) for row in rows], lookup_columns)
+
+	key_to_id = {}
+	new_rows = []
+	updated_rows = []
+	for row in rows:
+		key = get_row_key(row, key_columns)
+		prev_row = key_to_prev_row.get(key)
+		if not prev_row:
+			new_rows.append(row)
+			key_to_id[key] = str(row['id'])
+			continue
+
+		key_to_id[key] = str(prev_row.id)
+		if guard_column and not is_not_older(row[guard_column], getattr(prev_row, guard_column)):
+			continue
+
+		updated_row = {'id': prev_row.id}
+		for column in update_columns:
+			value = row[column]
+			if column in keep_if_unset_columns and value is None:
+				value = getattr(prev_row, column)
+			updated_row[column] = value
+		updated_rows.append(updated_row)
+
+	session.bulk_insert_mappings(model, new_rows)
+	session.bulk_update_mappings(model, updated_rows)
+	return key_to_id
+
+def upsert_rows(
+	session: Session,
+	model: Any,
+	rows: List[Dict],
+	key_columns: List[str],
+	update_columns: List[str],
+	keep_if_unset_columns: List[str] = None,
+	guard_column: str = 'last_modified_at',
+) -> Dict[Tuple, str]:
+	"""
+		Inserts the rows, or, for the rows whose key_columns are already written,
+		updates their update_columns unless the row written has a newer
+		guard_column. keep_if_unset_columns keep the value written when the new
+		row has None for them. key_columns must be a unique constraint of the
+		table, which INSERT ... ON CONFLICT relies on in PostgreSQL. Other
+		databases (sqlite in the tests) look up the rows written instead.
+
+		Returns the id of the row with each key, whether or not it was updated.
+		The keys are tuples of the string values of key_columns, see get_row_key.
+	"""
+	if not rows:
+		return {}
+
+	keep_if_unset_columns = keep_if_unset_columns or []
+	rows = _dedupe_rows(rows, key_columns, keep_if_unset_columns, guard_column)
+
+	now = datetime.datetime.utcnow()
+	rows = [
+		dict(row, id=row.get('id') or models.GUID_DEFAULT(), created_at=now, updated_at=now)
+		for row in rows
+	]
+
+	# The statements below skip the session, so anything pending in it has to
+	# reach the database first.
+	session.flush()
+
+	if session.get_bind().dialect.name == 'postgresql':
+		key_to_id = _upsert_rows_postgresql(
+			session, model, rows, key_columns, update_columns, keep_if_unset_columns, guard_column)
+	else:
+		key_to_id = _upsert_rows_by_lookup(
+			session, model, rows, key_columns, update_columns, keep_if_unset_columns, guard_column)
+
+	# Objects loaded before the upsert still hold their old values
+	for obj in list(session.identity_map.values()):
+		if isinstance(obj, model):
+			session.expire(obj)
+
+	return key_to_id
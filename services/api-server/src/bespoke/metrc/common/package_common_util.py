@@ -4,10 +4,36 @@ from sqlalchemy.orm.session import Session
 from typing import List, Union
 
 from bespoke.db import models, db_constants
-from bespoke.metrc.common.metrc_common_util import chunker
+from bespoke.metrc.common import metrc_upsert_util
+from bespoke.metrc.common.metrc_common_util import get_rows_by_ids
 
 UNKNOWN_LAB_STATUS = 'unknown'
 
+# The columns update_packages writes when a package is written again
+PACKAGE_UPDATE_COLUMNS = [
+	'type',
+	'company_id',
+	'license_number',
+	'package_label',
+	'package_type',
+	'product_name',
+	'product_category_name',
+	'package_payload',
+	'last_modified_at',
+	'packaged_date',
+	'quantity',
+	'unit_of_measure',
+]
+
+# The columns maybe_merge_into_prev_package only overrides when they are defined
+PACKAGE_KEEP_IF_UNSET_COLUMNS = [
+	'type',
+	'company_id',
+	'license_number',
+	'packaged_date',
+	'quantity',
+]
+
 class TransferPackageObj(object):
 
 	def __init__(self, company_id: str, transfer_type: str, transfer_package: models.MetrcTransferPackage) -> None:
@@ -88,7 +114,7 @@ def maybe_merge_into_prev_package(
 		# Only override when the newer one is defined
 		prev.packaged_date = cur.packaged_date
 
-	if cur.quantity:
+	if cur.quantity is not None:
 		prev.quantity = cur.quantity
 
 	if cur.company_id:
@@ -106,51 +132,40 @@ def get_prev_metrc_packages(
 	session: Session,
 ) -> List[models.MetrcPackage]:
 	# Note: metrc_packages are unique on (us_state, package_id).
-	prev_packages = []
-	for package_id in package_ids:
-		prev_package = session.query(models.MetrcPackage).filter(
-			models.MetrcPackage.us_state == us_state
-		).filter(
-			models.MetrcPackage.package_id == package_id
-		).first()
-		if prev_package:
-			prev_packages.append(prev_package)
-
-	return prev_packages
+	return get_rows_by_ids(
+		session,
+		models.MetrcPackage,
+		models.MetrcPackage.package_id,
+		package_ids,
+		filters=[models.MetrcPackage.us_state == us_state],
+	)
 
 def update_packages(
 	packages: List[models.MetrcPackage],
 	session: Session,
 ) -> None:
-	package_ids = [package.package_id for package in packages] 
-
-	us_state = packages[0].us_state
-	prev_metrc_packages = get_prev_metrc_packages(us_state, package_ids, session)
-
-	package_id_to_prev_package = {}
-	for prev_metrc_package in prev_metrc_packages:
-		# Package key is package_id - the same package
-		# may show up across different transfers.
-		prev_metrc_package_key = prev_metrc_package.package_id
-		package_id_to_prev_package[prev_metrc_package_key] = prev_metrc_package
-
-	# Write the packages
+	# The same merge as maybe_merge_into_prev_package, in bulk: packages
+	# are unique on (us_state, package_id), and the same package may show
+	# up more than once in the same day.
+	rows = []
 	for metrc_package in packages:
-		metrc_package_key = metrc_package.package_id
-
-		if metrc_package_key in package_id_to_prev_package:
-			# update
-			prev_metrc_package = package_id_to_prev_package[metrc_package_key]
-			maybe_merge_into_prev_package(
-				prev=prev_metrc_package, 
-				cur=metrc_package
-			)
-		else:
-			# add
-			session.add(metrc_package)
-			# In some rare cases, a new package may show up twice in the same day.
-			# The following line prevents an attempt to insert a duplicate.
-			package_id_to_prev_package[metrc_package_key] = metrc_package
+		row = metrc_upsert_util.get_row(metrc_package, ['us_state', 'package_id'] + PACKAGE_UPDATE_COLUMNS)
+		for column in PACKAGE_KEEP_IF_UNSET_COLUMNS:
+			# Only override these when the newer package defines them. The
+			# upsert keeps the stored value in place of a None, and a blank
+			# string is not defined either, but a quantity of 0 is.
+			if row[column] == '':
+				row[column] = None
+		rows.append(row)
+
+	metrc_upsert_util.upsert_rows(
+		session,
+		models.MetrcPackage,
+		rows,
+		key_columns=['us_state', 'package_id'],
+		update_columns=PACKAGE_UPDATE_COLUMNS,
+		keep_if_unset_columns=PACKAGE_KEEP_IF_UNSET_COLUMNS,
+	)
 
 def update_packages_from_sales_transactions(
 	sales_transactions: List[models.MetrcSalesTransaction],
@@ -159,14 +174,9 @@ def update_packages_from_sales_transactions(
 	us_state = sales_transactions[0].us_state
 	package_ids = [tx.package_id for tx in sales_transactions] 
 
-	BATCH_SIZE = 50
-	prev_metrc_packages = []
-
 	# metrc_packages are unique on package_id, when they 
 	# are not associated with a delivery.
-	for package_ids_chunk in chunker(package_ids, BATCH_SIZE):
-		prev_metrc_packages_chunk = get_prev_metrc_packages(us_state, package_ids_chunk, session)
-		prev_metrc_packages += prev_metrc_packages_chunk
+	prev_metrc_packages = get_prev_metrc_packages(us_state, package_ids, session)
 
 	package_id_to_prev_package = {}
 	for prev_metrc_package in prev_metrc_packages:
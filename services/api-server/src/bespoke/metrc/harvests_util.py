@@ -8,7 +8,7 @@ from typing import Any, Callable, List, Dict, cast
 from bespoke import errors
 from bespoke.db import models
 from bespoke.db.models import session_scope
-from bespoke.metrc.common import metrc_common_util
+from bespoke.metrc.common import metrc_common_util, metrc_metrics_util
 from bespoke.metrc.common.metrc_common_util import chunker
 
 class HarvestObj(object):
@@ -17,16 +17,12 @@ class HarvestObj(object):
 		self.metrc_harvest = harvest
 
 def _get_prev_harvests(harvest_ids: List[str], session: Session) -> List[models.MetrcHarvest]:
-	prev_harvests = []
-
-	for harvest_id in harvest_ids:
-		prev_harvest = session.query(models.MetrcHarvest).filter(
-			models.MetrcHarvest.harvest_id == harvest_id
-		).first()
-		if prev_harvest:
-			prev_harvests.append(prev_harvest)
-
-	return prev_harvests
+	return metrc_common_util.get_rows_by_ids(
+		session,
+		models.MetrcHarvest,
+		models.MetrcHarvest.harvest_id,
+		harvest_ids,
+	)
 
 class Harvests(object):
 
@@ -34,6 +30,7 @@ class Harvests(object):
 		self._harvests = harvests
 		self._api_type = api_type
 
+	@metrc_metrics_util.time_filter_new_only('harvests')
 	def filter_new_only(self, ctx: metrc_common_util.DownloadContext, session: Session) -> 'Harvests':
 		"""
 			Only keep harvests which are newly updated, e.g.,
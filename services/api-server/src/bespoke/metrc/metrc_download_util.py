@@ -1,19 +1,24 @@
 import datetime
 import logging
+import queue
+import threading
 import time
 import traceback
-from typing import Dict, List, Optional, Tuple, cast
+from typing import Any, Callable, Dict, Generator, List, Optional, Tuple, cast
 
 from bespoke import errors
 from bespoke.async_jobs import async_jobs_util
+from bespoke.async_jobs.async_job_checkpoint_util import JobCheckpointer
 from bespoke.config.config_util import MetrcWorkerConfig
 from bespoke.date import date_util
-from bespoke.db import queries
+from bespoke.db import models, queries
+from bespoke.db.models import session_scope
 from bespoke.metrc import (
 	transfers_util, sales_util, 
 	packages_util, plants_util, plant_batches_util, harvests_util
 )
 from bespoke.metrc.common import metrc_common_util, metrc_download_summary_util
+from bespoke.metrc.common.metrc_metrics_util import Phase
 from bespoke.metrc.common.metrc_error_util import (
 	BESPOKE_INTERNAL_ERROR_STATUS_CODE
 )
@@ -35,97 +40,189 @@ DownloadDataForMetrcApiKeyInDateRangeRespDict = TypedDict('DownloadDataForMetrcA
 	'nonblocking_download_errors': List[errors.Error],
 })
 
-def _download_data_for_ctx(
+def _catch_exception(ctx: metrc_common_util.DownloadContext, e: Exception, path: str) -> None:
+	ctx.error_catcher.add_retry_error(
+		path=path,
+		time_range=[ctx.get_cur_date_str()],
+		err_details=MetrcErrorDetailsDict(
+			reason='Unexpected exception downloading or writing {}. Err: {}'.format(path, e),
+			status_code=BESPOKE_INTERNAL_ERROR_STATUS_CODE,
+			traceback='{}'.format(traceback.format_exc())
+		)
+	)
+	logging.error('EXCEPTION downloading {} for company {} on {}'.format(path, ctx.company_details['name'], ctx.cur_date))
+	logging.error(traceback.format_exc())
+
+class DayDownload(object):
+	"""
+		The data of a license for a day, downloaded from Metrc and turned into
+		models, which is then written by _write_day. An API that is not enabled
+		or failed to download is left as None, and is not written.
+	"""
+
+	def __init__(
+		self,
+		ctx: metrc_common_util.DownloadContext,
+		license_permissions_dict: metrc_common_util.LicensePermissionsDict,
+	) -> None:
+		self.ctx = ctx
+		self.license_permissions_dict = license_permissions_dict
+		self.package_models: List[packages_util.PackageObject] = None
+		self.harvest_models: List[harvests_util.HarvestObj] = None
+		self.plant_batches_models: List[plant_batches_util.PlantBatchObj] = None
+		self.plants_models: List[plants_util.PlantObj] = None
+		self.sales_receipt_models: List[sales_util.SalesReceiptObj] = None
+		self.downloaded_transfers: transfers_util.DownloadedTransfers = None
+
+def _download_day(
 	session: Session,
 	ctx: metrc_common_util.DownloadContext,
 	license_permissions_dict: metrc_common_util.LicensePermissionsDict,
-) -> Tuple[Dict, errors.Error]:
-	cur_date = ctx.cur_date
-	license = ctx.license
-	license_number = license['license_number']
-	company_name = ctx.company_details['name']
-
-	logging.info(f'Downloading Metrc data for license {license_number} for last modified date {cur_date}')
-	cur_date_str = ctx.get_cur_date_str()
-
-	def _catch_exception(e: Exception, path: str) -> None:
-		ctx.error_catcher.add_retry_error(
-			path=path,
-			time_range=[cur_date_str],
-			err_details=MetrcErrorDetailsDict(
-				reason='Unexpected exception downloading or writing {}. Err: {}'.format(path, e),
-				status_code=BESPOKE_INTERNAL_ERROR_STATUS_CODE,
-				traceback='{}'.format(traceback.format_exc())
-			)
-		)
-		logging.error('EXCEPTION downloading {} for company {} on {}'.format(path, company_name, cur_date))
-		logging.error(traceback.format_exc())
+) -> DayDownload:
+	"""
+		Only reads from the database (e.g., to skip what was already written),
+		so it can run in another thread, with its own session, while a previous
+		day is being written.
+	"""
+	day_download = DayDownload(ctx, license_permissions_dict)
+	apis_to_use = ctx.get_adjusted_apis_to_use()
+	metrics = ctx.metrics
+
+	if license_permissions_dict['is_packages_enabled'] and apis_to_use.get('packages', False):
+		with metrics.time_phase('packages', Phase.DOWNLOAD):
+			try:
+				day_download.package_models = packages_util.download_packages_with_session(session=session, ctx=ctx)
+				metrics.add_phase('packages', Phase.DOWNLOAD, num_rows=len(day_download.package_models))
+			except Exception as e:
+				_catch_exception(ctx, e, '/packages')
+
+	if license_permissions_dict['is_harvests_enabled'] and apis_to_use.get('harvests', False):
+		with metrics.time_phase('harvests', Phase.DOWNLOAD):
+			try:
+				day_download.harvest_models = harvests_util.download_harvests_with_session(session=session, ctx=ctx)
+				metrics.add_phase('harvests', Phase.DOWNLOAD, num_rows=len(day_download.harvest_models))
+			except Exception as e:
+				_catch_exception(ctx, e, '/harvests')
+
+	if license_permissions_dict['is_plant_batches_enabled'] and apis_to_use.get('plant_batches', False):
+		with metrics.time_phase('plant_batches', Phase.DOWNLOAD):
+			try:
+				day_download.plant_batches_models = plant_batches_util.download_plant_batches_with_session(session=session, ctx=ctx)
+				metrics.add_phase('plant_batches', Phase.DOWNLOAD, num_rows=len(day_download.plant_batches_models))
+			except Exception as e:
+				_catch_exception(ctx, e, '/plantbatches')
+
+	if license_permissions_dict['is_plants_enabled'] and apis_to_use.get('plants', False):
+		with metrics.time_phase('plants', Phase.DOWNLOAD):
+			try:
+				day_download.plants_models = plants_util.download_plants_with_session(session=session, ctx=ctx)
+				metrics.add_phase('plants', Phase.DOWNLOAD, num_rows=len(day_download.plants_models))
+			except Exception as e:
+				_catch_exception(ctx, e, '/plants')
+
+	if license_permissions_dict['is_sales_receipts_enabled'] and apis_to_use.get('sales_receipts', False):
+		with metrics.time_phase('sales_receipts', Phase.DOWNLOAD):
+			try:
+				sales_receipts_tuple = sales_util.download_sales_info_with_session(
+					session=session,
+					ctx=ctx,
+				)
+				day_download.sales_receipt_models = sales_util.download_sales_transactions(
+					ctx=ctx,
+					sales_receipts_tuple=sales_receipts_tuple,
+				)
+				metrics.add_phase('sales_receipts', Phase.DOWNLOAD, num_rows=len(day_download.sales_receipt_models))
+			except Exception as e:
+				_catch_exception(ctx, e, '/sales')
 
-	if license_permissions_dict['is_packages_enabled'] and ctx.get_adjusted_apis_to_use().get('packages', False):
-		try:
-			package_models = packages_util.download_packages_with_session(session=session, ctx=ctx)
-			packages_util.write_packages_with_session(session=session, package_models=package_models)
-		except Exception as e:
-			_catch_exception(e, '/packages')
+	if license_permissions_dict['is_transfers_enabled'] and apis_to_use.get('transfers', False):
+		# Download transfers data for the particular day and key
+		err = None
+		with metrics.time_phase('transfers', Phase.DOWNLOAD):
+			try:
+				day_download.downloaded_transfers, err = transfers_util.download_transfers_with_session(
+					session=session,
+					ctx=ctx,
+				)
+				if day_download.downloaded_transfers:
+					metrics.add_phase(
+						'transfers', Phase.DOWNLOAD, num_rows=len(day_download.downloaded_transfers.metrc_transfer_objs))
+			except Exception as e:
+				_catch_exception(ctx, e, '/transfers')
 
-	if license_permissions_dict['is_harvests_enabled'] and ctx.get_adjusted_apis_to_use().get('harvests', False):
-		try:
-			harvest_models = harvests_util.download_harvests_with_session(session=session, ctx=ctx)
-			harvests_util.write_harvests_with_session(session=session, harvest_models=harvest_models)
-		except Exception as e:
-			_catch_exception(e, '/harvests')
+		if err:
+			logging.error(f'Error thrown for license {ctx.license["license_number"]} for last modified date {ctx.cur_date}!')
+			logging.error(f'Error: {err}')
 
-	if license_permissions_dict['is_plant_batches_enabled'] and ctx.get_adjusted_apis_to_use().get('plant_batches', False):
-		try:
-			plant_batches_models = plant_batches_util.download_plant_batches_with_session(session=session, ctx=ctx)
-			plant_batches_util.write_plant_batches_with_session(
-                session=session,
-                plant_batches_models=plant_batches_models,
-            )
-		except Exception as e:
-			_catch_exception(e, '/plantbatches')
+	return day_download
+
+def _write_day(session: Session, day_download: DayDownload) -> Dict:
+	ctx = day_download.ctx
+	metrics = ctx.metrics
+
+	if day_download.package_models is not None:
+		with metrics.time_phase('packages', Phase.WRITE):
+			try:
+				packages_util.write_packages_with_session(session=session, package_models=day_download.package_models)
+				metrics.add_phase('packages', Phase.WRITE, num_rows=len(day_download.package_models))
+			except Exception as e:
+				_catch_exception(ctx, e, '/packages')
+
+	if day_download.harvest_models is not None:
+		with metrics.time_phase('harvests', Phase.WRITE):
+			try:
+				harvests_util.write_harvests_with_session(session=session, harvest_models=day_download.harvest_models)
+				metrics.add_phase('harvests', Phase.WRITE, num_rows=len(day_download.harvest_models))
+			except Exception as e:
+				_catch_exception(ctx, e, '/harvests')
+
+	if day_download.plant_batches_models is not None:
+		with metrics.time_phase('plant_batches', Phase.WRITE):
+			try:
+				plant_batches_util.write_plant_batches_with_session(
+					session=session,
+					plant_batches_models=day_download.plant_batches_models,
+				)
+				metrics.add_phase('plant_batches', Phase.WRITE, num_rows=len(day_download.plant_batches_models))
+			except Exception as e:
+				_catch_exception(ctx, e, '/plantbatches')
 
 	# NOTE: plants have references to plant batches and harvests, so this
-	# must come after fetching plant_batches and harvests
-	if license_permissions_dict['is_plants_enabled'] and ctx.get_adjusted_apis_to_use().get('plants', False):
-		try:
-			plants_models = plants_util.download_plants_with_session(session=session, ctx=ctx)
-			plants_util.write_plants_with_session(session=session, plants_models=plants_models)
-		except Exception as e:
-			_catch_exception(e, '/plants')
+	# must come after writing plant_batches and harvests
+	if day_download.plants_models is not None:
+		with metrics.time_phase('plants', Phase.WRITE):
+			try:
+				plants_util.write_plants_with_session(session=session, plants_models=day_download.plants_models)
+				metrics.add_phase('plants', Phase.WRITE, num_rows=len(day_download.plants_models))
+			except Exception as e:
+				_catch_exception(ctx, e, '/plants')
 
 	# NOTE: Sales data has references to packages, so this method
-	# should run after download_packages
-	if license_permissions_dict['is_sales_receipts_enabled'] and ctx.get_adjusted_apis_to_use().get('sales_receipts', False):
-		try:
-			sales_receipts_tuple = sales_util.download_sales_info_with_session(
-                session=session,
-                ctx=ctx,
-            )
-			sales_util.write_sales_info_with_session(
-                session=session,
-                ctx=ctx,
-                sales_receipts_tuple=sales_receipts_tuple,
-            )
-		except Exception as e:
-			_catch_exception(e, '/sales')
-
-	if license_permissions_dict['is_transfers_enabled'] and ctx.get_adjusted_apis_to_use().get('transfers', False):
-		# NOTE: transfer must come after download_packages, because transfers
-		# may update the state of packages
-		# Download transfers data for the particular day and key
-		err = None
-		try:
-			success, err = transfers_util.populate_transfers_table_with_session(
-				session=session,
-				ctx=ctx,
-			)
-		except Exception as e:
-			_catch_exception(e, '/transfers')
-
-		if err:
-			logging.error(f'Error thrown for license {license_number} for last modified date {cur_date}!')
-			logging.error(f'Error: {err}')
+	# should run after writing packages
+	if day_download.sales_receipt_models is not None:
+		with metrics.time_phase('sales_receipts', Phase.WRITE):
+			try:
+				sales_util.write_sales_receipt_models_with_session(
+					session=session,
+					sales_receipt_models=day_download.sales_receipt_models,
+				)
+				metrics.add_phase('sales_receipts', Phase.WRITE, num_rows=len(day_download.sales_receipt_models))
+			except Exception as e:
+				_catch_exception(ctx, e, '/sales')
+
+	# NOTE: transfer must come after writing packages, because transfers
+	# may update the state of packages
+	if day_download.downloaded_transfers is not None:
+		with metrics.time_phase('transfers', Phase.WRITE):
+			try:
+				transfers_util.write_transfers_with_session(
+					session=session,
+					downloaded_transfers=day_download.downloaded_transfers,
+				)
+				metrics.add_phase(
+					'transfers', Phase.WRITE, num_rows=len(day_download.downloaded_transfers.metrc_transfer_objs))
+			except Exception as e:
+				_catch_exception(ctx, e, '/transfers')
 
 	return {
 		'transfers_api': ctx.request_status['transfers_api'],
@@ -138,16 +235,45 @@ def _download_data_for_ctx(
 		'lab_results_api': ctx.request_status['lab_results_api'],
 		'sales_receipts_api': ctx.request_status['receipts_api'],
 		'sales_transactions_api': ctx.request_status['sales_transactions_api']
-	}, None
+	}
 
-def _download_data_for_metrc_api_key_license_for_date(
+def _download_data_for_ctx(
+	session: Session,
+	ctx: metrc_common_util.DownloadContext,
+	license_permissions_dict: metrc_common_util.LicensePermissionsDict,
+) -> Tuple[Dict, errors.Error]:
+	logging.info(f'Downloading Metrc data for license {ctx.license["license_number"]} for last modified date {ctx.cur_date}')
+	day_download = _download_day(session, ctx, license_permissions_dict)
+	return _write_day(session, day_download), None
+
+class DateDownload(object):
+	"""
+		The result of _download_for_date: either resp, when there is nothing to
+		write for the date, or the day_download to write.
+	"""
+
+	def __init__(
+		self,
+		date: datetime.date,
+		resp: DownloadDataForMetrcApiKeyForDateRespDict = None,
+		err: errors.Error = None,
+		day_download: DayDownload = None,
+		download_seconds: float = 0.0,
+	) -> None:
+		self.date = date
+		self.resp = resp
+		self.err = err
+		self.day_download = day_download
+		self.download_seconds = download_seconds
+
+def _download_for_date(
 	session: Session,
 	worker_cfg: MetrcWorkerConfig,
 	apis_to_use: Optional[metrc_common_util.ApisToUseDict],
 	metrc_api_key_data_fetcher: metrc_common_util.MetrcApiKeyDataFetcher,
 	date: datetime.date,
 	is_retry_failures: bool,
-) -> Tuple[DownloadDataForMetrcApiKeyForDateRespDict, errors.Error]:
+) -> DateDownload:
 	all_nonblocking_download_errors: List[errors.Error] = []
 
 	license_number = metrc_api_key_data_fetcher.get_target_license_number()
@@ -193,12 +319,15 @@ def _download_data_for_metrc_api_key_license_for_date(
 
 	today = date_util.now_as_date()
 	if date >= today:
-		return DownloadDataForMetrcApiKeyForDateRespDict(
-			success=False,
-			is_previously_successful=False, # It is not possible for a previous download to be successful.
-			nonblocking_download_errors=all_nonblocking_download_errors
-		), errors.Error('Date is today or in the future, which is invalid')
-
+		return DateDownload(
+			date=date,
+			resp=DownloadDataForMetrcApiKeyForDateRespDict(
+				success=False,
+				is_previously_successful=False, # It is not possible for a previous download to be successful.
+				nonblocking_download_errors=all_nonblocking_download_errors
+			),
+			err=errors.Error('Date is today or in the future, which is invalid'),
+		)
 
 	is_previously_successful = metrc_download_summary_util.is_metrc_download_summary_previously_successful(
 		session=session,
@@ -209,47 +338,170 @@ def _download_data_for_metrc_api_key_license_for_date(
 	)
 	if is_previously_successful:
 		logging.info(f'Download data for license number {license_number} and date {date} was previously successful')
-		return DownloadDataForMetrcApiKeyForDateRespDict(
-			success=True,
-			is_previously_successful=True,
-			nonblocking_download_errors=all_nonblocking_download_errors,
-		), None
+		return DateDownload(
+			date=date,
+			resp=DownloadDataForMetrcApiKeyForDateRespDict(
+				success=True,
+				is_previously_successful=True,
+				nonblocking_download_errors=all_nonblocking_download_errors,
+			),
+		)
 
 	logging.info(f'Downloading data for license number {license_number} and date {date}...')
 
-	api_status_dict = None
-	err = None
-
+	day_download = DayDownload(ctx, license_permissions_dict)
+	before = time.time()
 	try:
-		before = time.time()
-		api_status_dict, err = _download_data_for_ctx(
+		day_download = _download_day(
 			session=session,
 			ctx=ctx,
 			license_permissions_dict=license_permissions_dict,
 		)
+	except Exception as e:
+		logging.error('SEVERE error, download data for metrc failed: {}'.format(e))
+		logging.error(traceback.format_exc())
+
+	return DateDownload(
+		date=date,
+		day_download=day_download,
+		download_seconds=time.time() - before,
+	)
+
+def _write_for_date(
+	session: Session,
+	metrc_api_key_data_fetcher: metrc_common_util.MetrcApiKeyDataFetcher,
+	date_download: DateDownload,
+) -> Tuple[DownloadDataForMetrcApiKeyForDateRespDict, errors.Error]:
+	if date_download.resp:
+		return date_download.resp, date_download.err
+
+	day_download = date_download.day_download
+	ctx = day_download.ctx
+	date = date_download.date
+
+	try:
+		before = time.time()
+		_write_day(session, day_download)
 		after = time.time()
-		logging.info('Took {:.2f} seconds to download data for day {} license {}'.format(
-			after - before, date, ctx.license['license_number']))
-	except errors.Error as e1:
-		err = e1
+		logging.info('Took {:.2f} seconds to download and {:.2f} seconds to write data for day {} license {}'.format(
+			date_download.download_seconds, after - before, date, ctx.license['license_number']))
 	except Exception as e:
 		logging.error('SEVERE error, download data for metrc failed: {}'.format(e))
 		logging.error(traceback.format_exc())
-		err = errors.Error('{}'.format(e))
 
 	metrc_download_summary_util.write_metrc_download_summary(
 		session=session,
-		license_number=license_number,
+		license_number=ctx.license['license_number'],
 		cur_date=date,
-		license_permissions_dict=license_permissions_dict,
+		license_permissions_dict=day_download.license_permissions_dict,
 		retry_errors=ctx.get_retry_errors(),
 		company_id=ctx.company_details['company_id'],
 		metrc_api_key_id=metrc_api_key_data_fetcher.get_metrc_api_key_id(),
+		metrics=ctx.metrics.get_summary(),
 	)
 
 	return DownloadDataForMetrcApiKeyForDateRespDict(
 		success=True,
 		is_previously_successful=False,
+		nonblocking_download_errors=[],
+	), None
+
+def _download_data_for_metrc_api_key_license_for_date(
+	session: Session,
+	worker_cfg: MetrcWorkerConfig,
+	apis_to_use: Optional[metrc_common_util.ApisToUseDict],
+	metrc_api_key_data_fetcher: metrc_common_util.MetrcApiKeyDataFetcher,
+	date: datetime.date,
+	is_retry_failures: bool,
+) -> Tuple[DownloadDataForMetrcApiKeyForDateRespDict, errors.Error]:
+	date_download = _download_for_date(
+		session=session,
+		worker_cfg=worker_cfg,
+		apis_to_use=apis_to_use,
+		metrc_api_key_data_fetcher=metrc_api_key_data_fetcher,
+		date=date,
+		is_retry_failures=is_retry_failures,
+	)
+	return _write_for_date(session, metrc_api_key_data_fetcher, date_download)
+
+def download_dates_in_background(
+	session_maker: Callable[..., Session],
+	dates: List[datetime.date],
+	download_date: Callable[[Session, datetime.date], Any],
+	max_prefetched_days: int,
+) -> Generator[Any, None, None]:
+	"""
+		Yields download_date(session, date) for each of the dates, in order.
+		The dates are downloaded in a background thread with its own session,
+		while the caller writes the previous ones, with at most
+		max_prefetched_days downloaded and waiting to be written. Closing the
+		iterator (e.g., breaking out of the loop over it) stops the downloads.
+	"""
+	date_downloads: queue.Queue = queue.Queue(maxsize=max(max_prefetched_days, 1))
+	is_stopped = threading.Event()
+
+	def _put(item: Any) -> None:
+		while not is_stopped.is_set():
+			try:
+				date_downloads.put(item, timeout=0.1)
+				return
+			except queue.Full:
+				continue
+
+	def _download_dates() -> None:
+		try:
+			with session_scope(session_maker) as session:
+				for date in dates:
+					if is_stopped.is_set():
+						return
+					_put(download_date(session, date))
+		except Exception as e:
+			logging.error(traceback.format_exc())
+			_put(e)
+
+	thread = threading.Thread(target=_download_dates, daemon=True)
+	thread.start()
+	try:
+		for _ in dates:
+			item = date_downloads.get()
+			if isinstance(item, Exception):
+				raise item
+			yield item
+	finally:
+		is_stopped.set()
+		thread.join()
+
+def _write_dates(
+	session: Session,
+	config: Config,
+	metrc_api_key_data_fetcher: metrc_common_util.MetrcApiKeyDataFetcher,
+	date_downloads: Generator[DateDownload, None, None],
+	end_date: datetime.date,
+	checkpointer: Optional[JobCheckpointer],
+) -> Tuple[DownloadDataForMetrcApiKeyInDateRangeRespDict, errors.Error]:
+	all_nonblocking_download_errors: List[errors.Error] = []
+
+	for date_download in date_downloads:
+		current_date_response, err = _write_for_date(session, metrc_api_key_data_fetcher, date_download)
+
+		if not current_date_response['success']:
+			return DownloadDataForMetrcApiKeyInDateRangeRespDict(
+				success=False,
+				nonblocking_download_errors=all_nonblocking_download_errors,
+			), errors.Error('{}'.format(err))
+		else:
+			nonblocking_download_errors = current_date_response['nonblocking_download_errors']
+
+		if checkpointer:
+			# The day is committed, so the async job resumes from the next day,
+			# see orchestrate_download_data_for_metrc_api_key_license
+			checkpointer.save({
+				'start_date': date_util.date_to_str(date_download.date + datetime.timedelta(days=1)),
+				'end_date': date_util.date_to_str(end_date),
+			})
+
+	return DownloadDataForMetrcApiKeyInDateRangeRespDict(
+		success=True,
 		nonblocking_download_errors=all_nonblocking_download_errors,
 	), None
 
@@ -262,7 +514,7 @@ def _download_data_for_metrc_api_key_license_for_date(
 #      or equal to permissions vs current permissions, skip download
 #   b. Otherwise, run download for license and date
 #
-# is_async_job: whether invocation is within an async job
+# checkpointer: saves the progress of the async job this runs in, if any
 # is_retry_failures: whether or not download retries Metrc download summaries marked as failures
 @errors.return_error_tuple
 def download_data_for_metrc_api_key_license_in_date_range(
@@ -273,7 +525,7 @@ def download_data_for_metrc_api_key_license_in_date_range(
 	license_number: str,
 	start_date: datetime.date,
 	end_date: datetime.date,
-	is_async_job: bool = False,
+	checkpointer: Optional[JobCheckpointer] = None,
 	is_retry_failures: bool = False,
 ) -> Tuple[DownloadDataForMetrcApiKeyInDateRangeRespDict, errors.Error]:
 	metrc_api_key, err = queries.get_metrc_api_key_by_id(
@@ -314,55 +566,46 @@ def download_data_for_metrc_api_key_license_in_date_range(
 			nonblocking_download_errors=[errors.Error('Metrc API key is not valid')],
 		), None
 
-	all_nonblocking_download_errors: List[errors.Error] = []
-	not_previously_successful_count = 0
-
-	cur_date = start_date
-	while cur_date <= end_date:
-		current_date_response, err = _download_data_for_metrc_api_key_license_for_date(
-			session=session,
+	def _download_date(download_session: Session, date: datetime.date) -> DateDownload:
+		return _download_for_date(
+			session=download_session,
 			worker_cfg=worker_cfg,
 			apis_to_use=apis_to_use,
 			metrc_api_key_data_fetcher=metrc_api_key_data_fetcher,
-			date=cur_date,
+			date=date,
 			is_retry_failures=is_retry_failures,
 		)
 
-		if not current_date_response['success']:
-			return DownloadDataForMetrcApiKeyInDateRangeRespDict(
-				success=False,
-				nonblocking_download_errors=all_nonblocking_download_errors,
-			), errors.Error('{}'.format(err))
-		else:
-			is_previously_successful = current_date_response['is_previously_successful']
-			if not is_previously_successful:
-				not_previously_successful_count += 1
-			nonblocking_download_errors = current_date_response['nonblocking_download_errors']
-
-		cur_date = cur_date + datetime.timedelta(days=1)
-
-		if is_async_job:
-			# We limit the number of days actual data is downloaded to five days
-			# and schedule another async job to pick up where this job left off.
-			# This is because async jobs have a duration limit.
-			if not_previously_successful_count >= 5:
-				success, err = async_jobs_util.generate_download_data_for_metrc_api_key_license_job_by_license_number(
-					session=session,
-					cfg=config,
-					metrc_api_key_id=metrc_api_key_dict['id'],
-					license_number=license_number,
-				)
-				if err:
-					return DownloadDataForMetrcApiKeyInDateRangeRespDict(
-						success=False,
-						nonblocking_download_errors=all_nonblocking_download_errors,
-					), err
-				break
+	dates = [start_date + datetime.timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+	date_downloads: Generator[DateDownload, None, None]
+	if worker_cfg.num_days_to_prefetch > 0:
+		# Download the next days while the current day is written. Each day is
+		# still written in the order above (packages before sales and transfers,
+		# etc), and only after the previous day is written.
+		#
+		# NOTE: a day downloaded before the previous day is written may not
+		# skip what the previous day writes, which is then written again
+		# (writes are upserts, so this is safe).
+		date_downloads = download_dates_in_background(
+			session_maker=models.new_sessionmaker(session.get_bind()),
+			dates=dates,
+			download_date=_download_date,
+			max_prefetched_days=worker_cfg.num_days_to_prefetch,
+		)
+	else:
+		date_downloads = (_download_date(session, date) for date in dates)
 
-	return DownloadDataForMetrcApiKeyInDateRangeRespDict(
-		success=True,
-		nonblocking_download_errors=all_nonblocking_download_errors,
-	), None
+	try:
+		return _write_dates(
+			session=session,
+			config=config,
+			metrc_api_key_data_fetcher=metrc_api_key_data_fetcher,
+			date_downloads=date_downloads,
+			end_date=end_date,
+			checkpointer=checkpointer,
+		)
+	finally:
+		date_downloads.close()
 
 @errors.return_error_tuple
 def refresh_metrc_api_key_permissions(
@@ -1,5 +1,4 @@
 import logging
-import json
 
 from dateutil import parser
 from sqlalchemy.orm.session import Session
@@ -9,8 +8,8 @@ from bespoke import errors
 from bespoke.db import models
 from bespoke.db.db_constants import PackageType
 from bespoke.db.models import session_scope
-from bespoke.metrc.common import metrc_common_util, package_common_util
-from bespoke.metrc.common.metrc_common_util import chunker
+from bespoke.metrc.common import metrc_common_util, metrc_metrics_util, package_common_util
+from bespoke.metrc.common.metrc_common_util import chunker, SplitTimeBy
 
 class PackageObject(object):
 	
@@ -42,6 +41,7 @@ class Packages(object):
 
 		return payload
 
+	@metrc_metrics_util.time_filter_new_only('packages')
 	def filter_new_only(self, ctx: metrc_common_util.DownloadContext, session: Session) -> 'Packages':
 		"""
 			Only keep packages which are newly updated, e.g.,
@@ -108,9 +108,8 @@ class Packages(object):
 		return package_objs
 
 def download_packages(ctx: metrc_common_util.DownloadContext, session_maker: Callable) -> List[PackageObject]:
-	# NOTE: Sometimes there are a lot of inactive packages to pull for a single day
-	# and this makes it look like the sync is stuck / hanging - could be good to
-	# change this logic to use smaller (intraday) time ranges to prevent this.
+	# Busy licenses have a lot of inactive packages to pull for a single day,
+	# which adaptive splits pull in shorter (intraday) time ranges.
 	active_packages: List[Dict] = []
 	inactive_packages: List[Dict] = []
 	onhold_packages: List[Dict] = []
@@ -121,23 +120,23 @@ def download_packages(ctx: metrc_common_util.DownloadContext, session_maker: Cal
 	rest = ctx.rest
 
 	try:
-		resp = rest.get('/packages/v1/active', time_range=[cur_date_str])
-		active_packages = json.loads(resp.content)
+		resp = rest.get('/packages/v1/active', time_range=[cur_date_str], split_time_by=SplitTimeBy.ADAPTIVE)
+		active_packages = resp.results
 		request_status['packages_api'] = 200
 	except errors.Error as e:
 		logging.error(e)
 		metrc_common_util.update_if_all_are_unsuccessful(request_status, 'packages_api', e)
 
 	try:
-		resp = rest.get('/packages/v1/inactive', time_range=[cur_date_str])
-		inactive_packages = json.loads(resp.content)
+		resp = rest.get('/packages/v1/inactive', time_range=[cur_date_str], split_time_by=SplitTimeBy.ADAPTIVE)
+		inactive_packages = resp.results
 		request_status['packages_api'] = 200
 	except errors.Error as e:
 		metrc_common_util.update_if_all_are_unsuccessful(request_status, 'packages_api', e)
 
 	try:
-		resp = rest.get('/packages/v1/onhold', time_range=[cur_date_str])
-		onhold_packages = json.loads(resp.content)
+		resp = rest.get('/packages/v1/onhold', time_range=[cur_date_str], split_time_by=SplitTimeBy.ADAPTIVE)
+		onhold_packages = resp.results
 		request_status['packages_api'] = 200
 	except errors.Error as e:
 		metrc_common_util.update_if_all_are_unsuccessful(request_status, 'packages_api', e)
@@ -195,9 +194,8 @@ def download_packages_with_session(
 	session: Session,
 	ctx: metrc_common_util.DownloadContext,
 ) -> List[PackageObject]:
-	# NOTE: Sometimes there are a lot of inactive packages to pull for a single day
-	# and this makes it look like the sync is stuck / hanging - could be good to
-	# change this logic to use smaller (intraday) time ranges to prevent this.
+	# Busy licenses have a lot of inactive packages to pull for a single day,
+	# which adaptive splits pull in shorter (intraday) time ranges.
 	active_packages: List[Dict] = []
 	inactive_packages: List[Dict] = []
 	onhold_packages: List[Dict] = []
@@ -208,23 +206,23 @@ def download_packages_with_session(
 	rest = ctx.rest
 
 	try:
-		resp = rest.get('/packages/v1/active', time_range=[cur_date_str])
-		active_packages = json.loads(resp.content)
+		resp = rest.get('/packages/v1/active', time_range=[cur_date_str], split_time_by=SplitTimeBy.ADAPTIVE)
+		active_packages = resp.results
 		request_status['packages_api'] = 200
 	except errors.Error as e:
 		logging.error(e)
 		metrc_common_util.update_if_all_are_unsuccessful(request_status, 'packages_api', e)
 
 	try:
-		resp = rest.get('/packages/v1/inactive', time_range=[cur_date_str])
-		inactive_packages = json.loads(resp.content)
+		resp = rest.get('/packages/v1/inactive', time_range=[cur_date_str], split_time_by=SplitTimeBy.ADAPTIVE)
+		inactive_packages = resp.results
 		request_status['packages_api'] = 200
 	except errors.Error as e:
 		metrc_common_util.update_if_all_are_unsuccessful(request_status, 'packages_api', e)
 
 	try:
-		resp = rest.get('/packages/v1/onhold', time_range=[cur_date_str])
-		onhold_packages = json.loads(resp.content)
+		resp = rest.get('/packages/v1/onhold', time_range=[cur_date_str], split_time_by=SplitTimeBy.ADAPTIVE)
+		onhold_packages = resp.results
 		request_status['packages_api'] = 200
 	except errors.Error as e:
 		metrc_common_util.update_if_all_are_unsuccessful(request_status, 'packages_api', e)
@@ -8,7 +8,7 @@ from typing import Any, Callable, List, Dict, cast
 from bespoke import errors
 from bespoke.db import models
 from bespoke.db.models import session_scope
-from bespoke.metrc.common import metrc_common_util
+from bespoke.metrc.common import metrc_common_util, metrc_metrics_util
 from bespoke.metrc.common.metrc_common_util import chunker
 
 class PlantBatchObj(object):
@@ -17,16 +17,12 @@ class PlantBatchObj(object):
 		self.metrc_plant_batch = batch
 
 def _get_prev_plant_batches(plant_batch_ids: List[str], session: Session) -> List[models.MetrcPlantBatch]:
-	prev_plant_batches = []
-
-	for batch_id in plant_batch_ids:
-		prev_plant_batch = session.query(models.MetrcPlantBatch).filter(
-			models.MetrcPlantBatch.plant_batch_id == batch_id
-		).first()
-		if prev_plant_batch:
-			prev_plant_batches.append(prev_plant_batch)
-
-	return prev_plant_batches
+	return metrc_common_util.get_rows_by_ids(
+		session,
+		models.MetrcPlantBatch,
+		models.MetrcPlantBatch.plant_batch_id,
+		plant_batch_ids,
+	)
 
 class PlantBatches(object):
 
@@ -34,6 +30,7 @@ class PlantBatches(object):
 		self._plant_batches = plant_batches
 		self._api_type = api_type
 
+	@metrc_metrics_util.time_filter_new_only('plant_batches')
 	def filter_new_only(self, ctx: metrc_common_util.DownloadContext, session: Session) -> 'PlantBatches':
 		"""
 			Only keep plant batches which are newly updated, e.g.,
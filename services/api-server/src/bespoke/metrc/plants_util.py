@@ -8,27 +8,32 @@ from typing import Any, Callable, List, Dict, cast
 from bespoke import errors
 from bespoke.db import models
 from bespoke.db.models import session_scope
-from bespoke.metrc.common import metrc_common_util
+from bespoke.metrc.common import metrc_common_util, metrc_metrics_util, metrc_upsert_util
 from bespoke.metrc.common.metrc_common_util import chunker
 
+PLANT_UPDATE_COLUMNS = [
+	'type',
+	'license_number',
+	'company_id',
+	'label',
+	'planted_date',
+	'payload',
+	'last_modified_at',
+]
+
 class PlantObj(object):
 	
 	def __init__(self, plant: models.MetrcPlant) -> None:
 		self.metrc_plant = plant
 
 def _get_prev_plants(us_state: str, plant_ids: List[str], session: Session) -> List[models.MetrcPlant]:
-	prev_plants = []
-
-	for plant_id in plant_ids:
-		prev_plant = session.query(models.MetrcPlant).filter(
-			models.MetrcPlant.us_state == us_state
-		).filter(
-			models.MetrcPlant.plant_id == plant_id
-		).first()
-		if prev_plant:
-			prev_plants.append(prev_plant)
-
-	return prev_plants
+	return metrc_common_util.get_rows_by_ids(
+		session,
+		models.MetrcPlant,
+		models.MetrcPlant.plant_id,
+		plant_ids,
+		filters=[models.MetrcPlant.us_state == us_state],
+	)
 
 class Plants(object):
 
@@ -36,6 +41,7 @@ class Plants(object):
 		self._plants = plants
 		self._api_type = api_type
 
+	@metrc_metrics_util.time_filter_new_only('plants')
 	def filter_new_only(self, ctx: metrc_common_util.DownloadContext, session: Session) -> 'Plants':
 		"""
 			Only keep plants which are newly updated, e.g.,
@@ -182,34 +188,17 @@ def _write_plants_chunk(
 	if not plants:
 		return
 
-	key_to_plant = {}
-
-	us_state = plants[0].metrc_plant.us_state
-	plant_ids = [plant.metrc_plant.plant_id for plant in plants]
-
-	prev_plants = _get_prev_plants(us_state, plant_ids, session)
-	for prev_plant in prev_plants:
-		key_to_plant[prev_plant.plant_id] = prev_plant
-
-	for plant in plants:
-		metrc_plant = plant.metrc_plant
-		if metrc_plant.plant_id in key_to_plant:
-			# update
-			prev = key_to_plant[metrc_plant.plant_id]
-			prev.type = metrc_plant.type
-			prev.license_number = metrc_plant.license_number
-			prev.us_state = metrc_plant.us_state
-			prev.company_id = metrc_plant.company_id
-			prev.label = metrc_plant.label
-			prev.planted_date = metrc_plant.planted_date
-			prev.payload = metrc_plant.payload
-			prev.last_modified_at = metrc_plant.last_modified_at
-		else:
-			# add
-			session.add(metrc_plant)
-			# In some rare cases, a new harvest may show up twice in the same day.
-			# The following line prevents an attempt to insert a duplicate.
-			key_to_plant[metrc_plant.plant_id] = metrc_plant
+	# Plants are unique on (us_state, plant_id)
+	metrc_upsert_util.upsert_rows(
+		session,
+		models.MetrcPlant,
+		[
+			metrc_upsert_util.get_row(plant.metrc_plant, ['us_state', 'plant_id'] + PLANT_UPDATE_COLUMNS)
+			for plant in plants
+		],
+		key_columns=['us_state', 'plant_id'],
+		update_columns=PLANT_UPDATE_COLUMNS,
+	)
 
 
 def write_plants(plants_models: List[PlantObj], session_maker: Callable, BATCH_SIZE: int = 50) -> None:
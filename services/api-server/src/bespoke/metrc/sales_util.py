@@ -1,16 +1,20 @@
+import concurrent.futures
 import logging
 import json
+import traceback
 
 from dateutil import parser
 from sqlalchemy.orm.session import Session
-from sqlalchemy import func
-from typing import Any, Callable, List, Iterable, Tuple, Dict, cast
+from typing import Any, Callable, List, Iterable, Optional, Tuple, Dict, cast
 
 from bespoke import errors
 from bespoke.db import models
 from bespoke.db.models import session_scope
-from bespoke.metrc.common import metrc_common_util
+from bespoke.metrc.common import metrc_common_util, metrc_metrics_util, metrc_upsert_util
 from bespoke.metrc.common.metrc_common_util import chunker, SplitTimeBy
+from bespoke.metrc.common.metrc_error_util import (
+	BESPOKE_INTERNAL_ERROR_STATUS_CODE, MetrcErrorDetailsDict
+)
 
 
 METRC_SALES_RECEIPT_SPECIAL_PII_KEYS = [
@@ -50,18 +54,13 @@ class SalesTransactions(object):
 		return sales_transactions
 
 def _get_prev_sales_receipts(receipt_ids: List[str], us_state: str, session: Session) -> List[models.MetrcSalesReceipt]:
-	sales_receipts = []
-
-	for receipt_id in receipt_ids:
-		sales_receipt = session.query(models.MetrcSalesReceipt).filter(
-			models.MetrcSalesReceipt.us_state == us_state
-		).filter(
-			models.MetrcSalesReceipt.receipt_id == receipt_id
-		).first()
-		if sales_receipt:
-			sales_receipts.append(sales_receipt)
-
-	return sales_receipts
+	return metrc_common_util.get_rows_by_ids(
+		session,
+		models.MetrcSalesReceipt,
+		models.MetrcSalesReceipt.receipt_id,
+		receipt_ids,
+		filters=[models.MetrcSalesReceipt.us_state == us_state],
+	)
 
 class SalesReceiptObj(object):
 
@@ -103,25 +102,74 @@ def _download_sales_receipt(
 		ctx=ctx,
 		receipt_id=receipt.receipt_id
 	)
-	ctx.request_status['sales_transactions_api'] = 200
 
 	return SalesReceiptObj(
 		receipt=receipt,
 		transactions=transactions
 	)
 
+def _try_download_sales_receipt(
+	receipt_type: str,
+	s: Dict,
+	i: int,
+	ctx: metrc_common_util.DownloadContext,
+) -> Tuple[Optional[SalesReceiptObj], Optional[Exception]]:
+	"""
+		Runs in a worker thread, so it only records the failure in the
+		error catcher and leaves updating the request status to the caller.
+	"""
+	try:
+		return _download_sales_receipt(receipt_type, s, i, ctx), None
+	except Exception as e:
+		path = '/sales/v1/receipts/{}'.format(s['Id'])
+		logging.error(f'EXCEPTION downloading {path} for license number {ctx.license["license_number"]} on date {ctx.cur_date}')
+		logging.error(traceback.format_exc())
+
+		if not isinstance(e, errors.Error):
+			# Metrc errors are already recorded in the error catcher by REST
+			ctx.error_catcher.add_retry_error(
+				path=path,
+				time_range=[ctx.get_cur_date_str()],
+				err_details=MetrcErrorDetailsDict(
+					reason='Unexpected exception downloading {}. Err: {}'.format(path, e),
+					status_code=BESPOKE_INTERNAL_ERROR_STATUS_CODE,
+					traceback='{}'.format(traceback.format_exc())
+				)
+			)
+		return None, e
+
 def get_sales_receipt_models(
 	receipt_type: str,
 	start_i: int,
 	cur_sales_receipts: List[Dict], 
 	ctx: metrc_common_util.DownloadContext,
 ) -> List[SalesReceiptObj]:
+	"""
+		Downloads the transactions of the receipts, num_parallel_sales_transactions
+		receipts at a time, and returns them in the order of cur_sales_receipts.
+
+		Receipts whose transactions fail to download are left out and recorded in
+		ctx.error_catcher. Since they are not written, the next sync of the same
+		date downloads them again.
+	"""
+	args = [(receipt_type, s, start_i + i, ctx) for i, s in enumerate(cur_sales_receipts)]
+
+	num_workers = min(ctx.worker_cfg.num_parallel_sales_transactions, len(cur_sales_receipts))
+	if num_workers > 1:
+		with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+			results = list(executor.map(lambda arg: _try_download_sales_receipt(*arg), args))
+	else:
+		results = [_try_download_sales_receipt(*arg) for arg in args]
+
 	sales_receipt_objs = []
+	for sales_receipt_obj, e in results:
+		if e:
+			if isinstance(e, errors.Error):
+				metrc_common_util.update_if_all_are_unsuccessful(ctx.request_status, 'sales_transactions_api', e)
+			continue
 
-	for i in range(len(cur_sales_receipts)):
-		s = cur_sales_receipts[i]
-		sales_receipt_obj = _download_sales_receipt(receipt_type, s, start_i + i, ctx)
 		sales_receipt_objs.append(sales_receipt_obj)
+		ctx.request_status['sales_transactions_api'] = 200
 
 	return sales_receipt_objs
 
@@ -146,6 +194,7 @@ class SalesReceipts(object):
 	def get_sales_receipts_dicts(self) -> List[Dict]:
 		return self._sales_receipts
 
+	@metrc_metrics_util.time_filter_new_only('sales_receipts')
 	def filter_new_only(self, ctx: metrc_common_util.DownloadContext, session: Session) -> 'SalesReceipts':
 		"""
 			Only keep sales receipts in which either of the following is true:
@@ -156,25 +205,14 @@ class SalesReceipts(object):
 			sales receipt hasn't changed.
 		"""
 		us_state = ctx.license['us_state']
-		prev_sales_receipts = []
-		receipt_id_to_tx_count = {}
-
-		batch_size = 10
-		for sales_receipts_chunk in cast(Iterable[List[Dict]], chunker(self._sales_receipts, batch_size)):
-			cur_receipt_ids = ['{}'.format(s['Id']) for s in sales_receipts_chunk]
-			prev_sales_receipts_chunk = _get_prev_sales_receipts(cur_receipt_ids, us_state, session)
-			prev_sales_receipts += prev_sales_receipts_chunk
-
-			for cur_receipt_id in cur_receipt_ids:
-				query = session.query(func.count(models.MetrcSalesTransaction.receipt_id)).filter(
-					models.MetrcSalesTransaction.us_state == us_state
-				).filter(
-					models.MetrcSalesTransaction.receipt_id == cur_receipt_id
-				)
-
-				results = query.all()
-				for (tx_count, ) in results:
-					receipt_id_to_tx_count[cur_receipt_id] = tx_count
+		receipt_ids = ['{}'.format(s['Id']) for s in self._sales_receipts]
+		prev_sales_receipts = _get_prev_sales_receipts(receipt_ids, us_state, session)
+		receipt_id_to_tx_count = metrc_common_util.get_id_to_row_count(
+			session,
+			models.MetrcSalesTransaction.receipt_id,
+			receipt_ids,
+			filters=[models.MetrcSalesTransaction.us_state == us_state],
+		)
 
 		receipt_number_to_sales_receipt = {}
 		for prev_sales_receipt in prev_sales_receipts:
@@ -201,9 +239,8 @@ class SalesReceipts(object):
 
 
 def download_sales_info(ctx: metrc_common_util.DownloadContext, session_maker: Callable) -> Tuple[SalesReceipts, SalesReceipts]:
-	# NOTE: Sometimes there are a lot of inactive receipts to pull for a single day
-	# and this makes it look like the sync is stuck / hanging - could be good to
-	# change this logic to use smaller (intraday) time ranges to prevent this.
+	# Busy licenses have a lot of receipts to pull for a single day, which
+	# adaptive splits pull in shorter (intraday) time ranges.
 	active_sales_receipts_arr: List[Dict] = []
 	inactive_sales_receipts_arr: List[Dict] = []
 
@@ -213,7 +250,7 @@ def download_sales_info(ctx: metrc_common_util.DownloadContext, session_maker: C
 	rest = ctx.rest
 
 	try:
-		resp = rest.get('/sales/v1/receipts/inactive', time_range=[cur_date_str], split_time_by=SplitTimeBy.HOUR)
+		resp = rest.get('/sales/v1/receipts/inactive', time_range=[cur_date_str], split_time_by=SplitTimeBy.ADAPTIVE)
 		inactive_sales_receipts_arr = resp.results
 		request_status['receipts_api'] = 200
 	except errors.Error as e:
@@ -223,7 +260,7 @@ def download_sales_info(ctx: metrc_common_util.DownloadContext, session_maker: C
 		inactive_sales_receipts = SalesReceipts(inactive_sales_receipts_arr, 'inactive').filter_new_only(ctx, session)
 
 	try:
-		resp = rest.get('/sales/v1/receipts/active', time_range=[cur_date_str], split_time_by=SplitTimeBy.HOUR)
+		resp = rest.get('/sales/v1/receipts/active', time_range=[cur_date_str], split_time_by=SplitTimeBy.ADAPTIVE)
 		active_sales_receipts_arr = resp.results
 		request_status['receipts_api'] = 200
 	except errors.Error as e:
@@ -247,56 +284,73 @@ def download_sales_info(ctx: metrc_common_util.DownloadContext, session_maker: C
 	
 	return (inactive_sales_receipts, active_sales_receipts)
 
-def _update_sales_transaction(prev: models.MetrcSalesTransaction, cur: models.MetrcSalesTransaction) -> None:
-	prev.type = cur.type
-	prev.license_number = cur.license_number
-	prev.us_state = cur.us_state
-	prev.receipt_id = cur.receipt_id
-	prev.receipt_row_id = cur.receipt_row_id
-	prev.package_id = cur.package_id
-	prev.package_label = cur.package_label
-	prev.product_name = cur.product_name
-	prev.product_category_name = cur.product_category_name
-	prev.quantity_sold = cur.quantity_sold
-	prev.unit_of_measure = cur.unit_of_measure
-	prev.total_price = cur.total_price
-	prev.recorded_datetime = cur.recorded_datetime
-	prev.payload = cur.payload
-	prev.last_modified_at = cur.last_modified_at	
-
-def _write_sales_transactions_chunk(
-	receipt_id: str,
-	sales_transactions: List[models.MetrcSalesTransaction],
-	session: Session) -> None:
-	if not sales_transactions:
-		return
-
-	us_state = sales_transactions[0].us_state
+# The columns of a sales receipt that are written when it is written again
+SALES_RECEIPT_UPDATE_COLUMNS = [
+	'type',
+	'license_number',
+	'company_id',
+	'sales_customer_type',
+	'sales_datetime',
+	'total_packages',
+	'total_price',
+	'payload',
+	'last_modified_at',
+]
 
-	query = session.query(func.count(models.MetrcSalesTransaction.id)).filter(
-		models.MetrcSalesTransaction.us_state == us_state
-	).filter(
-		models.MetrcSalesTransaction.receipt_id == receipt_id
+def _get_prev_sales_transactions(receipt_ids: List[str], us_state: str, session: Session) -> Dict[str, List[models.MetrcSalesTransaction]]:
+	receipt_id_to_prev_txs: Dict[str, List[models.MetrcSalesTransaction]] = {}
+	prev_sales_txs = metrc_common_util.get_rows_by_ids(
+		session,
+		models.MetrcSalesTransaction,
+		models.MetrcSalesTransaction.receipt_id,
+		receipt_ids,
+		filters=[models.MetrcSalesTransaction.us_state == us_state],
 	)
-	num_prev_txs = cast(Callable, query.scalar)()
-	if num_prev_txs > 0:
-		prev_sales_txs = session.query(models.MetrcSalesTransaction).filter(
-			models.MetrcSalesTransaction.us_state == us_state
-		).filter(
-			models.MetrcSalesTransaction.receipt_id == receipt_id
-		).all()
+	for prev_sales_tx in prev_sales_txs:
+		receipt_id_to_prev_txs.setdefault(prev_sales_tx.receipt_id, []).append(prev_sales_tx)
+
+	return receipt_id_to_prev_txs
+
+def _write_sales_transactions(
+	receipt_id_to_sales_txs: Dict[str, List[models.MetrcSalesTransaction]],
+	us_state: str,
+	session: Session) -> None:
+	"""
+		Sales transactions data comes in an "all or nothing" fashion, e.g., we
+		get all the transactions for a receipt ID. So when we pull a receipt
+		again, its transactions replace the ones we had: transactions of the
+		same package are updated, new ones are added, and the ones we no longer
+		see are marked as deleted.
+
+		metrc_sales_transactions have no unique key to upsert on, so this
+		looks up the previous transactions of all the receipts at once and
+		writes them with a bulk insert, a bulk update and an UPDATE that marks
+		the ones no longer seen as deleted.
+	"""
+	receipt_id_to_prev_txs = _get_prev_sales_transactions(
+		list(receipt_id_to_sales_txs.keys()), us_state, session)
+
+	new_tx_dicts = []
+	id_to_updated_tx_dict: Dict[str, Dict] = {}
+	tx_ids_to_delete = []
+
+	for receipt_id, sales_transactions in receipt_id_to_sales_txs.items():
+		if not sales_transactions:
+			continue
+
 		package_id_to_prev_tx = {}
 		prev_txs_to_delete = {}
-		for prev_sales_tx in prev_sales_txs:
+		for prev_sales_tx in receipt_id_to_prev_txs.get(receipt_id, []):
 			package_id_to_prev_tx[prev_sales_tx.package_id] = prev_sales_tx
 			prev_txs_to_delete[prev_sales_tx.package_id] = prev_sales_tx
-			
 
 		for sales_tx in sales_transactions:
+			sales_tx_dict = metrc_upsert_util.get_model_row(sales_tx)
 			if sales_tx.package_id in package_id_to_prev_tx:
 				prev_tx = package_id_to_prev_tx[sales_tx.package_id]
-				_update_sales_transaction(prev=prev_tx, cur=sales_tx)
-				prev_tx.is_deleted = False # In case it flipped from is_deleted True to False
+				sales_tx_dict['id'] = prev_tx.id
+				sales_tx_dict['is_deleted'] = False # In case it flipped from is_deleted True to False
+				id_to_updated_tx_dict[str(prev_tx.id)] = sales_tx_dict
 
 				if sales_tx.package_id in prev_txs_to_delete:
 					# If we see the same package_id from the previous set of transactions
@@ -304,40 +358,21 @@ def _write_sales_transactions_chunk(
 					# we have to delete those transactions.
 					del prev_txs_to_delete[sales_tx.package_id]
 			else:
-				session.add(sales_tx)
+				new_tx_dicts.append(sales_tx_dict)
 
-		for prev_tx_to_delete in prev_txs_to_delete.values():
-			prev_tx_to_delete.is_deleted = True
+		tx_ids_to_delete += [prev_tx.id for prev_tx in prev_txs_to_delete.values()]
 
-		return
+	session.bulk_insert_mappings(models.MetrcSalesTransaction, new_tx_dicts)
+	session.bulk_update_mappings(models.MetrcSalesTransaction, list(id_to_updated_tx_dict.values()))
+	for tx_ids_chunk in chunker(tx_ids_to_delete, metrc_common_util.LOOKUP_BATCH_SIZE):
+		session.query(models.MetrcSalesTransaction).filter(
+			models.MetrcSalesTransaction.id.in_(tx_ids_chunk)
+		).update({'is_deleted': True}, synchronize_session=False)
 
-	# If there are no previous transactions then do a bulk insert of all these
-	# sales transactions
-
-	# Sales transactions data comes in an "all or nothing" fashion, e.g.,
-	# we get all the transactions for a receipt ID. So if we pull that data again,
-	# we need to flush out what we had before associated with this receipt ID
-	sales_transaction_dicts = []
-	for sales_tx in sales_transactions:
-		sales_transaction_dicts.append({
-			'type': sales_tx.type,
-			'license_number': sales_tx.license_number,
-			'us_state': sales_tx.us_state,
-			'receipt_id': sales_tx.receipt_id,
-			'receipt_row_id': sales_tx.receipt_row_id,
-			'package_id': sales_tx.package_id,
-			'package_label': sales_tx.package_label,
-			'product_name': sales_tx.product_name,
-			'product_category_name': sales_tx.product_category_name,
-			'quantity_sold': sales_tx.quantity_sold,
-			'unit_of_measure': sales_tx.unit_of_measure,
-			'total_price': sales_tx.total_price,
-			'recorded_datetime': sales_tx.recorded_datetime,
-			'payload': sales_tx.payload,
-			'last_modified_at': sales_tx.last_modified_at	
-		})
-
-	session.execute(models.MetrcSalesTransaction.__table__.insert(), sales_transaction_dicts)
+	# Objects loaded before the write still hold their old values
+	for prev_txs in receipt_id_to_prev_txs.values():
+		for prev_tx in prev_txs:
+			session.expire(prev_tx)
 
 	# package_common_util.update_packages_from_sales_transactions(
 	# 	sales_transactions, session)
@@ -349,47 +384,48 @@ def _write_sales_receipts_chunk(
 	if not sales_receipt_objs:
 		return
 
-	receipt_ids = [receipt_obj.metrc_receipt.receipt_id for receipt_obj in sales_receipt_objs]
 	us_state = sales_receipt_objs[0].metrc_receipt.us_state
 
-	prev_sales_receipts = _get_prev_sales_receipts(receipt_ids, us_state, session)
-
-	receipt_number_to_sales_receipt = {}
-	for prev_sales_receipt in prev_sales_receipts:
-		receipt_number_to_sales_receipt[prev_sales_receipt.receipt_number] = prev_sales_receipt
+	# Sales receipts are unique on (us_state, receipt_id)
+	receipt_rows = [
+		metrc_upsert_util.get_model_row(receipt_obj.metrc_receipt)
+		for receipt_obj in sales_receipt_objs
+	]
+	key_to_prev_receipt = metrc_upsert_util.get_key_to_row(
+		session,
+		models.MetrcSalesReceipt,
+		['us_state', 'receipt_id'],
+		[metrc_upsert_util.get_row_key(row, ['us_state', 'receipt_id']) for row in receipt_rows],
+		['last_modified_at'],
+	)
+	key_to_receipt_row_id = metrc_upsert_util.upsert_rows(
+		session,
+		models.MetrcSalesReceipt,
+		receipt_rows,
+		key_columns=['us_state', 'receipt_id'],
+		update_columns=SALES_RECEIPT_UPDATE_COLUMNS,
+	)
 
+	receipt_id_to_sales_txs: Dict[str, List[models.MetrcSalesTransaction]] = {}
 	for sales_receipt_obj in sales_receipt_objs:
 		sales_receipt = sales_receipt_obj.metrc_receipt
-		receipt_row_id = None
-		if sales_receipt.receipt_number in receipt_number_to_sales_receipt:
-			# update
-			prev = receipt_number_to_sales_receipt[sales_receipt.receipt_number]
-			prev.type = sales_receipt.type
-			prev.license_number = sales_receipt.license_number
-			prev.us_state = sales_receipt.us_state
-			prev.us_state = sales_receipt.us_state
-			prev.company_id = sales_receipt.company_id
-			prev.sales_customer_type = sales_receipt.sales_customer_type
-			prev.sales_datetime = sales_receipt.sales_datetime
-			prev.total_packages = sales_receipt.total_packages
-			prev.total_price = sales_receipt.total_price
-			prev.payload = sales_receipt.payload
-			prev.last_modified_at = sales_receipt.last_modified_at
-			receipt_row_id = str(prev.id)
-		else:
-			# add
-			session.add(sales_receipt)
-			# In some rare cases, a new sales receipt may show up twice in the same day.
-			# The following line prevents an attempt to insert a duplicate.
-			receipt_number_to_sales_receipt[sales_receipt.receipt_number] = sales_receipt
-			session.flush()
-			receipt_row_id = str(sales_receipt.id)
-
+		receipt_key = metrc_upsert_util.get_row_key(sales_receipt, ['us_state', 'receipt_id'])
+		prev_receipt = key_to_prev_receipt.get(receipt_key)
+		if prev_receipt and not metrc_upsert_util.is_not_older(
+			sales_receipt.last_modified_at, prev_receipt.last_modified_at):
+			# The transactions of a receipt older than the one we have are
+			# older too, so they are left as they are, like the receipt
+			continue
+
+		receipt_row_id = key_to_receipt_row_id[receipt_key]
 		for tx in sales_receipt_obj.transactions:
 			tx.receipt_row_id = cast(Any, receipt_row_id)
 
-		_write_sales_transactions_chunk(
-			sales_receipt.receipt_id, sales_receipt_obj.transactions, session)
+		# In some rare cases, a sales receipt may show up twice in the same
+		# day, the transactions seen last are the ones kept.
+		receipt_id_to_sales_txs[sales_receipt.receipt_id] = sales_receipt_obj.transactions
+
+	_write_sales_transactions(receipt_id_to_sales_txs, us_state, session)
 
 def _write_inactive_sales_info(
 	session: Session,
@@ -399,6 +435,8 @@ def _write_inactive_sales_info(
 ) -> None:
 	# Do inactive sales receipts, while also fetching their transactions
 	sales_receipts_dicts = sales_receipts.get_sales_receipts_dicts()
+	# Each batch is downloaded in parallel, so make it big enough to use all the workers
+	batch_size = max(batch_size, ctx.worker_cfg.num_parallel_sales_transactions)
 	batches_count = len(sales_receipts_dicts) // batch_size + 1
 
 	i = 0
@@ -417,7 +455,7 @@ def _write_inactive_sales_info(
 		_write_sales_receipts_chunk(sales_receipt_models, session)
 		session.commit()
 
-		i += len(sales_receipt_models)
+		i += len(sales_dicts_chunk)
 		batch_index += 1
 
 def _write_active_sales_info(
@@ -428,6 +466,8 @@ def _write_active_sales_info(
 ) -> None:
 	# Do active sales receipts, while also fetching their transactions
 	sales_receipts_dicts = sales_receipts.get_sales_receipts_dicts()
+	# Each batch is downloaded in parallel, so make it big enough to use all the workers
+	batch_size = max(batch_size, ctx.worker_cfg.num_parallel_sales_transactions)
 	batches_count = len(sales_receipts_dicts) // batch_size + 1
 	
 	i = 0
@@ -446,14 +486,14 @@ def _write_active_sales_info(
 		_write_sales_receipts_chunk(sales_receipt_models, session)
 		session.commit()
 
-		i += len(sales_receipt_models)
+		i += len(sales_dicts_chunk)
 		batch_index += 1
 
 def write_sales_info(
 	sales_receipts_tuple: Tuple[SalesReceipts, SalesReceipts], 
 	ctx: metrc_common_util.DownloadContext,
 	session_maker: Callable, 
-	batch_size: int = 1,
+	batch_size: int = 50,
 ) -> None:
 	inactive_sales_receipts, active_sales_receipts = sales_receipts_tuple[0], sales_receipts_tuple[1]
 	with session_scope(session_maker) as session:
@@ -464,9 +504,8 @@ def download_sales_info_with_session(
 	session: Session,
 	ctx: metrc_common_util.DownloadContext,
 ) -> Tuple[SalesReceipts, SalesReceipts]:
-	# NOTE: Sometimes there are a lot of inactive receipts to pull for a single day
-	# and this makes it look like the sync is stuck / hanging - could be good to
-	# change this logic to use smaller (intraday) time ranges to prevent this.
+	# Busy licenses have a lot of receipts to pull for a single day, which
+	# adaptive splits pull in shorter (intraday) time ranges.
 	active_sales_receipts_arr: List[Dict] = []
 	inactive_sales_receipts_arr: List[Dict] = []
 
@@ -476,7 +515,7 @@ def download_sales_info_with_session(
 	rest = ctx.rest
 
 	try:
-		resp = rest.get('/sales/v1/receipts/inactive', time_range=[cur_date_str], split_time_by=SplitTimeBy.HOUR)
+		resp = rest.get('/sales/v1/receipts/inactive', time_range=[cur_date_str], split_time_by=SplitTimeBy.ADAPTIVE)
 		inactive_sales_receipts_arr = resp.results
 		request_status['receipts_api'] = 200
 	except errors.Error as e:
@@ -485,7 +524,7 @@ def download_sales_info_with_session(
 	inactive_sales_receipts = SalesReceipts(inactive_sales_receipts_arr, 'inactive').filter_new_only(ctx, session)
 
 	try:
-		resp = rest.get('/sales/v1/receipts/active', time_range=[cur_date_str], split_time_by=SplitTimeBy.HOUR)
+		resp = rest.get('/sales/v1/receipts/active', time_range=[cur_date_str], split_time_by=SplitTimeBy.ADAPTIVE)
 		active_sales_receipts_arr = resp.results
 		request_status['receipts_api'] = 200
 	except errors.Error as e:
@@ -512,7 +551,7 @@ def write_sales_info_with_session(
 	session: Session,
 	ctx: metrc_common_util.DownloadContext,
 	sales_receipts_tuple: Tuple[SalesReceipts, SalesReceipts], 
-	batch_size: int = 1,
+	batch_size: int = 50,
 ) -> None:
 	inactive_sales_receipts, active_sales_receipts = sales_receipts_tuple[0], sales_receipts_tuple[1]
 	_write_inactive_sales_info(
@@ -527,3 +566,41 @@ def write_sales_info_with_session(
 		ctx=ctx,
 		batch_size=batch_size,
 	)
+
+def download_sales_transactions(
+	ctx: metrc_common_util.DownloadContext,
+	sales_receipts_tuple: Tuple[SalesReceipts, SalesReceipts],
+) -> List[SalesReceiptObj]:
+	"""
+		Downloads the transactions of all the inactive, then active, sales
+		receipts, so they can be written later with write_sales_receipt_models_with_session
+		without making any more requests to Metrc.
+	"""
+	inactive_sales_receipts, active_sales_receipts = sales_receipts_tuple[0], sales_receipts_tuple[1]
+	inactive_sales_receipt_models = get_sales_receipt_models(
+		receipt_type='inactive',
+		start_i=0,
+		cur_sales_receipts=inactive_sales_receipts.get_sales_receipts_dicts(),
+		ctx=ctx,
+	)
+	active_sales_receipt_models = get_sales_receipt_models(
+		receipt_type='active',
+		start_i=0,
+		cur_sales_receipts=active_sales_receipts.get_sales_receipts_dicts(),
+		ctx=ctx,
+	)
+	return inactive_sales_receipt_models + active_sales_receipt_models
+
+def write_sales_receipt_models_with_session(
+	session: Session,
+	sales_receipt_models: List[SalesReceiptObj],
+	batch_size: int = 50,
+) -> None:
+	batch_index = 1
+	batches_count = len(sales_receipt_models) // batch_size + 1
+
+	for sales_receipt_models_chunk in cast(Iterable[List[SalesReceiptObj]], chunker(sales_receipt_models, batch_size)):
+		logging.info(f'Writing sales receipts batch {batch_index} of {batches_count}...')
+		_write_sales_receipts_chunk(sales_receipt_models_chunk, session)
+		session.commit()
+		batch_index += 1
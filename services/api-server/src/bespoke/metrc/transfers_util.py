@@ -10,7 +10,9 @@ from bespoke.db.metrc_models_util import (
 		CompanyDeliveryObj, MetrcDeliveryObj, MetrcTransferObj
 )
 from bespoke.companies import licenses_util
-from bespoke.metrc.common import metrc_common_util, package_common_util
+from bespoke.metrc.common import (
+	metrc_common_util, metrc_metrics_util, metrc_upsert_util, package_common_util
+)
 from bespoke.metrc.common.package_common_util import (
 	UNKNOWN_LAB_STATUS, TransferPackageObj
 )
@@ -109,18 +111,13 @@ class TransferPackages(object):
 		return metrc_packages, get_final_lab_status(lab_statuses)
 
 def _get_prev_metrc_transfers(transfer_ids: List[str], us_state: str, session: Session) -> List[models.MetrcTransfer]:
-	metrc_transfers = []
-
-	for transfer_id in transfer_ids:
-		metrc_transfer = session.query(models.MetrcTransfer).filter(
-			models.MetrcTransfer.us_state == us_state
-		).filter(
-			models.MetrcTransfer.transfer_id == transfer_id
-		).first()
-		if metrc_transfer:
-			metrc_transfers.append(metrc_transfer)
-
-	return metrc_transfers
+	return metrc_common_util.get_rows_by_ids(
+		session,
+		models.MetrcTransfer,
+		models.MetrcTransfer.transfer_id,
+		transfer_ids,
+		filters=[models.MetrcTransfer.us_state == us_state],
+	)
 
 class Transfers(object):
 
@@ -132,6 +129,7 @@ class Transfers(object):
 		return Transfers(transfers)
 
 
+	@metrc_metrics_util.time_filter_new_only('transfers')
 	def filter_new_only(self, ctx: metrc_common_util.DownloadContext, session: Session) -> 'Transfers':
 		"""
 			Only keep transfers which are newly updated, e.g.,
@@ -257,61 +255,78 @@ class Transfers(object):
 
 		return metrc_transfer_objs
 
+# The columns of a transfer that are written when it is written again,
+# us_state and transfer_id stay the same
+TRANSFER_UPDATE_COLUMNS = [
+	'shipper_facility_license_number',
+	'shipper_facility_name',
+	'created_date',
+	'manifest_number',
+	'shipment_type_name',
+	'shipment_transaction_type',
+	'transfer_payload',
+	'lab_results_status',
+	'last_modified_at',
+]
+
+DELIVERY_UPDATE_COLUMNS = [
+	'recipient_facility_license_number',
+	'recipient_facility_name',
+	'shipment_type_name',
+	'shipment_transaction_type',
+	'received_datetime',
+	'delivery_payload',
+]
+
+TRANSFER_PACKAGE_UPDATE_COLUMNS = [
+	'transfer_row_id',
+	'delivery_row_id',
+	'type',
+	'us_state',
+	'package_label',
+	'package_type',
+	'product_name',
+	'product_category_name',
+	'package_payload',
+	'last_modified_at',
+	'shipped_quantity',
+	'received_quantity',
+	'shipped_unit_of_measure',
+	'received_unit_of_measure',
+	'shipper_wholesale_price',
+	'shipment_package_state',
+	'lab_results_status',
+]
+
 def _write_transfers(
 	transfer_objs: List[MetrcTransferObj], 
 	delivery_id_to_transfer_row_id: Dict, 
 	all_company_deliveries: List[CompanyDeliveryObj],
 	session: Session) -> None:
-	transfer_ids = [transfer_obj.metrc_transfer.transfer_id for transfer_obj in transfer_objs]
-	us_states = [transfer_obj.metrc_transfer.us_state for transfer_obj in transfer_objs]
-
+	# Dont write transfer objects which are not complete, perhaps due to
+	# their packages not being pulled successfully.
+	transfer_objs = [transfer_obj for transfer_obj in transfer_objs if not transfer_obj.has_error]
 	if not transfer_objs:
 		return
 
-	prev_metrc_transfers = _get_prev_metrc_transfers(transfer_ids, us_states[0], session)
-
-	transfer_id_to_prev_transfer = {}
-	for prev_transfer in prev_metrc_transfers:
-		transfer_id_to_prev_transfer[prev_transfer.transfer_id] = prev_transfer
+	# Transfers are unique on (us_state, transfer_id), and were always
+	# overwritten regardless of their last_modified_at
+	key_columns = ['us_state', 'transfer_id']
+	key_to_transfer_row_id = metrc_upsert_util.upsert_rows(
+		session,
+		models.MetrcTransfer,
+		[metrc_upsert_util.get_model_row(transfer_obj.metrc_transfer) for transfer_obj in transfer_objs],
+		key_columns=key_columns,
+		update_columns=TRANSFER_UPDATE_COLUMNS,
+		guard_column=None,
+	)
 
 	for metrc_transfer_obj in transfer_objs:
-		if metrc_transfer_obj.has_error:
-			# Dont write transfer objects which are not complete, perhaps due to
-			# their packages not being pulled successfully.
-			continue
-
-		metrc_transfer = metrc_transfer_obj.metrc_transfer
 		all_company_deliveries.extend(metrc_transfer_obj.company_deliveries)
-		if metrc_transfer.transfer_id in transfer_id_to_prev_transfer:
-			# update
-			prev_transfer = transfer_id_to_prev_transfer[metrc_transfer.transfer_id]
-
-			# Assume these stay the same:
-			# us_state
-			# transfer_id
-			prev_transfer.shipper_facility_license_number = metrc_transfer.shipper_facility_license_number
-			prev_transfer.shipper_facility_name = metrc_transfer.shipper_facility_name
-			prev_transfer.created_date = metrc_transfer.created_date
-			prev_transfer.manifest_number = metrc_transfer.manifest_number
-			prev_transfer.shipment_type_name = metrc_transfer.shipment_type_name
-			prev_transfer.shipment_transaction_type = metrc_transfer.shipment_transaction_type
-			prev_transfer.transfer_payload = metrc_transfer.transfer_payload
-			prev_transfer.lab_results_status = metrc_transfer.lab_results_status
-			prev_transfer.last_modified_at = metrc_transfer.last_modified_at
-
-			for delivery_id in metrc_transfer_obj.get_delivery_ids():
-				delivery_id_to_transfer_row_id[delivery_id] = str(prev_transfer.id)
-		else:
-			# add
-			session.add(metrc_transfer)
-			session.flush()
-
-			# In some rare cases, a new transfer may show up twice in the same day.
-			# The following line prevents an attempt to insert a duplicate transfer.
-			transfer_id_to_prev_transfer[metrc_transfer.transfer_id] = metrc_transfer
-
-			for delivery_id in metrc_transfer_obj.get_delivery_ids():
-				delivery_id_to_transfer_row_id[delivery_id] = str(metrc_transfer.id)
+		transfer_row_id = key_to_transfer_row_id[
+			metrc_upsert_util.get_row_key(metrc_transfer_obj.metrc_transfer, key_columns)]
+		for delivery_id in metrc_transfer_obj.get_delivery_ids():
+			delivery_id_to_transfer_row_id[delivery_id] = transfer_row_id
 
 def _write_company_deliveries(
 	deliveries: List[CompanyDeliveryObj],
@@ -327,26 +342,29 @@ def _write_company_deliveries(
 	company_id = deliveries[0].company_delivery.company_id
 
 	delivery_key_to_prev_delivery: Dict[Tuple[str, str, str], models.CompanyDelivery] = {}
-	
+
+	delivery_row_id_to_transfer_row_id = {}
 	for company_delivery_obj in deliveries:
 		metrc_delivery = company_delivery_obj.metrc_delivery
-		cur_transfer_row_id = delivery_id_to_transfer_row_id[metrc_delivery.delivery_id]
 		cur_delivery_row_id = delivery_id_to_delivery_row_id[metrc_delivery.delivery_id]
-
-		prev_delivery = session.query(models.CompanyDelivery).filter(
-			models.CompanyDelivery.us_state == us_state
-		).filter(
-			models.CompanyDelivery.license_number == license_number
-		).filter(
-			models.CompanyDelivery.company_id == company_id
-		).filter(
-			models.CompanyDelivery.transfer_row_id == cur_transfer_row_id
-		).filter(
-			models.CompanyDelivery.delivery_row_id == cur_delivery_row_id
-		).first()
-		if prev_delivery:
-			key = (prev_delivery.license_number, str(prev_delivery.transfer_row_id), str(prev_delivery.delivery_row_id))
-			delivery_key_to_prev_delivery[key] = prev_delivery
+		delivery_row_id_to_transfer_row_id[cur_delivery_row_id] = delivery_id_to_transfer_row_id[metrc_delivery.delivery_id]
+
+	prev_deliveries = metrc_common_util.get_rows_by_ids(
+		session,
+		models.CompanyDelivery,
+		models.CompanyDelivery.delivery_row_id,
+		delivery_row_id_to_transfer_row_id.keys(),
+		filters=[
+			models.CompanyDelivery.us_state == us_state,
+			models.CompanyDelivery.license_number == license_number,
+			models.CompanyDelivery.company_id == company_id,
+		],
+	)
+	for prev_delivery in prev_deliveries:
+		if str(prev_delivery.transfer_row_id) != delivery_row_id_to_transfer_row_id[str(prev_delivery.delivery_row_id)]:
+			continue
+		key = (prev_delivery.license_number, str(prev_delivery.transfer_row_id), str(prev_delivery.delivery_row_id))
+		delivery_key_to_prev_delivery[key] = prev_delivery
 
 	for company_delivery_obj in deliveries:
 		company_delivery = company_delivery_obj.company_delivery
@@ -385,60 +403,27 @@ def _write_deliveries(
 	delivery_id_to_transfer_row_id: Dict,
 	delivery_id_to_delivery_row_id: Dict, 
 	session: Session) -> None:
-
-	transfer_row_ids = []
-	prev_metrc_deliveries = []
+	if not deliveries:
+		return
 
 	for metrc_delivery in deliveries:
-		cur_transfer_row_id = delivery_id_to_transfer_row_id[metrc_delivery.delivery_id]
-		transfer_row_ids.append(cur_transfer_row_id)
-
-		prev_metrc_delivery = session.query(models.MetrcDelivery).filter(
-				models.MetrcDelivery.us_state == metrc_delivery.us_state
-			).filter(
-				models.MetrcDelivery.transfer_row_id == cur_transfer_row_id
-			).filter(
-				models.MetrcDelivery.delivery_id == metrc_delivery.delivery_id
-			).first()
-		if prev_metrc_delivery:
-			prev_metrc_deliveries.append(prev_metrc_delivery)
-
-	delivery_key_to_prev_delivery: Dict[Tuple[str, str], models.MetrcDelivery] = {}
-	for prev_delivery in prev_metrc_deliveries:
-		cur_transfer_row_id = delivery_id_to_transfer_row_id[prev_delivery.delivery_id]
-		key = (cur_transfer_row_id, prev_delivery.delivery_id)
-		delivery_key_to_prev_delivery[key] = prev_delivery
+		metrc_delivery.transfer_row_id = cast(Any, delivery_id_to_transfer_row_id[metrc_delivery.delivery_id])
+
+	# Deliveries are unique on (us_state, transfer_row_id, delivery_id), so
+	# only the delivery written for the same transfer is the previous one
+	key_columns = ['us_state', 'transfer_row_id', 'delivery_id']
+	key_to_delivery_row_id = metrc_upsert_util.upsert_rows(
+		session,
+		models.MetrcDelivery,
+		[metrc_upsert_util.get_model_row(metrc_delivery) for metrc_delivery in deliveries],
+		key_columns=key_columns,
+		update_columns=DELIVERY_UPDATE_COLUMNS,
+		guard_column=None,
+	)
 
 	for metrc_delivery in deliveries:
-		transfer_row_id = delivery_id_to_transfer_row_id[metrc_delivery.delivery_id]
-		key = (transfer_row_id, metrc_delivery.delivery_id)
-
-		if key in delivery_key_to_prev_delivery:
-			# update
-			prev_delivery = delivery_key_to_prev_delivery[key]
-			delivery_id_to_delivery_row_id[metrc_delivery.delivery_id] = str(prev_delivery.id)
-
-			# delivery_id - no change
-			prev_delivery.transfer_row_id = cast(Any, transfer_row_id)
-			prev_delivery.recipient_facility_license_number = metrc_delivery.recipient_facility_license_number
-			prev_delivery.recipient_facility_name = metrc_delivery.recipient_facility_name
-			prev_delivery.shipment_type_name = metrc_delivery.shipment_type_name
-			prev_delivery.shipment_transaction_type = metrc_delivery.shipment_transaction_type
-			prev_delivery.received_datetime = metrc_delivery.received_datetime
-			prev_delivery.delivery_payload = metrc_delivery.delivery_payload
-		else:
-			# add
-			metrc_delivery.transfer_row_id = cast(Any, transfer_row_id)
-
-			session.add(metrc_delivery)
-			session.flush()
-
-			# In some rare cases, a new delivery may show up twice in the same day.
-			# The following line prevents an attempt to insert a duplicate delivery.
-			delivery_key_to_prev_delivery[key] = metrc_delivery
-
-			# This must come AFTER session.flush().
-			delivery_id_to_delivery_row_id[metrc_delivery.delivery_id] = str(metrc_delivery.id)
+		delivery_id_to_delivery_row_id[metrc_delivery.delivery_id] = key_to_delivery_row_id[
+			metrc_upsert_util.get_row_key(metrc_delivery, key_columns)]
 
 def _write_transfer_packages(
 	metrc_packages: List[models.MetrcTransferPackage], 
@@ -446,60 +431,32 @@ def _write_transfer_packages(
 	delivery_id_to_transfer_row_id: Dict,
 	delivery_id_to_delivery_row_id: Dict,
 	session: Session) -> None:
+	if not metrc_packages:
+		return
 
-	# Note the de-dupe here, there may be multiple packages with the same package_id from the
-	# packages collected above (this is because multiple deliveries may have the same package).
-	# Since metrc_packages are unique on (delivery_id, package_id), note
-	# the following query may return more than BATCH_SIZE number of results.
-	prev_metrc_packages = []
-
-	for pkg in metrc_packages:
-		prev_metrc_package = cast(models.MetrcTransferPackage, session.query(models.MetrcTransferPackage).filter(
-			models.MetrcTransferPackage.delivery_id == pkg.delivery_id
-		).filter(
-			models.MetrcTransferPackage.package_id == pkg.package_id
-		).first())
-
-		if prev_metrc_package:
-			prev_metrc_packages.append(prev_metrc_package)
-
-	delivery_id_package_id_to_prev_package = {}
-	for prev_metrc_package in prev_metrc_packages:
-		# Package key is a tuple of (delivery_id, package_id) - the
-		# same package may show up in multiple different deliveries.
-		metrc_package_key = (prev_metrc_package.delivery_id, prev_metrc_package.package_id)
-		delivery_id_package_id_to_prev_package[metrc_package_key] = prev_metrc_package
-
-	# Write the packages
+	rows = []
 	for metrc_package in metrc_packages:
-		metrc_package_key = (metrc_package.delivery_id, metrc_package.package_id)
-
 		cur_delivery_id = package_id_to_delivery_id[metrc_package.package_id]
-		transfer_row_id = delivery_id_to_transfer_row_id[cur_delivery_id]
-		delivery_row_id = delivery_id_to_delivery_row_id[metrc_package.delivery_id]
-
-		if metrc_package_key in delivery_id_package_id_to_prev_package:
-			# update
-			prev_metrc_package = delivery_id_package_id_to_prev_package[metrc_package_key]
-			prev_metrc_package.transfer_row_id = cast(Any, transfer_row_id)
-			prev_metrc_package.delivery_row_id = cast(Any, delivery_row_id)
-			prev_metrc_package.delivery_id = metrc_package.delivery_id
-			# package_id - no need to update
-			# created_at - no need to update
-			package_common_util.merge_into_prev_transfer_package(
-				prev=prev_metrc_package, 
-				cur=metrc_package
-			)
-		else:
-			# add
-			metrc_package.transfer_row_id = cast(Any, transfer_row_id)
-			metrc_package.delivery_row_id = cast(Any, delivery_row_id)
-			session.add(metrc_package)
-			session.flush()
-
-		# In some rare cases, a new package may show up twice in the same day.
-		# The following line prevents an attempt to insert a duplicate package.
-		delivery_id_package_id_to_prev_package[metrc_package_key] = metrc_package
+		metrc_package.transfer_row_id = cast(Any, delivery_id_to_transfer_row_id[cur_delivery_id])
+		metrc_package.delivery_row_id = cast(Any, delivery_id_to_delivery_row_id[metrc_package.delivery_id])
+
+		row = metrc_upsert_util.get_model_row(metrc_package)
+		if not row['type']:
+			# If the type is not defined, dont overwrite the one written
+			row['type'] = None
+		rows.append(row)
+
+	# Transfer packages are unique on (delivery_id, package_id) - the
+	# same package may show up in multiple different deliveries. The ones
+	# modified before what we currently have are not written.
+	metrc_upsert_util.upsert_rows(
+		session,
+		models.MetrcTransferPackage,
+		rows,
+		key_columns=['delivery_id', 'package_id'],
+		update_columns=TRANSFER_PACKAGE_UPDATE_COLUMNS,
+		keep_if_unset_columns=['type'],
+	)
 
 def _get_company_delivery_objs(transfer_objs: List[MetrcTransferObj]) -> List[CompanyDeliveryObj]:
 	company_delivery_objs = []
@@ -735,10 +692,26 @@ def populate_transfers_table(
 	return True, None
 
 @errors.return_error_tuple
-def populate_transfers_table_with_session(
+class DownloadedTransfers(object):
+	"""
+		The transfers of a day, with their deliveries and packages, as
+		downloaded by download_transfers_with_session.
+	"""
+
+	def __init__(
+		self,
+		metrc_transfer_objs: List[MetrcTransferObj],
+		transfer_package_objs: List[TransferPackageObj],
+		package_id_to_delivery_id: Dict[str, str],
+	) -> None:
+		self.metrc_transfer_objs = metrc_transfer_objs
+		self.transfer_package_objs = transfer_package_objs
+		self.package_id_to_delivery_id = package_id_to_delivery_id
+
+def download_transfers_with_session(
 	session: Session,
 	ctx: metrc_common_util.DownloadContext,
-) -> Tuple[bool, errors.Error]:
+) -> Tuple[DownloadedTransfers, errors.Error]:
 
 	## Setup
 	company_details = ctx.company_details
@@ -756,7 +729,7 @@ def populate_transfers_table_with_session(
 		request_status['transfers_api'] = 200
 	except errors.Error as e:
 		request_status['transfers_api'] = e.details.get('status_code')
-		return False, e
+		return None, e
 
 	incoming_transfers = Transfers.build(incoming_transfers_arr).filter_new_only(
 		ctx, session
@@ -782,7 +755,7 @@ def populate_transfers_table_with_session(
 		request_status['transfers_api'] = 200
 	except errors.Error as e:
 		request_status['transfers_api'] = e.details.get('status_code')
-		return False, e
+		return None, e
 
 	outgoing_transfers = Transfers.build(outgoing_transfers_arr).filter_new_only(
 		ctx, session
@@ -806,7 +779,7 @@ def populate_transfers_table_with_session(
 		request_status['transfers_api'] = 200
 	except errors.Error as e:
 		request_status['transfers_api'] = e.details.get('status_code')
-		return False, e
+		return None, e
 
 	rejected_transfers = Transfers.build(rejected_transfers_arr).filter_new_only(
 		ctx, session
@@ -897,6 +870,20 @@ def populate_transfers_table_with_session(
 
 		metrc_transfer.lab_results_status = get_final_lab_status(lab_result_statuses_for_transfer)
 
+	return DownloadedTransfers(
+		metrc_transfer_objs=metrc_transfer_objs,
+		transfer_package_objs=all_metrc_transfer_package_objs,
+		package_id_to_delivery_id=package_id_to_delivery_id,
+	), None
+
+def write_transfers_with_session(
+	session: Session,
+	downloaded_transfers: DownloadedTransfers,
+) -> None:
+	metrc_transfer_objs = downloaded_transfers.metrc_transfer_objs
+	all_metrc_transfer_package_objs = downloaded_transfers.transfer_package_objs
+	package_id_to_delivery_id = downloaded_transfers.package_id_to_delivery_id
+
 	## Write the transfers
 
 	# Find previous transfers, update those that previously existed, add rows
@@ -953,4 +940,13 @@ def populate_transfers_table_with_session(
 		)
 		session.commit()
 
+def populate_transfers_table_with_session(
+	session: Session,
+	ctx: metrc_common_util.DownloadContext,
+) -> Tuple[bool, errors.Error]:
+	downloaded_transfers, err = download_transfers_with_session(session, ctx)
+	if err:
+		return False, err
+
+	write_transfers_with_session(session, downloaded_transfers)
 	return True, None
@@ -0,0 +1,244 @@
+"""
+	A file that helps you create synthetic companies, with contracts, loans,
+	advances and repayments, to benchmark the loan calculations against.
+"""
+import datetime
+import decimal
+import json
+import random
+from datetime import timedelta
+from typing import Dict, List
+
+from bespoke.date import date_util
+from bespoke.db import models
+from bespoke.db.db_constants import LoanStatusEnum, LoanTypeEnum, ProductType
+from bespoke_test.contract import contract_test_helper
+from bespoke_test.contract.contract_test_helper import ContractInputDict
+from bespoke_test.payments import payment_test_helper
+from mypy_extensions import TypedDict
+from sqlalchemy.orm.session import Session
+
+PortfolioConfigDict = TypedDict('PortfolioConfigDict', {
+	'num_loans': int,
+	'repayments_per_loan': int,
+	'num_contracts': int,
+	'use_dynamic_interest_rate': bool,
+	'history_days': int, # How many days before today the first loan can be originated
+})
+
+# The product types the synthetic companies are created for
+PORTFOLIO_PRODUCT_TYPES = [
+	ProductType.INVENTORY_FINANCING,
+	ProductType.LINE_OF_CREDIT,
+	ProductType.INVOICE_FINANCING,
+	ProductType.DISPENSARY_FINANCING,
+]
+
+INTEREST_RATE = 0.002
+
+# Days from a loan's origination date until it is due
+LOAN_TERM_DAYS = 60
+
+def get_default_portfolio_config() -> PortfolioConfigDict:
+	return PortfolioConfigDict(
+		num_loans=20,
+		repayments_per_loan=2,
+		num_contracts=2,
+		use_dynamic_interest_rate=False,
+		history_days=365,
+	)
+
+def _get_loan_type(product_type: str) -> str:
+	if product_type == ProductType.LINE_OF_CREDIT:
+		return LoanTypeEnum.LINE_OF_CREDIT
+	if product_type == ProductType.INVOICE_FINANCING:
+		return LoanTypeEnum.INVOICE
+	return LoanTypeEnum.INVENTORY
+
+def _get_contract_config(
+	product_type: str,
+	start_date: datetime.date,
+	end_date: datetime.date,
+	use_dynamic_interest_rate: bool,
+) -> Dict:
+	input_dict = ContractInputDict(
+		interest_rate=INTEREST_RATE,
+		maximum_principal_amount=10000000.0,
+		max_days_until_repayment=0, # unused
+		late_fee_structure=json.dumps({
+			'1-14': 0.25,
+			'15-29': 0.50,
+			'30+': 1.0
+		}),
+	)
+
+	if use_dynamic_interest_rate:
+		# Two rates, switching halfway through the contract
+		middle_date = start_date + timedelta(days=(end_date - start_date).days // 2)
+		input_dict['dynamic_interest_rate'] = json.dumps({
+			'{}-{}'.format(date_util.date_to_str(start_date), date_util.date_to_str(middle_date)): INTEREST_RATE,
+			'{}-{}'.format(
+				date_util.date_to_str(middle_date + timedelta(days=1)),
+				date_util.date_to_str(end_date),
+			): INTEREST_RATE / 2,
+		})
+
+	if product_type == ProductType.LINE_OF_CREDIT:
+		input_dict['borrowing_base_accounts_receivable_percentage'] = 0.5
+		input_dict['borrowing_base_inventory_percentage'] = 0.25
+		input_dict['borrowing_base_cash_percentage'] = 0.75
+		input_dict['borrowing_base_cash_in_daca_percentage'] = 0.25
+
+	return contract_test_helper.create_contract_config(
+		product_type=product_type,
+		input_dict=input_dict,
+	)
+
+def create_company(
+	session: Session,
+	product_type: str,
+	index: int,
+	today: datetime.date,
+	config: PortfolioConfigDict,
+	rand: random.Random,
+) -> str:
+	"""
+		Creates a customer with config['num_contracts'] back to back contracts,
+		the last of which is active, and config['num_loans'] loans originated
+		over the config['history_days'] days before today. Loans that are
+		past due by today are repaid in full, the others only in part.
+
+		Returns the id of the company.
+	"""
+	parent_company = models.ParentCompany(name=f'Synthetic {product_type} {index} (Parent Company)')
+	session.add(parent_company)
+	session.flush()
+
+	company_settings = models.CompanySettings()
+	session.add(company_settings)
+	session.flush()
+
+	company = models.Company(
+		parent_company_id=parent_company.id,
+		is_customer=True,
+		name=f'Synthetic {product_type} {index}',
+		identifier=f'S{index}',
+		company_settings_id=company_settings.id,
+	)
+	session.add(company)
+	session.flush()
+	company_id = str(company.id)
+	company_settings.company_id = company_id
+
+	first_date = today - timedelta(days=config['history_days'])
+	# The last contract runs for a year after today
+	contract_days = (config['history_days'] + 365) // config['num_contracts']
+	contract: models.Contract = None
+	for i in range(config['num_contracts']):
+		start_date = first_date + timedelta(days=i * contract_days)
+		end_date = start_date + timedelta(days=contract_days - 1)
+		contract = models.Contract(
+			company_id=company_id,
+			product_type=product_type,
+			product_config=_get_contract_config(
+				product_type, start_date, end_date, config['use_dynamic_interest_rate']),
+			start_date=start_date,
+			end_date=end_date,
+			adjusted_end_date=end_date,
+		)
+		session.add(contract)
+	contract_test_helper.set_and_add_contract_for_company(contract, company_id, session)
+
+	for i in range(config['num_loans']):
+		origination_date = first_date + timedelta(days=rand.randint(0, config['history_days'] - 1))
+		maturity_date = origination_date + timedelta(days=LOAN_TERM_DAYS)
+		amount = float(rand.randint(1000, 50000))
+
+		artifact_id = None
+		if product_type == ProductType.INVOICE_FINANCING:
+			# Invoice financing loans are calculated against their invoice
+			invoice = models.Invoice(
+				company_id=company_id,
+				subtotal_amount=decimal.Decimal(amount * 1.25),
+			)
+			session.add(invoice)
+			session.flush()
+			artifact_id = invoice.id
+
+		loan = models.Loan(
+			company_id=company_id,
+			identifier=str(i + 1),
+			loan_type=_get_loan_type(product_type),
+			artifact_id=artifact_id,
+			status=LoanStatusEnum.APPROVED,
+			amount=decimal.Decimal(amount),
+			requested_payment_date=origination_date,
+			origination_date=origination_date,
+			maturity_date=maturity_date,
+			adjusted_maturity_date=maturity_date,
+		)
+		session.add(loan)
+		session.flush()
+
+		payment_test_helper.make_advance(
+			session,
+			loan,
+			amount,
+			date_util.date_to_str(origination_date),
+			date_util.date_to_str(origination_date),
+		)
+
+		repayments_per_loan = config['repayments_per_loan']
+		is_repaid_in_full = maturity_date < today
+		last_repayment_date = min(maturity_date + timedelta(days=rand.randint(0, 30)), today)
+		days_to_repay = (last_repayment_date - origination_date).days
+		if repayments_per_loan <= 0 or days_to_repay <= 1:
+			continue
+
+		repayment_dates: List[datetime.date] = sorted([
+			origination_date + timedelta(days=rand.randint(1, days_to_repay))
+			for _ in range(repayments_per_loan - 1)
+		]) + [last_repayment_date]
+		num_parts = repayments_per_loan if is_repaid_in_full else repayments_per_loan + 1
+
+		for repayment_date in repayment_dates:
+			payment_test_helper.make_repayment(
+				session=session,
+				company_id=company_id,
+				loan=loan,
+				payment_date=date_util.date_to_str(repayment_date),
+				effective_date=date_util.date_to_str(repayment_date),
+				to_principal=round(amount / num_parts, 2),
+				to_interest=0.0,
+				to_late_fees=0.0,
+				to_account_balance=0.0,
+			)
+
+	session.flush()
+	return company_id
+
+def create_portfolio(
+	session: Session,
+	today: datetime.date,
+	companies_per_product_type: int,
+	config: PortfolioConfigDict,
+	seed: int = 0,
+) -> Dict[str, List[str]]:
+	"""
+		Creates companies_per_product_type companies for each of the
+		PORTFOLIO_PRODUCT_TYPES. The same seed always creates the same loans
+		and repayments.
+
+		Returns the ids of the companies created for each product type.
+	"""
+	rand = random.Random(seed)
+	product_type_to_company_ids: Dict[str, List[str]] = {}
+	index = 0
+	for product_type in PORTFOLIO_PRODUCT_TYPES:
+		product_type_to_company_ids[product_type] = []
+		for _ in range(companies_per_product_type):
+			product_type_to_company_ids[product_type].append(
+				create_company(session, product_type, index, today, config, rand))
+			index += 1
+
+	return product_type_to_company_ids
@@ -0,0 +1,436 @@
+"""
+	An in-process stand-in for the Metrc API, which serves synthetic packages,
+	harvests, plant batches, plants, sales receipts and transfers, so that
+	downloads can be run and measured without a live Metrc API key.
+
+	Install it with install_simulator, after which every request made through
+	metrc_transport_util (REST, MetrcApiKeyDataFetcher, etc.) is answered by
+	the simulator rather than Metrc. Requests still go through the transport's
+	per API key rate limit, and responses with injected 429s and 500s are
+	retried by REST like real ones.
+
+	The data is generated from the seed, license and day only, so the same
+	request always gets the same response, and the time ranges of a day
+	(e.g., the hours of sales receipts) split its data between them.
+"""
+import datetime
+import json
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from dateutil import parser
+from mypy_extensions import TypedDict
+from sqlalchemy.orm.session import Session
+
+from bespoke.db import models
+from bespoke.metrc.common import metrc_transport_util
+from bespoke.security import security_util
+
+SimulatorConfigDict = TypedDict('SimulatorConfigDict', {
+	'packages_per_day': int,
+	'harvests_per_day': int,
+	'plant_batches_per_day': int,
+	'plants_per_day': int,
+	'sales_receipts_per_day': int,
+	'transactions_per_receipt': int,
+	'transfers_per_day': int,
+	'deliveries_per_transfer': int, # At most 9
+	'packages_per_delivery': int,
+	'latency_seconds': float, # How long each response takes
+	'too_many_requests_rate': float, # Fraction of requests answered with a 429
+	'server_error_rate': float, # Fraction of requests answered with a 500
+	'retry_after_seconds': float, # Retry-After of the 429 responses
+	'seed': int,
+})
+
+def get_default_simulator_config() -> SimulatorConfigDict:
+	return SimulatorConfigDict(
+		packages_per_day=30,
+		harvests_per_day=5,
+		plant_batches_per_day=5,
+		plants_per_day=20,
+		sales_receipts_per_day=50,
+		transactions_per_receipt=3,
+		transfers_per_day=6,
+		deliveries_per_transfer=2,
+		packages_per_delivery=3,
+		latency_seconds=0.0,
+		too_many_requests_rate=0.0,
+		server_error_rate=0.0,
+		retry_after_seconds=0.1,
+		seed=0,
+	)
+
+# The first digit of the ids of each kind of data, so that an id says what
+# it is, which license and day it belongs to (see _get_id)
+class _Kind(object):
+	PACKAGE = 1
+	HARVEST = 2
+	PLANT_BATCH = 3
+	PLANT = 4
+	SALES_RECEIPT = 5
+	TRANSFER = 6
+
+# The endpoints of each kind, the items of a day are split between them
+_KIND_TO_PREFIX_AND_SUBTYPES: Dict[int, Tuple[str, List[str]]] = {
+	_Kind.PACKAGE: ('/packages/v1/', ['active', 'inactive', 'onhold']),
+	_Kind.HARVEST: ('/harvests/v1/', ['active', 'inactive', 'onhold']),
+	_Kind.PLANT_BATCH: ('/plantbatches/v1/', ['active', 'inactive']),
+	_Kind.PLANT: ('/plants/v1/', ['vegetative', 'flowering', 'inactive', 'onhold']),
+	_Kind.SALES_RECEIPT: ('/sales/v1/receipts/', ['active', 'inactive']),
+	_Kind.TRANSFER: ('/transfers/v1/', ['incoming', 'outgoing', 'rejected']),
+}
+
+def _get_id(kind: int, license_index: int, day: datetime.date, n: int) -> int:
+	return int(f'{kind}{license_index:03d}{day.strftime("%Y%m%d")}{n:06d}')
+
+def _parse_id(item_id: int) -> Tuple[int, int, datetime.date, int]:
+	s = str(item_id)
+	return int(s[0]), int(s[1:4]), datetime.datetime.strptime(s[4:12], '%Y%m%d').date(), int(s[12:])
+
+def _parse_datetime(datetime_str: str) -> datetime.datetime:
+	# The synthetic data is in naive datetimes
+	return parser.parse(datetime_str).replace(tzinfo=None)
+
+class SimulatedResponse(object):
+	"""
+		Stands in for the requests.models.Response of a request to Metrc.
+	"""
+
+	def __init__(self, status_code: int, content: Any = None, reason: str = 'OK', headers: Dict[str, str] = None) -> None:
+		self.status_code = status_code
+		self.ok = status_code < 400
+		self.reason = reason
+		self.content = json.dumps(content).encode('utf-8') if content is not None else b''
+		self.headers = headers or {}
+
+class MetrcSimulator(object):
+
+	def __init__(self, config: SimulatorConfigDict, license_numbers: List[str]) -> None:
+		self._config = config
+		self._license_numbers = license_numbers
+		self._random = random.Random(config['seed'])
+		self._lock = threading.Lock()
+		self.status_code_to_count: Dict[int, int] = {}
+
+	@property
+	def num_requests(self) -> int:
+		with self._lock:
+			return sum(self.status_code_to_count.values())
+
+	def _rand(self, *key: Any) -> random.Random:
+		return random.Random('-'.join([str(self._config['seed'])] + [str(k) for k in key]))
+
+	def _get_count(self, kind: int) -> int:
+		return {
+			_Kind.PACKAGE: self._config['packages_per_day'],
+			_Kind.HARVEST: self._config['harvests_per_day'],
+			_Kind.PLANT_BATCH: self._config['plant_batches_per_day'],
+			_Kind.PLANT: self._config['plants_per_day'],
+			_Kind.SALES_RECEIPT: self._config['sales_receipts_per_day'],
+			_Kind.TRANSFER: self._config['transfers_per_day'],
+		}[kind]
+
+	def _get_last_modified(self, kind: int, day: datetime.date, n: int) -> datetime.datetime:
+		# Spread the items of a day over the day
+		seconds = int((n + 0.5) * 24 * 60 * 60 / self._get_count(kind))
+		return datetime.datetime.combine(day, datetime.time()) + datetime.timedelta(seconds=seconds)
+
+	def _get_item(self, kind: int, license_index: int, day: datetime.date, n: int) -> Dict:
+		item_id = _get_id(kind, license_index, day, n)
+		last_modified = self._get_last_modified(kind, day, n).isoformat()
+		rand = self._rand(item_id)
+		day_str = day.isoformat()
+
+		if kind == _Kind.PACKAGE:
+			return {
+				'Id': item_id,
+				'Label': f'PKG{item_id}',
+				'PackageType': 'Product',
+				'Item': {
+					'Name': f'Product {rand.randint(1, 50)}',
+					'ProductCategoryName': rand.choice(['Flower', 'Edible', 'Concentrate']),
+				},
+				'Quantity': rand.randint(1, 100),
+				'UnitOfMeasureName': 'Each',
+				'PackagedDate': day_str,
+				'LastModified': last_modified,
+			}
+		elif kind == _Kind.HARVEST:
+			return {
+				'Id': item_id,
+				'Name': f'Harvest {item_id}',
+				'HarvestStartDate': day_str,
+				'LastModified': last_modified,
+			}
+		elif kind == _Kind.PLANT_BATCH:
+			return {
+				'Id': item_id,
+				'Name': f'Plant batch {item_id}',
+				'PlantedDate': day_str,
+				'LastModified': last_modified,
+			}
+		elif kind == _Kind.PLANT:
+			return {
+				'Id': item_id,
+				'Label': f'PLT{item_id}',
+				'PlantedDate': day_str,
+				'LastModified': last_modified,
+			}
+		elif kind == _Kind.SALES_RECEIPT:
+			num_packages = self._config['transactions_per_receipt']
+			return {
+				'Id': item_id,
+				'ReceiptNumber': f'R{item_id}',
+				'SalesCustomerType': 'Consumer',
+				'SalesDateTime': last_modified,
+				'TotalPackages': num_packages,
+				'TotalPrice': round(rand.uniform(10, 200), 2),
+				'IsFinal': True,
+				'LastModified': last_modified,
+			}
+		else:
+			return {
+				'Id': item_id,
+				'ManifestNumber': f'M{item_id}',
+				'ShipperFacilityLicenseNumber': f'SHIPPER-{license_index}',
+				'ShipperFacilityName': f'Shipper {license_index}',
+				'CreatedDateTime': last_modified,
+				'ShipmentTypeName': 'Transfer',
+				'ShipmentTransactionType': 'Standard',
+				'LastModified': last_modified,
+				# Incoming transfers have a single delivery
+				'DeliveryId': item_id * 10,
+				'RecipientFacilityLicenseNumber': self._license_numbers[license_index],
+				'RecipientFacilityName': f'Recipient {license_index}',
+				'ReceivedDateTime': last_modified,
+			}
+
+	def _get_items(
+		self,
+		kind: int,
+		subtype: str,
+		license_index: int,
+		start: datetime.datetime,
+		end: datetime.datetime,
+	) -> List[Dict]:
+		count = self._get_count(kind)
+		subtypes = _KIND_TO_PREFIX_AND_SUBTYPES[kind][1]
+		subtype_index = subtypes.index(subtype)
+
+		items = []
+		day = start.date()
+		while datetime.datetime.combine(day, datetime.time()) < end:
+			for n in range(count):
+				if n % len(subtypes) != subtype_index:
+					continue
+				last_modified = self._get_last_modified(kind, day, n)
+				if start <= last_modified < end:
+					items.append(self._get_item(kind, license_index, day, n))
+			day += datetime.timedelta(days=1)
+
+		return items
+
+	def _get_transactions(self, receipt_id: int) -> Dict:
+		_, license_index, day, n = _parse_id(receipt_id)
+		rand = self._rand('transactions', receipt_id)
+		last_modified = self._get_last_modified(_Kind.SALES_RECEIPT, day, n).isoformat()
+		transactions = []
+		for _ in range(self._config['transactions_per_receipt']):
+			# Sell the packages of the same day
+			package_id = _get_id(
+				_Kind.PACKAGE, license_index, day, rand.randrange(max(self._config['packages_per_day'], 1)))
+			transactions.append({
+				'PackageId': package_id,
+				'PackageLabel': f'PKG{package_id}',
+				'ProductName': f'Product {rand.randint(1, 50)}',
+				'ProductCategoryName': rand.choice(['Flower', 'Edible', 'Concentrate']),
+				'QuantitySold': rand.randint(1, 5),
+				'UnitOfMeasureName': 'Each',
+				'TotalPrice': round(rand.uniform(5, 60), 2),
+				'RecordedDateTime': last_modified,
+				'LastModified': last_modified,
+			})
+		return {'Id': receipt_id, 'Transactions': transactions}
+
+	def _get_deliveries(self, transfer_id: int) -> List[Dict]:
+		_, license_index, day, n = _parse_id(transfer_id)
+		received_datetime = self._get_last_modified(_Kind.TRANSFER, day, n).isoformat()
+		return [
+			{
+				'Id': transfer_id * 10 + i,
+				'RecipientFacilityLicenseNumber': f'RECIPIENT-{transfer_id}-{i}',
+				'RecipientFacilityName': f'Recipient {transfer_id} {i}',
+				'ShipmentTypeName': 'Transfer',
+				'ShipmentTransactionType': 'Standard',
+				'ReceivedDateTime': received_datetime,
+			}
+			for i in range(min(self._config['deliveries_per_transfer'], 9))
+		]
+
+	def _get_delivery_packages(self, delivery_id: int, is_wholesale: bool) -> List[Dict]:
+		transfer_id = delivery_id // 10
+		_, license_index, day, _ = _parse_id(transfer_id)
+		rand = self._rand('delivery', delivery_id)
+		packages = []
+		for i in range(self._config['packages_per_delivery']):
+			package_id = _get_id(
+				_Kind.PACKAGE, license_index, day, rand.randrange(max(self._config['packages_per_day'], 1)))
+			if is_wholesale:
+				packages.append({
+					'PackageId': package_id,
+					'ShipperWholesalePrice': round(rand.uniform(10, 500), 2),
+					'ReceiverWholesalePrice': round(rand.uniform(10, 500), 2),
+				})
+				continue
+
+			packages.append({
+				'PackageId': package_id,
+				'PackageLabel': f'PKG{package_id}',
+				'PackageType': 'Product',
+				'ProductName': f'Product {rand.randint(1, 50)}',
+				'ProductCategoryName': rand.choice(['Flower', 'Edible', 'Concentrate']),
+				'ShippedQuantity': rand.randint(1, 100),
+				'ShippedUnitOfMeasureName': 'Each',
+				'ReceivedUnitOfMeasureName': 'Each',
+				'ShipmentPackageState': 'Accepted',
+				'LabTestingState': rand.choice(['TestPassed', 'TestPassed', 'TestFailed']),
+			})
+		return packages
+
+	def _get_content(self, path: str, params: Dict[str, List[str]]) -> Optional[Any]:
+		if path.rstrip('/') == '/facilities/v1':
+			return [{'License': {'Number': license_number}} for license_number in self._license_numbers]
+
+		license_number = params.get('licenseNumber', [None])[0]
+		if license_number not in self._license_numbers:
+			return None
+		license_index = self._license_numbers.index(license_number)
+
+		parts = path.strip('/').split('/')
+		if parts[0] == 'sales' and len(parts) == 4 and parts[3].isdigit():
+			return self._get_transactions(int(parts[3]))
+		if parts[0] == 'transfers' and len(parts) == 4 and parts[3] == 'deliveries':
+			return self._get_deliveries(int(parts[2]))
+		if parts[0] == 'transfers' and parts[2:3] == ['delivery']:
+			return self._get_delivery_packages(int(parts[3]), is_wholesale=parts[-1] == 'wholesale')
+
+		for kind, (prefix, subtypes) in _KIND_TO_PREFIX_AND_SUBTYPES.items():
+			if not path.startswith(prefix) or path[len(prefix):] not in subtypes:
+				continue
+			if 'lastModifiedStart' not in params:
+				return None
+			start = _parse_datetime(params['lastModifiedStart'][0])
+			end = _parse_datetime(params['lastModifiedEnd'][0]) if 'lastModifiedEnd' in params else \
+				start + datetime.timedelta(days=1)
+			return self._get_items(kind, path[len(prefix):], license_index, start, end)
+
+		return None
+
+	def _respond(self, url: str) -> SimulatedResponse:
+		with self._lock:
+			roll = self._random.random()
+
+		if roll < self._config['too_many_requests_rate']:
+			return SimulatedResponse(
+				metrc_transport_util.TOO_MANY_REQUESTS_STATUS_CODE,
+				reason='Too Many Requests',
+				headers={'Retry-After': str(self._config['retry_after_seconds'])},
+			)
+		if roll < self._config['too_many_requests_rate'] + self._config['server_error_rate']:
+			return SimulatedResponse(500, reason='Internal Server Error')
+
+		parsed_url = urlparse(url)
+		content = self._get_content(parsed_url.path, parse_qs(parsed_url.query))
+		if content is None:
+			return SimulatedResponse(404, reason='Not Found')
+		return SimulatedResponse(200, content)
+
+	def get(self, url: str, auth: Any = None) -> SimulatedResponse:
+		if self._config['latency_seconds']:
+			time.sleep(self._config['latency_seconds'])
+
+		resp = self._respond(url)
+		with self._lock:
+			self.status_code_to_count[resp.status_code] = self.status_code_to_count.get(resp.status_code, 0) + 1
+		return resp
+
+class SimulatedTransport(metrc_transport_util.Transport):
+	"""
+		The transport, rate limits included, with the simulator in place of
+		the sessions to Metrc.
+	"""
+
+	def __init__(self, simulator: MetrcSimulator, requests_per_second_per_api_key: Optional[float]) -> None:
+		super(SimulatedTransport, self).__init__(requests_per_second_per_api_key)
+		self._simulator = simulator
+
+	def _get_session(self, base_url: str) -> Any:
+		return self._simulator
+
+def install_simulator(
+	simulator: MetrcSimulator,
+	requests_per_second_per_api_key: Optional[float] = None,
+) -> Callable[[], None]:
+	"""
+		Sends all requests to Metrc to the simulator. Returns a function
+		which puts the previous transport back.
+	"""
+	prev_transport = metrc_transport_util._transport
+	metrc_transport_util._transport = SimulatedTransport(simulator, requests_per_second_per_api_key)
+
+	def uninstall() -> None:
+		metrc_transport_util._transport = prev_transport
+
+	return uninstall
+
+def create_company_with_metrc_api_key(
+	session: Session,
+	security_cfg: security_util.ConfigDict,
+	license_numbers: List[str],
+	api_key: str,
+	us_state: str = 'CA',
+) -> str:
+	"""
+		Creates a company which holds the licenses, and the Metrc API key the
+		simulator serves them to. Returns the id of the Metrc API key.
+	"""
+	parent_company = models.ParentCompany(name='Simulated Metrc (Parent Company)')
+	session.add(parent_company)
+	session.flush()
+
+	company_settings = models.CompanySettings()
+	session.add(company_settings)
+	session.flush()
+
+	company = models.Company(
+		parent_company_id=parent_company.id,
+		is_customer=True,
+		name='Simulated Metrc',
+		identifier='SM',
+		company_settings_id=company_settings.id,
+	)
+	session.add(company)
+	session.flush()
+	company_settings.company_id = company.id
+
+	for license_number in license_numbers:
+		session.add(models.CompanyLicense(
+			company_id=company.id,
+			license_number=license_number,
+			us_state=us_state,
+		))
+
+	metrc_api_key = models.MetrcApiKey(
+		company_id=company.id,
+		us_state=us_state,
+		encrypted_api_key=security_util.encode_secret_string(security_cfg, api_key),
+		hashed_key=security_util.encode_secret_string(
+			security_cfg, api_key, serializer_type=security_util.SerializerType.SERIALIZER),
+	)
+	session.add(metrc_api_key)
+	session.flush()
+	return str(metrc_api_key.id)
@@ -1,5 +1,6 @@
 import json
 import requests
+import threading
 from typing import Dict, List, Tuple, NamedTuple
 
 from bespoke import errors
@@ -16,6 +17,8 @@ class FakeREST(object):
 
 	def __init__(self, req_to_resp: Dict[RequestKey, Dict]) -> None:
 		self.req_to_resp = req_to_resp
+		# Sales transactions are downloaded from several threads
+		self._lock = threading.Lock()
 		keys = list(req_to_resp.keys())
 		for key in keys:
 			self.req_to_resp[key]['__index'] = 0
@@ -29,11 +32,13 @@ class FakeREST(object):
 			raise errors.Error(
 				'Unexpected request provided {}'.format(key), details={'status_code': 400})
 
-		index = self.req_to_resp[key]['__index']
-		resps = self.req_to_resp[key]['resps']
-		if index >= len(resps):
-			raise errors.Error(
-				'Too many unregistered requests made to {}'.format(key), details={'status_code': 400})
+		with self._lock:
+			index = self.req_to_resp[key]['__index']
+			resps = self.req_to_resp[key]['resps']
+			if index >= len(resps):
+				raise errors.Error(
+					'Too many unregistered requests made to {}'.format(key), details={'status_code': 400})
+			self.req_to_resp[key]['__index'] += 1
 
 		resp = resps[index]
 		is_ok = resp.get('status', '') == 'OK'
@@ -41,8 +46,6 @@ class FakeREST(object):
 		if 'json' in resp:
 			content = json.dumps(resp['json']).encode('utf-8')
 
-		self.req_to_resp[key]['__index'] += 1
-
 		if split_time_by:
 			# Populate whatever the results would be in the results field
 			# of the HTTPReponse, since that is how split_time_by works
@@ -0,0 +1,18 @@
+"""
+	Gunicorn hooks of the async server, e.g.,
+
+		gunicorn -c gunicorn_async.conf.py manage_async:app
+
+	Each worker starts its async job consumer once it is forked, so that the
+	consumer threads run in the process that serves the app, and stops it
+	when it exits.
+"""
+from typing import Any
+
+def post_fork(server: Any, worker: Any) -> None:
+	import manage_async
+	manage_async.start_async_job_consumer()
+
+def worker_exit(server: Any, worker: Any) -> None:
+	import manage_async
+	manage_async.stop_async_job_consumer()
@@ -8,6 +8,7 @@ from flask import Flask
 from flask_cors import CORS
 from flask_script import Manager
 
+from bespoke.async_jobs import async_job_consumer_util
 from bespoke.db import models
 from bespoke.email import sendgrid_util
 from server.config import get_config, get_email_client_config, is_development_env
@@ -62,5 +63,34 @@ app.sendgrid_client = sendgrid_util.Client(
 	email_client_config, app.session_maker,
 	config.get_security_config())
 
+app.async_job_consumer = None
+
+def start_async_job_consumer() -> None:
+	"""
+		Starts the threads that run async jobs as soon as they are queued. It is
+		called by the gunicorn worker that serves the app (see
+		gunicorn_async.conf.py) rather than on import, so that the tests and the
+		manager commands that import the app do not run jobs.
+	"""
+	if config.ASYNC_JOB_CONSUMER_NUM_THREADS <= 0 or app.async_job_consumer:
+		return
+
+	app.async_job_consumer = async_job_consumer_util.AsyncJobConsumer(
+		engine=app.engine,
+		session_maker=app.session_maker,
+		cfg=config,
+		sendgrid_client=app.sendgrid_client,
+		num_threads=config.ASYNC_JOB_CONSUMER_NUM_THREADS,
+		poll_seconds=config.ASYNC_JOB_CONSUMER_POLL_SECONDS,
+	)
+	app.async_job_consumer.start()
+
+def stop_async_job_consumer() -> None:
+	if not app.async_job_consumer:
+		return
+
+	app.async_job_consumer.stop()
+	app.async_job_consumer = None
+
 if __name__ == "__main__":
 	manager.run()
@@ -5,6 +5,7 @@ from typing import Dict
 from bespoke.config.config_util import (
 	is_prod_env, is_development_env, is_test_env, 
 	MetrcWorkerConfig, FCSConfigDict)
+from bespoke.async_util import process_pool_util
 from bespoke.config import config_util
 from bespoke.email.email_manager import EmailConfigDict, SendGridConfigDict
 from bespoke.security import security_util
@@ -112,12 +113,37 @@ class Config(object):
 			max_workers=self.THREAD_POOL_MAX_WORKERS, 
 			thread_name_prefix="async-jobs"
 		)
+		# Number of worker processes that compute company balances for the async
+		# jobs, 0 computes them in the async job's thread instead. Worker processes
+		# are only started once a balance needs to be computed.
+		self.BALANCE_PROCESS_POOL_MAX_WORKERS = int(os.environ.get('BALANCE_PROCESS_POOL_MAX_WORKERS')) if os.environ.get('BALANCE_PROCESS_POOL_MAX_WORKERS') is not None else 0
+		self.BALANCE_PROCESS_POOL = process_pool_util.RestartingProcessPool(
+			max_workers=self.BALANCE_PROCESS_POOL_MAX_WORKERS,
+		) if self.BALANCE_PROCESS_POOL_MAX_WORKERS > 0 else None
 		self.ASYNC_JOB_SLACK_URL = os.environ.get('ASYNC_JOB_SLACK_URL')
 		self.ASYNC_MAX_NUM_CAPPED_JOB = int(os.environ.get('ASYNC_MAX_NUM_CAPPED_JOB')) if os.environ.get('ASYNC_MAX_NUM_CAPPED_JOB') is not None else 2
+		# Number of threads of the async server that claim and run queued jobs as
+		# soon as they are queued (see async_job_consumer_util), 0 only runs jobs
+		# when the orchestration handler is called.
+		self.ASYNC_JOB_CONSUMER_NUM_THREADS = int(os.environ.get('ASYNC_JOB_CONSUMER_NUM_THREADS')) if os.environ.get('ASYNC_JOB_CONSUMER_NUM_THREADS') is not None else 0
+		# How often the consumer threads look for queued jobs when no job was
+		# queued, for the jobs queued without a NOTIFY (e.g., the ones timed out).
+		self.ASYNC_JOB_CONSUMER_POLL_SECONDS = float(os.environ.get('ASYNC_JOB_CONSUMER_POLL_SECONDS')) if os.environ.get('ASYNC_JOB_CONSUMER_POLL_SECONDS') is not None else 30.0
 
 		# Metrc
 		# Number of historical days of data to download Metrc data for, relative to today.
 		self.DOWNLOAD_METRC_DATA_DAYS = int(os.environ.get('DOWNLOAD_METRC_DATA_DAYS')) if os.environ.get('DOWNLOAD_METRC_DATA_DAYS') else 14
+		# Number of sales receipts to download the transactions of at once.
+		self.METRC_NUM_PARALLEL_SALES_TRANSACTIONS = int(os.environ.get('METRC_NUM_PARALLEL_SALES_TRANSACTIONS')) if os.environ.get('METRC_NUM_PARALLEL_SALES_TRANSACTIONS') else 1
+		# Number of intraday time ranges (e.g., the hours of sales receipts) to download at once.
+		self.METRC_NUM_PARALLEL_TIME_RANGES = int(os.environ.get('METRC_NUM_PARALLEL_TIME_RANGES')) if os.environ.get('METRC_NUM_PARALLEL_TIME_RANGES') else 1
+		# Number of requests that may be in flight at once for a single Metrc API key.
+		self.METRC_MAX_CONCURRENT_REQUESTS_PER_API_KEY = int(os.environ.get('METRC_MAX_CONCURRENT_REQUESTS_PER_API_KEY')) if os.environ.get('METRC_MAX_CONCURRENT_REQUESTS_PER_API_KEY') else 4
+		# Number of days to download ahead, while the previous day is written to the database.
+		self.METRC_NUM_DAYS_TO_PREFETCH = int(os.environ.get('METRC_NUM_DAYS_TO_PREFETCH')) if os.environ.get('METRC_NUM_DAYS_TO_PREFETCH') else 1
+		# Directory to archive raw Metrc responses in, and whether to 'record' them there or 'replay' them from there.
+		self.METRC_ARCHIVE_DIR = os.environ.get('METRC_ARCHIVE_DIR')
+		self.METRC_ARCHIVE_MODE = os.environ.get('METRC_ARCHIVE_MODE', 'off')
 
 	def get_security_config(self) -> security_util.ConfigDict:
 		return security_util.ConfigDict(
@@ -129,8 +155,13 @@ class Config(object):
 	def get_metrc_worker_config(self) -> MetrcWorkerConfig:
 		return MetrcWorkerConfig(
 			num_parallel_licenses=1,
-			num_parallel_sales_transactions=1,
-			force_fetch_missing_sales_transactions=False
+			num_parallel_sales_transactions=self.METRC_NUM_PARALLEL_SALES_TRANSACTIONS,
+			force_fetch_missing_sales_transactions=False,
+			num_parallel_time_ranges=self.METRC_NUM_PARALLEL_TIME_RANGES,
+			max_concurrent_requests_per_api_key=self.METRC_MAX_CONCURRENT_REQUESTS_PER_API_KEY,
+			num_days_to_prefetch=self.METRC_NUM_DAYS_TO_PREFETCH,
+			archive_dir=self.METRC_ARCHIVE_DIR,
+			archive_mode=self.METRC_ARCHIVE_MODE,
 		)
 
 	def get_env_base_url(self) -> str:
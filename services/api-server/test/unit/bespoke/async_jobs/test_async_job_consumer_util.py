@@ -0,0 +1,121 @@
+import threading
+import time
+import uuid
+from typing import Callable, List, cast
+
+from bespoke.async_jobs import async_job_consumer_util
+from bespoke.date import date_util
+from bespoke.db import models
+from bespoke.db.db_constants import AsyncJobNameEnum, AsyncJobStatusEnum
+from bespoke.db.models import session_scope
+from bespoke_test.db import db_unittest
+from server.config import get_config
+
+# How long a test waits for the consumer threads before it fails
+WAIT_SECONDS = 10.0
+
+def _wait_for(condition: Callable[[], bool]) -> bool:
+	deadline = time.time() + WAIT_SECONDS
+	while not condition():
+		if time.time() > deadline:
+			return False
+		time.sleep(0.01)
+	return True
+
+class CountingConsumer(async_job_consumer_util.AsyncJobConsumer):
+	"""
+		A consumer that never finds a job, and counts how often it looked
+	"""
+
+	def __init__(self, session_maker: Callable, poll_seconds: float) -> None:
+		super(CountingConsumer, self).__init__(
+			engine=session_maker.kw['bind'], # type: ignore
+			session_maker=session_maker,
+			cfg=get_config(),
+			sendgrid_client=None,
+			num_threads=1,
+			poll_seconds=poll_seconds,
+		)
+		self.num_runs = 0
+
+	def run_next_job(self) -> bool:
+		self.num_runs += 1
+		return False
+
+class TestAsyncJobConsumer(db_unittest.TestCase):
+
+	def test_runs_queued_jobs(self) -> None:
+		self.reset()
+		job_ids: List[str] = []
+		with session_scope(self.session_maker) as session:
+			for _ in range(3):
+				job = models.AsyncJob( # type: ignore
+					name=AsyncJobNameEnum.LOANS_COMING_DUE,
+					status=AsyncJobStatusEnum.QUEUED,
+					is_high_priority=False,
+					queued_at=date_util.now(),
+					is_deleted=False,
+					# A company without loans, so there is nothing to notify
+					job_payload={'company_id': str(uuid.uuid4())},
+				)
+				session.add(job)
+				session.flush()
+				job_ids.append(str(job.id))
+
+		def get_statuses() -> List[str]:
+			with session_scope(self.session_maker) as session:
+				return [
+					cast(models.AsyncJob, session.query(models.AsyncJob).get(job_id)).status
+					for job_id in job_ids
+				]
+
+		consumer = async_job_consumer_util.AsyncJobConsumer(
+			engine=self.session_maker.kw['bind'],
+			session_maker=self.session_maker,
+			cfg=get_config(),
+			sendgrid_client=None,
+			num_threads=2,
+			poll_seconds=0.05,
+		)
+		consumer.start()
+		try:
+			self.assertTrue(_wait_for(
+				lambda: get_statuses() == [AsyncJobStatusEnum.COMPLETED] * len(job_ids)))
+		finally:
+			consumer.stop()
+
+	def test_sleeps_until_woken_up(self) -> None:
+		consumer = CountingConsumer(self.session_maker, poll_seconds=60.0)
+		consumer.start()
+		try:
+			self.assertTrue(_wait_for(lambda: consumer.num_runs == 1))
+			# Not woken up, so it does not look for a job until it polls again
+			time.sleep(0.2)
+			self.assertEqual(1, consumer.num_runs)
+
+			# e.g., the listener received a NOTIFY that a job was queued
+			consumer.wake_up()
+			self.assertTrue(_wait_for(lambda: consumer.num_runs == 2))
+		finally:
+			consumer.stop()
+
+	def test_polls_when_not_woken_up(self) -> None:
+		consumer = CountingConsumer(self.session_maker, poll_seconds=0.05)
+		consumer.start()
+		try:
+			self.assertTrue(_wait_for(lambda: consumer.num_runs >= 3))
+		finally:
+			consumer.stop()
+
+	def test_stop_ends_the_threads(self) -> None:
+		consumer = CountingConsumer(self.session_maker, poll_seconds=60.0)
+		consumer.start()
+		self.assertTrue(_wait_for(lambda: consumer.num_runs == 1))
+
+		# The sleeping thread is woken up rather than waited on until it polls
+		stop_thread = threading.Thread(target=consumer.stop)
+		stop_thread.start()
+		stop_thread.join(WAIT_SECONDS)
+		self.assertFalse(stop_thread.is_alive())
+		self.assertFalse(any(thread.is_alive() for thread in consumer._threads))
+		self.assertEqual(1, consumer.num_runs)
@@ -0,0 +1,81 @@
+import datetime
+import unittest
+from typing import List
+
+from bespoke.async_jobs import async_job_scheduler_util
+from bespoke.async_jobs.async_job_scheduler_util import AsyncJobLaneDict
+from bespoke.db import models
+
+NOW = datetime.datetime(2020, 10, 1, 12, tzinfo=datetime.timezone.utc)
+
+def _get_jobs(name: str, minutes_ago: List[int], is_high_priority: bool = False) -> List[models.AsyncJob]:
+	return [
+		models.AsyncJob( # type: ignore
+			name=name,
+			queued_at=NOW - datetime.timedelta(minutes=m),
+			is_high_priority=is_high_priority,
+		)
+		for m in minutes_ago
+	]
+
+class TestScheduleJobs(unittest.TestCase):
+
+	def _schedule(self, job_name_to_num_running: dict, job_name_to_queued_jobs: dict, num_jobs: int) -> List[str]:
+		jobs = async_job_scheduler_util.schedule_jobs(
+			job_name_to_lane={
+				'emails': AsyncJobLaneDict(max_concurrency=None, weight=3, slo_minutes=15),
+				'balances': AsyncJobLaneDict(max_concurrency=None, weight=1, slo_minutes=60),
+				'metrc': AsyncJobLaneDict(max_concurrency=1, weight=1, slo_minutes=60),
+			},
+			job_name_to_num_running=job_name_to_num_running,
+			job_name_to_queued_jobs=job_name_to_queued_jobs,
+			num_jobs=num_jobs,
+			now=NOW,
+		)
+		return [job.name for job in jobs]
+
+	def test_slots_are_shared_by_weight(self) -> None:
+		# Balance jobs were queued first, but cannot take all the slots
+		self.assertEqual(
+			['emails', 'emails', 'balances', 'emails', 'emails', 'emails'],
+			self._schedule({}, {
+				'emails': _get_jobs('emails', [5] * 10),
+				'balances': _get_jobs('balances', [10] * 10),
+			}, num_jobs=6),
+		)
+
+		# Running jobs count towards the share of their lane
+		self.assertEqual(
+			['balances', 'balances'],
+			self._schedule({'emails': 6}, {
+				'emails': _get_jobs('emails', [5] * 10),
+				'balances': _get_jobs('balances', [10] * 10),
+			}, num_jobs=2),
+		)
+
+	def test_max_concurrency(self) -> None:
+		self.assertEqual(
+			['metrc', 'balances', 'balances'],
+			self._schedule({}, {
+				'metrc': _get_jobs('metrc', [30, 30]),
+				'balances': _get_jobs('balances', [10, 10]),
+			}, num_jobs=4),
+		)
+		self.assertEqual(
+			['balances', 'balances'],
+			self._schedule({'metrc': 1}, {
+				'metrc': _get_jobs('metrc', [30, 30]),
+				'balances': _get_jobs('balances', [10, 10]),
+			}, num_jobs=4),
+		)
+
+	def test_high_priority_and_late_jobs_first(self) -> None:
+		# The emails are past their SLO, the balance update is high priority
+		self.assertEqual(
+			['balances', 'emails', 'metrc'],
+			self._schedule({'emails': 10}, {
+				'emails': _get_jobs('emails', [20]),
+				'metrc': _get_jobs('metrc', [30]),
+				'balances': _get_jobs('balances', [1], is_high_priority=True),
+			}, num_jobs=3),
+		)
@@ -0,0 +1,490 @@
+import datetime
+import decimal
+import uuid
+from typing import Callable, Dict, List, cast
+
+from sqlalchemy.dialects import postgresql
+
+from bespoke.async_jobs import async_job_checkpoint_util, async_jobs_util
+from bespoke.async_jobs.async_job_scheduler_util import AsyncJobLaneDict
+from bespoke.date import date_util
+from bespoke.db import models
+from bespoke.db.db_constants import AsyncJobNameEnum, AsyncJobStatusEnum, ProductType
+from bespoke.db.models import session_scope
+from bespoke_test.contract import contract_test_helper
+from bespoke_test.contract.contract_test_helper import ContractInputDict
+from bespoke_test.db import db_unittest, test_helper
+from bespoke_test.finance import finance_test_helper
+from manage_async import app as async_app
+from server.config import get_config
+
+METRC_JOB = AsyncJobNameEnum.DOWNLOAD_DATA_FOR_METRC_API_KEY_LICENSE
+LOANS_JOB = AsyncJobNameEnum.LOANS_COMING_DUE
+
+def _add_job(
+	session_maker: Callable,
+	name: str,
+	minutes_ago: int,
+	status: str = AsyncJobStatusEnum.QUEUED,
+	is_high_priority: bool = False,
+) -> str:
+	with session_scope(session_maker) as session:
+		job = models.AsyncJob( # type: ignore
+			name=name,
+			status=status,
+			is_high_priority=is_high_priority,
+			queued_at=date_util.now() - datetime.timedelta(minutes=minutes_ago),
+			started_at=date_util.now(),
+			ended_at=date_util.now(),
+			is_deleted=False,
+			job_payload={},
+		)
+		session.add(job)
+		session.flush()
+		return str(job.id)
+
+class TestClaimQueuedJob(db_unittest.TestCase):
+
+	def _claim_all(self, job_name_to_lane: Dict[str, AsyncJobLaneDict]) -> List[str]:
+		job_ids = []
+		while True:
+			job, err = async_jobs_util.claim_queued_job(self.session_maker, job_name_to_lane)
+			self.assertIsNone(err)
+			if not job:
+				return job_ids
+			self.assertEqual(AsyncJobStatusEnum.INITIALIZED, job.status)
+			job_ids.append(str(job.id))
+
+	def test_high_priority_then_weighted_lanes_first(self) -> None:
+		self.reset()
+		old_job_id = _add_job(self.session_maker, LOANS_JOB, minutes_ago=10)
+		new_job_id = _add_job(self.session_maker, LOANS_JOB, minutes_ago=5)
+		high_priority_job_id = _add_job(self.session_maker, LOANS_JOB, minutes_ago=1, is_high_priority=True)
+		metrc_job_id = _add_job(self.session_maker, METRC_JOB, minutes_ago=8)
+		_add_job(self.session_maker, LOANS_JOB, minutes_ago=20, status=AsyncJobStatusEnum.FAILED)
+
+		job_name_to_lane = {
+			LOANS_JOB: AsyncJobLaneDict(max_concurrency=None, weight=2, slo_minutes=60),
+			METRC_JOB: AsyncJobLaneDict(max_concurrency=2, weight=1, slo_minutes=60),
+		}
+		# The loans lane gets twice the slots of the Metrc lane
+		self.assertEqual(
+			[high_priority_job_id, old_job_id, metrc_job_id, new_job_id],
+			self._claim_all(job_name_to_lane),
+		)
+
+	def test_lanes_wait_for_a_free_slot(self) -> None:
+		self.reset()
+		_add_job(self.session_maker, METRC_JOB, minutes_ago=30, status=AsyncJobStatusEnum.IN_PROGRESS)
+		metrc_job_ids = [_add_job(self.session_maker, METRC_JOB, minutes_ago=20 - i) for i in range(3)]
+		job_id = _add_job(self.session_maker, LOANS_JOB, minutes_ago=1)
+
+		job_name_to_lane = {
+			METRC_JOB: AsyncJobLaneDict(max_concurrency=2, weight=1, slo_minutes=60),
+		}
+		# One Metrc job is already running, so only one more may start, after
+		# the job of the lane with no running jobs
+		self.assertEqual([job_id, metrc_job_ids[0]], self._claim_all(job_name_to_lane))
+
+		with session_scope(self.session_maker) as session:
+			job = cast(
+				models.AsyncJob,
+				session.query(models.AsyncJob).get(metrc_job_ids[0]))
+			job.status = AsyncJobStatusEnum.COMPLETED
+
+		self.assertEqual([metrc_job_ids[1]], self._claim_all(job_name_to_lane))
+
+	def test_queued_jobs_are_selected_skip_locked(self) -> None:
+		self.reset()
+		with session_scope(self.session_maker) as session:
+			query = async_jobs_util._query_queued_jobs(session, LOANS_JOB).limit(1)
+			sql = str(query.statement.compile(dialect=postgresql.dialect()))
+		self.assertIn('FOR UPDATE SKIP LOCKED', sql)
+
+	def test_jobs_locked_by_another_claim_are_skipped(self) -> None:
+		self.reset()
+		if self.session_maker.kw['bind'].dialect.name != 'postgresql':
+			self.skipTest('SQLite has no row locks, FOR UPDATE SKIP LOCKED is left out')
+
+		locked_job_id = _add_job(self.session_maker, LOANS_JOB, minutes_ago=10)
+		job_id = _add_job(self.session_maker, LOANS_JOB, minutes_ago=5)
+		job_name_to_lane = {
+			LOANS_JOB: AsyncJobLaneDict(max_concurrency=None, weight=1, slo_minutes=60),
+		}
+
+		# Another consumer is in the middle of claiming the oldest job
+		with session_scope(self.session_maker) as session:
+			locked_job = async_jobs_util._query_queued_jobs(session, LOANS_JOB).first()
+			self.assertEqual(locked_job_id, str(locked_job.id))
+
+			self.assertEqual([job_id], self._claim_all(job_name_to_lane))
+
+		self.assertEqual([locked_job_id], self._claim_all(job_name_to_lane))
+
+	def test_jobs_over_max_concurrency_are_released(self) -> None:
+		self.reset()
+		job_name_to_lane = {
+			METRC_JOB: AsyncJobLaneDict(max_concurrency=2, weight=1, slo_minutes=60),
+		}
+		# Two consumers each claimed a Metrc job for the last free slot, so the
+		# lane has one job too many
+		_add_job(self.session_maker, METRC_JOB, minutes_ago=30, status=AsyncJobStatusEnum.IN_PROGRESS)
+		first_job_id = _add_job(self.session_maker, METRC_JOB, minutes_ago=20, status=AsyncJobStatusEnum.INITIALIZED)
+		second_job_id = _add_job(self.session_maker, METRC_JOB, minutes_ago=10, status=AsyncJobStatusEnum.INITIALIZED)
+		loans_job_id = _add_job(self.session_maker, LOANS_JOB, minutes_ago=5, status=AsyncJobStatusEnum.INITIALIZED)
+
+		with session_scope(self.session_maker) as session:
+			jobs = cast(List[models.AsyncJob], session.query(models.AsyncJob).filter(
+				models.AsyncJob.id.in_([first_job_id, second_job_id, loans_job_id])
+			).order_by(models.AsyncJob.queued_at).all())
+
+			jobs_to_run = async_jobs_util._release_jobs_over_max_concurrency(
+				session, job_name_to_lane, jobs)
+			self.assertEqual([first_job_id, loans_job_id], [str(job.id) for job in jobs_to_run])
+
+		with session_scope(self.session_maker) as session:
+			job_id_to_status = {
+				str(job.id): job.status for job in session.query(models.AsyncJob).all()
+			}
+			self.assertEqual(AsyncJobStatusEnum.INITIALIZED, job_id_to_status[first_job_id])
+			self.assertEqual(AsyncJobStatusEnum.QUEUED, job_id_to_status[second_job_id])
+			self.assertEqual(AsyncJobStatusEnum.INITIALIZED, job_id_to_status[loans_job_id])
+
+		# The released job runs once a slot is free
+		self.assertEqual([], self._claim_all(job_name_to_lane))
+		with session_scope(self.session_maker) as session:
+			job = cast(models.AsyncJob, session.query(models.AsyncJob).get(first_job_id))
+			job.status = AsyncJobStatusEnum.COMPLETED
+		self.assertEqual([second_job_id], self._claim_all(job_name_to_lane))
+
+class TestJobCheckpointer(db_unittest.TestCase):
+
+	def test_save_resumes_from_the_last_cursor(self) -> None:
+		self.reset()
+		with session_scope(self.session_maker) as session:
+			session.expire_on_commit = False
+			job = models.AsyncJob( # type: ignore
+				name=METRC_JOB,
+				status=AsyncJobStatusEnum.IN_PROGRESS,
+				queued_at=date_util.now(),
+				job_payload={'license_number': 'abc'},
+			)
+			session.add(job)
+
+		self.assertIsNone(async_job_checkpoint_util.get_cursor(job.job_payload))
+
+		checkpointer = async_job_checkpoint_util.JobCheckpointer(self.session_maker, job)
+		checkpointer.save({'start_date': '10/02/2020'})
+		checkpointer.save({'start_date': '10/03/2020'})
+
+		with session_scope(self.session_maker) as session:
+			saved_job = cast(models.AsyncJob, session.query(models.AsyncJob).get(job.id))
+			# Only the last cursor is kept, along with the job's payload
+			self.assertEqual(
+				{'license_number': 'abc', 'cursor': {'start_date': '10/03/2020'}},
+				saved_job.retry_payload,
+			)
+			self.assertEqual({'start_date': '10/03/2020'}, async_job_checkpoint_util.get_cursor(saved_job.retry_payload))
+			self.assertIsNotNone(saved_job.heartbeat_at)
+			self.assertEqual({'license_number': 'abc'}, saved_job.job_payload)
+
+		# The job execute_job merges back when it ends keeps the checkpoint
+		self.assertEqual({'start_date': '10/03/2020'}, async_job_checkpoint_util.get_cursor(job.retry_payload))
+
+	def test_checkpoint_is_cleared_once_done_or_retried(self) -> None:
+		self.reset()
+		with session_scope(self.session_maker) as session:
+			session.expire_on_commit = False
+			job = models.AsyncJob( # type: ignore
+				name=LOANS_JOB,
+				status=AsyncJobStatusEnum.INITIALIZED,
+				queued_at=date_util.now(),
+				is_deleted=False,
+				num_retries=0,
+				# A company without loans, so there is nothing to notify
+				job_payload={'company_id': str(uuid.uuid4())},
+			)
+			session.add(job)
+
+		async_job_checkpoint_util.JobCheckpointer(self.session_maker, job).save({'num_companies_done': 5})
+		success, err = async_jobs_util.execute_job(self.session_maker, get_config(), None, job)
+		self.assertIsNone(err)
+
+		with session_scope(self.session_maker) as session:
+			saved_job = cast(models.AsyncJob, session.query(models.AsyncJob).get(job.id))
+			self.assertEqual(AsyncJobStatusEnum.COMPLETED, saved_job.status)
+			self.assertIsNone(saved_job.retry_payload)
+
+			saved_job.status = AsyncJobStatusEnum.FAILED
+			saved_job.retry_payload = dict(
+				saved_job.job_payload, **{async_job_checkpoint_util.CURSOR_KEY: {'num_companies_done': 5}})
+
+		with session_scope(self.session_maker) as session:
+			success, err = async_jobs_util.retry_job(session, [str(job.id)])
+			self.assertIsNone(err)
+
+		with session_scope(self.session_maker) as session:
+			saved_job = cast(models.AsyncJob, session.query(models.AsyncJob).get(job.id))
+			self.assertEqual(AsyncJobStatusEnum.QUEUED, saved_job.status)
+			self.assertIsNone(saved_job.retry_payload)
+
+class TestOrchestrationHandler(db_unittest.TestCase):
+
+	def _add_running_job(self, status: str, initialized_hours_ago: int, heartbeat_hours_ago: int = None) -> str:
+		with session_scope(self.session_maker) as session:
+			job = models.AsyncJob( # type: ignore
+				name=METRC_JOB,
+				status=status,
+				is_high_priority=False,
+				queued_at=date_util.hours_from_today(-initialized_hours_ago - 1),
+				initialized_at=date_util.hours_from_today(-initialized_hours_ago),
+				started_at=date_util.hours_from_today(-initialized_hours_ago) if heartbeat_hours_ago is not None else None,
+				heartbeat_at=date_util.hours_from_today(-heartbeat_hours_ago) if heartbeat_hours_ago is not None else None,
+				is_deleted=False,
+				num_retries=0,
+				job_payload={},
+			)
+			session.add(job)
+			session.flush()
+			return str(job.id)
+
+	def _get_statuses(self, job_ids: List[str]) -> List[str]:
+		with session_scope(self.session_maker) as session:
+			return [
+				cast(models.AsyncJob, session.query(models.AsyncJob).get(job_id)).status
+				for job_id in job_ids
+			]
+
+	def test_jobs_are_timed_out_by_their_heartbeat(self) -> None:
+		self.reset()
+		# Claimed hours ago, but still making progress
+		alive_job_id = self._add_running_job(AsyncJobStatusEnum.IN_PROGRESS, initialized_hours_ago=3, heartbeat_hours_ago=0)
+		stuck_job_id = self._add_running_job(AsyncJobStatusEnum.IN_PROGRESS, initialized_hours_ago=3, heartbeat_hours_ago=2)
+		# Claimed but never started, e.g., the server restarted
+		orphaned_job_id = self._add_running_job(AsyncJobStatusEnum.INITIALIZED, initialized_hours_ago=2)
+		new_job_id = self._add_running_job(AsyncJobStatusEnum.INITIALIZED, initialized_hours_ago=0)
+
+		with async_app.app_context():
+			job_ids, err = async_jobs_util.orchestration_handler(self.session_maker, available_job_number=10)
+		self.assertIsNone(err)
+		self.assertEqual([], job_ids)
+
+		self.assertEqual([
+			AsyncJobStatusEnum.IN_PROGRESS,
+			AsyncJobStatusEnum.QUEUED,
+			AsyncJobStatusEnum.QUEUED,
+			AsyncJobStatusEnum.INITIALIZED,
+		], self._get_statuses([alive_job_id, stuck_job_id, orphaned_job_id, new_job_id]))
+
+		with session_scope(self.session_maker) as session:
+			stuck_job = cast(models.AsyncJob, session.query(models.AsyncJob).get(stuck_job_id))
+			self.assertEqual(1, stuck_job.num_retries)
+
+class TestListDirtyCompanyIdsWithoutQueuedJob(db_unittest.TestCase):
+
+	def test_only_dirty_companies_without_queued_job(self) -> None:
+		self.reset()
+		seed = test_helper.BasicSeed.create(self.session_maker, self)
+		seed.initialize()
+		company_ids = [seed.get_company_id('company_admin', index=i) for i in range(3)]
+		bank_company_id = seed.get_company_id('bank_admin', index=0)
+
+		with session_scope(self.session_maker) as session:
+			for company_id, date_str, needs_recompute in [
+				(company_ids[0], '10/01/2020', True),
+				(company_ids[0], '10/02/2020', True),
+				(company_ids[1], '10/01/2020', True),
+				(company_ids[2], '10/01/2020', False),
+				(bank_company_id, '10/01/2020', True),
+			]:
+				financial_summary = finance_test_helper.get_default_financial_summary(
+					total_limit=100.0,
+					available_limit=100.0,
+					product_type=ProductType.INVENTORY_FINANCING,
+					date_str=date_str,
+					company_id=company_id,
+				)
+				financial_summary.needs_recompute = needs_recompute
+				session.add(financial_summary)
+
+			async_jobs_util.add_jobs_to_queue(
+				session=session,
+				job_name=AsyncJobNameEnum.UPDATE_COMPANY_BALANCES,
+				submitted_by_user_id=None,
+				is_high_priority=False,
+				job_payloads=[{'company_id': company_ids[1]}],
+			)
+
+		with session_scope(self.session_maker) as session:
+			self.assertEqual(
+				[company_ids[0]], async_jobs_util.list_dirty_company_ids_without_queued_job(session))
+
+			async_jobs_util.add_jobs_to_queue(
+				session=session,
+				job_name=AsyncJobNameEnum.UPDATE_COMPANY_BALANCES,
+				submitted_by_user_id=None,
+				is_high_priority=False,
+				job_payloads=[{'company_id': company_ids[0]}],
+			)
+
+		with session_scope(self.session_maker) as session:
+			self.assertEqual([], async_jobs_util.list_dirty_company_ids_without_queued_job(session))
+
+class TestOrchestrateUpdateDirtyCompanyBalances(db_unittest.TestCase):
+
+	def setUp(self) -> None:
+		super(TestOrchestrateUpdateDirtyCompanyBalances, self).setUp()
+		self._orig_companies_per_checkpoint = async_jobs_util.COMPANIES_PER_BALANCE_CHECKPOINT
+		# Two companies at a time, so a batch of four takes two chunks
+		async_jobs_util.COMPANIES_PER_BALANCE_CHECKPOINT = 2
+
+	def tearDown(self) -> None:
+		async_jobs_util.COMPANIES_PER_BALANCE_CHECKPOINT = self._orig_companies_per_checkpoint
+		super(TestOrchestrateUpdateDirtyCompanyBalances, self).tearDown()
+
+	def _seed_dirty_companies(self, num_failing: int) -> List[str]:
+		# The first num_failing companies fail, since their contract only
+		# starts after today
+		self.reset()
+		seed = test_helper.BasicSeed.create(self.session_maker, self)
+		seed.initialize()
+		company_ids = [seed.get_company_id('company_admin', index=i) for i in range(4)]
+		today = date_util.now_as_date(date_util.DEFAULT_TIMEZONE)
+
+		with session_scope(self.session_maker) as session:
+			for i, company_id in enumerate(company_ids):
+				financial_summary = finance_test_helper.get_default_financial_summary(
+					total_limit=100.0,
+					available_limit=100.0,
+					product_type=ProductType.INVENTORY_FINANCING,
+					date_str=date_util.date_to_str(today),
+					company_id=company_id,
+				)
+				financial_summary.needs_recompute = True
+				session.add(financial_summary)
+
+				contract = models.Contract(
+					company_id=company_id,
+					product_type=ProductType.INVENTORY_FINANCING,
+					product_config=contract_test_helper.create_contract_config(
+						product_type=ProductType.INVENTORY_FINANCING,
+						input_dict=ContractInputDict(
+							interest_rate=0.05,
+							maximum_principal_amount=100.0,
+							max_days_until_repayment=0,
+							late_fee_structure='{}',
+						)
+					),
+					start_date=today + datetime.timedelta(days=1 if i < num_failing else -30),
+					adjusted_end_date=today + datetime.timedelta(days=300),
+				)
+				session.add(contract)
+				session.flush()
+				cast(models.Company, session.query(models.Company).get(company_id)).contract_id = contract.id
+
+		return company_ids
+
+	def _get_company_ids_that_need_recompute(self) -> List[str]:
+		with session_scope(self.session_maker) as session:
+			return sorted([
+				str(financial_summary.company_id)
+				for financial_summary in session.query(models.FinancialSummary).filter(
+					models.FinancialSummary.needs_recompute == True
+				).all()
+			])
+
+	def test_failing_companies_do_not_fail_the_batch(self) -> None:
+		# All the companies of the first chunk fail
+		company_ids = self._seed_dirty_companies(num_failing=2)
+
+		with session_scope(self.session_maker) as session:
+			session.expire_on_commit = False
+			job = models.AsyncJob( # type: ignore
+				name=AsyncJobNameEnum.DAILY_COMPANY_BALANCES_RUN,
+				status=AsyncJobStatusEnum.IN_PROGRESS,
+				queued_at=date_util.now(),
+				job_payload={'company_ids': company_ids},
+			)
+			session.add(job)
+
+		with session_scope(self.session_maker) as session:
+			success, err = async_jobs_util.orchestrate_update_dirty_company_balances(
+				session, get_config(), None, cast(Dict, job.job_payload),
+				checkpointer=async_job_checkpoint_util.JobCheckpointer(self.session_maker, job))
+
+		self.assertTrue(success)
+		self.assertEqual(sorted(company_ids[:2]), sorted(err.details['company_id_to_error'].keys()))
+		self.assertEqual([], self._get_company_ids_that_need_recompute())
+
+		# The errors are saved with the cursor, for when the job resumes
+		cursor = async_job_checkpoint_util.get_cursor(cast(Dict, job.retry_payload))
+		self.assertEqual(4, cursor['num_companies_done'])
+		self.assertEqual(sorted(company_ids[:2]), sorted(cursor['company_id_to_error'].keys()))
+
+	def test_resumes_from_the_cursor(self) -> None:
+		company_ids = self._seed_dirty_companies(num_failing=0)
+		job_payload = {
+			'company_ids': company_ids,
+			async_job_checkpoint_util.CURSOR_KEY: {
+				'num_companies_done': 2,
+				'company_id_to_error': {company_ids[0]: 'Failed before the job was interrupted'},
+			},
+		}
+
+		with session_scope(self.session_maker) as session:
+			success, err = async_jobs_util.orchestrate_update_dirty_company_balances(
+				session, get_config(), None, job_payload)
+
+		self.assertTrue(success)
+		# The errors of the companies done before the job was interrupted are kept
+		self.assertEqual(
+			{company_ids[0]: 'Failed before the job was interrupted'},
+			err.details['company_id_to_error'],
+		)
+		# Only the companies after the cursor are computed
+		self.assertEqual(sorted(company_ids[:2]), self._get_company_ids_that_need_recompute())
+
+class TestCompanyBalanceBatches(db_unittest.TestCase):
+
+	def test_get_company_id_to_balance_work(self) -> None:
+		self.reset()
+		seed = test_helper.BasicSeed.create(self.session_maker, self)
+		seed.initialize()
+		company_ids = [seed.get_company_id('company_admin', index=i) for i in range(2)]
+		today = datetime.date(2020, 10, 31)
+
+		with session_scope(self.session_maker) as session:
+			for origination_date, closed_at, is_deleted in [
+				(datetime.date(2020, 10, 31), None, False),
+				(datetime.date(2020, 10, 1), None, None),
+				(datetime.date(2020, 1, 1), date_util.now(), False),
+				(datetime.date(2020, 1, 1), None, True),
+				(None, None, False),
+			]:
+				session.add(models.Loan( # type: ignore
+					company_id=company_ids[0],
+					amount=decimal.Decimal(100.0),
+					origination_date=origination_date,
+					closed_at=closed_at,
+					is_deleted=is_deleted,
+				))
+
+		with session_scope(self.session_maker) as session:
+			company_id_to_work = async_jobs_util.get_company_id_to_balance_work(session, company_ids, today)
+
+		# Only the open loans that were originated count
+		self.assertEqual({company_ids[0]: 1.0 + 1.0 + 2.0, company_ids[1]: 1.0}, company_id_to_work)
+
+	def test_get_company_balance_batches(self) -> None:
+		company_id_to_work = {
+			'heavy': 30.0,
+			'medium': 6.0,
+			'light-0': 2.0,
+			'light-1': 2.0,
+			'light-2': 2.0,
+			'light-3': 2.0,
+		}
+		self.assertEqual(
+			[['heavy'], ['medium', 'light-0', 'light-1'], ['light-2', 'light-3']],
+			async_jobs_util.get_company_balance_batches(company_id_to_work, max_work=10.0, max_companies=3),
+		)
@@ -0,0 +1,20 @@
+import os
+import unittest
+from concurrent.futures.process import BrokenProcessPool
+
+from bespoke.async_util.process_pool_util import RestartingProcessPool
+
+class TestRestartingProcessPool(unittest.TestCase):
+
+	def test_starts_new_workers_once_broken(self) -> None:
+		pool = RestartingProcessPool(max_workers=1)
+		try:
+			self.assertEqual(1, pool.submit(abs, -1).result())
+
+			# The worker dies without answering
+			with self.assertRaises(BrokenProcessPool):
+				pool.submit(os._exit, 1).result()
+
+			self.assertEqual(2, pool.submit(abs, -2).result())
+		finally:
+			pool.shutdown()
@@ -129,6 +129,45 @@ class TestMinimumFees(db_unittest.TestCase):
 		}
 		self._run_test(test)
 
+	def test_accumulate_with_stored_state(self) -> None:
+
+		def populate_fn(fee_accumulator: fee_util.FeeAccumulator) -> None:
+			contract_start_date = date_util.load_date_str('01/02/2020')
+			contract_end_date = date_util.load_date_str('01/02/2021')
+
+			stored_fee_accumulator = fee_util.FeeAccumulator()
+			stored_fee_accumulator.accumulate(
+				contract_start_date=contract_start_date,
+				contract_end_date=contract_end_date,
+				interest_for_day=2.0,
+				fees_for_day=0.1,
+				day=date_util.load_date_str('01/03/2020')
+			)
+			stored_state = json.loads(json.dumps(stored_fee_accumulator.get_state()))
+
+			fee_accumulator.add_state(stored_state)
+			fee_accumulator.accumulate(
+				contract_start_date=contract_start_date,
+				contract_end_date=contract_end_date,
+				interest_for_day=0.5,
+				fees_for_day=0.1,
+				day=date_util.load_date_str('01/04/2020')
+			)
+
+		test: Dict = {
+			'today': '01/10/2020',
+			'contracts': [_get_contract(minimum_monthly_amount=3.0)],
+			'populate_fn': populate_fn,
+			'expected_fee_dict': fee_util.MinimumInterestInfoDict(
+				duration='monthly',
+				minimum_amount=3.0,
+				amount_accrued=2.7,
+				amount_short=0.3,
+				prorated_info=None,
+			)
+		}
+		self._run_test(test)
+
 	def test_accumulate_per_quarter(self) -> None:
 
 		def populate_fn(fee_accumulator: fee_util.FeeAccumulator) -> None:
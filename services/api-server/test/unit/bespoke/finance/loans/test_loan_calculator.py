@@ -0,0 +1,431 @@
+import copy
+import datetime
+import json
+import unittest
+from typing import Any, Dict, List, cast
+
+from bespoke.date import date_util
+from bespoke.db import models
+from bespoke.db.db_constants import PaymentType, ProductType
+from bespoke.finance import contract_util
+from bespoke.finance.loans import fee_util, loan_calculator
+from bespoke.finance.payments import payment_util
+from bespoke_test.contract import contract_test_helper
+from bespoke_test.contract.contract_test_helper import ContractInputDict
+
+def _get_late_fee_structure() -> str:
+	return json.dumps({
+		'1-14': 0.25,
+		'15-29': 0.50,
+		'30+': 1.0
+	})
+
+def _get_contract_dict(
+	product_type: str,
+	start_date: str,
+	end_date: str,
+	input_dict: Dict = None,
+) -> models.ContractDict:
+	contract_input_dict = ContractInputDict(
+		interest_rate=0.002,
+		maximum_principal_amount=120000.01,
+		max_days_until_repayment=0,
+		late_fee_structure=_get_late_fee_structure(),
+	)
+	if input_dict:
+		contract_input_dict.update(cast(Any, input_dict))
+
+	return models.ContractDict(
+		id='contract-' + start_date,
+		product_type=product_type,
+		product_config=contract_test_helper.create_contract_config(
+			product_type=product_type,
+			input_dict=contract_input_dict,
+		),
+		start_date=date_util.load_date_str(start_date),
+		end_date=date_util.load_date_str(end_date),
+		adjusted_end_date=date_util.load_date_str(end_date),
+		terminated_at=None,
+	)
+
+def _get_loan_dict(
+	origination_date: str,
+	maturity_date: str,
+	is_frozen: bool = False,
+	closed_at: datetime.datetime = None,
+) -> models.LoanDict:
+	return models.LoanDict(
+		id='loan-id',
+		company_id='company-id',
+		artifact_id='artifact-id',
+		identifier='1',
+		created_at=None,
+		origination_date=date_util.load_date_str(origination_date),
+		maturity_date=date_util.load_date_str(maturity_date),
+		adjusted_maturity_date=date_util.load_date_str(maturity_date),
+		amount=500.03,
+		status='approved',
+		outstanding_principal_balance=None,
+		outstanding_interest=None,
+		outstanding_fees=None,
+		is_frozen=is_frozen,
+		funded_at=None,
+		closed_at=closed_at,
+	)
+
+def _get_transaction(
+	payment_type: str,
+	deposit_date: str,
+	settlement_date: str,
+	to_principal: float,
+	to_interest: float = 0.0,
+	to_fees: float = 0.0,
+	loan_id: str = 'loan-id',
+) -> models.AugmentedTransactionDict:
+	return models.AugmentedTransactionDict(
+		transaction=models.TransactionDict(
+			id='transaction-' + payment_type + deposit_date,
+			type=payment_type,
+			amount=to_principal + to_interest + to_fees,
+			loan_id=loan_id,
+			payment_id='payment-' + payment_type + deposit_date,
+			to_principal=to_principal,
+			to_interest=to_interest,
+			to_fees=to_fees,
+			effective_date=date_util.load_date_str(settlement_date),
+			is_deleted=False,
+		),
+		payment=models.PaymentDict(
+			id='payment-' + payment_type + deposit_date,
+			type=payment_type,
+			amount=to_principal + to_interest + to_fees,
+			method='ach',
+			submitted_at=None,
+			deposit_date=date_util.load_date_str(deposit_date),
+			settlement_date=date_util.load_date_str(settlement_date),
+		),
+		tx_info=None,
+	)
+
+def _get_company_settings(interest_end_date: str = None, late_fees_end_date: str = None) -> models.CompanySettingsDict:
+	return cast(models.CompanySettingsDict, {
+		'interest_end_date': date_util.load_date_str(interest_end_date) if interest_end_date else None,
+		'late_fees_end_date': date_util.load_date_str(late_fees_end_date) if late_fees_end_date else None,
+	})
+
+def _get_replay_summary(replay: loan_calculator.LoanReplay) -> Dict:
+	return {
+		'date_to_state': replay.date_to_state,
+		'fee_accruals': replay.fee_accruals,
+		'dated_errors': [(cur_date, err.msg) for cur_date, err in replay.dated_errors],
+		'fatal_error': (replay.fatal_error[0], replay.fatal_error[1].msg) if replay.fatal_error else None,
+		'debug_column_names': replay.debug_column_names,
+		'debug_rows': replay.debug_rows,
+	}
+
+class TestAccrualKernel(unittest.TestCase):
+	"""
+		The accrual kernel must give exactly the same results as calculating
+		every day one at a time.
+	"""
+
+	def _run_test(self, test: Dict) -> None:
+		contract_helper, err = contract_util.ContractHelper.build('company-id', test['contracts'])
+		self.assertIsNone(err)
+
+		report_date = date_util.load_date_str(test['report_date'])
+		threshold_info = loan_calculator.ThresholdInfoDict(
+			day_threshold_met=date_util.load_date_str(test['day_threshold_met']) if test.get('day_threshold_met') else None
+		)
+
+		results = []
+		for use_accrual_kernel in [True, False]:
+			txs_helper, err = loan_calculator.TransactionsHelper.build(
+				test['transactions'], test.get('payment_to_include'), report_date)
+			self.assertIsNone(err)
+
+			calculator = loan_calculator.LoanCalculator(
+				contract_helper, fee_accumulator=None, use_accrual_kernel=use_accrual_kernel)
+			replay = calculator._replay_loan_history(
+				threshold_info=threshold_info,
+				loan=test['loan'],
+				invoice=test.get('invoice'),
+				company_settings=test['company_settings'],
+				txs_helper=txs_helper,
+				replay_up_to_date=report_date,
+				payment_to_include=copy.deepcopy(test.get('payment_to_include')),
+				include_debug_info=True,
+			)
+			self.assertGreater(len(replay.date_to_state) + len(replay.dated_errors), 0)
+
+			fee_accumulator = fee_util.FeeAccumulator()
+			fee_accumulator.init_with_date_range(report_date, report_date)
+			calculator = loan_calculator.LoanCalculator(
+				contract_helper, fee_accumulator, use_accrual_kernel=use_accrual_kernel)
+			calculate_result, errs = calculator.calculate_loan_balance(
+				threshold_info,
+				test['loan'],
+				test.get('invoice'),
+				test['company_settings'],
+				test['transactions'],
+				report_date,
+				should_round_output=False,
+				payment_to_include=copy.deepcopy(test.get('payment_to_include')),
+				include_debug_info=True,
+			)
+
+			results.append({
+				'replay': _get_replay_summary(replay),
+				'calculate_result': calculate_result,
+				'errors': [err.msg for err in errs] if errs else None,
+				'fee_accumulator': fee_accumulator.get_state(),
+			})
+
+		kernel_result, daily_result = results
+		self.assertEqual(daily_result, kernel_result)
+
+	def test_repayments_and_late_fees(self) -> None:
+		self._run_test({
+			'contracts': [_get_contract_dict(ProductType.INVENTORY_FINANCING, '01/01/2020', '12/31/2021')],
+			'loan': _get_loan_dict('02/03/2020', '03/04/2020'),
+			'transactions': [
+				_get_transaction(PaymentType.ADVANCE, '02/03/2020', '02/03/2020', to_principal=500.03),
+				# A repayment which crosses over the end of the month
+				_get_transaction(PaymentType.REPAYMENT, '02/28/2020', '03/02/2020', to_principal=100.11, to_interest=3.21),
+				_get_transaction(PaymentType.REPAYMENT, '05/12/2020', '05/14/2020', to_principal=200.0, to_interest=9.5, to_fees=4.25),
+			],
+			'company_settings': _get_company_settings(),
+			'report_date': '08/15/2020',
+		})
+
+	def test_loan_paid_off_by_maturity_date(self) -> None:
+		self._run_test({
+			'contracts': [_get_contract_dict(ProductType.INVENTORY_FINANCING, '01/01/2020', '12/31/2021')],
+			'loan': _get_loan_dict('02/03/2020', '03/04/2020'),
+			'transactions': [
+				_get_transaction(PaymentType.ADVANCE, '02/03/2020', '02/03/2020', to_principal=500.03),
+				_get_transaction(PaymentType.REPAYMENT, '03/03/2020', '03/06/2020', to_principal=500.03, to_interest=29.5),
+			],
+			'company_settings': _get_company_settings(),
+			'report_date': '04/20/2020',
+		})
+
+	def test_dynamic_interest_rate_and_multiple_contracts(self) -> None:
+		self._run_test({
+			'contracts': [
+				_get_contract_dict(ProductType.INVENTORY_FINANCING, '01/01/2020', '03/31/2020', {
+					'dynamic_interest_rate': json.dumps({
+						'01/01/2020-02/14/2020': 0.002,
+						'02/15/2020-03/31/2020': 0.0035,
+					}),
+				}),
+				_get_contract_dict(ProductType.INVENTORY_FINANCING, '04/01/2020', '12/31/2020', {
+					'interest_rate': 0.001,
+					'late_fee_structure': json.dumps({'1-5': 0.1, '6+': 0.3}),
+				}),
+			],
+			'loan': _get_loan_dict('02/03/2020', '04/10/2020'),
+			'transactions': [
+				_get_transaction(PaymentType.ADVANCE, '02/03/2020', '02/03/2020', to_principal=500.03),
+				_get_transaction(PaymentType.ADJUSTMENT, '03/10/2020', '03/10/2020', to_principal=-20.0, to_interest=1.5),
+			],
+			'company_settings': _get_company_settings(),
+			'report_date': '06/01/2020',
+		})
+
+	def test_interest_and_late_fees_end_dates(self) -> None:
+		self._run_test({
+			'contracts': [_get_contract_dict(ProductType.INVENTORY_FINANCING, '01/01/2020', '12/31/2021')],
+			'loan': _get_loan_dict('02/03/2020', '03/04/2020'),
+			'transactions': [
+				_get_transaction(PaymentType.ADVANCE, '02/03/2020', '02/03/2020', to_principal=500.03),
+			],
+			'company_settings': _get_company_settings(interest_end_date='04/15/2020', late_fees_end_date='03/20/2020'),
+			'report_date': '05/31/2020',
+		})
+
+	def test_invoice_financing(self) -> None:
+		self._run_test({
+			'contracts': [_get_contract_dict(ProductType.INVOICE_FINANCING, '01/01/2020', '12/31/2021')],
+			'loan': _get_loan_dict('02/03/2020', '03/04/2020'),
+			'invoice': cast(models.InvoiceDict, {'id': 'artifact-id', 'subtotal_amount': 700.0}),
+			'transactions': [
+				_get_transaction(PaymentType.ADVANCE, '02/03/2020', '02/03/2020', to_principal=500.03),
+				_get_transaction(PaymentType.REPAYMENT, '02/20/2020', '02/24/2020', to_principal=250.0, to_interest=12.0),
+			],
+			'company_settings': _get_company_settings(),
+			'report_date': '04/01/2020',
+		})
+
+	def test_line_of_credit(self) -> None:
+		self._run_test({
+			'contracts': [_get_contract_dict(ProductType.LINE_OF_CREDIT, '01/01/2020', '12/31/2021', {
+				'borrowing_base_accounts_receivable_percentage': 0.5,
+				'borrowing_base_inventory_percentage': 0.25,
+				'borrowing_base_cash_percentage': 0.75,
+				'borrowing_base_cash_in_daca_percentage': 0.5,
+			})],
+			'loan': _get_loan_dict('02/03/2020', '02/03/2021'),
+			'transactions': [
+				_get_transaction(PaymentType.ADVANCE, '02/03/2020', '02/03/2020', to_principal=500.03),
+			],
+			'company_settings': _get_company_settings(),
+			'report_date': '04/01/2020',
+		})
+
+	def test_factoring_fee_threshold_met(self) -> None:
+		self._run_test({
+			'contracts': [_get_contract_dict(ProductType.INVENTORY_FINANCING, '01/01/2020', '12/31/2021', {
+				'factoring_fee_threshold': 100.0,
+				'adjusted_factoring_fee_percentage': 0.001,
+			})],
+			'loan': _get_loan_dict('02/03/2020', '03/04/2020'),
+			'transactions': [
+				_get_transaction(PaymentType.ADVANCE, '02/03/2020', '02/03/2020', to_principal=500.03),
+			],
+			'day_threshold_met': '02/20/2020',
+			'company_settings': _get_company_settings(),
+			'report_date': '04/01/2020',
+		})
+
+	def test_frozen_loan_closed(self) -> None:
+		self._run_test({
+			'contracts': [_get_contract_dict(ProductType.INVENTORY_FINANCING, '01/01/2020', '12/31/2021')],
+			'loan': _get_loan_dict('02/03/2020', '03/04/2020', is_frozen=True, closed_at=datetime.datetime(2020, 3, 15, 12)),
+			'transactions': [
+				_get_transaction(PaymentType.ADVANCE, '02/03/2020', '02/03/2020', to_principal=500.03),
+			],
+			'company_settings': _get_company_settings(),
+			'report_date': '04/01/2020',
+		})
+
+	def test_days_without_a_contract(self) -> None:
+		self._run_test({
+			'contracts': [
+				_get_contract_dict(ProductType.INVENTORY_FINANCING, '01/01/2020', '02/29/2020'),
+				_get_contract_dict(ProductType.INVENTORY_FINANCING, '03/10/2020', '12/31/2020'),
+			],
+			'loan': _get_loan_dict('02/03/2020', '03/04/2020'),
+			'transactions': [
+				_get_transaction(PaymentType.ADVANCE, '02/03/2020', '02/03/2020', to_principal=500.03),
+			],
+			'company_settings': _get_company_settings(),
+			'report_date': '04/01/2020',
+		})
+
+	def test_payment_to_include(self) -> None:
+		self._run_test({
+			'contracts': [_get_contract_dict(ProductType.INVENTORY_FINANCING, '01/01/2020', '12/31/2021')],
+			'loan': _get_loan_dict('02/03/2020', '03/04/2020'),
+			'transactions': [
+				_get_transaction(PaymentType.ADVANCE, '02/03/2020', '02/03/2020', to_principal=500.03),
+			],
+			'payment_to_include': loan_calculator.IncludedPaymentDict(
+				option=payment_util.RepaymentOption.CUSTOM_AMOUNT,
+				custom_amount=200.0,
+				custom_amount_split=None,
+				deposit_date=date_util.load_date_str('03/20/2020'),
+				settlement_date=date_util.load_date_str('03/24/2020'),
+				should_pay_principal_first=False,
+				amount_reserved_for_principal=None,
+			),
+			'company_settings': _get_company_settings(),
+			'report_date': '04/01/2020',
+		})
+
+class TestLoanReplay(unittest.TestCase):
+
+	def test_get_state_as_of(self) -> None:
+		def get_state(name: str) -> loan_calculator.LoanDayStateDict:
+			return cast(loan_calculator.LoanDayStateDict, {'name': name})
+
+		replay = loan_calculator.LoanReplay(initial_state=get_state('initial'))
+		for date_str in ['02/03/2020', '02/04/2020', '02/07/2020', '02/05/2020']:
+			replay.set_state(date_util.load_date_str(date_str), get_state(date_str))
+		# A state set again for the same day replaces the previous one
+		replay.set_state(date_util.load_date_str('02/04/2020'), get_state('02/04/2020-final'))
+
+		for date_str, expected_name in [
+			('02/01/2020', 'initial'),
+			('02/03/2020', '02/03/2020'),
+			('02/04/2020', '02/04/2020-final'),
+			('02/05/2020', '02/05/2020'),
+			# Days that were skipped keep the state of the day before
+			('02/06/2020', '02/05/2020'),
+			('02/07/2020', '02/07/2020'),
+			('03/01/2020', '02/07/2020'),
+		]:
+			self.assertEqual(
+				expected_name,
+				cast(Dict, replay.get_state_as_of(date_util.load_date_str(date_str)))['name'],
+			)
+
+class TestTransactionIndex(unittest.TestCase):
+
+	def _get_transactions(self) -> List[models.AugmentedTransactionDict]:
+		return [
+			_get_transaction(PaymentType.ADVANCE, '02/03/2020', '02/03/2020', to_principal=500.03, loan_id='loan-1'),
+			_get_transaction(PaymentType.ADVANCE, '02/05/2020', '02/05/2020', to_principal=200.0, loan_id='loan-2'),
+			_get_transaction(PaymentType.REPAYMENT, '03/10/2020', '03/12/2020', to_principal=100.0, to_interest=2.5, loan_id='loan-2'),
+			_get_transaction(PaymentType.REPAYMENT, '02/27/2020', '03/02/2020', to_principal=300.0, loan_id='loan-1'),
+			_get_transaction(PaymentType.REPAYMENT, '03/11/2020', '03/12/2020', to_principal=50.0, loan_id='loan-1'),
+			# Transactions of loans which are not being calculated do not count
+			_get_transaction(PaymentType.REPAYMENT, '02/10/2020', '02/11/2020', to_principal=1000.0, loan_id='loan-3'),
+		]
+
+	def test_transactions_helper_matches_building_from_transactions(self) -> None:
+		augmented_transactions = self._get_transactions()
+		loans = [{'id': 'loan-1'}, {'id': 'loan-2'}]
+		index = loan_calculator.TransactionIndex.build(cast(List[models.LoanDict], loans), augmented_transactions)
+
+		for loan in loans:
+			loan_txs = [tx for tx in augmented_transactions if tx['transaction']['loan_id'] == loan['id']]
+			self.assertEqual(loan_txs, index.get_transactions_for_loan(loan['id']))
+
+			for today_str in ['02/01/2020', '02/28/2020', '03/11/2020', '04/01/2020']:
+				today = date_util.load_date_str(today_str)
+				expected_helper, err = loan_calculator.TransactionsHelper.build(loan_txs, None, today)
+				self.assertIsNone(err)
+				helper, err = loan_calculator.TransactionsHelper.build(
+					loan_txs, None, today, loan_transaction_index=index.get_loan_transaction_index(loan['id']))
+				self.assertIsNone(err)
+				self.assertEqual(expected_helper.__dict__, helper.__dict__)
+
+		self.assertEqual([], index.get_transactions_for_loan('unknown-loan'))
+
+	def test_threshold_info_matches_adding_transactions(self) -> None:
+		contract_helper, err = contract_util.ContractHelper.build('company-id', [
+			_get_contract_dict(ProductType.INVENTORY_FINANCING, '01/01/2020', '12/31/2020', {
+				'factoring_fee_threshold': 350.0,
+				'factoring_fee_threshold_starting_value': 0.0,
+				'adjusted_factoring_fee_percentage': 0.001,
+			}),
+		])
+		self.assertIsNone(err)
+
+		augmented_transactions = self._get_transactions()
+		loans = cast(List[models.LoanDict], [{'id': 'loan-1'}, {'id': 'loan-2'}])
+
+		expected_accumulator = loan_calculator.ThresholdAccumulator(contract_helper)
+		for loan in loans:
+			loan_calculator.get_transactions_for_loan(
+				loan['id'], augmented_transactions, accumulator=expected_accumulator)
+
+		accumulator = loan_calculator.ThresholdAccumulator(contract_helper)
+		accumulator.add_transaction_index(loan_calculator.TransactionIndex.build(loans, augmented_transactions))
+
+		for report_date_str, expected_day_threshold_met in [
+			('02/15/2020', None),
+			('03/02/2020', None),
+			('03/20/2020', '03/12/2020'),
+		]:
+			report_date = date_util.load_date_str(report_date_str)
+			expected_threshold_info, err = expected_accumulator.compute_threshold_info(report_date)
+			self.assertIsNone(err)
+			threshold_info, err = accumulator.compute_threshold_info(report_date)
+			self.assertIsNone(err)
+
+			self.assertEqual(expected_threshold_info, threshold_info)
+			self.assertEqual(
+				date_util.load_date_str(expected_day_threshold_met) if expected_day_threshold_met else None,
+				threshold_info['day_threshold_met'])
@@ -9,7 +9,9 @@ from bespoke.date import date_util
 from bespoke.db import models
 from bespoke.db.db_constants import PRODUCT_TYPES, ProductType
 from bespoke.db.models import session_scope
+from bespoke.finance import financial_summary_util
 from bespoke.finance.loans import reports_util
+from bespoke.finance.reports import loan_balances
 from bespoke_test.contract import contract_test_helper
 from bespoke_test.contract.contract_test_helper import ContractInputDict
 from bespoke_test.db import db_unittest, test_helper
@@ -452,6 +454,77 @@ class TestComputeAndUpdateBankFinancialSummaries(db_unittest.TestCase):
 		self._run_compute_and_update_test(populate, len(PRODUCT_TYPES))
 
 
+	def test_update_incrementally_matches_compute(self) -> None:
+		self.reset()
+		seed = test_helper.BasicSeed.create(self.session_maker, self)
+		seed.initialize()
+
+		company_id = seed.get_company_id('company_admin', index=0)
+		dummy_company_id = seed.get_company_id('company_admin', index=1)
+
+		with session_scope(self.session_maker) as session:
+			self._add_summary_for_company(session, company_id, ProductType.INVENTORY_FINANCING)
+			self._add_summary_for_company(session, dummy_company_id, ProductType.INVENTORY_FINANCING, is_dummy_account=True)
+			self._add_summary_for_company(session, seed.get_company_id('company_admin', index=2), ProductType.INVENTORY_FINANCING)
+			self._add_summary_for_company(session, seed.get_company_id('company_admin', index=3), ProductType.LINE_OF_CREDIT)
+			session.flush()
+
+			self.assertIsNone(reports_util.compute_and_update_bank_financial_summaries(session, TODAY))
+
+		with session_scope(self.session_maker) as session:
+			financial_summary_changes = []
+			for cur_company_id, cur_date in [
+				(company_id, TODAY),
+				(dummy_company_id, TODAY),
+				(company_id, FOUR_DAYS_FROM_TODAY),
+			]:
+				financial_summary = session.query(models.FinancialSummary).filter(
+					models.FinancialSummary.company_id == cur_company_id
+				).filter(
+					models.FinancialSummary.date == cur_date
+				).first()
+				old_values = {
+					field: getattr(financial_summary, field) for field in financial_summary_util.BANK_FINANCIAL_SUMMARY_FIELDS
+				}
+				financial_summary.total_outstanding_principal = decimal.Decimal('80.25')
+				financial_summary.interest_accrued_today = decimal.Decimal('3.33333')
+				financial_summary.available_limit = decimal.Decimal('-4.50')
+				financial_summary_changes.append(loan_balances.FinancialSummaryChangeDict(
+					company_id=cur_company_id,
+					date=cur_date,
+					old_values=old_values,
+					new_values={
+						field: getattr(financial_summary, field) for field in financial_summary_util.BANK_FINANCIAL_SUMMARY_FIELDS
+					},
+				))
+			session.flush()
+
+			dates_to_recompute, err = reports_util.update_bank_financial_summaries_incrementally(
+				session, financial_summary_changes)
+			self.assertIsNone(err)
+			# There are no bank financial summaries four days from today yet
+			self.assertEqual(set([FOUR_DAYS_FROM_TODAY]), dates_to_recompute)
+
+		with session_scope(self.session_maker) as session:
+			expected_bank_summaries, err = reports_util.compute_bank_financial_summaries(session, TODAY)
+			self.assertIsNone(err)
+			product_type_to_expected = {
+				bank_summary.product_type: bank_summary for bank_summary in expected_bank_summaries
+			}
+
+			bank_summaries = session.query(models.BankFinancialSummary).filter(
+				models.BankFinancialSummary.date == TODAY
+			).all()
+			self.assertEqual(len(PRODUCT_TYPES), len(bank_summaries))
+			for bank_summary in bank_summaries:
+				expected = product_type_to_expected[bank_summary.product_type]
+				for field in financial_summary_util.BANK_FINANCIAL_SUMMARY_FIELDS:
+					self.assertAlmostEqual(
+						float(getattr(expected, field)),
+						float(getattr(bank_summary, field)),
+						places=2,
+					)
+
 	def test_gets_companies_that_need_recompute(self) -> None:
 		self.reset()
 		seed = test_helper.BasicSeed.create(self.session_maker, self)
@@ -513,6 +586,16 @@ class TestComputeAndUpdateBankFinancialSummaries(db_unittest.TestCase):
 		self.assertEqual(company_one_id, compute_requests[0]['company_id'])
 		self.assertEqual(company_one_id, compute_requests[0]['company']['id'])
 
+		with session_scope(self.session_maker) as session:
+			compute_requests = reports_util.list_financial_summaries_that_need_balances_recomputed_by_companies(
+				session, company_ids=[company_two_id, company_one_id], today=TODAY, amount_to_fetch=1)
+		# One summary per company, today's first, in the order of the companies
+		self.assertEqual(
+			[(company_two_id, TODAY + timedelta(days=1)), (company_one_id, TODAY)],
+			[(req['company_id'], req['report_date']) for req in compute_requests],
+		)
+		self.assertEqual(company_two_id, compute_requests[0]['company']['id'])
+
 	def test_set_needs_balance_recomputed_skips_correct_financial_summaries(self) -> None:
 		self.reset()
 		seed = test_helper.BasicSeed.create(self.session_maker, self)
@@ -576,3 +659,54 @@ class TestComputeAndUpdateBankFinancialSummaries(db_unittest.TestCase):
 
 			financial_summary = session.query(models.FinancialSummary).filter(models.FinancialSummary.needs_recompute == True).first()
 			self.assertEqual(14, financial_summary.days_to_compute_back)
+
+	def test_set_needs_balance_recomputed_deletes_out_of_date_loan_checkpoints(self) -> None:
+		self.reset()
+		seed = test_helper.BasicSeed.create(self.session_maker, self)
+		seed.initialize()
+
+		company_one_id = seed.get_company_id('company_admin', index=0)
+		company_two_id = seed.get_company_id('company_admin', index=1)
+		checkpoint_dates = [
+			date_util.load_date_str('08/31/2020'),
+			date_util.load_date_str('09/30/2020'),
+			date_util.load_date_str('10/31/2020'),
+		]
+
+		with session_scope(self.session_maker) as session:
+			for company_id in [company_one_id, company_two_id]:
+				loan = models.Loan(
+					company_id=company_id,
+					amount=decimal.Decimal(100.0),
+				)
+				session.add(loan)
+				session.flush()
+
+				for checkpoint_date in checkpoint_dates:
+					session.add(models.LoanBalanceCheckpoint(
+						company_id=company_id,
+						loan_id=loan.id,
+						date=checkpoint_date,
+						inputs_hash='unused',
+						state_payload={},
+					))
+
+		with session_scope(self.session_maker) as session:
+			reports_util.set_needs_balance_recomputed(
+				company_ids=[company_one_id],
+				cur_date=date_util.load_date_str('10/14/2020'),
+				days_to_compute_back=14,
+				session=session
+			)
+
+		with session_scope(self.session_maker) as session:
+			loan_checkpoints = session.query(models.LoanBalanceCheckpoint).filter(
+				models.LoanBalanceCheckpoint.company_id == company_one_id
+			).order_by(models.LoanBalanceCheckpoint.date).all()
+			# Only the checkpoint from before the first day recomputed (09/30/2020) is kept
+			self.assertEqual([checkpoint_dates[0]], [c.date for c in loan_checkpoints])
+
+			count = session.query(models.LoanBalanceCheckpoint).filter(
+				models.LoanBalanceCheckpoint.company_id == company_two_id
+			).count()
+			self.assertEqual(3, count)
@@ -1,6 +1,11 @@
+import concurrent.futures
+import datetime
 import decimal
 import json
+import multiprocessing
 import uuid
+from collections import OrderedDict
+from concurrent.futures.process import BrokenProcessPool
 from datetime import timedelta
 from sqlalchemy.orm.session import Session
 from typing import Any, Callable, Dict, List, cast
@@ -10,17 +15,28 @@ from bespoke.db import db_constants, models
 from bespoke.db.db_constants import ProductType
 from bespoke.db.models import session_scope
 from bespoke.finance import financial_summary_util, number_util
-from bespoke.finance.loans import reports_util
+from bespoke.finance.fetchers import per_customer_fetcher
+from bespoke.finance.loans import loan_calculator, loan_checkpoint_util, reports_util
 from bespoke.finance.payments import payment_util, repayment_util_fees
+from bespoke.finance.reports import loan_balances
 from bespoke.finance.reports.loan_balances import LoansInfoEntryDict
-from bespoke.finance.types import payment_types
+from bespoke.finance.types import payment_types, per_customer_types
 from bespoke_test.contract import contract_test_helper
 from bespoke_test.contract.contract_test_helper import ContractInputDict
 from bespoke_test.db import db_unittest, test_helper
-from bespoke_test.finance import finance_test_helper
+from bespoke_test.finance import finance_test_helper, portfolio_test_helper
 from bespoke_test.payments import payment_test_helper
 
 
+_PROCESS_POOL: concurrent.futures.ProcessPoolExecutor = None
+
+def _get_process_pool() -> concurrent.futures.ProcessPoolExecutor:
+	global _PROCESS_POOL
+	if not _PROCESS_POOL:
+		_PROCESS_POOL = concurrent.futures.ProcessPoolExecutor(
+			max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+	return _PROCESS_POOL
+
 def _get_late_fee_structure() -> str:
 	return json.dumps({
 		'1-14': 0.25,
@@ -30,6 +46,186 @@ def _get_late_fee_structure() -> str:
 
 class TestCalculateLoanBalance(db_unittest.TestCase):
 
+	def _assert_matches_per_date_customer_updates(
+		self,
+		company_dict: models.CompanyDict,
+		report_date: datetime.date,
+		days_back: int,
+	) -> None:
+		# Fetching together with other companies must give the same financials,
+		# even if another company's financials could not be fetched. Fetching may
+		# extend the contract, so roll back anything written along the way.
+		missing_company_id = str(uuid.uuid4())
+		session = self.session_maker()
+		try:
+			bulk_fetcher = per_customer_fetcher.BulkFetcher(
+				[
+					per_customer_types.CompanyInfoDict(id=missing_company_id, name='Missing'),
+					per_customer_types.CompanyInfoDict(id=company_dict['id'], name=company_dict['name']),
+				],
+				session,
+				ignore_deleted=True,
+			)
+			_, err = bulk_fetcher.fetch(report_date)
+			self.assertIsNone(err)
+
+			bulk_customer_info, err = bulk_fetcher.get_financials(company_dict['id'])
+			self.assertIsNone(err)
+
+			_, err = bulk_fetcher.get_financials(missing_company_id)
+			self.assertIsNotNone(err)
+		finally:
+			session.rollback()
+			session.close()
+
+		# The single replay over all the report dates must produce exactly
+		# what computing each report date on its own produces. Fetching may
+		# extend the contract, so roll back anything written along the way.
+		session = self.session_maker()
+		try:
+			customer_balance = loan_balances.CustomerBalance(company_dict, session)
+			fetcher = per_customer_fetcher.Fetcher(
+				per_customer_types.CompanyInfoDict(
+					id=company_dict['id'],
+					name=company_dict['name']
+				),
+				session,
+				ignore_deleted=True,
+			)
+			_, err = fetcher.fetch(report_date)
+			self.assertIsNone(err)
+			customer_info = fetcher.get_financials()
+
+			self.assertEqual(customer_info, bulk_customer_info)
+
+			report_date_to_is_past_date: Dict[datetime.date, bool] = OrderedDict()
+			report_date_to_is_past_date[report_date] = False
+			for i in range(days_back, 0, -1):
+				report_date_to_is_past_date[report_date - timedelta(days=i)] = True
+
+			day_to_customer_update, err = customer_balance._get_customer_updates(
+				report_date_to_is_past_date,
+				customer_info,
+				include_debug_info=False,
+				include_frozen=False,
+			)
+			self.assertIsNone(err)
+			self.assertEqual(days_back + 1, len(day_to_customer_update))
+
+			for cur_date, customer_update in day_to_customer_update.items():
+				expected_customer_update, err = customer_balance._get_customer_update(
+					cur_date,
+					customer_info,
+					include_debug_info=False,
+					include_frozen=False,
+					is_past_date=cur_date != report_date,
+				)
+				self.assertIsNone(err)
+				self.assertEqual(expected_customer_update, customer_update)
+
+			# Resuming each loan from the checkpoint the first calculation took
+			# must produce the same updates as replaying the loans from the start.
+			loan_id_to_checkpoints: Dict[str, loan_calculator.LoanCheckpoints] = {}
+			_, err = customer_balance._get_customer_updates(
+				report_date_to_is_past_date,
+				customer_info,
+				include_debug_info=False,
+				include_frozen=False,
+				loan_id_to_checkpoints=loan_id_to_checkpoints,
+			)
+			self.assertIsNone(err)
+
+			# Calculating in a worker process must give the same updates and checkpoints
+			worker_day_to_customer_update, worker_loan_id_to_checkpoints, err = _get_process_pool().submit(
+				loan_balances._get_customer_updates_in_worker,
+				company_dict,
+				report_date_to_is_past_date,
+				customer_info,
+				False,
+				False,
+				{},
+			).result()
+			self.assertIsNone(err)
+			self.assertEqual(day_to_customer_update, worker_day_to_customer_update)
+			self.assertEqual(
+				{loan_id: checkpoints.new_checkpoint for loan_id, checkpoints in loan_id_to_checkpoints.items()},
+				{loan_id: checkpoints.new_checkpoint for loan_id, checkpoints in worker_loan_id_to_checkpoints.items()},
+			)
+
+			# The updates of a worker process that died are calculated in this
+			# process instead
+			broken_future: concurrent.futures.Future = concurrent.futures.Future()
+			broken_future.set_exception(BrokenProcessPool())
+			pending_update = loan_balances.PendingCustomerUpdate(
+				report_date_to_is_past_date=report_date_to_is_past_date,
+				customer_info=customer_info,
+			)
+			pending_update.future = broken_future
+			fallback_day_to_customer_update, err = customer_balance.finish_update(pending_update)
+			self.assertIsNone(err)
+			self.assertEqual(day_to_customer_update, fallback_day_to_customer_update)
+
+			stored_loan_id_to_checkpoints = {}
+			for loan_id, checkpoints in loan_id_to_checkpoints.items():
+				new_checkpoint = checkpoints.new_checkpoint
+				if not new_checkpoint:
+					continue
+
+				stored_loan_id_to_checkpoints[loan_id] = loan_calculator.LoanCheckpoints([
+					loan_checkpoint_util._payload_to_checkpoint(
+						new_checkpoint['date'],
+						new_checkpoint['inputs_hash'],
+						json.loads(json.dumps(loan_checkpoint_util._checkpoint_to_payload(new_checkpoint))),
+					)
+				])
+
+			resumed_day_to_customer_update, err = customer_balance._get_customer_updates(
+				report_date_to_is_past_date,
+				customer_info,
+				include_debug_info=False,
+				include_frozen=False,
+				loan_id_to_checkpoints=stored_loan_id_to_checkpoints,
+			)
+			self.assertIsNone(err)
+			self.assertEqual(day_to_customer_update, resumed_day_to_customer_update)
+		finally:
+			session.rollback()
+			session.close()
+
+	def _assert_financial_summaries_written(
+		self,
+		company_id: str,
+		day_to_customer_update: Dict[datetime.date, loan_balances.CustomerUpdateDict],
+	) -> None:
+		with session_scope(self.session_maker) as session:
+			financial_summaries = cast(
+				List[models.FinancialSummary],
+				session.query(models.FinancialSummary).filter(
+					models.FinancialSummary.company_id == company_id
+				).all())
+
+			date_to_financial_summary = {
+				financial_summary.date: financial_summary for financial_summary in financial_summaries
+			}
+			# One row per date, no matter how many times it was written
+			self.assertEqual(len(financial_summaries), len(date_to_financial_summary))
+
+			for cur_date, customer_update in day_to_customer_update.items():
+				if customer_update is None:
+					continue
+				financial_summary = date_to_financial_summary[cur_date]
+				summary_update = customer_update['summary_update']
+				self.assertFalse(financial_summary.needs_recompute)
+				self.assertAlmostEqual(
+					number_util.round_currency(summary_update['total_outstanding_principal']),
+					float(financial_summary.total_outstanding_principal))
+				self.assertAlmostEqual(
+					number_util.round_currency(summary_update['total_outstanding_interest']),
+					float(financial_summary.total_outstanding_interest))
+				self.assertAlmostEqual(
+					number_util.round_currency(summary_update['available_limit']),
+					float(financial_summary.available_limit))
+
 	def _run_test(
 		self, 
 		test: Dict,
@@ -73,6 +269,10 @@ class TestCalculateLoanBalance(db_unittest.TestCase):
 
 			today = today_date_dict['today']
 
+			if today_date_dict['days_back'] > 0:
+				self._assert_matches_per_date_customer_updates(
+					company_dict, today_date_dict['report_date'], today_date_dict['days_back'])
+
 			with session_scope(self.session_maker) as session:
 				day_to_customer_update, err = reports_util.update_company_balance(
 					session=session,
@@ -84,6 +284,19 @@ class TestCalculateLoanBalance(db_unittest.TestCase):
 					today_for_test=today
 				)
 			self.assertIsNone(err)
+			self._assert_financial_summaries_written(company_id, day_to_customer_update)
+
+			if today_date_dict['days_back'] > 0:
+				# Writing the same updates again updates the financial summaries
+				# that were just inserted
+				with session_scope(self.session_maker) as session:
+					writer = loan_balances.CustomerUpdatesWriter(session)
+					for cur_date, cur_customer_update in day_to_customer_update.items():
+						if cur_customer_update is not None:
+							writer.add(company_id, cur_customer_update, is_todays_update=False)
+					_, err = writer.write()
+				self.assertIsNone(err)
+				self._assert_financial_summaries_written(company_id, day_to_customer_update)
 
 			customer_update = day_to_customer_update[today]
 			# Sort by increasing adjusted maturity date for consistency in tests
@@ -4947,3 +5160,80 @@ class TestCalculateLoanBalance(db_unittest.TestCase):
 		for test in tests:
 			self._run_test(test, loan_ids)
 			i += 1
+
+class TestSyntheticPortfolio(db_unittest.TestCase):
+
+	def test_balances_calculate_for_every_product_type(self) -> None:
+		today = date_util.load_date_str('06/30/2022')
+		config = portfolio_test_helper.get_default_portfolio_config()
+		config['num_loans'] = 5
+		config['num_contracts'] = 3
+		config['use_dynamic_interest_rate'] = True
+
+		with session_scope(self.session_maker) as session:
+			product_type_to_company_ids = portfolio_test_helper.create_portfolio(
+				session, today, companies_per_product_type=1, config=config)
+
+		self.assertEqual(
+			set(portfolio_test_helper.PORTFOLIO_PRODUCT_TYPES), set(product_type_to_company_ids.keys()))
+
+		for product_type, company_ids in product_type_to_company_ids.items():
+			with session_scope(self.session_maker) as session:
+				company = session.query(models.Company).get(company_ids[0])
+				customer_balance = loan_balances.CustomerBalance(company.as_dict(), session)
+				day_to_customer_update, err = customer_balance.update(
+					start_date_for_storing_updates=today - timedelta(days=2),
+					today=today,
+					include_debug_info=False,
+					is_past_date_default_val=False,
+				)
+				self.assertIsNone(err)
+				self.assertEqual(3, len(day_to_customer_update))
+
+				customer_update = day_to_customer_update[today]
+				self.assertEqual(product_type, customer_update['summary_update']['product_type'])
+				self.assertEqual(config['num_loans'], len(customer_update['loan_updates']))
+
+	def test_batch_of_companies_calculates_in_the_process_pool(self) -> None:
+		today = date_util.load_date_str('06/30/2022')
+		config = portfolio_test_helper.get_default_portfolio_config()
+		config['num_loans'] = 3
+		config['num_contracts'] = 2
+
+		with session_scope(self.session_maker) as session:
+			product_type_to_company_ids = portfolio_test_helper.create_portfolio(
+				session, today, companies_per_product_type=1, config=config)
+		company_ids = [company_ids[0] for company_ids in product_type_to_company_ids.values()]
+
+		with session_scope(self.session_maker) as session:
+			compute_requests = []
+			for company_id in company_ids:
+				company = cast(models.Company, session.query(models.Company).get(company_id))
+				compute_requests.append(reports_util.ComputeSummaryRequest(
+					company=company.as_dict(),
+					company_id=company_id,
+					report_date=today,
+					update_days_back=1,
+				))
+
+			company_id_to_error: Dict[str, str] = {}
+			_, descriptive_errors, fatal_error = reports_util.run_customer_balances_for_financial_summaries_that_need_recompute(
+				session,
+				compute_requests,
+				process_pool=_get_process_pool(),
+				company_id_to_error=company_id_to_error,
+			)
+			self.assertIsNone(fatal_error)
+			self.assertEqual([], descriptive_errors)
+			self.assertEqual({}, company_id_to_error)
+
+		with session_scope(self.session_maker) as session:
+			for company_id in company_ids:
+				financial_summaries = cast(
+					List[models.FinancialSummary],
+					session.query(models.FinancialSummary).filter(
+						models.FinancialSummary.company_id == company_id
+					).all())
+				self.assertEqual(
+					[today - timedelta(days=1), today],
+					sorted([financial_summary.date for financial_summary in financial_summaries]))
@@ -200,6 +200,57 @@ class TestContractHelper(unittest.TestCase):
 		contract, err = contract_helper.get_contract(date_util.load_date_str('1/1/2020'))
 		self.assertIsNotNone(err)
 
+	def test_contracts_sharing_a_boundary_day(self) -> None:
+		company_id = 'unused_for_debug_msg'
+
+		contract_dicts = [
+			models.ContractDict(
+				id='unused2',
+				product_type=ProductType.INVENTORY_FINANCING,
+				product_config=_get_default_contract_config(ProductType.INVENTORY_FINANCING, {
+					'late_fee_structure': json.dumps({'1-3': 0.1, '4-9': 0.2, '10+': 0.5}),
+					'interest_rate': 0.02,
+				}),
+				start_date=date_util.load_date_str('2/15/2020'),
+				end_date=None,
+				adjusted_end_date=date_util.load_date_str('2/28/2020'),
+				terminated_at=None
+			),
+			models.ContractDict(
+				id='unused',
+				product_type=ProductType.INVENTORY_FINANCING,
+				product_config=_get_default_contract_config(ProductType.INVENTORY_FINANCING, {
+					'late_fee_structure': json.dumps({'1-3': 0.5, '4-9': 0.4, '10+': 0.3}),
+					'interest_rate': 0.05,
+				}),
+				start_date=date_util.load_date_str('2/11/2020'),
+				end_date=None,
+				adjusted_end_date=date_util.load_date_str('2/15/2020'),
+				terminated_at=None
+			),
+		]
+
+		contract_helper, err = contract_util.ContractHelper.build(company_id, contract_dicts)
+		self.assertIsNone(err)
+
+		# The earlier contract wins on the day both contracts are in effect
+		contract, err = contract_helper.get_contract(date_util.load_date_str('2/15/2020'))
+		self.assertIsNone(err)
+		self.assertEqual('unused', contract.contract_id)
+
+		contract, err = contract_helper.get_contract(date_util.load_date_str('2/16/2020'))
+		self.assertIsNone(err)
+		self.assertEqual('unused2', contract.contract_id)
+		self.assertEqual((0.02, None), contract.get_interest_rate(date_util.load_date_str('2/16/2020')))
+
+		# The contract is only built once
+		same_contract, err = contract_helper.get_contract(date_util.load_date_str('2/28/2020'))
+		self.assertIsNone(err)
+		self.assertIs(contract, same_contract)
+
+		contract, err = contract_helper.get_contract(date_util.load_date_str('2/29/2020'))
+		self.assertIsNotNone(err)
+
 class TestDynamicInterestRate(unittest.TestCase):
 
 	def test_missing_start_date(self) -> None:
@@ -355,6 +406,42 @@ class TestDynamicInterestRate(unittest.TestCase):
 			date_util.load_date_str('12/26/2021'))
 		self.assertIn('no interest rate configured', err.msg)
 
+		interest_rate, err = contract.get_interest_rate(
+			date_util.load_date_str('2/15/2020'))
+		self.assertIn('no interest rate configured', err.msg)
+
+	def test_interest_rate_after_updating_contract_dates(self) -> None:
+		contract_dict = models.ContractDict(
+					id='unused',
+					product_type=ProductType.INVENTORY_FINANCING,
+					product_config=_get_default_contract_config(ProductType.INVENTORY_FINANCING, {
+						'dynamic_interest_rate': json.dumps(
+							{'2/16/2020-10/30/2020': 0.5, '10/31/2020-12/26/2020': 0.2}
+						)
+					}),
+					start_date=date_util.load_date_str('2/16/2020'),
+					end_date=None,
+					adjusted_end_date=date_util.load_date_str('12/26/2020'),
+					terminated_at=None
+		)
+
+		contract, _ = contract_util.Contract.build(contract_dict, validate=False)
+		interest_rate, err = contract.get_interest_rate(date_util.load_date_str('1/2/2020'))
+		self.assertIsNotNone(err)
+
+		success, err = contract.update_fields_dependent_on_contract_dates(
+			new_contract_start_date=date_util.load_date_str('01/02/2020'),
+			new_contract_end_date=date_util.load_date_str('12/02/2020')
+		)
+		self.assertIsNone(err)
+
+		# Cached interest rates are dropped once the dynamic interest rate changes
+		self.assertEqual((0.5, None), contract.get_interest_rate(
+			date_util.load_date_str('1/2/2020')))
+		interest_rate, err = contract.get_interest_rate(
+			date_util.load_date_str('12/26/2020'))
+		self.assertIn('no interest rate configured', err.msg)
+
 	def test_update_fields_on_contract_dates(self) -> None:
 		company_id = 'unused_for_debug_msg'
 		tests: List[Dict] = [
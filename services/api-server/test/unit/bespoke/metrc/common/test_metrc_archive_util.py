@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+
+from bespoke import errors
+from bespoke.metrc.common import metrc_archive_util
+from bespoke.metrc.common.metrc_archive_util import ArchiveMode, ResponseArchive
+
+class TestResponseArchive(unittest.TestCase):
+
+	def test_put_and_get(self) -> None:
+		with tempfile.TemporaryDirectory() as archive_dir:
+			archive = ResponseArchive(archive_dir, ArchiveMode.RECORD)
+			archive.put('abcd', '/packages/v1/active', ['01/01/2020'], b'[{"Id": 1}]')
+			archive.put('abcd', '/packages/v1/inactive', ['01/01/2020'], b'[]')
+			archive.put('abcd', '/packages/v1/onhold', ['01/01/2020'], b'[]')
+			archive.put('efgh', '/packages/v1/active', ['01/01/2020'], b'[]')
+			# The last response archived for a request is the one kept
+			archive.put('abcd', '/packages/v1/onhold', ['01/01/2020'], b'[{"Id": 2}]')
+
+			self.assertEqual(b'[{"Id": 1}]', archive.get('abcd', '/packages/v1/active', ['01/01/2020']))
+			self.assertEqual(b'[]', archive.get('abcd', '/packages/v1/inactive', ['01/01/2020']))
+			self.assertEqual(b'[{"Id": 2}]', archive.get('abcd', '/packages/v1/onhold', ['01/01/2020']))
+			self.assertEqual(b'[]', archive.get('efgh', '/packages/v1/active', ['01/01/2020']))
+			self.assertIsNone(archive.get('abcd', '/packages/v1/active', ['01/02/2020']))
+			self.assertIsNone(archive.get('abcd', '/packages/v1/active', None))
+
+			# Identical responses are stored once
+			num_objects = sum([len(files) for _, _, files in os.walk(os.path.join(archive_dir, 'objects'))])
+			self.assertEqual(3, num_objects)
+
+			with self.assertRaises(errors.Error):
+				archive.get_response('abcd', '/packages/v1/active', ['01/02/2020'])
+
+	def test_put_and_get_time_ranges(self) -> None:
+		with tempfile.TemporaryDirectory() as archive_dir:
+			archive = ResponseArchive(archive_dir, ArchiveMode.RECORD)
+			time_ranges = [
+				['10/01/2020 00:00:00', '10/01/2020 12:00:00'],
+				['10/01/2020 12:00:00', '10/02/2020 00:00:00'],
+			]
+			archive.put_time_ranges('abcd', '/packages/v1/active', '10/01/2020', time_ranges)
+
+			self.assertEqual(time_ranges, archive.get_time_ranges('abcd', '/packages/v1/active', '10/01/2020'))
+			with self.assertRaises(errors.Error) as cm:
+				archive.get_time_ranges('abcd', '/packages/v1/active', '10/02/2020')
+			self.assertEqual(metrc_archive_util.NOT_IN_ARCHIVE_STATUS_CODE, cm.exception.details['status_code'])
+
+	def test_get_archive(self) -> None:
+		self.assertIsNone(metrc_archive_util.get_archive(None, ArchiveMode.RECORD))
+		self.assertIsNone(metrc_archive_util.get_archive('tmp/archive', ArchiveMode.OFF))
+		self.assertTrue(metrc_archive_util.get_archive('tmp/archive', ArchiveMode.REPLAY).is_replay())
+		with self.assertRaises(errors.Error):
+			metrc_archive_util.get_archive('tmp/archive', 'unknown')
@@ -1,10 +1,24 @@
+import datetime
+import json
+import tempfile
+import threading
+import time
 import unittest
+from datetime import timedelta
+from dateutil import parser
+from typing import Any, Callable, List
+from urllib.parse import parse_qs, urlparse
 
+from bespoke import errors
 from bespoke.date import date_util
-from bespoke.metrc.common import metrc_common_util
+from bespoke.metrc.common import (
+	metrc_archive_util, metrc_common_util, metrc_transport_util
+)
+from bespoke.metrc.common.metrc_archive_util import ArchiveMode, ResponseArchive
 from bespoke.metrc.common.metrc_common_util import (
-	_get_date_str, SplitTimeBy
+	_get_date_str, AuthDict, CompanyDetailsDict, SplitTimeBy
 )
+from bespoke.metrc.common.metrc_error_util import ErrorCatcher
 
 class TestFns(unittest.TestCase):
 
@@ -295,3 +309,302 @@ class TestFns(unittest.TestCase):
 			sales_receipts=True,
 			transfers=True,
 		), metrc_common_util.get_default_apis_to_use())
+
+class FakeResponse(object):
+
+	def __init__(self, status_code: int, content: Any) -> None:
+		self.status_code = status_code
+		self.ok = status_code == 200
+		self.reason = 'OK' if self.ok else 'Unauthorized'
+		self.content = json.dumps(content).encode('utf-8')
+
+class FakeREST(metrc_common_util.REST):
+	"""
+		Keeps track of how many requests were in flight at once, see _fake_get
+	"""
+
+	def __init__(self, user_key: str, failing_hours: List[int] = [], **kwargs: Any) -> None:
+		super(FakeREST, self).__init__(
+			sendgrid_client=None,
+			auth_dict=AuthDict(vendor_key='vendor-key', user_key=user_key),
+			company_details=CompanyDetailsDict(company_id='', name='Test company'),
+			license_number='abcd',
+			us_state='CA',
+			error_catcher=ErrorCatcher(),
+			**kwargs
+		)
+		self.failing_hours = failing_hours
+		self.max_in_flight = 0
+		self._in_flight = 0
+		self._lock = threading.Lock()
+
+class FakeTransport(metrc_transport_util.Transport):
+
+	def __init__(self, get: Callable[[str], FakeResponse]) -> None:
+		super(FakeTransport, self).__init__(requests_per_second_per_api_key=None)
+		self._fake_get = get
+
+	def get(self, base_url: str, url: str, auth: Any) -> Any:
+		return self._fake_get(url)
+
+def _fake_get(rest: FakeREST) -> Callable[[str], FakeResponse]:
+	def get(url: str) -> FakeResponse:
+		with rest._lock:
+			rest._in_flight += 1
+			rest.max_in_flight = max(rest.max_in_flight, rest._in_flight)
+
+		hour = int(url.split('lastModifiedStart=')[1][11:13])
+		# Later hours answer first, so the results only come back in order if
+		# they are joined in the order of the time ranges
+		time.sleep(0.001 * (24 - hour))
+
+		with rest._lock:
+			rest._in_flight -= 1
+
+		if hour in rest.failing_hours:
+			return FakeResponse(401, {})
+		return FakeResponse(200, [{'hour': hour}])
+	return get
+
+class TestREST(unittest.TestCase):
+
+	def setUp(self) -> None:
+		self._orig_transport = metrc_transport_util._transport
+
+	def tearDown(self) -> None:
+		metrc_transport_util._transport = self._orig_transport
+
+	def _get(self, rest: FakeREST) -> List[Any]:
+		metrc_transport_util._transport = FakeTransport(_fake_get(rest))
+		resp = rest.get('/sales/v1/receipts/active', time_range=['10/01/2020'], split_time_by=SplitTimeBy.HOUR)
+		return resp.results
+
+	def test_time_ranges_in_parallel_are_joined_in_order(self) -> None:
+		for num_parallel_time_ranges in [1, 8]:
+			with self.subTest(num_parallel_time_ranges=num_parallel_time_ranges):
+				rest = FakeREST(
+					user_key=f'join-in-order-{num_parallel_time_ranges}',
+					num_parallel_time_ranges=num_parallel_time_ranges,
+				)
+				self.assertEqual([{'hour': hour} for hour in range(24)], self._get(rest))
+				if num_parallel_time_ranges == 1:
+					self.assertEqual(1, rest.max_in_flight)
+				else:
+					self.assertGreater(rest.max_in_flight, 1)
+
+	def test_api_key_limits_requests_in_flight(self) -> None:
+		# Both share the API key, so together only 3 requests are in flight at once
+		rests = [
+			FakeREST(user_key='shared-key', num_parallel_time_ranges=8, max_concurrent_requests=3)
+			for _ in range(2)
+		]
+		in_flight_lock = threading.Lock()
+		in_flight = [0]
+		max_in_flight = [0]
+
+		def get(url: str) -> FakeResponse:
+			with in_flight_lock:
+				in_flight[0] += 1
+				max_in_flight[0] = max(max_in_flight[0], in_flight[0])
+			time.sleep(0.002)
+			with in_flight_lock:
+				in_flight[0] -= 1
+			return FakeResponse(200, [{'url': url}])
+
+		metrc_transport_util._transport = FakeTransport(get)
+		threads = [
+			threading.Thread(
+				target=rest.get,
+				args=('/sales/v1/receipts/active', ['10/01/2020'], SplitTimeBy.HOUR),
+			)
+			for rest in rests
+		]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+		self.assertGreater(max_in_flight[0], 1)
+		self.assertLessEqual(max_in_flight[0], 3)
+
+	def test_failing_time_range_raises_and_is_caught(self) -> None:
+		rest = FakeREST(user_key='failing-hour', failing_hours=[5], num_parallel_time_ranges=4)
+		with self.assertRaises(errors.Error) as cm:
+			self._get(rest)
+
+		self.assertIn('Code: 401', str(cm.exception))
+		retry_errors = rest._error_catcher.get_retry_errors()
+		self.assertEqual(1, len(retry_errors))
+		self.assertEqual(
+			['2020-10-01T05:00:00', '2020-10-01T06:00:00'],
+			retry_errors[0].retry_params['time_range'],
+		)
+
+	def test_archived_responses_are_replayed(self) -> None:
+		with tempfile.TemporaryDirectory() as archive_dir:
+			rest = FakeREST(
+				user_key='archive',
+				archive=ResponseArchive(archive_dir, ArchiveMode.RECORD),
+				failing_hours=[3],
+			)
+			with self.assertRaises(errors.Error):
+				self._get(rest)
+
+			def _fail_get(url: str) -> FakeResponse:
+				raise Exception('Replayed requests must not go to Metrc')
+
+			rest = FakeREST(
+				user_key='archive',
+				archive=ResponseArchive(archive_dir, ArchiveMode.REPLAY),
+			)
+			metrc_transport_util._transport = FakeTransport(_fail_get)
+			resp = rest.get(
+				'/sales/v1/receipts/active',
+				time_range=['2020-10-01T02:00:00', '2020-10-01T03:00:00'],
+			)
+			self.assertEqual([{'hour': 2}], json.loads(resp.content))
+
+			# Failed requests are not archived
+			with self.assertRaises(errors.Error) as cm:
+				rest.get(
+					'/sales/v1/receipts/active',
+					time_range=['2020-10-01T03:00:00', '2020-10-01T04:00:00'],
+				)
+			self.assertEqual(
+				metrc_archive_util.NOT_IN_ARCHIVE_STATUS_CODE, cm.exception.details['status_code'])
+
+class TestAdaptiveSplit(unittest.TestCase):
+
+	def setUp(self) -> None:
+		self._orig_transport = metrc_transport_util._transport
+		self._orig_hints = metrc_common_util._adaptive_window_hints
+		self._orig_max_results = metrc_common_util.MAX_RESULTS_PER_ADAPTIVE_WINDOW
+		metrc_common_util._adaptive_window_hints = metrc_common_util.AdaptiveWindowHints()
+
+	def tearDown(self) -> None:
+		metrc_transport_util._transport = self._orig_transport
+		metrc_common_util._adaptive_window_hints = self._orig_hints
+		metrc_common_util.MAX_RESULTS_PER_ADAPTIVE_WINDOW = self._orig_max_results
+
+	def _get(
+		self,
+		day_str: str,
+		events: List[datetime.datetime],
+		max_window: timedelta = None,
+		archive: ResponseArchive = None,
+	) -> List[List[datetime.datetime]]:
+		"""
+			Returns the windows queried. Windows longer than max_window time out.
+		"""
+		windows: List[List[datetime.datetime]] = []
+
+		def get(url: str) -> FakeResponse:
+			query = parse_qs(urlparse(url).query)
+			start = parser.parse(query['lastModifiedStart'][0])
+			end = parser.parse(query['lastModifiedEnd'][0])
+			windows.append([start, end])
+			if max_window and end - start > max_window:
+				return FakeResponse(504, {})
+			return FakeResponse(200, [{'at': e.isoformat()} for e in events if start <= e < end])
+
+		metrc_transport_util._transport = FakeTransport(get)
+		rest = FakeREST(user_key='adaptive', archive=archive)
+		resp = rest.get('/sales/v1/receipts/active', time_range=[day_str], split_time_by=SplitTimeBy.ADAPTIVE)
+		self.assertEqual([{'at': e.isoformat()} for e in events], resp.results)
+		return windows
+
+	def test_quiet_day_is_one_request(self) -> None:
+		events = [datetime.datetime(2020, 10, 1, hour) for hour in range(0, 24, 3)]
+		windows = self._get('10/01/2020', events)
+		self.assertEqual([[datetime.datetime(2020, 10, 1), datetime.datetime(2020, 10, 2)]], windows)
+
+	def test_timeouts_split_the_window(self) -> None:
+		events = [datetime.datetime(2020, 10, 1, hour, 30) for hour in range(24)]
+		windows = self._get('10/01/2020', events, max_window=timedelta(hours=3))
+
+		# Whole day, 12 and 6 hours time out, then 3 hours at a time, since
+		# 6 hours still time out after each sparse window
+		self.assertEqual(
+			[timedelta(hours=24), timedelta(hours=12), timedelta(hours=6)],
+			[end - start for start, end in windows[:3]])
+		successful_windows = [w for w in windows if w[1] - w[0] <= timedelta(hours=3)]
+		self.assertEqual(8, len(successful_windows))
+		self.assertEqual(datetime.datetime(2020, 10, 2), successful_windows[-1][1])
+
+		# The next day starts from the window that worked
+		windows = self._get('10/02/2020', [], max_window=timedelta(hours=3))
+		self.assertEqual(timedelta(hours=3), windows[0][1] - windows[0][0])
+		# and coalesces sparse windows
+		self.assertEqual(timedelta(hours=6), windows[1][1] - windows[1][0])
+
+	def test_large_results_shorten_the_next_windows(self) -> None:
+		metrc_common_util.MAX_RESULTS_PER_ADAPTIVE_WINDOW = 4
+		events = [datetime.datetime(2020, 10, 1, hour) for hour in range(12)]
+		windows = self._get('10/01/2020', events)
+		self.assertEqual(1, len(windows))
+
+		windows = self._get('10/02/2020', [datetime.datetime(2020, 10, 2, hour) for hour in range(12)])
+		self.assertEqual(
+			[timedelta(hours=12), timedelta(hours=6), timedelta(hours=6)],
+			[end - start for start, end in windows])
+
+	def test_get_adaptive_results_splits_on_timeouts_and_too_many_results(self) -> None:
+		metrc_common_util.MAX_RESULTS_PER_ADAPTIVE_WINDOW = 4
+		events = [datetime.datetime(2020, 10, 1, hour) for hour in range(6)]
+
+		for status_code in metrc_common_util.TIMEOUT_STATUS_CODES:
+			with self.subTest(status_code=status_code):
+				metrc_common_util._adaptive_window_hints = metrc_common_util.AdaptiveWindowHints()
+				windows: List[timedelta] = []
+
+				def get(url: str) -> FakeResponse:
+					query = parse_qs(urlparse(url).query)
+					start = parser.parse(query['lastModifiedStart'][0])
+					end = parser.parse(query['lastModifiedEnd'][0])
+					windows.append(end - start)
+					if end - start > timedelta(hours=12):
+						return FakeResponse(status_code, {})
+					return FakeResponse(200, [{'at': e.isoformat()} for e in events if start <= e < end])
+
+				metrc_transport_util._transport = FakeTransport(get)
+				rest = FakeREST(user_key=f'adaptive-{status_code}')
+				results = rest._get_adaptive_results('/packages/v1/active', '10/01/2020')
+
+				self.assertEqual([{'at': e.isoformat()} for e in events], results)
+				# The whole day times out and is queried in halves. The first half
+				# has too many results, so the window after it is halved again,
+				# and the quiet window after that doubles the last one back.
+				self.assertEqual(
+					[timedelta(hours=24), timedelta(hours=12), timedelta(hours=6), timedelta(hours=6)],
+					windows,
+				)
+				# Timeouts are not reported as errors of the download
+				self.assertEqual([], rest._error_catcher.get_retry_errors())
+
+	def test_adaptive_downloads_are_replayed_from_the_archive(self) -> None:
+		events = [datetime.datetime(2020, 10, 1, hour, 30) for hour in range(24)]
+		with tempfile.TemporaryDirectory() as archive_dir:
+			windows = self._get(
+				'10/01/2020',
+				events,
+				max_window=timedelta(hours=3),
+				archive=ResponseArchive(archive_dir, ArchiveMode.RECORD),
+			)
+			# Only the windows that did not time out are archived
+			self.assertGreater(len(windows), 8)
+
+			def _fail_get(url: str) -> FakeResponse:
+				raise Exception('Replayed requests must not go to Metrc')
+
+			# Like a new process, the replay has no window hints, and still only
+			# queries the windows in the archive
+			metrc_common_util._adaptive_window_hints = metrc_common_util.AdaptiveWindowHints()
+			metrc_transport_util._transport = FakeTransport(_fail_get)
+			rest = FakeREST(user_key='adaptive', archive=ResponseArchive(archive_dir, ArchiveMode.REPLAY))
+			resp = rest.get('/sales/v1/receipts/active', time_range=['10/01/2020'], split_time_by=SplitTimeBy.ADAPTIVE)
+			self.assertEqual([{'at': e.isoformat()} for e in events], resp.results)
+
+			with self.assertRaises(errors.Error) as cm:
+				rest.get('/sales/v1/receipts/active', time_range=['10/02/2020'], split_time_by=SplitTimeBy.ADAPTIVE)
+			self.assertEqual(
+				metrc_archive_util.NOT_IN_ARCHIVE_STATUS_CODE, cm.exception.details['status_code'])
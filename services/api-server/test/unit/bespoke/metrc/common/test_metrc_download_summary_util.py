@@ -8,7 +8,8 @@ from bespoke.db import models
 from bespoke.db.models import session_scope
 from bespoke.metrc import metrc_api_keys_util
 from bespoke.metrc.common import metrc_common_util
-from bespoke.metrc.common import metrc_download_summary_util
+from bespoke.metrc.common import metrc_download_summary_util, metrc_metrics_util
+from bespoke.metrc.common.metrc_metrics_util import Phase
 from bespoke.metrc.common.metrc_error_util import (
 	MetrcErrorDetailsDict, BESPOKE_INTERNAL_ERROR_STATUS_CODE
 )
@@ -276,6 +277,7 @@ class TestWriteMetrcDownloadSummaryAndNeedsRerun(db_unittest.TestCase):
 				retry_errors=error_catcher.get_retry_errors(),
 				company_id=test['company_id'],
 				metrc_api_key_id=test['metrc_api_key_id'],
+				metrics=test.get('metrics'),
 			)
 
 	def test_write_two_different_summaries_from_same_api_key(self) -> None:
@@ -524,3 +526,64 @@ class TestWriteMetrcDownloadSummaryAndNeedsRerun(db_unittest.TestCase):
 				'cur_date': date_util.load_date_str('10/01/2020'),
 				'company_id': company_id_1,
 			}, retry_infos[0])
+
+	def test_sync_metrics_report(self) -> None:
+		self.reset()
+		seed = test_helper.BasicSeed.create(self.session_maker, self)
+		seed.initialize()
+
+		metrc_api_key_id = self._write_metrc_api_key(seed, company_index=0)
+		company_id = seed.get_company_id('company_admin', index=0)
+
+		for cur_date, license_number, seconds in [
+			('10/01/2020', 'abcd', 1.0),
+			('10/02/2020', 'abcd', 2.0),
+			('10/01/2020', 'efgh', 4.0),
+			# Outside of the report dates
+			('10/05/2020', 'abcd', 8.0),
+		]:
+			metrics = metrc_metrics_util.SyncMetrics()
+			request_metric = metrc_metrics_util.new_request_metric('/packages/v1/active', [cur_date])
+			request_metric.update(status_code=200, seconds=seconds, num_bytes=100)
+			metrics.add_request(request_metric)
+			metrics.add_phase('packages', Phase.WRITE, seconds=seconds / 2, num_rows=10)
+			self._write_metrc_download_summary({
+				'cur_date': cur_date,
+				'company_id': company_id,
+				'metrc_api_key_id': metrc_api_key_id,
+				'license_number': license_number,
+				'errors': [],
+				'metrics': metrics.get_summary(),
+			})
+
+		# Downloads from before metrics were recorded are left out
+		self._write_metrc_download_summary({
+			'cur_date': '10/01/2020',
+			'company_id': company_id,
+			'metrc_api_key_id': metrc_api_key_id,
+			'license_number': 'ijkl',
+			'errors': [],
+		})
+
+		with session_scope(self.session_maker) as session:
+			report, err = metrc_download_summary_util.get_sync_metrics_report(
+				session,
+				start_date=date_util.load_date_str('10/01/2020'),
+				end_date=date_util.load_date_str('10/02/2020'),
+			)
+			self.assertIsNone(err)
+
+		self.assertEqual(
+			[('efgh', '/packages/v1/active', 1, 4.0, 100), ('abcd', '/packages/v1/active', 2, 3.0, 200)],
+			[
+				(row['license_number'], row['endpoint'], row['num_days'], row['metrics']['seconds'], row['metrics']['num_bytes'])
+				for row in report['endpoints']
+			],
+		)
+		self.assertEqual(
+			[('efgh', 'packages', Phase.WRITE, 1, 2.0, 10), ('abcd', 'packages', Phase.WRITE, 2, 1.5, 20)],
+			[
+				(row['license_number'], row['api'], row['phase'], row['num_days'], row['seconds'], row['num_rows'])
+				for row in report['phases']
+			],
+		)
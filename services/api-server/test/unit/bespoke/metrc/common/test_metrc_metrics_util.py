@@ -0,0 +1,55 @@
+import unittest
+
+from bespoke.metrc.common import metrc_common_util, metrc_metrics_util
+from bespoke.metrc.common.metrc_common_util import (
+	AuthDict, CompanyDetailsDict, SplitTimeBy
+)
+from bespoke.metrc.common.metrc_error_util import ErrorCatcher
+
+from bespoke_test.metrc import metrc_simulator
+
+class TestSyncMetrics(unittest.TestCase):
+
+	def test_get_endpoint(self) -> None:
+		for path, expected in [
+			('/packages/v1/active', '/packages/v1/active'),
+			('/sales/v1/receipts/1234', '/sales/v1/receipts/{id}'),
+			('/transfers/v1/1234/deliveries', '/transfers/v1/{id}/deliveries'),
+			('/transfers/v1/delivery/1234/packages/wholesale?licenseNumber=abcd', '/transfers/v1/delivery/{id}/packages/wholesale'),
+		]:
+			self.assertEqual(expected, metrc_metrics_util.get_endpoint(path))
+
+	def test_requests_are_measured(self) -> None:
+		config = metrc_simulator.get_default_simulator_config()
+		config.update(sales_receipts_per_day=10, too_many_requests_rate=0.3, retry_after_seconds=0.0)
+		uninstall_simulator = metrc_simulator.install_simulator(metrc_simulator.MetrcSimulator(config, ['abcd']))
+
+		metrics = metrc_metrics_util.SyncMetrics()
+		rest = metrc_common_util.REST(
+			sendgrid_client=None,
+			auth_dict=AuthDict(vendor_key='vendor-key', user_key='requests-are-measured'),
+			company_details=CompanyDetailsDict(company_id='', name='Test company'),
+			license_number='abcd',
+			us_state='CA',
+			error_catcher=ErrorCatcher(),
+			metrics=metrics,
+		)
+		try:
+			receipts = rest.get(
+				'/sales/v1/receipts/active', time_range=['10/01/2020'], split_time_by=SplitTimeBy.HOUR).results
+			rest.get(f'/sales/v1/receipts/{receipts[0]["Id"]}')
+		finally:
+			uninstall_simulator()
+
+		summary = metrics.get_summary()
+		self.assertEqual(['/sales/v1/receipts/active', '/sales/v1/receipts/{id}'], sorted(summary['endpoints'].keys()))
+
+		receipts_metrics = summary['endpoints']['/sales/v1/receipts/active']
+		self.assertEqual(24, receipts_metrics['num_requests'])
+		self.assertEqual(0, receipts_metrics['num_failed_requests'])
+		self.assertEqual(5, receipts_metrics['num_results'])
+		self.assertGreater(receipts_metrics['num_bytes'], 0)
+		self.assertGreater(receipts_metrics['num_too_many_requests'], 0)
+		self.assertEqual(receipts_metrics['num_too_many_requests'], receipts_metrics['num_retries'])
+		self.assertEqual(1, summary['endpoints']['/sales/v1/receipts/{id}']['num_requests'])
+		self.assertEqual(metrc_metrics_util.NUM_SLOWEST_REQUESTS, len(summary['slowest_requests']))
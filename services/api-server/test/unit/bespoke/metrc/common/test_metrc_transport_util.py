@@ -0,0 +1,83 @@
+import time
+import unittest
+from typing import Any, Dict, List
+
+from requests.auth import HTTPBasicAuth
+
+from bespoke.metrc.common import metrc_transport_util
+from bespoke.metrc.common.metrc_transport_util import TokenBucket
+
+class FakeResponse(object):
+
+	def __init__(self, status_code: int, headers: Dict[str, str] = None) -> None:
+		self.status_code = status_code
+		self.headers = headers or {}
+
+class FakeSession(object):
+
+	def __init__(self, responses: List[FakeResponse]) -> None:
+		self.responses = responses
+		self.requested_at: List[float] = []
+
+	def get(self, url: str, auth: Any) -> FakeResponse:
+		self.requested_at.append(time.monotonic())
+		return self.responses.pop(0)
+
+class TestTokenBucket(unittest.TestCase):
+
+	def test_limits_requests_per_second(self) -> None:
+		bucket = TokenBucket(requests_per_second=50.0, capacity=1.0)
+		start = time.monotonic()
+		for _ in range(6):
+			bucket.acquire()
+		# The first token is there from the start, the other 5 take 20ms each
+		self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+	def test_pause_holds_back_requests(self) -> None:
+		for requests_per_second in [None, 1000.0]:
+			with self.subTest(requests_per_second=requests_per_second):
+				bucket = TokenBucket(requests_per_second=requests_per_second)
+				bucket.pause(0.05)
+				self.assertGreaterEqual(bucket.acquire(), 0.04)
+				self.assertEqual(0.0, bucket.acquire())
+
+class TestTransport(unittest.TestCase):
+
+	def test_get_retry_after_seconds(self) -> None:
+		tests: List[Dict] = [
+			{'headers': {}, 'expected': metrc_transport_util.DEFAULT_RETRY_AFTER_SECONDS},
+			{'headers': {'Retry-After': '3'}, 'expected': 3.0},
+			{'headers': {'Retry-After': 'not a date'}, 'expected': metrc_transport_util.DEFAULT_RETRY_AFTER_SECONDS},
+			{'headers': {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}, 'expected': 0.0},
+		]
+		for test in tests:
+			self.assertEqual(
+				test['expected'],
+				metrc_transport_util.get_retry_after_seconds(FakeResponse(429, test['headers'])),
+			)
+
+	def test_too_many_requests_pauses_api_key(self) -> None:
+		base_url = 'https://api-ca.metrc.com'
+		session = FakeSession([
+			FakeResponse(429, {'Retry-After': '0.05'}),
+			FakeResponse(200),
+			FakeResponse(200),
+		])
+		transport = metrc_transport_util.Transport(requests_per_second_per_api_key=None)
+		transport._base_url_to_session[base_url] = session # type: ignore
+
+		auth = HTTPBasicAuth('vendor-key', 'user-key')
+		other_auth = HTTPBasicAuth('vendor-key', 'other-user-key')
+		self.assertEqual(429, transport.get(base_url, base_url + '/facilities/v1/', auth).status_code)
+		# Other API keys are not held back
+		transport.get(base_url, base_url + '/facilities/v1/', other_auth)
+		transport.get(base_url, base_url + '/facilities/v1/', auth)
+
+		self.assertLess(session.requested_at[1] - session.requested_at[0], 0.04)
+		self.assertGreaterEqual(session.requested_at[2] - session.requested_at[0], 0.04)
+
+	def test_one_session_per_base_url(self) -> None:
+		transport = metrc_transport_util.Transport(requests_per_second_per_api_key=None)
+		ca_session = transport._get_session('https://api-ca.metrc.com')
+		self.assertIs(ca_session, transport._get_session('https://api-ca.metrc.com'))
+		self.assertIsNot(ca_session, transport._get_session('https://api-co.metrc.com'))
@@ -0,0 +1,122 @@
+import datetime
+from typing import Any, Dict, List
+
+from bespoke.db import db_constants, models
+from bespoke.db.models import session_scope
+from bespoke.metrc.common import metrc_upsert_util
+from bespoke.metrc.common.package_common_util import (
+	PACKAGE_KEEP_IF_UNSET_COLUMNS, PACKAGE_UPDATE_COLUMNS
+)
+
+from bespoke_test.db import db_unittest
+
+def _package_row(package_id: str, last_modified_at: datetime.datetime, **kwargs: Any) -> Dict:
+	row = {column: None for column in ['us_state', 'package_id'] + PACKAGE_UPDATE_COLUMNS}
+	row.update(
+		us_state='CA',
+		package_id=package_id,
+		license_number='abcd',
+		packaged_date=datetime.date(2020, 1, 1),
+		last_modified_at=last_modified_at,
+	)
+	row.update(kwargs)
+	return row
+
+class TestUpsertRows(db_unittest.TestCase):
+
+	def _upsert(self, rows: List[Dict]) -> Dict:
+		with session_scope(self.session_maker) as session:
+			return metrc_upsert_util.upsert_rows(
+				session,
+				models.MetrcPackage,
+				rows,
+				key_columns=['us_state', 'package_id'],
+				update_columns=PACKAGE_UPDATE_COLUMNS,
+				keep_if_unset_columns=PACKAGE_KEEP_IF_UNSET_COLUMNS,
+			)
+
+	def _get_packages(self) -> Dict[str, Dict]:
+		with session_scope(self.session_maker) as session:
+			return {
+				p.package_id: {
+					'id': str(p.id),
+					'type': p.type,
+					'product_name': p.product_name,
+					'last_modified_at': p.last_modified_at,
+				}
+				for p in session.query(models.MetrcPackage).all()
+			}
+
+	def test_insert_and_update(self) -> None:
+		self.reset()
+		day1 = datetime.datetime(2020, 1, 1)
+		day2 = datetime.datetime(2020, 1, 2)
+		day3 = datetime.datetime(2020, 1, 3)
+
+		key_to_id = self._upsert([
+			_package_row('1', day2, type=db_constants.PackageType.ACTIVE, product_name='p1'),
+			_package_row('2', day2, type=db_constants.PackageType.ACTIVE, product_name='p2'),
+			# The newer of the rows with the same key is written, and it keeps
+			# the type of the older one since it doesn't define it
+			_package_row('3', day2, type=db_constants.PackageType.ACTIVE, product_name='p3-old'),
+			_package_row('3', day3, product_name='p3'),
+			_package_row('3', day1, product_name='p3-older'),
+		])
+		packages = self._get_packages()
+		self.assertEqual(['1', '2', '3'], sorted(packages.keys()))
+		for package_id, package in packages.items():
+			self.assertEqual(package['id'], key_to_id[('CA', package_id)])
+		self.assertEqual('p3', packages['3']['product_name'])
+		self.assertEqual(db_constants.PackageType.ACTIVE, packages['3']['type'])
+
+		key_to_id = self._upsert([
+			# Older than what is written, so it is skipped
+			_package_row('1', day1, type=db_constants.PackageType.INACTIVE, product_name='p1-old'),
+			# Newer, but keeps the type written
+			_package_row('2', day3, product_name='p2-new'),
+			_package_row('4', day1, type=db_constants.PackageType.INACTIVE, product_name='p4'),
+		])
+		new_packages = self._get_packages()
+		self.assertEqual(['1', '2', '3', '4'], sorted(new_packages.keys()))
+		# The ids of skipped rows are returned too
+		self.assertEqual(packages['1']['id'], key_to_id[('CA', '1')])
+		self.assertEqual(packages['2']['id'], key_to_id[('CA', '2')])
+		self.assertEqual(new_packages['4']['id'], key_to_id[('CA', '4')])
+
+		self.assertEqual({
+			'id': packages['1']['id'],
+			'type': db_constants.PackageType.ACTIVE,
+			'product_name': 'p1',
+			'last_modified_at': day2,
+		}, new_packages['1'])
+		self.assertEqual({
+			'id': packages['2']['id'],
+			'type': db_constants.PackageType.ACTIVE,
+			'product_name': 'p2-new',
+			'last_modified_at': day3,
+		}, new_packages['2'])
+
+	def test_without_guard_column(self) -> None:
+		self.reset()
+		with session_scope(self.session_maker) as session:
+			for last_modified_at, manifest_number in [
+				(datetime.datetime(2020, 1, 2), 'new'),
+				(datetime.datetime(2020, 1, 1), 'old'),
+			]:
+				metrc_upsert_util.upsert_rows(
+					session,
+					models.MetrcTransfer,
+					[{
+						'us_state': 'CA',
+						'transfer_id': '1',
+						'manifest_number': manifest_number,
+						'last_modified_at': last_modified_at,
+					}],
+					key_columns=['us_state', 'transfer_id'],
+					update_columns=['manifest_number', 'last_modified_at'],
+					guard_column=None,
+				)
+
+		with session_scope(self.session_maker) as session:
+			transfers = session.query(models.MetrcTransfer).all()
+			self.assertEqual(['old'], [t.manifest_number for t in transfers])
@@ -358,3 +358,39 @@ class TestUpdatePackages(db_unittest.TestCase):
 
 			self.assertEqual('2-name-NEW', metrc_packages[2].product_name)
 			self.assertEqual({'Label': 'B-NEW'}, metrc_packages[2].package_payload)
+
+	def test_update_packages_with_a_quantity_of_zero(self) -> None:
+		self.reset()
+
+		def get_package(quantity: decimal.Decimal, last_modified_at: str) -> models.MetrcPackage:
+			return models.MetrcPackage(
+				type='type-1',
+				license_number='abcd',
+				us_state='CA',
+				package_id='1',
+				package_label='A',
+				package_payload={'Label': 'A'},
+				last_modified_at=parser.parse(last_modified_at),
+				packaged_date=parser.parse('01/01/2020'),
+				quantity=quantity,
+				unit_of_measure='Each',
+			)
+
+		def get_quantity() -> decimal.Decimal:
+			with session_scope(self.session_maker) as session:
+				package = cast(models.MetrcPackage, session.query(models.MetrcPackage).first())
+				return package.quantity
+
+		with session_scope(self.session_maker) as session:
+			package_common_util.update_packages([get_package(decimal.Decimal(5), '01/01/2020')], session=session)
+		self.assertEqual(decimal.Decimal(5), get_quantity())
+
+		# A package without a quantity keeps the one we have
+		with session_scope(self.session_maker) as session:
+			package_common_util.update_packages([get_package(None, '01/02/2020')], session=session)
+		self.assertEqual(decimal.Decimal(5), get_quantity())
+
+		# All of the package was used up
+		with session_scope(self.session_maker) as session:
+			package_common_util.update_packages([get_package(decimal.Decimal(0), '01/03/2020')], session=session)
+		self.assertEqual(decimal.Decimal(0), get_quantity())
@@ -0,0 +1,84 @@
+import datetime
+import threading
+from typing import List
+
+from bespoke.metrc import metrc_download_util
+from sqlalchemy.orm.session import Session
+
+from bespoke_test.db import db_unittest
+
+class TestDownloadDatesInBackground(db_unittest.TestCase):
+
+	def _get_dates(self, num_days: int) -> List[datetime.date]:
+		return [datetime.date(2020, 1, 1) + datetime.timedelta(days=i) for i in range(num_days)]
+
+	def test_yields_dates_in_order_and_downloads_ahead(self) -> None:
+		dates = self._get_dates(5)
+		downloaded_dates: List[datetime.date] = []
+		download_thread_ids = set()
+		lock = threading.Lock()
+
+		def _download_date(session: Session, date: datetime.date) -> datetime.date:
+			with lock:
+				downloaded_dates.append(date)
+				download_thread_ids.add(threading.get_ident())
+			return date
+
+		written_dates = []
+		max_ahead = 0
+		for date in metrc_download_util.download_dates_in_background(
+			session_maker=self.session_maker,
+			dates=dates,
+			download_date=_download_date,
+			max_prefetched_days=1,
+		):
+			with lock:
+				max_ahead = max(max_ahead, len(downloaded_dates) - len(written_dates))
+			written_dates.append(date)
+
+		self.assertEqual(dates, written_dates)
+		self.assertEqual(dates, downloaded_dates)
+		self.assertNotIn(threading.get_ident(), download_thread_ids)
+		# The day being written, 1 day waiting and 1 day being downloaded
+		self.assertLessEqual(max_ahead, 3)
+
+	def test_closing_stops_downloads(self) -> None:
+		dates = self._get_dates(10)
+		downloaded_dates: List[datetime.date] = []
+
+		def _download_date(session: Session, date: datetime.date) -> datetime.date:
+			downloaded_dates.append(date)
+			return date
+
+		date_downloads = metrc_download_util.download_dates_in_background(
+			session_maker=self.session_maker,
+			dates=dates,
+			download_date=_download_date,
+			max_prefetched_days=1,
+		)
+		for date in date_downloads:
+			if date == dates[1]:
+				break
+		date_downloads.close()
+
+		self.assertLessEqual(len(downloaded_dates), 4)
+
+	def test_download_exceptions_are_raised(self) -> None:
+		dates = self._get_dates(3)
+
+		def _download_date(session: Session, date: datetime.date) -> datetime.date:
+			if date == dates[1]:
+				raise Exception('Failed to download')
+			return date
+
+		written_dates = []
+		with self.assertRaises(Exception):
+			for date in metrc_download_util.download_dates_in_background(
+				session_maker=self.session_maker,
+				dates=dates,
+				download_date=_download_date,
+				max_prefetched_days=2,
+			):
+				written_dates.append(date)
+
+		self.assertEqual([dates[0]], written_dates)
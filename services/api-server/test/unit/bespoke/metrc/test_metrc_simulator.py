@@ -0,0 +1,67 @@
+import json
+import unittest
+from typing import Any, Callable, Optional
+
+from bespoke.metrc.common import metrc_common_util
+from bespoke.metrc.common.metrc_common_util import (
+	AuthDict, CompanyDetailsDict, SplitTimeBy
+)
+from bespoke.metrc.common.metrc_error_util import ErrorCatcher
+
+from bespoke_test.metrc import metrc_simulator
+
+def _get_rest(user_key: str) -> metrc_common_util.REST:
+	return metrc_common_util.REST(
+		sendgrid_client=None,
+		auth_dict=AuthDict(vendor_key='vendor-key', user_key=user_key),
+		company_details=CompanyDetailsDict(company_id='', name='Test company'),
+		license_number='abcd',
+		us_state='CA',
+		error_catcher=ErrorCatcher(),
+	)
+
+class TestMetrcSimulator(unittest.TestCase):
+
+	def setUp(self) -> None:
+		self._uninstall_simulator: Optional[Callable[[], None]] = None
+
+	def tearDown(self) -> None:
+		if self._uninstall_simulator:
+			self._uninstall_simulator()
+
+	def _install(self, **kwargs: Any) -> metrc_simulator.MetrcSimulator:
+		config = metrc_simulator.get_default_simulator_config()
+		config.update(kwargs)
+		simulator = metrc_simulator.MetrcSimulator(config, ['abcd'])
+		self._uninstall_simulator = metrc_simulator.install_simulator(simulator)
+		return simulator
+
+	def test_time_ranges_split_the_day(self) -> None:
+		simulator = self._install(sales_receipts_per_day=10)
+		rest = _get_rest('split-the-day')
+
+		receipts = json.loads(rest.get('/sales/v1/receipts/active', time_range=['10/01/2020']).content)
+		hourly_receipts = rest.get(
+			'/sales/v1/receipts/active', time_range=['10/01/2020'], split_time_by=SplitTimeBy.HOUR).results
+
+		# Half the receipts are active, the other half inactive
+		self.assertEqual(5, len(receipts))
+		self.assertEqual(receipts, hourly_receipts)
+		self.assertEqual(25, simulator.num_requests)
+
+		transactions = json.loads(rest.get(f'/sales/v1/receipts/{receipts[0]["Id"]}').content)
+		self.assertEqual(3, len(transactions['Transactions']))
+		# The same request always gets the same response
+		self.assertEqual(
+			transactions, json.loads(rest.get(f'/sales/v1/receipts/{receipts[0]["Id"]}').content))
+
+	def test_too_many_requests_are_retried(self) -> None:
+		simulator = self._install(too_many_requests_rate=0.3, retry_after_seconds=0.0)
+		rest = _get_rest('too-many-requests')
+
+		hourly_receipts = rest.get(
+			'/sales/v1/receipts/active', time_range=['10/01/2020'], split_time_by=SplitTimeBy.HOUR).results
+
+		self.assertEqual(25, len(hourly_receipts))
+		self.assertEqual(24, simulator.status_code_to_count[200])
+		self.assertGreater(simulator.status_code_to_count[429], 0)
@@ -1,3 +1,4 @@
+import unittest
 import uuid
 from dateutil import parser
 from typing import Callable, Dict, List, cast
@@ -681,3 +682,173 @@ class TestPopulateSalesTable(db_unittest.TestCase):
 
 		self._assert_transactions(expected_transactions, session_maker)
 
+
+class TestBulkLookups(db_unittest.TestCase):
+
+	def test_lookups_by_receipt_id(self) -> None:
+		self.reset()
+		with session_scope(self.session_maker) as session:
+			for us_state, receipt_id, num_txs in [
+				('CA', '1', 2),
+				('CA', '2', 1),
+				('CA', '4', 3),
+				('CO', '1', 5),
+			]:
+				session.add(models.MetrcSalesReceipt(
+					us_state=us_state,
+					license_number='abcd',
+					receipt_id=receipt_id,
+					receipt_number=f'{receipt_id}-receipt-num',
+				))
+				for i in range(num_txs):
+					session.add(models.MetrcSalesTransaction(
+						us_state=us_state,
+						license_number='abcd',
+						receipt_id=receipt_id,
+						package_id=str(i),
+					))
+
+		orig_batch_size = metrc_common_util.LOOKUP_BATCH_SIZE
+		# Look up 2 receipt ids at a time, so the results of several queries are combined
+		metrc_common_util.LOOKUP_BATCH_SIZE = 2
+		try:
+			with session_scope(self.session_maker) as session:
+				receipt_ids = ['1', '2', '3', '4', '1']
+				prev_receipts = sales_util._get_prev_sales_receipts(receipt_ids, 'CA', session)
+				self.assertEqual(['1', '2', '4'], sorted([r.receipt_id for r in prev_receipts]))
+
+				self.assertEqual({'1': 2, '2': 1, '4': 3}, metrc_common_util.get_id_to_row_count(
+					session,
+					models.MetrcSalesTransaction.receipt_id,
+					receipt_ids,
+					filters=[models.MetrcSalesTransaction.us_state == 'CA'],
+				))
+
+				receipt_id_to_prev_txs = sales_util._get_prev_sales_transactions(receipt_ids, 'CO', session)
+				self.assertEqual(['1'], list(receipt_id_to_prev_txs.keys()))
+				self.assertEqual(5, len(receipt_id_to_prev_txs['1']))
+		finally:
+			metrc_common_util.LOOKUP_BATCH_SIZE = orig_batch_size
+
+class TestWriteSalesReceipts(db_unittest.TestCase):
+
+	def _write(self, last_modified_at: str, package_id_to_quantity: Dict[str, int]) -> None:
+		receipt = models.MetrcSalesReceipt(
+			type='active',
+			us_state='CA',
+			license_number='abcd',
+			receipt_id='1',
+			receipt_number='1-receipt-num',
+			last_modified_at=parser.parse(last_modified_at),
+		)
+		transactions = [
+			models.MetrcSalesTransaction(
+				type='active',
+				us_state='CA',
+				license_number='abcd',
+				receipt_id='1',
+				package_id=package_id,
+				quantity_sold=quantity,
+				last_modified_at=parser.parse(last_modified_at),
+				is_deleted=False,
+			)
+			for package_id, quantity in package_id_to_quantity.items()
+		]
+		with session_scope(self.session_maker) as session:
+			sales_util._write_sales_receipts_chunk([sales_util.SalesReceiptObj(receipt, transactions)], session)
+
+	def _get_transactions(self) -> Dict[str, Dict]:
+		with session_scope(self.session_maker) as session:
+			return {
+				tx.package_id: {'quantity_sold': int(tx.quantity_sold), 'is_deleted': tx.is_deleted}
+				for tx in session.query(models.MetrcSalesTransaction).all()
+			}
+
+	def test_transactions_of_an_older_receipt_are_not_written(self) -> None:
+		self.reset()
+		self._write('02/02/2020', {'1': 1, '2': 2})
+
+		self._write('02/01/2020', {'1': 9})
+		self.assertEqual({
+			'1': {'quantity_sold': 1, 'is_deleted': False},
+			'2': {'quantity_sold': 2, 'is_deleted': False},
+		}, self._get_transactions())
+
+		self._write('02/03/2020', {'1': 5})
+		self.assertEqual({
+			'1': {'quantity_sold': 5, 'is_deleted': False},
+			'2': {'quantity_sold': 2, 'is_deleted': True},
+		}, self._get_transactions())
+
+class TestGetSalesReceiptModels(unittest.TestCase):
+
+	def test_partial_failures_are_left_out(self) -> None:
+		ctx = metrc_test_helper.create_download_context(
+			cur_date='1/1/2020',
+			company_id=str(uuid.uuid4()),
+			name='Company 1',
+			license_auth=LicenseAuthDict(
+				license_number='abcd',
+				us_state='CA',
+				vendor_key='vkey',
+				user_key='ukey'
+			)
+		)
+		ok_receipt_ids = [1, 2, 4, 6]
+		req_to_resp: Dict[RequestKey, Dict] = {
+			RequestKey(url=f'/sales/v1/receipts/{receipt_id}', time_range=None): {
+				'resps': [{
+					'status': 'OK',
+					'json': {
+						'Transactions': [
+							_sales_transaction_json({
+								'Id': receipt_id * 10,
+								'LastModified': parser.parse('02/01/2020').isoformat(),
+								'RecordedDateTime': parser.parse('02/02/2020').isoformat(),
+								'QuantitySold': 1,
+								'TotalPrice': 10.1,
+							}),
+						]
+					}
+				}]
+			}
+			for receipt_id in ok_receipt_ids
+		}
+		# Receipt 3 is unexpectedly missing its transactions, and receipt 5
+		# is a request Metrc fails
+		req_to_resp[RequestKey(url='/sales/v1/receipts/3', time_range=None)] = {
+			'resps': [{'status': 'OK', 'json': {}}]
+		}
+		ctx.rest = cast(metrc_common_util.REST, FakeREST(req_to_resp=req_to_resp))
+		ctx.worker_cfg.num_parallel_sales_transactions = 3
+
+		sales_receipt_objs = sales_util.get_sales_receipt_models(
+			receipt_type='active',
+			start_i=0,
+			cur_sales_receipts=[
+				_sales_receipt_json({
+					'Id': receipt_id,
+					'LastModified': parser.parse('02/01/2020').isoformat(),
+					'SalesDateTime': parser.parse('02/02/2020').isoformat(),
+					'TotalPackages': 1,
+					'TotalPrice': 10.1,
+					'IsFinal': False,
+				})
+				for receipt_id in range(1, 7)
+			],
+			ctx=ctx,
+		)
+
+		self.assertEqual(
+			[str(receipt_id) for receipt_id in ok_receipt_ids],
+			[obj.metrc_receipt.receipt_id for obj in sales_receipt_objs],
+		)
+		self.assertEqual(
+			[[str(receipt_id * 10 + 1)] for receipt_id in ok_receipt_ids],
+			[[tx.package_id for tx in obj.transactions] for obj in sales_receipt_objs],
+		)
+		self.assertEqual(200, ctx.request_status['sales_transactions_api'])
+		self.assertEqual(
+			['/sales/v1/receipts/3'],
+			[retry_error.retry_params['path'] for retry_error in ctx.get_retry_errors()],
+		)
@@ -0,0 +1 @@
+DROP TABLE "public"."loan_balance_checkpoints";
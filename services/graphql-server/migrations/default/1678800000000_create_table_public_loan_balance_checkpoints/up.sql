@@ -0,0 +1,3 @@
+CREATE TABLE "public"."loan_balance_checkpoints" ("id" uuid NOT NULL DEFAULT gen_random_uuid(), "company_id" uuid NOT NULL, "loan_id" uuid NOT NULL, "date" date NOT NULL, "inputs_hash" text NOT NULL, "state_payload" json NOT NULL, "created_at" timestamptz NOT NULL DEFAULT now(), "updated_at" timestamptz NOT NULL DEFAULT now(), PRIMARY KEY ("id") , FOREIGN KEY ("loan_id") REFERENCES "public"."loans"("id") ON UPDATE restrict ON DELETE cascade, UNIQUE ("id"), UNIQUE ("loan_id", "date"));
+CREATE INDEX "loan_balance_checkpoints_company_id_date_idx" ON "public"."loan_balance_checkpoints" ("company_id", "date");
+CREATE EXTENSION IF NOT EXISTS pgcrypto;
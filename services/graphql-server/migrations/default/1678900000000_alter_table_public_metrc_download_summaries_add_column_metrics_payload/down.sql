@@ -0,0 +1 @@
+ALTER TABLE "public"."metrc_download_summaries" DROP COLUMN IF EXISTS "metrics_payload";
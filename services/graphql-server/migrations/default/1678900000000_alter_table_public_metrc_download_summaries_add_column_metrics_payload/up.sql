@@ -0,0 +1 @@
+ALTER TABLE "public"."metrc_download_summaries" ADD COLUMN "metrics_payload" JSONB;
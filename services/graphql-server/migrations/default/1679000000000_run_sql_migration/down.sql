@@ -0,0 +1 @@
+DROP INDEX IF EXISTS financial_summaries_needs_recompute_company_id_key;
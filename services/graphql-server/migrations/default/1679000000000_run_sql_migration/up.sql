@@ -0,0 +1 @@
+CREATE INDEX IF NOT EXISTS financial_summaries_needs_recompute_company_id_key ON financial_summaries (company_id) WHERE needs_recompute;
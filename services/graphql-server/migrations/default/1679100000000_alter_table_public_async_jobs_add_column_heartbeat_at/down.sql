@@ -0,0 +1 @@
+alter table "public"."async_jobs" drop column "heartbeat_at";
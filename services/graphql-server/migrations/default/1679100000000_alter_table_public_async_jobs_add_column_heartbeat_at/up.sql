@@ -0,0 +1 @@
+alter table "public"."async_jobs" add column "heartbeat_at" timestamptz;